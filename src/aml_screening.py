@@ -0,0 +1,447 @@
+"""
+Sanctions and PEP screening against WatchlistEntry.
+
+Active watchlist entries are held in memory as a WatchlistIndex: postings
+from normalised name tokens, and from their phonetic keys, to entry
+numbers. A name is screened by looking up its tokens and keys, keeping the
+entries that share enough of them, and scoring only those. That scales with
+how common the name's tokens are, not with the size of the list, so inline
+screening takes milliseconds.
+
+Scoring compares tokens one by one: an exact match counts 1.0, and a match
+on the phonetic key (Mohamed / Muhammad, Wanjiku / Wanjiko) counts
+PHONETIC_MATCH. The entry's tokens weigh most, so extra middle names on our
+side do not hide a listed person. Scores from HIT_SCORE up are hits;
+REVIEW_SCORE up to HIT_SCORE need review.
+
+What is screened inline (pre_save decides, post_save records ScreeningHits):
+
+* a new Customer, or one whose name changed: sets aml_screening_status,
+  and sets pep_status and risk_rating on PEP or sanction matches;
+* a new JointHolder: the account holder goes to REVIEW on a match;
+* a new FXTransfer beneficiary: a matched transfer is held in VALIDATION;
+* a FundsTransfer beneficiary when the amount is LARGE_VALUE_KES or more.
+
+load_watchlist() replaces one list and bumps the list version. The loading
+process then rebuilds its index in a background thread. Other processes
+notice the new version on their next screening. They keep screening
+against the index they have while their own rebuild runs in the
+background, so a save never waits for an index build; only a process with
+no index at all builds one inline. rescreen() is the nightly job: when the
+version has moved, it screens every customer in parallel by id range,
+always against the current version.
+
+Screening only ever raises a customer's status, inline or in a rescreen; a
+name change that no longer matches leaves a HIT in place. Clearing a hit is
+a reviewer's decision.
+"""
+
+import logging
+import threading
+from collections import Counter, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.db.models import Max, Min
+from django.db.models.signals import post_save, pre_save
+from django.dispatch import receiver
+
+from .customer_search import normalize_name
+from .models import (
+    Customer,
+    CustomerAccount,
+    FundsTransfer,
+    FXTransfer,
+    JointHolder,
+    ScreeningHit,
+    WatchlistEntry,
+)
+
+
+HIT_SCORE = 0.85
+REVIEW_SCORE = 0.70
+PHONETIC_MATCH = 0.9
+MIN_TOKEN_LENGTH = 2
+LARGE_VALUE_KES = Decimal("1000000.00")
+
+WORKERS = 4
+RESCREEN_CHUNK = 20_000
+VERSION_KEY = "aml:watchlist:version"
+RESCREENED_KEY = "aml:watchlist:rescreened"
+
+CLEAR, REVIEW, HIT = "CLEAR", "REVIEW", "HIT"
+SEVERITY = {CLEAR: 0, REVIEW: 1, HIT: 2}
+
+Match = namedtuple("Match", ["entry_id", "list_type", "name", "score"])
+
+logger = logging.getLogger(__name__)
+
+
+# =========================================================
+# NAME KEYS
+# =========================================================
+
+_SOUNDEX_CODES = {}
+for _letters, _code in (("bfpv", "1"), ("cgjkqsxz", "2"), ("dt", "3"), ("l", "4"), ("mn", "5"), ("r", "6")):
+    for _letter in _letters:
+        _SOUNDEX_CODES[_letter] = _code
+
+
+def phonetic_key(token):
+    """Soundex without the four-character cut-off, so long names keep their shape."""
+    if not token.isalpha():
+        return token
+    key = [token[0]]
+    previous = _SOUNDEX_CODES.get(token[0], "")
+    for letter in token[1:]:
+        code = _SOUNDEX_CODES.get(letter, "")
+        if code and code != previous:
+            key.append(code)
+        if letter not in "hw":
+            previous = code
+    return "".join(key)
+
+
+def name_tokens(name):
+    return tuple(token for token in normalize_name(name).split() if len(token) >= MIN_TOKEN_LENGTH)
+
+
+def _token_score(token, key, candidates):
+    best = 0.0
+    for other, other_key in candidates:
+        if token == other:
+            return 1.0
+        if key == other_key:
+            best = PHONETIC_MATCH
+    return best
+
+
+def score(query_tokens, entry_tokens):
+    query = [(token, phonetic_key(token)) for token in query_tokens]
+    entry = [(token, phonetic_key(token)) for token in entry_tokens]
+    if not query or not entry:
+        return 0.0
+    entry_cover = sum(_token_score(token, key, query) for token, key in entry) / len(entry)
+    query_cover = sum(_token_score(token, key, entry) for token, key in query) / len(query)
+    return 0.7 * entry_cover + 0.3 * query_cover
+
+
+# =========================================================
+# INDEX
+# =========================================================
+
+class WatchlistIndex:
+
+    def __init__(self, version, entries):
+        """``entries`` is an iterable of (id, list_type, full_name)."""
+        self.version = version
+        self.ids = []
+        self.list_types = []
+        self.names = []
+        self.tokens = []
+        self._by_token = {}
+        self._by_key = {}
+
+        for entry_id, list_type, full_name in entries:
+            tokens = name_tokens(full_name)
+            if not tokens:
+                continue
+            number = len(self.ids)
+            self.ids.append(entry_id)
+            self.list_types.append(list_type)
+            self.names.append(full_name)
+            self.tokens.append(tokens)
+            for token in set(tokens):
+                self._by_token.setdefault(token, []).append(number)
+            for key in {phonetic_key(token) for token in tokens}:
+                self._by_key.setdefault(key, []).append(number)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def match(self, name, threshold=REVIEW_SCORE):
+        """Matches scoring ``threshold`` or more, best first."""
+        query = name_tokens(name)
+        if not query:
+            return []
+
+        shared = Counter()
+        for token in set(query):
+            numbers = set(self._by_token.get(token, ()))
+            numbers.update(self._by_key.get(phonetic_key(token), ()))
+            shared.update(numbers)
+
+        matches = []
+        for number, count in shared.items():
+            # An entry needs most of its own tokens present before it is worth scoring.
+            if count < min(2, len(self.tokens[number])):
+                continue
+            value = score(query, self.tokens[number])
+            if value >= threshold:
+                matches.append(Match(self.ids[number], self.list_types[number], self.names[number], round(value, 4)))
+        return sorted(matches, key=lambda match: -match.score)
+
+
+def watchlist_version():
+    return cache.get_or_set(VERSION_KEY, 1, None)
+
+
+_index = None
+_index_lock = threading.Lock()
+_rebuilding = None
+
+
+def _build_index(version):
+    entries = (
+        WatchlistEntry.objects
+        .filter(is_active=True)
+        .values_list("id", "list_type", "full_name")
+        .iterator(chunk_size=10_000)
+    )
+    return WatchlistIndex(version, entries)
+
+
+def _rebuild(version):
+    global _index, _rebuilding
+    try:
+        index = _build_index(version)
+        with _index_lock:
+            _index = index
+    except Exception:
+        logger.exception("rebuilding the watchlist index for version %s failed", version)
+    finally:
+        connections.close_all()
+        with _index_lock:
+            _rebuilding = None
+
+
+def warm_index():
+    """Rebuild the index for the current list version in a background thread, if needed."""
+    global _rebuilding
+    version = watchlist_version()
+    with _index_lock:
+        if (_index is not None and _index.version == version) or _rebuilding is not None:
+            return
+        _rebuilding = version
+    threading.Thread(target=_rebuild, args=(version,), name="aml-watchlist-index", daemon=True).start()
+
+
+def get_index(wait=False):
+    """
+    This process's index. When the list version has moved on, the rebuild
+    runs in the background and the previous index is returned meanwhile,
+    unless ``wait`` asks for the current version there and then.
+    """
+    global _index
+    version = watchlist_version()
+    index = _index
+    if index is not None and index.version == version:
+        return index
+    if index is None or wait:
+        index = _build_index(version)
+        with _index_lock:
+            _index = index
+        return index
+    warm_index()
+    return index
+
+
+def screen(name):
+    """(status, matches) for ``name``."""
+    matches = get_index().match(name)
+    if not matches:
+        return CLEAR, matches
+    return (HIT if matches[0].score >= HIT_SCORE else REVIEW), matches
+
+
+# =========================================================
+# LOADING LISTS
+# =========================================================
+
+def _bump_version():
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, 2, None)
+
+
+def load_watchlist(list_name, list_type, records):
+    """
+    Replace ``list_name`` with ``records``: dicts with external_id and
+    full_name, and optionally country and date_of_birth. Entries missing
+    from the new file are deactivated, not deleted, so past hits keep their
+    entry.
+    """
+    entries = [
+        WatchlistEntry(
+            list_name=list_name,
+            list_type=list_type,
+            external_id=str(record["external_id"]),
+            full_name=record["full_name"],
+            name_normalized=normalize_name(record["full_name"]),
+            country=record.get("country") or "",
+            date_of_birth=record.get("date_of_birth"),
+            is_active=True,
+        )
+        for record in records
+    ]
+    with transaction.atomic():
+        WatchlistEntry.objects.bulk_create(
+            entries,
+            batch_size=5000,
+            update_conflicts=True,
+            unique_fields=["list_name", "external_id"],
+            update_fields=["list_type", "full_name", "name_normalized", "country", "date_of_birth", "is_active"],
+        )
+        (
+            WatchlistEntry.objects
+            .filter(list_name=list_name, is_active=True)
+            .exclude(external_id__in=[entry.external_id for entry in entries])
+            .update(is_active=False)
+        )
+        transaction.on_commit(_bump_version)
+        transaction.on_commit(warm_index)
+    return len(entries)
+
+
+# =========================================================
+# INLINE SCREENING
+# =========================================================
+
+def _record_hits(subject, name, matches):
+    if not matches:
+        return
+    version = watchlist_version()
+    ScreeningHit.objects.bulk_create(
+        [
+            ScreeningHit(
+                subject_model=type(subject).__name__, subject_id=subject.pk, screened_name=name[:300],
+                entry_id=match.entry_id, score=match.score, list_version=version,
+            )
+            for match in matches
+        ],
+        ignore_conflicts=True,
+    )
+
+
+@receiver(pre_save, sender=Customer)
+def screen_customer(sender, instance, raw=False, **kwargs):
+    # customer_search's pre_save has already set _name_changed.
+    if raw or not (instance._state.adding or getattr(instance, "_name_changed", False)):
+        return
+    status, matches = screen(instance.full_name)
+    instance._screening = matches
+    current = instance.aml_screening_status
+    if current not in SEVERITY or SEVERITY[status] > SEVERITY[current]:
+        instance.aml_screening_status = status
+    if status != CLEAR:
+        instance.pep_status = instance.pep_status or any(match.list_type == "PEP" for match in matches)
+    if status == HIT:
+        instance.risk_rating = "HIGH"
+
+
+@receiver(pre_save, sender=JointHolder)
+def screen_joint_holder(sender, instance, raw=False, **kwargs):
+    if raw or not instance._state.adding:
+        return
+    instance._screening = screen(instance.full_name)[1]
+
+
+@receiver(pre_save, sender=FXTransfer)
+def screen_fx_beneficiary(sender, instance, raw=False, **kwargs):
+    if raw or not instance._state.adding:
+        return
+    status, matches = screen(instance.beneficiary_name)
+    instance._screening = matches
+    if status != CLEAR and instance.status == "PENDING":
+        instance.status = "VALIDATION"
+
+
+@receiver(pre_save, sender=FundsTransfer)
+def screen_large_transfer(sender, instance, raw=False, **kwargs):
+    if raw or not instance._state.adding or instance.amount < LARGE_VALUE_KES:
+        return
+    instance._screening = screen(instance.beneficiary_name)[1]
+
+
+@receiver(post_save, sender=Customer)
+@receiver(post_save, sender=JointHolder)
+@receiver(post_save, sender=FXTransfer)
+@receiver(post_save, sender=FundsTransfer)
+def record_screening(sender, instance, raw=False, **kwargs):
+    matches = instance.__dict__.pop("_screening", None)
+    if raw or not matches:
+        return
+    name = instance.full_name if sender in (Customer, JointHolder) else instance.beneficiary_name
+    _record_hits(instance, name, matches)
+    if sender is JointHolder:
+        customer_id = CustomerAccount.objects.filter(pk=instance.account_id).values_list("customer_id", flat=True)
+        Customer.objects.filter(pk__in=customer_id, aml_screening_status=CLEAR).update(aml_screening_status=REVIEW)
+
+
+# =========================================================
+# NIGHTLY RESCREEN
+# =========================================================
+
+def _rescreen_range(first_id, last_id):
+    """Screen customers with first_id <= id < last_id; return how many were raised."""
+    index = get_index(wait=True)
+    customers = list(
+        Customer.objects
+        .filter(pk__gte=first_id, pk__lt=last_id)
+        .only("id", "full_name", "aml_screening_status", "pep_status", "risk_rating")
+    )
+    raised, hits = [], []
+    for customer in customers:
+        matches = index.match(customer.full_name)
+        if not matches:
+            continue
+        status = HIT if matches[0].score >= HIT_SCORE else REVIEW
+        hits.extend(
+            ScreeningHit(
+                subject_model="Customer", subject_id=customer.pk, screened_name=customer.full_name[:300],
+                entry_id=match.entry_id, score=match.score, list_version=index.version,
+            )
+            for match in matches
+        )
+        if SEVERITY[status] > SEVERITY.get(customer.aml_screening_status, 0):
+            customer.aml_screening_status = status
+            customer.pep_status = customer.pep_status or any(match.list_type == "PEP" for match in matches)
+            if status == HIT:
+                customer.risk_rating = "HIGH"
+            raised.append(customer)
+
+    with transaction.atomic():
+        ScreeningHit.objects.bulk_create(hits, batch_size=5000, ignore_conflicts=True)
+        Customer.objects.bulk_update(
+            raised, ["aml_screening_status", "pep_status", "risk_rating"], batch_size=5000
+        )
+    return len(raised)
+
+
+def rescreen(workers=WORKERS, chunk_size=RESCREEN_CHUNK, force=False):
+    """
+    Rescreen every customer if the watchlist changed since the last run (or
+    ``force``). Returns the number of customers whose status was raised, or
+    None when nothing changed.
+    """
+    version = watchlist_version()
+    if not force and cache.get(RESCREENED_KEY) == version:
+        return None
+
+    bounds = Customer.objects.aggregate(first=Min("id"), last=Max("id"))
+    if bounds["first"] is None:
+        cache.set(RESCREENED_KEY, version, None)
+        return 0
+    ranges = [
+        (start, start + chunk_size)
+        for start in range(bounds["first"], bounds["last"] + 1, chunk_size)
+    ]
+
+    connections.close_all()
+    with ProcessPoolExecutor(max_workers=workers, initializer=connections.close_all) as pool:
+        raised = sum(pool.map(_rescreen_range, *zip(*ranges)))
+    cache.set(RESCREENED_KEY, version, None)
+    return raised
@@ -0,0 +1,258 @@
+"""
+Unified supervisor approval queue.
+
+Every KYCUpdateRequest, AccountModificationRequest and FX row awaiting a
+decision is mirrored as one ApprovalItem. Supervisors page through the queue
+with keyset pagination on (created_at, id), served by a partial index that
+only holds pending rows, so paging stays cheap however much history has
+built up.
+
+claim() leases items to one approver with SELECT ... FOR UPDATE SKIP LOCKED.
+Two approvers never get the same item, and an item whose lease lapses goes
+back to the queue. Items close on their own when the source row leaves its
+pending status.
+
+New items are announced on commit, not discovered by polling tables: on
+PostgreSQL through NOTIFY on the approval_queue channel, and to in-process
+subscribers everywhere. wait_for_items() listens on one long-lived
+connection per process rather than opening one per call.
+"""
+
+import json
+import select
+import threading
+from datetime import timedelta
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Q
+from django.db.models.signals import post_save
+from django.utils import timezone
+
+from .models import (
+    AccountModificationRequest,
+    ApprovalItem,
+    DenominationExchange,
+    FXBuy,
+    FXSell,
+    FXTransfer,
+    KYCUpdateRequest,
+)
+
+
+CHANNEL = "approval_queue"
+LEASE_SECONDS = 5 * 60
+PAGE_SIZE = 50
+
+# model -> statuses that need a supervisor
+SOURCES = {
+    KYCUpdateRequest: ("PENDING",),
+    AccountModificationRequest: ("PENDING",),
+    FXBuy: ("PENDING",),
+    FXSell: ("PENDING",),
+    FXTransfer: ("PENDING", "VALIDATION"),
+    DenominationExchange: ("PENDING", "VALIDATION"),
+}
+
+_subscribers = []
+
+
+def _summary(instance):
+    reference = getattr(instance, "transaction_reference", None) or instance.pk
+    return f"{type(instance).__name__} {reference}"[:200]
+
+
+# =========================================================
+# MIRRORING SOURCE ROWS
+# =========================================================
+
+def sync_item(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+
+    source = dict(source_model=sender.__name__, source_id=instance.pk)
+    if instance.status not in SOURCES[sender]:
+        ApprovalItem.objects.filter(status="PENDING", **source).update(
+            status="DONE", closed_at=timezone.now(), lease_expires_at=None
+        )
+        return
+
+    if ApprovalItem.objects.filter(**source).update(status="PENDING", closed_at=None):
+        return
+    try:
+        with transaction.atomic():
+            item = ApprovalItem.objects.create(
+                branch_id=instance.branch_id,
+                summary=_summary(instance),
+                created_at=instance.created_at,
+                **source,
+            )
+    except IntegrityError:
+        return
+    transaction.on_commit(lambda: notify(item))
+
+
+for _model in SOURCES:
+    post_save.connect(sync_item, sender=_model, dispatch_uid=f"approval-{_model.__name__}")
+
+
+def backfill():
+    """Create items for pending rows written before the queue existed."""
+    created = 0
+    for model, statuses in SOURCES.items():
+        name = model.__name__
+        existing = ApprovalItem.objects.filter(source_model=name).values_list("source_id", flat=True)
+        rows = model.objects.filter(status__in=statuses).exclude(pk__in=existing)
+        items = [
+            ApprovalItem(
+                branch_id=row.branch_id, source_model=name, source_id=row.pk,
+                summary=_summary(row), created_at=row.created_at,
+            )
+            for row in rows.iterator()
+        ]
+        ApprovalItem.objects.bulk_create(items, batch_size=1000, ignore_conflicts=True)
+        created += len(items)
+    return created
+
+
+# =========================================================
+# READS AND CLAIMS
+# =========================================================
+
+def _pending(branch=None):
+    items = ApprovalItem.objects.filter(status="PENDING")
+    if branch is not None:
+        items = items.filter(branch=branch)
+    return items
+
+
+def list_pending(branch=None, after=None, limit=PAGE_SIZE):
+    """
+    One page of pending items, oldest first. ``after`` is the cursor returned
+    with the previous page: a (created_at, id) pair, or None for page one.
+    """
+    items = _pending(branch)
+    if after is not None:
+        created_at, item_id = after
+        items = items.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=item_id))
+    page = list(items.order_by("created_at", "id")[:limit])
+    cursor = (page[-1].created_at, page[-1].id) if len(page) == limit else None
+    return page, cursor
+
+
+def claim(user, branch=None, count=1, lease_seconds=LEASE_SECONDS):
+    """Lease up to ``count`` of the oldest unclaimed items to ``user``."""
+    now = timezone.now()
+    with transaction.atomic():
+        items = list(
+            _pending(branch)
+            .filter(Q(lease_expires_at__isnull=True) | Q(lease_expires_at__lte=now))
+            .select_for_update(skip_locked=True)
+            .order_by("created_at", "id")[:count]
+        )
+        if items:
+            ApprovalItem.objects.filter(pk__in=[item.pk for item in items]).update(
+                claimed_by=user, lease_expires_at=now + timedelta(seconds=lease_seconds)
+            )
+    for item in items:
+        item.claimed_by = user
+        item.lease_expires_at = now + timedelta(seconds=lease_seconds)
+    return items
+
+
+def renew(item, user, lease_seconds=LEASE_SECONDS):
+    """Extend a lease the approver still holds; False if it has been lost."""
+    return bool(
+        ApprovalItem.objects
+        .filter(pk=item.pk, status="PENDING", claimed_by=user, lease_expires_at__gt=timezone.now())
+        .update(lease_expires_at=timezone.now() + timedelta(seconds=lease_seconds))
+    )
+
+
+def release(item, user):
+    ApprovalItem.objects.filter(pk=item.pk, claimed_by=user).update(claimed_by=None, lease_expires_at=None)
+
+
+# =========================================================
+# NOTIFICATIONS
+# =========================================================
+
+def subscribe(callback):
+    """Call ``callback(payload)`` for every item created in this process."""
+    _subscribers.append(callback)
+
+
+def notify(item):
+    payload = {"id": item.pk, "branch": item.branch_id, "source": item.source_model}
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_notify(%s, %s)", [CHANNEL, json.dumps(payload)])
+    for callback in list(_subscribers):
+        callback(payload)
+
+
+class Listener:
+    """
+    One LISTEN connection per process, opened on first use and kept open
+    between waits, so announcements made between two waits are queued on
+    it rather than lost. Works with psycopg2 and psycopg 3. A broken
+    connection is dropped and reopened by the next wait; anything announced
+    in between is missed, which is why callers re-read list_pending() after
+    each wake-up rather than trusting the payloads alone.
+    """
+
+    def __init__(self):
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._connection is None:
+            listener = connection.get_new_connection(connection.get_connection_params())
+            listener.autocommit = True
+            with listener.cursor() as cursor:
+                cursor.execute(f"LISTEN {CHANNEL}")
+            self._connection = listener
+        return self._connection
+
+    @staticmethod
+    def _receive(listener, timeout):
+        if hasattr(listener, "poll"):
+            # psycopg2: notifications collect on .notifies when polled.
+            if not listener.notifies and not select.select([listener], [], [], timeout)[0]:
+                return []
+            listener.poll()
+            notes = list(listener.notifies)
+            listener.notifies.clear()
+            return notes
+        # psycopg 3
+        notes = list(listener.notifies(timeout=timeout, stop_after=1))
+        if notes:
+            notes.extend(listener.notifies(timeout=0))
+        return notes
+
+    def wait(self, timeout):
+        with self._lock:
+            try:
+                notes = self._receive(self._connect(), timeout)
+            except connection.Database.Error:
+                self.close()
+                raise
+        return [json.loads(note.payload) for note in notes]
+
+    def close(self):
+        if self._connection is not None:
+            try:
+                self._connection.close()
+            finally:
+                self._connection = None
+
+
+_listener = Listener()
+
+
+def wait_for_items(timeout=30):
+    """
+    Block until items are announced on PostgreSQL or ``timeout`` passes, and
+    return their payloads. Waits on the process's shared autocommit
+    listener, which sits in LISTEN outside any request transaction.
+    """
+    return _listener.wait(timeout)
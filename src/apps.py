@@ -0,0 +1,44 @@
+"""
+App configuration for ``src``.
+
+Most modules here connect signal receivers (ledger postings, reference
+numbers, the outbox, SLA tracking, cache invalidation and so on) when they
+are imported. ready() imports all of them, so every process has the same
+receivers whatever else it happens to import first.
+"""
+
+from importlib import import_module
+
+from django.apps import AppConfig
+
+
+RECEIVER_MODULES = (
+    "ledger",
+    "references",
+    "outbox",
+    "reference_cache",
+    "service_catalog",
+    "sla",
+    "aml_screening",
+    "approval_queue",
+    "biller_gateway",
+    "card_limits",
+    "cross_sell",
+    "customer_search",
+    "dashboard_rollups",
+    "fx_rates",
+    "instrumentation",
+    "metrics_engine",
+    "partitions",
+    "standing_orders",
+)
+
+
+class SrcConfig(AppConfig):
+    name = "src"
+    label = "src"
+    default_auto_field = "django.db.models.BigAutoField"
+
+    def ready(self):
+        for module in RECEIVER_MODULES:
+            import_module(f"{self.name}.{module}")
@@ -0,0 +1,738 @@
+"""
+Benchmarks for the hot paths, run against data from synthetic_data.py.
+
+Each benchmark is registered with @benchmark("id"). Its setup function takes
+a Context and returns the operation to time. The runner calls the operation
+``warmup`` times untimed, then ``iterations`` times, each time under
+instrumentation.instrument, so every result carries both latency
+percentiles and the number of queries per operation.
+
+run() writes one JSON document with the results and enough about the
+environment to compare like with like (database vendor, row counts, seed).
+compare() sets two such documents side by side and lists the benchmarks
+that got slower, or issue more queries, than a threshold allows.
+
+The posting benchmarks write real rows. Run the suite only against a
+load-test database.
+
+Batch jobs are timed once per run rather than per operation.
+run_end_of_day() times one end_of_day.run() over the whole book. Use it
+against data from generate("accounts-5m") for the 5M-account figure.
+run_customer_search() times the teller lookups against a book of at least
+1M customers (generate("large")).
+run_statement_memory() renders statements of growing length in fresh
+processes and reports peak RSS, which should not grow with the length.
+run_pin_load() drives PIN verification from many client threads at once and
+reports throughput, latency and how often the pool answered busy.
+run_bulk_posting() times post_batch() over 10k- and 100k-row uploads.
+run_reference_allocation() has several processes draw references at once
+and checks that none was handed out twice.
+run_approval_load() pages and claims a queue of 10k pending approvals over
+50 branches with many approvers at once, and checks that no item was
+claimed twice.
+"""
+
+import json
+import os
+import platform
+import random
+import resource
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import timedelta
+from decimal import Decimal
+
+import numpy as np
+from django.contrib.auth import get_user_model
+from django.db import connection, connections
+from django.db.models import Count
+from django.utils import timezone
+
+from . import (
+    approval_queue,
+    biller_gateway,
+    biller_stub,
+    bulk_posting,
+    card_limits,
+    cross_sell,
+    customer_search,
+    dashboard_rollups,
+    end_of_day,
+    ledger,
+    pin_service,
+    references,
+    statements,
+)
+from .instrumentation import instrument
+from .models import ApprovalItem, BatchRun, Branch, Card, CashDeposit, Customer, CustomerAccount, LedgerEntry
+
+
+WARMUP = 5
+ITERATIONS = 50
+SAMPLE_SIZE = 200
+REGRESSION_THRESHOLD = 0.10
+# Result fields where a bigger number is worse: latency and queries per
+# operation, wall time and queries of batch runs, and statement memory.
+COMPARED_METRICS = ("p95_ms", "queries_per_op", "seconds", "queries", "peak_rss_kib", "growth_kib")
+
+BENCHMARKS = {}
+
+
+def benchmark(benchmark_id):
+    def register(func):
+        BENCHMARKS[benchmark_id] = func
+        return func
+    return register
+
+
+@dataclass
+class Context:
+    """What benchmarks pick their inputs from, drawn once per run from the seed."""
+    rng: random.Random
+    branch: Branch
+    user: object
+    account_ids: list
+    account_numbers: list
+    customers: list
+
+    def account_id(self):
+        return self.rng.choice(self.account_ids)
+
+    def customer(self):
+        return self.rng.choice(self.customers)
+
+
+def _context(seed):
+    rng = random.Random(seed)
+    branch = Branch.objects.order_by("pk").first()
+    if branch is None:
+        raise RuntimeError("no data to benchmark; run synthetic_data.generate() first")
+
+    accounts = list(
+        CustomerAccount.objects
+        .filter(branch=branch, status="ACTIVE")
+        .order_by("pk")
+        .values_list("pk", "account_number")[:SAMPLE_SIZE * 10]
+    )
+    accounts = rng.sample(accounts, min(SAMPLE_SIZE, len(accounts)))
+    customers = list(
+        Customer.objects.filter(branch=branch).order_by("pk").values_list("full_name", "mobile_number")[:SAMPLE_SIZE]
+    )
+    User = get_user_model()
+    user, _ = User.objects.get_or_create(**{User.USERNAME_FIELD: "benchmark-supervisor"})
+    return Context(
+        rng=rng,
+        branch=branch,
+        user=user,
+        account_ids=[pk for pk, _ in accounts],
+        account_numbers=[number for _, number in accounts],
+        customers=customers,
+    )
+
+
+# =========================================================
+# BENCHMARKS
+# =========================================================
+
+@benchmark("posting.deposit")
+def single_deposit(ctx):
+    def operation():
+        CashDeposit.objects.create(
+            branch=ctx.branch, account_id=ctx.account_id(), amount=Decimal("500.00"),
+            narration="Benchmark deposit", created_by=ctx.user,
+        )
+    return operation
+
+
+@benchmark("posting.batch-100")
+def batch_posting(ctx):
+    def operation():
+        rows = [
+            {"type": bulk_posting.DEPOSIT, "account_number": ctx.rng.choice(ctx.account_numbers),
+             "amount": "250.00", "narration": "Benchmark batch"}
+            for _ in range(100)
+        ]
+        bulk_posting.post_batch(rows, ctx.branch, ctx.user)
+    return operation
+
+
+@benchmark("lookup.balance")
+def balance_lookup(ctx):
+    return lambda: ledger.account_balance(ctx.account_id())
+
+
+@benchmark("lookup.customer-by-phone")
+def phone_search(ctx):
+    return lambda: customer_search.search(ctx.customer()[1], branch=ctx.branch)
+
+
+@benchmark("lookup.customer-by-name")
+def name_search(ctx):
+    return lambda: customer_search.search(ctx.customer()[0], branch=ctx.branch)
+
+
+@benchmark("lookup.customer-by-misspelled-name")
+def misspelled_name_search(ctx):
+    """A name with one letter dropped, so only the fuzzy path can find it."""
+    def operation():
+        name = ctx.customer()[0]
+        cut = ctx.rng.randrange(1, len(name))
+        customer_search.search(name[:cut] + name[cut + 1:], branch=ctx.branch)
+    return operation
+
+
+@benchmark("lookup.cross-sell")
+def cross_sell_lookup(ctx):
+    """Teller-side read of the precomputed offers; run cross_sell.precompute() first."""
+    customer_ids = list(
+        Customer.objects.filter(branch=ctx.branch).order_by("pk").values_list("pk", flat=True)[:SAMPLE_SIZE]
+    )
+    return lambda: cross_sell.recommendations(ctx.rng.choice(customer_ids))
+
+
+@benchmark("cards.authorize-reverse")
+def card_authorization(ctx):
+    """One POS authorization and its reversal, so daily counters never fill up."""
+    card_ids = list(
+        Card.objects.filter(account_id__in=ctx.account_ids, status="ACTIVE").values_list("pk", flat=True)
+    )
+    if not card_ids:
+        raise RuntimeError("no active cards among the sampled accounts")
+
+    def operation():
+        card_id = ctx.rng.choice(card_ids)
+        if card_limits.engine.authorize(card_id, card_limits.POS, "100.00").approved:
+            card_limits.engine.reverse(card_id, card_limits.POS, "100.00")
+    return operation
+
+
+@benchmark("statement.90-days")
+def statement_90_days(ctx):
+    date_to = timezone.localdate()
+    date_from = date_to - timedelta(days=90)
+
+    def operation():
+        for _ in statements.statement_lines(ctx.account_id(), date_from, date_to):
+            pass
+    return operation
+
+
+@benchmark("dashboard.counts-30-days")
+def dashboard_30_days(ctx):
+    date_to = timezone.localdate()
+    date_from = date_to - timedelta(days=30)
+    return lambda: dashboard_rollups.dashboard_counts(ctx.branch, date_from, date_to)
+
+
+@benchmark("approvals.page")
+def approval_page(ctx):
+    return lambda: approval_queue.list_pending(ctx.branch)
+
+
+@benchmark("approvals.claim-release")
+def approval_claim(ctx):
+    def operation():
+        for item in approval_queue.claim(ctx.user, ctx.branch, count=5):
+            approval_queue.release(item, ctx.user)
+    return operation
+
+
+@benchmark("billers.validate-200-concurrent")
+def biller_validation(ctx):
+    """200 bill fetches at once against the local stub; throughput is 200 / mean."""
+    stub = biller_stub.StubBiller(latency=0.02)
+    url = biller_gateway.run(lambda _: stub.start())
+    gateway = biller_gateway.BillerGateway(url, cache_ttl=0)
+    paybills = ("888888", "444400", "100100", "320320")
+    payments = [
+        (paybills[n % len(paybills)], f"{ctx.rng.randrange(10**7, 10**8)}1", "100.00", True)
+        for n in range(200)
+    ]
+
+    def operation():
+        return biller_gateway.run(lambda _: gateway.validate_many(payments))
+
+    async def shutdown(_):
+        await gateway.close()
+        await stub.stop()
+
+    operation.close = lambda: biller_gateway.run(shutdown)
+    return operation
+
+
+# =========================================================
+# RUNNER
+# =========================================================
+
+def _summary(seconds, queries):
+    milliseconds = np.asarray(seconds) * 1000.0
+    return {
+        "iterations": len(seconds),
+        "mean_ms": round(float(milliseconds.mean()), 3),
+        "p50_ms": round(float(np.percentile(milliseconds, 50)), 3),
+        "p95_ms": round(float(np.percentile(milliseconds, 95)), 3),
+        "p99_ms": round(float(np.percentile(milliseconds, 99)), 3),
+        "max_ms": round(float(milliseconds.max()), 3),
+        "queries_per_op": round(float(np.mean(queries)), 2),
+    }
+
+
+def run_one(benchmark_id, ctx, iterations=ITERATIONS, warmup=WARMUP):
+    operation = BENCHMARKS[benchmark_id](ctx)
+    try:
+        for _ in range(warmup):
+            operation()
+
+        seconds, queries = [], []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            with instrument("benchmark", benchmark_id) as measurement:
+                operation()
+            seconds.append(time.perf_counter() - started)
+            queries.append(measurement.queries)
+    finally:
+        # Benchmarks that start servers hang a close() on the operation.
+        close = getattr(operation, "close", None)
+        if close is not None:
+            close()
+    return _summary(seconds, queries)
+
+
+def _environment():
+    return {
+        "python": platform.python_version(),
+        "database": connection.vendor,
+        "rows": {
+            "customers": Customer.objects.count(),
+            "accounts": CustomerAccount.objects.count(),
+            "ledger_entries": LedgerEntry.objects.count(),
+        },
+    }
+
+
+def _write(document, output):
+    if output:
+        with open(output, "w") as handle:
+            json.dump(document, handle, indent=2, default=str)
+    return document
+
+
+def run(output=None, only=None, iterations=ITERATIONS, warmup=WARMUP, seed=42):
+    """Run the suite (or the ids in ``only``) and return the results document."""
+    ctx = _context(seed)
+    results = {
+        benchmark_id: run_one(benchmark_id, ctx, iterations, warmup)
+        for benchmark_id in BENCHMARKS
+        if only is None or benchmark_id in only
+    }
+    document = {
+        "started_at": timezone.now().isoformat(),
+        "seed": seed,
+        "environment": _environment(),
+        "results": results,
+    }
+    return _write(document, output)
+
+
+# =========================================================
+# BATCH JOBS
+# =========================================================
+
+def run_end_of_day(output=None, run_date=None, workers=end_of_day.WORKERS):
+    """
+    Time one end-of-day run. ``run_date`` defaults to the last day of the
+    current month, so interest posting and fees are included. The date must
+    not have been run before on this database.
+    """
+    today = timezone.localdate()
+    run_date = run_date or (today.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+    if BatchRun.objects.filter(run_date=run_date).exists():
+        raise RuntimeError(f"end of day already ran for {run_date}; pick another date or regenerate the data")
+
+    started = time.perf_counter()
+    stats = end_of_day.run(run_date, workers=workers)
+    seconds = time.perf_counter() - started
+
+    document = {
+        "started_at": timezone.now().isoformat(),
+        "environment": _environment(),
+        "results": {
+            "batch.end-of-day": {
+                "run_date": run_date.isoformat(),
+                "workers": workers,
+                "seconds": round(seconds, 3),
+                "accounts_per_second": round(stats.accounts / seconds, 1) if seconds else None,
+                "stats": vars(stats),
+            },
+        },
+    }
+    return _write(document, output)
+
+
+SEARCH_BENCHMARKS = (
+    "lookup.customer-by-phone",
+    "lookup.customer-by-name",
+    "lookup.customer-by-misspelled-name",
+)
+
+
+def run_customer_search(output=None, min_customers=1_000_000, iterations=ITERATIONS * 4, seed=42):
+    """Latency of the customer lookups once the table holds ``min_customers`` rows."""
+    customers = Customer.objects.count()
+    if customers < min_customers:
+        raise RuntimeError(f"{customers} customers; generate('large') gives the 1M-row book")
+    return run(output, only=SEARCH_BENCHMARKS, iterations=iterations, seed=seed)
+
+
+STATEMENT_SPANS = (30, 365, None)
+
+
+def _render_statement(account_id, date_from, output_format):
+    """Write one statement in this (fresh) process; returns (lines, start RSS, peak RSS) in KiB."""
+    start_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    writer_class = statements.WRITERS[output_format]
+    fd, path = tempfile.mkstemp(suffix=f".{writer_class.extension}")
+    os.close(fd)
+    try:
+        writer = writer_class(path, "Benchmark statement")
+        lines = 0
+        for line in statements.statement_lines(account_id, date_from):
+            writer.write(line)
+            lines += 1
+        writer.close()
+    finally:
+        os.remove(path)
+    return lines, start_rss, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_statement_memory(output=None, formats=("CSV", "XLSX", "PDF"), spans=STATEMENT_SPANS):
+    """
+    Peak RSS while rendering the busiest account's statement over each span
+    (days, None for the whole history), one fresh process per render.
+    """
+    busiest = (
+        LedgerEntry.objects
+        .filter(account_id__isnull=False)
+        .values("account_id")
+        .annotate(entries=Count("id"))
+        .order_by("-entries")
+        .first()
+    )
+    if busiest is None:
+        raise RuntimeError("no data to benchmark; run synthetic_data.generate() first")
+
+    today = timezone.localdate()
+    results = {}
+    for output_format in formats:
+        for days in spans:
+            date_from = today - timedelta(days=days) if days else None
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=1, initializer=connections.close_all) as pool:
+                lines, start_rss, peak_rss = pool.submit(
+                    _render_statement, busiest["account_id"], date_from, output_format,
+                ).result()
+            results[f"statement.rss-{output_format.lower()}-{days or 'all'}-days"] = {
+                "lines": lines,
+                "peak_rss_kib": peak_rss,
+                "growth_kib": peak_rss - start_rss,
+            }
+
+    document = {
+        "started_at": timezone.now().isoformat(),
+        "environment": _environment(),
+        "results": results,
+    }
+    return _write(document, output)
+
+
+def _verify_pins(service, card_ids, pins, rng_seed, count):
+    rng = random.Random(rng_seed)
+    seconds, busy = [], 0
+    try:
+        for _ in range(count):
+            card_id = rng.choice(card_ids)
+            started = time.perf_counter()
+            try:
+                # One wrong PIN in ten; the next right one clears the counter.
+                service.verify(card_id, pins[card_id] if rng.random() >= 0.1 else "0000")
+            except pin_service.PinServiceBusy:
+                busy += 1
+                continue
+            seconds.append(time.perf_counter() - started)
+    finally:
+        connection.close()
+    return seconds, busy
+
+
+def run_pin_load(output=None, clients=64, requests_per_client=100, cards=500, seed=42):
+    """
+    ``clients`` threads each verify ``requests_per_client`` PINs against one
+    PinService. Sets a PIN on ``cards`` active cards first.
+    """
+    rng = random.Random(seed)
+    card_ids = list(Card.objects.filter(status="ACTIVE").order_by("pk").values_list("pk", flat=True)[:cards])
+    if not card_ids:
+        raise RuntimeError("no active cards; run synthetic_data.generate() first")
+
+    service = pin_service.PinService()
+    pins = {card_id: f"{rng.randrange(10_000):04d}" for card_id in card_ids}
+    for card_id, pin in pins.items():
+        service.set_pin(card_id, pin)
+
+    started = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=clients) as threads:
+            results = list(threads.map(
+                _verify_pins,
+                [service] * clients, [card_ids] * clients, [pins] * clients,
+                [seed + n for n in range(clients)], [requests_per_client] * clients,
+            ))
+    finally:
+        service.shutdown()
+    elapsed = time.perf_counter() - started
+
+    seconds = [s for client_seconds, _ in results for s in client_seconds]
+    busy = sum(client_busy for _, client_busy in results)
+    summary = _summary(seconds, [0]) if seconds else {}
+    summary.pop("queries_per_op", None)
+    document = {
+        "started_at": timezone.now().isoformat(),
+        "seed": seed,
+        "environment": _environment(),
+        "results": {
+            f"pins.verify-{clients}-clients": dict(
+                summary,
+                workers=pin_service.WORKERS,
+                max_in_flight=pin_service.MAX_IN_FLIGHT,
+                verified=len(seconds),
+                busy=busy,
+                verifications_per_second=round(len(seconds) / elapsed, 1) if elapsed else None,
+            ),
+        },
+    }
+    return _write(document, output)
+
+
+def _upload(ctx, size):
+    """A teller upload of ``size`` rows: deposits, withdrawals and internal transfers."""
+    numbers = ctx.account_numbers
+    rows = []
+    for n in range(size):
+        source = ctx.rng.randrange(len(numbers))
+        row = {"account_number": numbers[source], "narration": "Benchmark upload"}
+        if n % 3 == 0:
+            row.update(type=bulk_posting.DEPOSIT, amount="1000.00")
+        elif n % 3 == 1:
+            row.update(type=bulk_posting.WITHDRAWAL, amount="100.00")
+        else:
+            row.update(type=bulk_posting.TRANSFER, amount="50.00",
+                       beneficiary_account=numbers[(source + 1) % len(numbers)],
+                       beneficiary_name="Benchmark Beneficiary")
+        rows.append(row)
+    return rows
+
+
+def run_bulk_posting(output=None, sizes=(10_000, 100_000), seed=42):
+    """Time one post_batch() per upload size; results carry rows per second."""
+    ctx = _context(seed)
+    results = {}
+    for size in sizes:
+        rows = _upload(ctx, size)
+        started = time.perf_counter()
+        with instrument("benchmark", f"posting.bulk-{size}") as measurement:
+            outcome = bulk_posting.post_batch(rows, ctx.branch, ctx.user)
+        seconds = time.perf_counter() - started
+        results[f"posting.bulk-{size // 1000}k"] = {
+            "rows": size,
+            "posted": outcome.posted,
+            "failed": len(outcome.failures),
+            "seconds": round(seconds, 3),
+            "rows_per_second": round(size / seconds, 1) if seconds else None,
+            "queries": measurement.queries,
+        }
+
+    document = {
+        "started_at": timezone.now().isoformat(),
+        "seed": seed,
+        "environment": _environment(),
+        "results": results,
+    }
+    return _write(document, output)
+
+
+def _allocate(series, branch_code, count):
+    started = time.perf_counter()
+    values = [references.generate_reference(series, branch_code) for _ in range(count)]
+    return values, time.perf_counter() - started
+
+
+def run_reference_allocation(output=None, workers=8, per_worker=20_000, series="DEP"):
+    """
+    Time ``workers`` processes each drawing ``per_worker`` references. Pairs
+    of workers share a branch shard, so blocks are contended as well as
+    spread. Fails if any value was issued twice.
+    """
+    branch_codes = list(Branch.objects.order_by("pk").values_list("branch_code", flat=True)[:max(1, workers // 2)])
+    if not branch_codes:
+        raise RuntimeError("no data to benchmark; run synthetic_data.generate() first")
+    shards = [branch_codes[n % len(branch_codes)] for n in range(workers)]
+
+    started = time.perf_counter()
+    connections.close_all()
+    with ProcessPoolExecutor(max_workers=workers, initializer=connections.close_all) as pool:
+        results = list(pool.map(_allocate, [series] * workers, shards, [per_worker] * workers))
+    seconds = time.perf_counter() - started
+
+    issued = [value for values, _ in results for value in values]
+    duplicates = len(issued) - len(set(issued))
+    if duplicates:
+        raise AssertionError(f"{duplicates} references were issued twice")
+
+    document = {
+        "started_at": timezone.now().isoformat(),
+        "environment": _environment(),
+        "results": {
+            f"references.{series.lower()}-{workers}-processes": {
+                "workers": workers,
+                "shards": len(branch_codes),
+                "issued": len(issued),
+                "block_size": references.BLOCK_SIZE,
+                "seconds": round(seconds, 3),
+                "per_second": round(len(issued) / seconds, 1) if seconds else None,
+                "slowest_worker_seconds": round(max(elapsed for _, elapsed in results), 3),
+            },
+        },
+    }
+    return _write(document, output)
+
+
+APPROVAL_LOAD_SOURCE = "BenchmarkLoad"
+
+
+def _approve(user, claim_size):
+    seconds, claimed = [], []
+    try:
+        while True:
+            started = time.perf_counter()
+            items = approval_queue.claim(user, count=claim_size)
+            seconds.append(time.perf_counter() - started)
+            if not items:
+                return seconds, claimed
+            claimed.extend(item.pk for item in items)
+    finally:
+        connection.close()
+
+
+def run_approval_load(output=None, pending=10_000, branches=50, approvers=20, claim_size=5, seed=42):
+    """
+    Fill the approval queue with ``pending`` items spread over ``branches``
+    branches, page through every branch's queue, then have ``approvers``
+    threads claim items until none are left. Fails if any item was claimed
+    twice. The load items are deleted afterwards.
+    """
+    rng = random.Random(seed)
+    branch_ids = list(Branch.objects.order_by("pk").values_list("pk", flat=True)[:branches])
+    if not branch_ids:
+        raise RuntimeError("no data to benchmark; run synthetic_data.generate() first")
+    User = get_user_model()
+    users = [
+        User.objects.get_or_create(**{User.USERNAME_FIELD: f"benchmark-approver-{n}"})[0]
+        for n in range(approvers)
+    ]
+
+    ApprovalItem.objects.filter(source_model=APPROVAL_LOAD_SOURCE).delete()
+    now = timezone.now()
+    ApprovalItem.objects.bulk_create(
+        [
+            ApprovalItem(
+                branch_id=branch_ids[n % len(branch_ids)],
+                source_model=APPROVAL_LOAD_SOURCE,
+                source_id=n,
+                summary=f"Load test item {n}",
+                created_at=now - timedelta(seconds=rng.randrange(7 * 24 * 60 * 60)),
+            )
+            for n in range(pending)
+        ],
+        batch_size=1000,
+    )
+
+    try:
+        seconds, queries = [], []
+        for branch_id in branch_ids:
+            branch = Branch(pk=branch_id)
+            cursor = None
+            while True:
+                started = time.perf_counter()
+                with instrument("benchmark", "approvals.page-load") as measurement:
+                    _, cursor = approval_queue.list_pending(branch, after=cursor)
+                seconds.append(time.perf_counter() - started)
+                queries.append(measurement.queries)
+                if cursor is None:
+                    break
+        paging = _summary(seconds, queries)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=approvers) as threads:
+            results = list(threads.map(_approve, users, [claim_size] * approvers))
+        elapsed = time.perf_counter() - started
+    finally:
+        ApprovalItem.objects.filter(source_model=APPROVAL_LOAD_SOURCE).delete()
+
+    claimed = [pk for _, pks in results for pk in pks]
+    duplicates = len(claimed) - len(set(claimed))
+    if duplicates:
+        raise AssertionError(f"{duplicates} approval items were claimed twice")
+    claiming = _summary([s for client_seconds, _ in results for s in client_seconds], [0])
+    claiming.pop("queries_per_op", None)
+
+    document = {
+        "started_at": timezone.now().isoformat(),
+        "seed": seed,
+        "environment": _environment(),
+        "results": {
+            f"approvals.page-{pending // 1000}k-pending": dict(paging, branches=len(branch_ids)),
+            f"approvals.claim-{approvers}-approvers": dict(
+                claiming,
+                claimed=len(claimed),
+                claim_size=claim_size,
+                claims_per_second=round(len(claimed) / elapsed, 1) if elapsed else None,
+            ),
+        },
+    }
+    return _write(document, output)
+
+
+def compare(baseline, current, threshold=REGRESSION_THRESHOLD):
+    """
+    Benchmarks in ``current`` that are worse than ``baseline`` by more than
+    ``threshold`` on any of COMPARED_METRICS. Both arguments are documents
+    from run() or the run_* functions, or paths to them. Metrics a result
+    does not report on both sides are not compared.
+    """
+    documents = []
+    for document in (baseline, current):
+        if isinstance(document, str):
+            with open(document) as handle:
+                document = json.load(handle)
+        documents.append(document["results"])
+    before, after = documents
+
+    regressions = []
+    for benchmark_id, result in after.items():
+        previous = before.get(benchmark_id)
+        if previous is None:
+            continue
+        for key in COMPARED_METRICS:
+            if not previous.get(key) or result.get(key) is None:
+                continue
+            if result[key] > previous[key] * (1 + threshold):
+                regressions.append({
+                    "benchmark": benchmark_id,
+                    "metric": key,
+                    "before": previous[key],
+                    "after": result[key],
+                    "change": round(result[key] / previous[key] - 1, 3),
+                })
+    return regressions
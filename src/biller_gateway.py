@@ -0,0 +1,412 @@
+"""
+Asynchronous biller gateway client: bill fetch and payment validation.
+
+Billers with bill_fetch_supported are asked for the bill before a
+BillPayment posts. The other billers are asked only to validate the
+reference. The client runs on asyncio and shares one pooled aiohttp session
+(at most POOL_SIZE connections), so a worker can have hundreds of
+validations in flight without a thread per call.
+
+Each biller, keyed by paybill number, is protected by:
+
+* a semaphore of PER_BILLER_CONCURRENCY, so a slow biller can take only its
+  own share of the pool;
+* a CircuitBreaker. After BREAKER_FAILURES consecutive failures the biller
+  is refused at once (BillerUnavailable) for BREAKER_RESET_SECONDS. One
+  trial call then decides whether it closes again; a trial that never
+  reports back is replaced by another after the same interval. Only
+  timeouts, connection errors and 5xx count as failures. Any other 4xx is
+  the biller refusing this payment (PaymentRejected), not the biller
+  failing.
+
+Fetched bills are cached for BILL_CACHE_TTL seconds under (paybill_number,
+reference_number), at most BILL_CACHE_MAX_ENTRIES of them; expired bills are
+swept on every insert. Concurrent fetches of the same bill share one
+request. A committed BillPayment evicts its bill, and any fetch of it still
+in flight, since the amount due has changed.
+
+Django code is synchronous, so check_payment() / validate_many() hand the
+work to one event loop that runs in a background thread for the whole
+process. The pool and the breakers live there across requests.
+
+When BILLER_GATEWAY_URL is configured, every new BillPayment is validated
+before it saves. Callers should call start_check(payment) as soon as the
+paybill, reference and amount are known. The biller round trip then runs
+on the loop while the request does its other work, and the pre_save
+receiver only collects the result. A payment saved without start_check()
+is validated there and then, which blocks the save for the round trip.
+
+biller_stub.py is a local stand-in for the gateway, used by tests and by the
+billers.validate-200-concurrent benchmark.
+"""
+
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_save, pre_save
+from django.dispatch import receiver
+
+from .models import BillPayment
+
+
+GATEWAY_URL = getattr(settings, "BILLER_GATEWAY_URL", None)
+REQUEST_TIMEOUT = getattr(settings, "BILLER_GATEWAY_TIMEOUT", 5)
+POOL_SIZE = 100
+PER_BILLER_CONCURRENCY = 10
+BILL_CACHE_TTL = 60
+BILL_CACHE_MAX_ENTRIES = 10_000
+BREAKER_FAILURES = 5
+BREAKER_RESET_SECONDS = 30
+
+
+class BillerError(Exception):
+    pass
+
+
+class BillerUnavailable(BillerError):
+    pass
+
+
+class BillNotFound(BillerError):
+    pass
+
+
+class PaymentRejected(BillerError):
+    pass
+
+
+@dataclass(frozen=True)
+class Bill:
+    paybill_number: str
+    reference_number: str
+    account_name: str
+    amount_due: Decimal
+    fetched_at: float
+
+
+@dataclass
+class Validation:
+    ok: bool
+    reason: str = ""
+    bill: Bill = None
+
+
+# =========================================================
+# CIRCUIT BREAKER AND CACHE
+# =========================================================
+
+class CircuitBreaker:
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half-open"
+
+    def __init__(self, failures=BREAKER_FAILURES, reset_seconds=BREAKER_RESET_SECONDS):
+        self.max_failures = failures
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+
+    def allow(self):
+        if self.state == self.CLOSED:
+            return True
+        now = time.monotonic()
+        if now - self.opened_at < self.reset_seconds:
+            return False
+        # Open for long enough, or the half-open trial was cancelled before
+        # it reported back: let exactly one trial call through.
+        self.state = self.HALF_OPEN
+        self.opened_at = now
+        return True
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.max_failures:
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+
+class BillCache:
+    """Bounded TTL cache of bills plus the fetches currently in flight."""
+
+    def __init__(self, ttl=BILL_CACHE_TTL, max_entries=BILL_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # Oldest fetch first, so expired bills are always at the front.
+        self._bills = OrderedDict()
+        self._in_flight = {}
+
+    def __len__(self):
+        return len(self._bills)
+
+    def get(self, key):
+        bill = self._bills.get(key)
+        if bill is None:
+            return None
+        if time.monotonic() - bill.fetched_at > self.ttl:
+            del self._bills[key]
+            return None
+        return bill
+
+    def put(self, key, bill):
+        self._bills.pop(key, None)
+        self._bills[key] = bill
+        self.sweep()
+        while len(self._bills) > self.max_entries:
+            self._bills.popitem(last=False)
+
+    def sweep(self):
+        """Drop expired bills."""
+        cutoff = time.monotonic() - self.ttl
+        while self._bills:
+            key, bill = next(iter(self._bills.items()))
+            if bill.fetched_at >= cutoff:
+                break
+            del self._bills[key]
+
+    async def get_or_fetch(self, key, fetch):
+        bill = self.get(key)
+        if bill is not None:
+            return bill
+        pending = self._in_flight.get(key)
+        if pending is None:
+            pending = self._in_flight[key] = asyncio.ensure_future(self._fetch(key, fetch))
+        return await asyncio.shield(pending)
+
+    async def _fetch(self, key, fetch):
+        task = asyncio.current_task()
+        try:
+            bill = await fetch()
+        finally:
+            current = self._in_flight.get(key) is task
+            if current:
+                del self._in_flight[key]
+        # An evict() during the fetch means the answer may already be stale.
+        if current:
+            self.put(key, bill)
+        return bill
+
+    def evict(self, key):
+        self._bills.pop(key, None)
+        self._in_flight.pop(key, None)
+
+    def clear(self):
+        self._bills.clear()
+
+
+# =========================================================
+# CLIENT
+# =========================================================
+
+class BillerGateway:
+    """One instance per event loop; use ``async with`` or call close()."""
+
+    def __init__(self, base_url=None, pool_size=POOL_SIZE, per_biller=PER_BILLER_CONCURRENCY,
+                 timeout=REQUEST_TIMEOUT, cache_ttl=BILL_CACHE_TTL):
+        self.base_url = (base_url or GATEWAY_URL or "").rstrip("/")
+        self.pool_size = pool_size
+        self.per_biller = per_biller
+        self.timeout = timeout
+        self.cache = BillCache(cache_ttl)
+        self._session = None
+        self._semaphores = {}
+        self._breakers = {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _session_for_loop(self):
+        import aiohttp
+
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=30),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self._session
+
+    def breaker(self, paybill_number):
+        breaker = self._breakers.get(paybill_number)
+        if breaker is None:
+            breaker = self._breakers[paybill_number] = CircuitBreaker()
+        return breaker
+
+    async def _call(self, paybill_number, method, path, payload=None):
+        import aiohttp
+
+        breaker = self.breaker(paybill_number)
+        if not breaker.allow():
+            raise BillerUnavailable(f"biller {paybill_number} is failing; circuit open")
+
+        semaphore = self._semaphores.get(paybill_number)
+        if semaphore is None:
+            semaphore = self._semaphores[paybill_number] = asyncio.Semaphore(self.per_biller)
+
+        url = f"{self.base_url}/billers/{paybill_number}{path}"
+        try:
+            async with semaphore:
+                async with self._session_for_loop().request(method, url, json=payload) as response:
+                    if response.status == 404:
+                        breaker.record_success()
+                        return None
+                    if response.status >= 500:
+                        raise BillerUnavailable(f"biller {paybill_number} answered {response.status}")
+                    if response.status >= 400:
+                        # The biller is up and refusing this request.
+                        breaker.record_success()
+                        raise PaymentRejected(f"biller {paybill_number} answered {response.status}")
+                    body = await response.json()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+            breaker.record_failure()
+            raise BillerUnavailable(f"biller {paybill_number}: {exc}") from exc
+        except BillerUnavailable:
+            breaker.record_failure()
+            raise
+        breaker.record_success()
+        return body
+
+    async def fetch_bill(self, paybill_number, reference_number):
+        async def fetch():
+            body = await self._call(paybill_number, "GET", f"/bills/{reference_number}")
+            if body is None:
+                raise BillNotFound(f"no bill for {reference_number} at {paybill_number}")
+            return Bill(
+                paybill_number=paybill_number,
+                reference_number=reference_number,
+                account_name=body.get("account_name", ""),
+                amount_due=Decimal(str(body["amount_due"])),
+                fetched_at=time.monotonic(),
+            )
+
+        return await self.cache.get_or_fetch((paybill_number, reference_number), fetch)
+
+    async def validate(self, paybill_number, reference_number, amount, fetch_supported=True):
+        """Validation for paying ``amount`` against the reference. Never raises BillNotFound."""
+        amount = Decimal(amount)
+        if amount <= 0:
+            return Validation(False, "amount must be positive")
+
+        if fetch_supported:
+            try:
+                bill = await self.fetch_bill(paybill_number, reference_number)
+            except BillNotFound as exc:
+                return Validation(False, str(exc))
+            if bill.amount_due and amount > bill.amount_due:
+                return Validation(False, f"amount exceeds the {bill.amount_due} due", bill)
+            return Validation(True, bill=bill)
+
+        body = await self._call(
+            paybill_number, "POST", "/validate",
+            {"reference_number": reference_number, "amount": str(amount)},
+        )
+        if body is None:
+            return Validation(False, f"unknown reference {reference_number}")
+        return Validation(bool(body.get("valid")), body.get("reason", ""))
+
+    async def validate_many(self, payments):
+        """validate() for many (paybill, reference, amount, fetch_supported) tuples at once."""
+        results = await asyncio.gather(
+            *(self.validate(*payment) for payment in payments), return_exceptions=True
+        )
+        validations = []
+        for result in results:
+            if isinstance(result, BillerError):
+                result = Validation(False, str(result))
+            elif isinstance(result, BaseException):
+                raise result
+            validations.append(result)
+        return validations
+
+
+# =========================================================
+# SYNCHRONOUS BRIDGE
+# =========================================================
+
+_loop = None
+_gateway = None
+_lock = threading.Lock()
+
+
+def _background_loop():
+    global _loop, _gateway
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="biller-gateway", daemon=True).start()
+            _gateway = BillerGateway()
+    return _loop, _gateway
+
+
+def run(coroutine_function, *args, timeout=None):
+    """Run ``coroutine_function(gateway, *args)`` on the shared loop and wait for it."""
+    loop, gateway = _background_loop()
+    future = asyncio.run_coroutine_threadsafe(coroutine_function(gateway, *args), loop)
+    return future.result(timeout or REQUEST_TIMEOUT * 2)
+
+
+def validate_many(payments):
+    return run(BillerGateway.validate_many, payments, timeout=REQUEST_TIMEOUT * 4)
+
+
+def start_check(payment):
+    """
+    Start validating ``payment`` on the shared loop without waiting, and
+    return the concurrent future. The future is kept on the payment, so
+    saving it waits only for whatever is left of the round trip.
+    """
+    fetch_supported = bool(payment.biller_id and payment.biller.bill_fetch_supported)
+    loop, gateway = _background_loop()
+    payment._biller_check = asyncio.run_coroutine_threadsafe(
+        gateway.validate(payment.paybill_number, payment.reference_number, payment.amount, fetch_supported),
+        loop,
+    )
+    return payment._biller_check
+
+
+def check_payment(payment):
+    """Raise PaymentRejected / BillerUnavailable unless the biller accepts ``payment``."""
+    future = getattr(payment, "_biller_check", None)
+    if future is None:
+        future = start_check(payment)
+    validation = future.result(REQUEST_TIMEOUT * 2)
+    if not validation.ok:
+        raise PaymentRejected(validation.reason)
+    return validation
+
+
+def evict_bill(paybill_number, reference_number):
+    """Forget the cached bill on the shared loop, if it has been started."""
+    loop, gateway = _loop, _gateway
+    if loop is not None:
+        loop.call_soon_threadsafe(gateway.cache.evict, (paybill_number, reference_number))
+
+
+@receiver(pre_save, sender=BillPayment)
+def validate_before_posting(sender, instance, raw=False, **kwargs):
+    if raw or instance.pk is not None or not GATEWAY_URL:
+        return
+    check_payment(instance)
+
+
+@receiver(post_save, sender=BillPayment)
+def evict_paid_bill(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    key = (instance.paybill_number, instance.reference_number)
+    transaction.on_commit(lambda: evict_bill(*key))
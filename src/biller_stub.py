@@ -0,0 +1,89 @@
+"""
+Local stand-in for the biller gateway, for tests and benchmarks.
+
+Serves the two endpoints biller_gateway.py calls:
+
+    GET  /billers/<paybill>/bills/<reference>   -> {"account_name", "amount_due"} or 404
+    POST /billers/<paybill>/validate            -> {"valid", "reason"}, 404, or 422
+                                                   for more than the amount due
+
+Bills are generated from a seed, so the same reference always has the same
+amount due. Every reference ending in "0" is treated as unknown. ``latency``
+adds a delay to each response. ``failure_rate`` answers that share of calls
+with 503, enough to trip the client's circuit breakers. Both can be changed
+while the server runs.
+"""
+
+import asyncio
+import random
+from decimal import Decimal
+
+
+class StubBiller:
+
+    def __init__(self, latency=0.02, failure_rate=0.0, seed=42):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.seed = seed
+        self.requests = 0
+        self._random = random.Random(seed)
+        self._runner = None
+
+    def bill(self, paybill_number, reference_number):
+        if reference_number.endswith("0"):
+            return None
+        rng = random.Random(f"{self.seed}:{paybill_number}:{reference_number}")
+        return {
+            "account_name": f"Account {reference_number}",
+            "amount_due": str(Decimal(rng.randrange(100, 50_000)).quantize(Decimal("0.01"))),
+        }
+
+    async def _respond(self, request, payload):
+        from aiohttp import web
+
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self._random.random() < self.failure_rate:
+            return web.json_response({"error": "unavailable"}, status=503)
+        if payload is None:
+            return web.json_response({"error": "not found"}, status=404)
+        return web.json_response(payload)
+
+    async def fetch(self, request):
+        info = request.match_info
+        return await self._respond(request, self.bill(info["paybill"], info["reference"]))
+
+    async def validate(self, request):
+        from aiohttp import web
+
+        body = await request.json()
+        bill = self.bill(request.match_info["paybill"], body.get("reference_number", ""))
+        if bill and Decimal(body.get("amount", "0")) > Decimal(bill["amount_due"]):
+            self.requests += 1
+            return web.json_response({"error": "amount exceeds the amount due"}, status=422)
+        return await self._respond(request, bill and {"valid": True, "reason": ""})
+
+    def app(self):
+        from aiohttp import web
+
+        app = web.Application()
+        app.router.add_get("/billers/{paybill}/bills/{reference}", self.fetch)
+        app.router.add_post("/billers/{paybill}/validate", self.validate)
+        return app
+
+    async def start(self, host="127.0.0.1", port=0):
+        """Start serving and return the base URL (port 0 picks a free port)."""
+        from aiohttp import web
+
+        self._runner = web.AppRunner(self.app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        bound_port = site._server.sockets[0].getsockname()[1]
+        return f"http://{host}:{bound_port}"
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,271 @@
+"""
+Batch posting for teller end-of-day and agent-banking uploads.
+
+post_batch() takes a list of row dicts, validates them up front and then posts
+them chunk by chunk. Each chunk runs in its own transaction:
+
+1. lock the chunk's accounts in primary-key order (so two batches touching
+   the same accounts can never deadlock), and fail the rows whose account
+   was closed or deleted since validation,
+2. read their balances once (ledger.account_balances, which counts the
+   legacy balance of accounts not yet opened in the ledger) and walk the
+   rows, rejecting any debit that would overdraw the account,
+3. bulk insert the accepted CashDeposit / CashWithdrawal / FundsTransfer
+   rows and their ledger legs.
+
+Like a single posting, a batch never writes CustomerAccount.balance; the
+column follows the ledger through ledger.roll_snapshots.
+
+A bad row is reported in the result and skipped; it never aborts the batch.
+If a chunk fails at the database level, only that chunk's rows are reported
+as failed.
+
+Row format::
+
+    {"type": "DEPOSIT" | "WITHDRAWAL" | "TRANSFER",
+     "account_number": "...", "amount": "1500.00", "narration": "...",
+     # TRANSFER only
+     "beneficiary_account": "...", "beneficiary_name": "..."}
+"""
+
+from collections import defaultdict
+from dataclasses import dataclass, field
+from decimal import Decimal, InvalidOperation
+
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+
+from . import dashboard_rollups, ledger, metrics_engine, outbox, references
+from .models import CashDeposit, CashWithdrawal, CustomerAccount, FundsTransfer
+
+
+CHUNK_SIZE = 1000
+LOOKUP_CHUNK_SIZE = 5000
+
+DEPOSIT = "DEPOSIT"
+WITHDRAWAL = "WITHDRAWAL"
+TRANSFER = "TRANSFER"
+
+POSTABLE_STATUSES = ("ACTIVE", "APPROVED")
+
+
+@dataclass
+class RowFailure:
+    row: int
+    error: str
+
+
+@dataclass
+class BatchResult:
+    total: int = 0
+    posted: int = 0
+    failures: list = field(default_factory=list)
+
+    def fail(self, row, error):
+        self.failures.append(RowFailure(row, error))
+
+
+@dataclass
+class _Row:
+    index: int
+    type: str
+    account_id: int
+    amount: Decimal
+    narration: str
+    beneficiary_account: str = ""
+    beneficiary_name: str = ""
+    beneficiary_id: int = None
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _resolve_accounts(account_numbers):
+    """account_number -> (id, status) for every number that exists."""
+    found = {}
+    numbers = sorted(set(account_numbers))
+    for chunk in _chunks(numbers, LOOKUP_CHUNK_SIZE):
+        rows = (
+            CustomerAccount.objects
+            .filter(account_number__in=chunk)
+            .values_list("account_number", "id", "status")
+        )
+        for number, account_id, status in rows:
+            found[number] = (account_id, status)
+    return found
+
+
+def _parse(rows, result):
+    numbers = [row.get("account_number", "") for row in rows]
+    numbers += [row.get("beneficiary_account", "") for row in rows if row.get("type") == TRANSFER]
+    accounts = _resolve_accounts(n for n in numbers if n)
+
+    parsed = []
+    for index, raw in enumerate(rows):
+        kind = str(raw.get("type", "")).upper()
+        if kind not in (DEPOSIT, WITHDRAWAL, TRANSFER):
+            result.fail(index, f"unknown type {raw.get('type')!r}")
+            continue
+
+        try:
+            amount = Decimal(str(raw.get("amount"))).quantize(Decimal("0.01"))
+        except (InvalidOperation, ValueError):
+            result.fail(index, f"invalid amount {raw.get('amount')!r}")
+            continue
+        if amount <= 0:
+            result.fail(index, "amount must be positive")
+            continue
+
+        account = accounts.get(raw.get("account_number"))
+        if account is None:
+            result.fail(index, f"unknown account {raw.get('account_number')!r}")
+            continue
+        account_id, status = account
+        if status not in POSTABLE_STATUSES:
+            result.fail(index, f"account is {status}")
+            continue
+
+        row = _Row(index, kind, account_id, amount, raw.get("narration") or "")
+        if kind == TRANSFER:
+            row.beneficiary_account = raw.get("beneficiary_account") or ""
+            row.beneficiary_name = raw.get("beneficiary_name") or ""
+            if not row.beneficiary_account or not row.beneficiary_name:
+                result.fail(index, "transfer needs beneficiary_account and beneficiary_name")
+                continue
+            beneficiary = accounts.get(row.beneficiary_account)
+            row.beneficiary_id = beneficiary[0] if beneficiary else None
+            if row.beneficiary_id == account_id:
+                result.fail(index, "cannot transfer to the same account")
+                continue
+
+        parsed.append(row)
+    return parsed
+
+
+def _transfer_legs(row):
+    credit = (
+        ledger.credit_account(row.beneficiary_id, row.amount)
+        if row.beneficiary_id else ledger.credit_gl(ledger.GL_TRANSFERS_OUT, row.amount)
+    )
+    return [ledger.debit_account(row.account_id, row.amount), credit]
+
+
+def _count_for_dashboard(branch, accepted):
+    # bulk_create skips the rollup signals too, so bump each service once.
+    day = timezone.localdate()
+    totals = [
+        (dashboard_rollups.TRACKED_MODELS[model][0], len(pairs), sum(obj.amount for _, obj in pairs))
+        for model, pairs in accepted.items()
+    ]
+
+    def apply():
+        for service, count, amount in totals:
+            dashboard_rollups.bump(branch.pk, day, service, "", count, amount)
+
+    transaction.on_commit(apply)
+
+
+def _post_chunk(rows, branch, user, result):
+    account_ids = {row.account_id for row in rows}
+    account_ids.update(row.beneficiary_id for row in rows if row.beneficiary_id)
+
+    with transaction.atomic():
+        statuses = dict(
+            CustomerAccount.objects
+            .select_for_update()
+            .filter(pk__in=account_ids)
+            .order_by("pk")
+            .values_list("pk", "status")
+        )
+        balances = ledger.account_balances(statuses)
+
+        accepted = defaultdict(list)
+        for row in rows:
+            # Validation ran before the locks; the accounts may have changed since.
+            status = statuses.get(row.account_id)
+            if status not in POSTABLE_STATUSES:
+                result.fail(row.index, f"account is {status}" if status else "account no longer exists")
+                continue
+            if row.beneficiary_id and row.beneficiary_id not in statuses:
+                result.fail(row.index, "beneficiary account no longer exists")
+                continue
+
+            if row.type == DEPOSIT:
+                balances[row.account_id] += row.amount
+                accepted[CashDeposit].append((row, CashDeposit(
+                    branch=branch, account_id=row.account_id, amount=row.amount,
+                    narration=row.narration, created_by=user,
+                )))
+                continue
+
+            if balances[row.account_id] < row.amount:
+                result.fail(row.index, "insufficient funds")
+                continue
+            balances[row.account_id] -= row.amount
+
+            if row.type == WITHDRAWAL:
+                accepted[CashWithdrawal].append((row, CashWithdrawal(
+                    branch=branch, account_id=row.account_id, amount=row.amount,
+                    narration=row.narration, created_by=user,
+                )))
+            else:
+                if row.beneficiary_id:
+                    balances[row.beneficiary_id] += row.amount
+                accepted[FundsTransfer].append((row, FundsTransfer(
+                    branch=branch, source_account_id=row.account_id,
+                    beneficiary_account=row.beneficiary_account,
+                    beneficiary_name=row.beneficiary_name, amount=row.amount,
+                    narration=row.narration, created_by=user,
+                )))
+
+        builders = {
+            CashDeposit: lambda row, obj: ledger.deposit_legs(obj),
+            CashWithdrawal: lambda row, obj: ledger.withdrawal_legs(obj),
+            FundsTransfer: lambda row, obj: _transfer_legs(row),
+        }
+
+        entries = []
+        posted = 0
+        for model, pairs in accepted.items():
+            # bulk_create skips pre_save and post_save, so the references,
+            # ledger legs, outbox events and metrics invalidation are done here.
+            for _, obj in pairs:
+                references.assign(obj, branch.branch_code)
+            model.objects.bulk_create([obj for _, obj in pairs], batch_size=CHUNK_SIZE)
+            outbox.record([obj for _, obj in pairs], outbox.CREATED)
+            metrics_engine.invalidate_rows(model, [obj for _, obj in pairs])
+            for row, obj in pairs:
+                entries.extend(ledger.build_entries(
+                    obj.reference, builders[model](row, obj),
+                    branch_id=branch.pk, source_model=model.__name__,
+                    source_id=obj.pk, narration=obj.narration,
+                ))
+            posted += len(pairs)
+
+        ledger.LedgerEntry.objects.bulk_create(entries, batch_size=CHUNK_SIZE)
+        _count_for_dashboard(branch, accepted)
+
+    return posted
+
+
+def post_batch(rows, branch, user=None, chunk_size=CHUNK_SIZE):
+    """Validate and post ``rows`` for ``branch``; returns a BatchResult."""
+    result = BatchResult(total=len(rows))
+    parsed = _parse(rows, result)
+
+    for chunk in _chunks(parsed, chunk_size):
+        # Rows in a chunk only fail individually before the inserts start;
+        # remember how many failures there were so a rolled-back chunk
+        # doesn't report its rows twice.
+        failures_before = len(result.failures)
+        try:
+            result.posted += _post_chunk(chunk, branch, user, result)
+        except DatabaseError as exc:
+            del result.failures[failures_before:]
+            for row in chunk:
+                result.fail(row.index, f"chunk rolled back: {exc}")
+
+    result.failures.sort(key=lambda failure: failure.row)
+    return result
@@ -0,0 +1,292 @@
+"""
+Authorization-time enforcement of Card.daily_pos_limit / daily_atm_limit.
+
+authorize() does an atomic check-and-add against the card's running total
+for today. It never runs SUM queries over past transactions. Counters live
+in one of three backends:
+
+* MemoryCounters - per-process slots objects holding integer cents; for a
+  single authorization worker and for tests.
+* RedisCounters  - shared across workers; a Lua script makes check-and-add
+  atomic, and keys expire after the day ends. Works against Redis or any
+  protocol-compatible local stand-in.
+* DatabaseCounters - CardDailyUsage rows with a conditional UPDATE; the
+  fallback when no Redis is configured.
+
+Counters reset lazily: every counter is stamped with its day, and the first
+use on a new day starts from zero.
+
+Limits and status are read from Card and kept on the engine together with
+the card's version from the shared cache. Saving a Card, or approving a
+CardLimitUpdate, bumps that version on commit, and every worker re-reads
+the card the next time it authorizes against it. Versions start from the
+clock, so an evicted version key never comes back with a value a worker
+already holds. Only ACTIVE cards are authorized.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import date
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Card, CardDailyUsage, CardLimitUpdate
+
+
+POS = "POS"
+ATM = "ATM"
+CHANNELS = (POS, ATM)
+
+MAX_DAILY_TRANSACTIONS = getattr(settings, "CARD_MAX_DAILY_TRANSACTIONS", 50)
+COUNTER_TTL = 2 * 24 * 60 * 60
+LIMITS_MAX_ENTRIES = 100_000
+AUTHORIZABLE_STATUS = "ACTIVE"
+
+
+@dataclass
+class Decision:
+    approved: bool
+    remaining: Decimal
+    reason: str = ""
+
+
+def to_cents(amount):
+    return int(Decimal(amount) * 100)
+
+
+def from_cents(cents):
+    return (Decimal(cents) / 100).quantize(Decimal("0.01"))
+
+
+def today():
+    return timezone.localdate().toordinal()
+
+
+# =========================================================
+# BACKENDS
+# =========================================================
+
+class _Slot:
+    __slots__ = ("day", "spent", "count")
+
+    def __init__(self, day):
+        self.day = day
+        self.spent = 0
+        self.count = 0
+
+
+class MemoryCounters:
+
+    def __init__(self):
+        self._slots = {}
+        self._lock = threading.Lock()
+
+    def check_and_add(self, card_id, channel, day, cents, limit_cents, max_count):
+        with self._lock:
+            slot = self._slots.get((card_id, channel))
+            if slot is None or slot.day != day:
+                slot = self._slots[(card_id, channel)] = _Slot(day)
+            if slot.count >= max_count:
+                return False, limit_cents - slot.spent, "velocity"
+            if slot.spent + cents > limit_cents:
+                return False, limit_cents - slot.spent, "limit"
+            slot.spent += cents
+            slot.count += 1
+            return True, limit_cents - slot.spent, ""
+
+    def release(self, card_id, channel, day, cents):
+        with self._lock:
+            slot = self._slots.get((card_id, channel))
+            if slot is not None and slot.day == day:
+                slot.spent = max(0, slot.spent - cents)
+                slot.count = max(0, slot.count - 1)
+
+
+class RedisCounters:
+
+    # KEYS[1] spent, KEYS[2] count; ARGV cents, limit, max_count, ttl
+    CHECK_AND_ADD = """
+    local spent = tonumber(redis.call('GET', KEYS[1]) or '0')
+    local count = tonumber(redis.call('GET', KEYS[2]) or '0')
+    if count >= tonumber(ARGV[3]) then return {0, tonumber(ARGV[2]) - spent, 'velocity'} end
+    if spent + tonumber(ARGV[1]) > tonumber(ARGV[2]) then return {0, tonumber(ARGV[2]) - spent, 'limit'} end
+    spent = redis.call('INCRBY', KEYS[1], ARGV[1])
+    redis.call('INCR', KEYS[2])
+    redis.call('EXPIRE', KEYS[1], ARGV[4])
+    redis.call('EXPIRE', KEYS[2], ARGV[4])
+    return {1, tonumber(ARGV[2]) - spent, ''}
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self._script = client.register_script(self.CHECK_AND_ADD)
+
+    @staticmethod
+    def _keys(card_id, channel, day):
+        base = f"card:{card_id}:{channel}:{day}"
+        return [f"{base}:spent", f"{base}:count"]
+
+    def check_and_add(self, card_id, channel, day, cents, limit_cents, max_count):
+        approved, remaining, reason = self._script(
+            keys=self._keys(card_id, channel, day),
+            args=[cents, limit_cents, max_count, COUNTER_TTL],
+        )
+        if isinstance(reason, bytes):
+            reason = reason.decode()
+        return bool(approved), int(remaining), reason
+
+    def release(self, card_id, channel, day, cents):
+        spent_key, count_key = self._keys(card_id, channel, day)
+        pipe = self.client.pipeline()
+        pipe.decrby(spent_key, cents)
+        pipe.decr(count_key)
+        pipe.execute()
+
+
+class DatabaseCounters:
+
+    def check_and_add(self, card_id, channel, day, cents, limit_cents, max_count):
+        usage_day = date.fromordinal(day)
+        amount = from_cents(cents)
+        limit = from_cents(limit_cents)
+        rows = CardDailyUsage.objects.filter(card_id=card_id, day=usage_day, channel=channel)
+
+        updated = rows.filter(spent__lte=limit - amount, count__lt=max_count).update(
+            spent=F("spent") + amount, count=F("count") + 1
+        )
+        if not updated and amount <= limit:
+            try:
+                with transaction.atomic():
+                    CardDailyUsage.objects.create(
+                        card_id=card_id, day=usage_day, channel=channel, spent=amount, count=1
+                    )
+                    updated = 1
+            except IntegrityError:
+                pass
+
+        spent, count = rows.values_list("spent", "count").first() or (Decimal(0), 0)
+        if updated:
+            return True, to_cents(limit - spent), ""
+        reason = "velocity" if count >= max_count else "limit"
+        return False, to_cents(limit - spent), reason
+
+    def release(self, card_id, channel, day, cents):
+        CardDailyUsage.objects.filter(
+            card_id=card_id, day=date.fromordinal(day), channel=channel
+        ).update(spent=F("spent") - from_cents(cents), count=F("count") - 1)
+
+
+# =========================================================
+# ENGINE
+# =========================================================
+
+def _version_key(card_id):
+    return f"card-limits:version:{card_id}"
+
+
+def current_version(card_id):
+    return cache.get_or_set(_version_key(card_id), time.time_ns, None)
+
+
+def invalidate(card_id):
+    """Make every worker re-read ``card_id``'s limits and status."""
+    try:
+        cache.incr(_version_key(card_id))
+    except ValueError:
+        cache.set(_version_key(card_id), time.time_ns(), None)
+
+
+class LimitEngine:
+
+    def __init__(self, counters, max_daily_transactions=MAX_DAILY_TRANSACTIONS, max_entries=LIMITS_MAX_ENTRIES):
+        self.counters = counters
+        self.max_daily_transactions = max_daily_transactions
+        self.max_entries = max_entries
+        self._limits = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _card_limits(self, card_id):
+        version = current_version(card_id)
+        with self._lock:
+            cached = self._limits.get(card_id)
+            if cached is not None and cached[0] == version:
+                self._limits.move_to_end(card_id)
+                return cached[1]
+
+        pos, atm, status = Card.objects.values_list(
+            "daily_pos_limit", "daily_atm_limit", "status"
+        ).get(pk=card_id)
+        limits = {POS: to_cents(pos), ATM: to_cents(atm), "status": status}
+        with self._lock:
+            self._limits[card_id] = (version, limits)
+            self._limits.move_to_end(card_id)
+            while len(self._limits) > self.max_entries:
+                self._limits.popitem(last=False)
+        return limits
+
+    def authorize(self, card_id, channel, amount):
+        if channel not in CHANNELS:
+            raise ValueError(f"unknown channel {channel!r}")
+        cents = to_cents(amount)
+        # A negative amount would lower the day's spend and raise the limit.
+        if cents <= 0:
+            return Decision(False, Decimal(0), "invalid amount")
+        limits = self._card_limits(card_id)
+        if limits["status"] != AUTHORIZABLE_STATUS:
+            return Decision(False, Decimal(0), "card inactive")
+
+        approved, remaining, reason = self.counters.check_and_add(
+            card_id, channel, today(), cents, limits[channel], self.max_daily_transactions
+        )
+        return Decision(approved, from_cents(max(remaining, 0)), reason)
+
+    def reverse(self, card_id, channel, amount):
+        """Give back an authorization that didn't complete."""
+        cents = to_cents(amount)
+        if cents <= 0:
+            raise ValueError(f"cannot reverse {amount}")
+        self.counters.release(card_id, channel, today(), cents)
+
+
+def _default_counters():
+    url = getattr(settings, "CARD_LIMITS_REDIS_URL", None)
+    if url:
+        import redis
+
+        return RedisCounters(redis.Redis.from_url(url))
+    return DatabaseCounters()
+
+
+engine = LimitEngine(_default_counters())
+
+
+@receiver(post_save, sender=CardLimitUpdate)
+def apply_limit_update(sender, instance, raw=False, **kwargs):
+    """Approved limit changes go to Card, then every engine re-reads the card."""
+    if raw or instance.approved_by_id is None:
+        return
+
+    def apply():
+        Card.objects.filter(pk=instance.card_id).update(
+            daily_pos_limit=instance.new_pos_limit,
+            daily_atm_limit=instance.new_atm_limit,
+        )
+        invalidate(instance.card_id)
+
+    transaction.on_commit(apply)
+
+
+@receiver(post_save, sender=Card)
+def refresh_card(sender, instance, raw=False, **kwargs):
+    if not raw:
+        card_id = instance.pk
+        transaction.on_commit(lambda: invalidate(card_id))
@@ -0,0 +1,432 @@
+"""
+Cross-sell scoring: ranked AddOn and AccountType offers per customer.
+
+Each Customer becomes a compact float32 feature vector with these parts:
+
+* income level, from monthly_income_range;
+* occupation, hashed into OCCUPATION_BUCKETS;
+* the account types and add-ons held;
+* card tier;
+* credit and debit volume and entry count over VOLUME_DAYS;
+* tenure.
+
+The model is a look-alike one, fitted from the book in one pass. For each
+offer it takes the mean standardised feature vector of the customers who
+already hold it. A customer's score for an offer is the dot product of
+their standardised vector with that mean, plus:
+
+* a small popularity prior;
+* RECOMMENDED_BOOST when AccountTypeAddOn.is_recommended links the add-on
+  to an account type they hold.
+
+Scoring is one matrix product per chunk of customers:
+(customers x features) @ (features x offers).
+
+An offer is eligible when the customer does not hold it already. An add-on
+must also be linked to one of the customer's account types; account types
+need no link, so a customer with no account yet is offered account types
+only. Customers whose aml_screening_status is not CLEAR get no offers.
+
+precompute() runs nightly. It stores the TOP_N offers per customer in
+CrossSellRecommendation and in the shared cache, so recommendations() for a
+teller is a cache read. When a customer takes up an offer (a new account or
+add-on), that offer is dropped from their stored list on commit.
+"""
+
+import math
+import re
+import zlib
+from dataclasses import dataclass
+from datetime import timedelta
+
+import numpy as np
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import ledger, reference_cache
+from .models import (
+    AccountTypeAddOn,
+    Card,
+    CrossSellRecommendation,
+    Customer,
+    CustomerAccount,
+    CustomerAccountAddOn,
+    LedgerEntry,
+)
+
+
+TOP_N = 3
+CHUNK_SIZE = 5000
+VOLUME_DAYS = 90
+OCCUPATION_BUCKETS = 16
+CARD_TIERS = ("CLASSIC", "GOLD", "PLATINUM", "INFINITE")
+HELD_STATUSES = ("PENDING", "APPROVED", "ACTIVE", "DORMANT")
+RECOMMENDED_BOOST = 0.5
+POPULARITY_WEIGHT = 0.2
+CACHE_TTL = 26 * 60 * 60
+
+ACCOUNT_TYPE = "ACCOUNT_TYPE"
+ADDON = "ADDON"
+
+CLEAR = "CLEAR"
+
+
+def income_level(text):
+    """log10 of the midpoint of a range such as "20,000 - 50,000" (0 if unparseable)."""
+    amounts = [int(number.replace(",", "")) for number in re.findall(r"\d[\d,]*", text or "")]
+    if not amounts:
+        return 0.0
+    lowered = text.lower()
+    if "below" in lowered or "under" in lowered:
+        amount = amounts[0] / 2
+    elif "above" in lowered or "over" in lowered:
+        amount = amounts[0] * 1.5
+    else:
+        amount = sum(amounts) / len(amounts)
+    return math.log10(amount + 1)
+
+
+def occupation_bucket(text):
+    return zlib.crc32((text or "").strip().lower().encode()) % OCCUPATION_BUCKETS
+
+
+# =========================================================
+# FEATURE SPACE
+# =========================================================
+
+@dataclass
+class FeatureSpace:
+    """Column layout of the feature vectors and of the offers, from the reference data."""
+    account_types: list
+    addons: list
+    offers: list
+    links: np.ndarray
+    recommended: np.ndarray
+
+    def __post_init__(self):
+        self.type_index = {account_type.pk: n for n, account_type in enumerate(self.account_types)}
+        self.addon_index = {addon.pk: n for n, addon in enumerate(self.addons)}
+        self.offer_index = {(kind, offer.pk): n for n, (kind, offer) in enumerate(self.offers)}
+        self.account_type_offers = np.array([kind == ACCOUNT_TYPE for kind, _ in self.offers], dtype=bool)
+
+        self.income_column = 0
+        self.occupation_start = 1
+        self.type_start = self.occupation_start + OCCUPATION_BUCKETS
+        self.addon_start = self.type_start + len(self.account_types)
+        self.tier_start = self.addon_start + len(self.addons)
+        self.volume_start = self.tier_start + len(CARD_TIERS) + 1
+        self.tenure_column = self.volume_start + 3
+        self.width = self.tenure_column + 1
+
+        # The feature column that says "holds this offer", one per offer.
+        self.own_column = np.array([
+            self.type_start + self.type_index[offer.pk] if kind == ACCOUNT_TYPE
+            else self.addon_start + self.addon_index[offer.pk]
+            for kind, offer in self.offers
+        ], dtype=np.int64)
+
+
+def feature_space():
+    data = reference_cache.reference_cache.get()
+    account_types = sorted(data.account_types.values(), key=lambda account_type: account_type.pk)
+    addons = sorted(data.addons.values(), key=lambda addon: addon.pk)
+    offers = (
+        [(ACCOUNT_TYPE, account_type) for account_type in account_types if account_type.is_active]
+        + [(ADDON, addon) for addon in addons if addon.is_active]
+    )
+    offer_index = {(kind, offer.pk): n for n, (kind, offer) in enumerate(offers)}
+    type_index = {account_type.pk: n for n, account_type in enumerate(account_types)}
+
+    # links[t, o]: add-on offer o can go with account type t; account-type
+    # offers need no link. recommended[t, o]: the link is flagged recommended.
+    links = np.zeros((len(account_types), len(offers)), dtype=bool)
+    recommended = np.zeros((len(account_types), len(offers)), dtype=np.float32)
+    pairs = AccountTypeAddOn.objects.values_list("account_type_id", "addon_id", "is_recommended")
+    for account_type_id, addon_id, is_recommended in pairs:
+        column = offer_index.get((ADDON, addon_id))
+        if column is None or account_type_id not in type_index:
+            continue
+        links[type_index[account_type_id], column] = True
+        if is_recommended:
+            recommended[type_index[account_type_id], column] = 1.0
+
+    return FeatureSpace(account_types, addons, offers, links, recommended)
+
+
+# =========================================================
+# FEATURES
+# =========================================================
+
+@dataclass
+class Chunk:
+    customer_ids: np.ndarray
+    features: np.ndarray
+    held: np.ndarray
+    eligible: np.ndarray
+    recommended: np.ndarray
+
+
+def _customer_chunks(chunk_size):
+    last_id = 0
+    while True:
+        rows = list(
+            Customer.objects
+            .filter(pk__gt=last_id)
+            .order_by("pk")
+            .values_list("pk", "occupation", "monthly_income_range", "created_at", "aml_screening_status")
+            [:chunk_size]
+        )
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1][0]
+
+
+def build_chunk(space, rows, now=None):
+    """Feature, holding and eligibility matrices for ``rows`` of Customer columns."""
+    now = now or timezone.now()
+    count = len(rows)
+    row_of = {row[0]: n for n, row in enumerate(rows)}
+    first_id, last_id = rows[0][0], rows[-1][0]
+    in_range = {"customer_id__gte": first_id, "customer_id__lte": last_id}
+
+    features = np.zeros((count, space.width), dtype=np.float32)
+    held = np.zeros((count, len(space.offers)), dtype=bool)
+    cleared = np.zeros(count, dtype=bool)
+
+    for n, (_, occupation, income, created_at, screening) in enumerate(rows):
+        features[n, space.income_column] = income_level(income)
+        features[n, space.occupation_start + occupation_bucket(occupation)] = 1.0
+        features[n, space.tenure_column] = (now - created_at).days / 365.0
+        cleared[n] = screening == CLEAR
+
+    account_customer = {}
+    accounts = (
+        CustomerAccount.objects
+        .filter(status__in=HELD_STATUSES, **in_range)
+        .values_list("pk", "customer_id", "account_type_id")
+    )
+    for account_id, customer_id, account_type_id in accounts:
+        n = row_of.get(customer_id)
+        if n is None:
+            continue
+        account_customer[account_id] = n
+        if account_type_id in space.type_index:
+            features[n, space.type_start + space.type_index[account_type_id]] = 1.0
+        column = space.offer_index.get((ACCOUNT_TYPE, account_type_id))
+        if column is not None:
+            held[n, column] = True
+
+    addons = (
+        CustomerAccountAddOn.objects
+        .filter(activated=True, account__customer_id__gte=first_id, account__customer_id__lte=last_id)
+        .values_list("account__customer_id", "addon_id")
+    )
+    for customer_id, addon_id in addons:
+        n = row_of.get(customer_id)
+        if n is None:
+            continue
+        if addon_id in space.addon_index:
+            features[n, space.addon_start + space.addon_index[addon_id]] = 1.0
+        column = space.offer_index.get((ADDON, addon_id))
+        if column is not None:
+            held[n, column] = True
+
+    cards = (
+        Card.objects
+        .filter(account__customer_id__gte=first_id, account__customer_id__lte=last_id)
+        .values_list("account__customer_id", "card_tier")
+    )
+    for customer_id, tier in cards:
+        n = row_of.get(customer_id)
+        if n is None:
+            continue
+        tier = (tier or "").upper()
+        offset = CARD_TIERS.index(tier) if tier in CARD_TIERS else len(CARD_TIERS)
+        features[n, space.tier_start + offset] = 1.0
+
+    if account_customer:
+        volumes = (
+            LedgerEntry.objects
+            .filter(account_id__in=list(account_customer), created_at__gte=now - timedelta(days=VOLUME_DAYS))
+            .values("account_id", "direction")
+            .annotate(total=Sum("amount"), entries=Count("id"))
+            .values_list("account_id", "direction", "total", "entries")
+        )
+        credits, debits, entries = np.zeros(count), np.zeros(count), np.zeros(count)
+        for account_id, direction, total, number in volumes:
+            n = account_customer[account_id]
+            if direction == ledger.CREDIT:
+                credits[n] += float(total)
+            else:
+                debits[n] += float(total)
+            entries[n] += number
+        features[:, space.volume_start] = np.log1p(credits)
+        features[:, space.volume_start + 1] = np.log1p(debits)
+        features[:, space.volume_start + 2] = np.log1p(entries)
+
+    types_held = features[:, space.type_start:space.addon_start]
+    linked = ((types_held @ space.links) > 0) | space.account_type_offers
+    eligible = linked & ~held & cleared[:, None]
+    recommended = (types_held @ space.recommended) > 0
+    return Chunk(np.array([row[0] for row in rows], dtype=np.int64), features, held, eligible, recommended)
+
+
+# =========================================================
+# MODEL
+# =========================================================
+
+@dataclass
+class Model:
+    space: FeatureSpace
+    mean: np.ndarray
+    scale: np.ndarray
+    weights: np.ndarray
+    prior: np.ndarray
+
+
+def fit(space, chunk_size=CHUNK_SIZE):
+    """One pass over the book: feature moments and the mean vector of each offer's holders."""
+    total = 0
+    sums = np.zeros(space.width)
+    squares = np.zeros(space.width)
+    holder_sums = np.zeros((len(space.offers), space.width))
+    holders = np.zeros(len(space.offers))
+
+    now = timezone.now()
+    for rows in _customer_chunks(chunk_size):
+        chunk = build_chunk(space, rows, now)
+        features = chunk.features.astype(np.float64)
+        total += len(rows)
+        sums += features.sum(axis=0)
+        squares += (features ** 2).sum(axis=0)
+        holder_sums += chunk.held.T.astype(np.float64) @ features
+        holders += chunk.held.sum(axis=0)
+
+    mean = sums / max(total, 1)
+    scale = np.sqrt(np.maximum(squares / max(total, 1) - mean ** 2, 0.0))
+    scale[scale < 1e-6] = 1.0
+
+    holder_mean = holder_sums / np.maximum(holders, 1)[:, None]
+    weights = (holder_mean - mean) / scale
+    weights[holders == 0] = 0.0
+    # Holding the offer itself says nothing about who else would take it.
+    weights[np.arange(len(space.offers)), space.own_column] = 0.0
+
+    prior = POPULARITY_WEIGHT * np.log((holders + 1) / (total + 2))
+    return Model(space, mean, scale, weights.astype(np.float32), prior.astype(np.float32))
+
+
+def score(model, chunk):
+    """(customers x offers) scores; ineligible offers score -inf."""
+    standardised = ((chunk.features - model.mean) / model.scale).astype(np.float32)
+    scores = standardised @ model.weights.T / np.float32(math.sqrt(model.space.width))
+    scores += model.prior
+    scores += RECOMMENDED_BOOST * chunk.recommended
+    scores[~chunk.eligible] = -np.inf
+    return scores
+
+
+def top_offers(model, scores, top_n=TOP_N):
+    """Best ``top_n`` eligible offers for each row of ``scores``, as stored lists."""
+    top_n = min(top_n, scores.shape[1])
+    if top_n == 0:
+        return [[] for _ in range(scores.shape[0])]
+    best = np.argpartition(-scores, top_n - 1, axis=1)[:, :top_n]
+    ranked = np.take_along_axis(best, np.argsort(-np.take_along_axis(scores, best, axis=1), axis=1), axis=1)
+
+    results = []
+    for n, columns in enumerate(ranked):
+        offers = []
+        for column in columns:
+            value = scores[n, column]
+            if not np.isfinite(value):
+                break
+            kind, offer = model.space.offers[column]
+            offers.append({
+                "kind": kind, "id": offer.pk, "code": offer.code, "name": offer.name,
+                "score": round(float(value), 4),
+            })
+        results.append(offers)
+    return results
+
+
+# =========================================================
+# NIGHTLY PRECOMPUTE AND LOOKUP
+# =========================================================
+
+def _cache_key(customer_id):
+    return f"cross-sell:{customer_id}"
+
+
+def precompute(top_n=TOP_N, chunk_size=CHUNK_SIZE):
+    """Fit, score every customer and store their top ``top_n`` offers; returns the customer count."""
+    space = feature_space()
+    model = fit(space, chunk_size)
+    now = timezone.now()
+
+    scored = 0
+    for rows in _customer_chunks(chunk_size):
+        chunk = build_chunk(space, rows, now)
+        offers = top_offers(model, score(model, chunk), top_n)
+        customer_ids = chunk.customer_ids.tolist()
+        CrossSellRecommendation.objects.bulk_create(
+            [
+                CrossSellRecommendation(customer_id=customer_id, offers=ranked, computed_at=now)
+                for customer_id, ranked in zip(customer_ids, offers)
+            ],
+            batch_size=1000,
+            update_conflicts=True,
+            unique_fields=["customer"],
+            update_fields=["offers", "computed_at"],
+        )
+        cache.set_many(
+            {_cache_key(customer_id): ranked for customer_id, ranked in zip(customer_ids, offers)},
+            CACHE_TTL,
+        )
+        scored += len(rows)
+    return scored
+
+
+def recommendations(customer_id):
+    """The precomputed offers for ``customer_id``, best first ([] if none)."""
+    key = _cache_key(customer_id)
+    offers = cache.get(key)
+    if offers is None:
+        offers = (
+            CrossSellRecommendation.objects
+            .filter(customer_id=customer_id)
+            .values_list("offers", flat=True)
+            .first()
+        ) or []
+        cache.set(key, offers, CACHE_TTL)
+    return offers
+
+
+def _drop_offer(customer_id, kind, offer_id):
+    offers = recommendations(customer_id)
+    kept = [offer for offer in offers if not (offer["kind"] == kind and offer["id"] == offer_id)]
+    if len(kept) == len(offers):
+        return
+    CrossSellRecommendation.objects.filter(customer_id=customer_id).update(offers=kept)
+    cache.set(_cache_key(customer_id), kept, CACHE_TTL)
+
+
+@receiver(post_save, sender=CustomerAccount)
+def account_taken_up(sender, instance, created, raw=False, **kwargs):
+    if raw or not created:
+        return
+    transaction.on_commit(lambda: _drop_offer(instance.customer_id, ACCOUNT_TYPE, instance.account_type_id))
+
+
+@receiver(post_save, sender=CustomerAccountAddOn)
+def addon_taken_up(sender, instance, created, raw=False, **kwargs):
+    if raw or not created:
+        return
+    customer_id = CustomerAccount.objects.filter(pk=instance.account_id).values_list("customer_id", flat=True).first()
+    if customer_id is not None:
+        transaction.on_commit(lambda: _drop_offer(customer_id, ADDON, instance.addon_id))
@@ -0,0 +1,259 @@
+"""
+Customer lookup for the teller CustomerLookup screen.
+
+search() works out what the teller typed and picks the cheapest indexed path:
+
+* KRA PIN (A123456789B)      -> customer_kra_pin_idx
+* national ID (digits only)  -> unique national_id index
+* phone number, any format   -> customer_mobile_norm_idx on the E.164-style
+                                mobile_normalized column
+* anything else              -> fuzzy name match
+
+Fuzzy name matching uses pg_trgm on PostgreSQL: the ``%`` operator
+(trigram_similar) filters through customer_name_trgm_idx, and the similarity
+score is only computed to order the matches. The operator's cut-off is the
+session's pg_trgm.similarity_threshold, set to MIN_NAME_SIMILARITY on every
+new connection. Other databases (SQLite test runs) fall back to the
+CustomerNameGram side table, which stores the same trigrams as rows and is
+matched in Python.
+"""
+
+import re
+import unicodedata
+from dataclasses import dataclass
+
+from django.db import connection, transaction
+from django.db.backends.signals import connection_created
+from django.db.models import Count
+from django.db.models.signals import post_migrate, post_save, pre_save
+from django.dispatch import receiver
+
+from .models import Customer, CustomerNameGram
+
+
+KENYA_DIALING_CODE = "254"
+
+KRA_PIN_RE = re.compile(r"^[AP]\d{9}[A-Z]$")
+NATIONAL_ID_RE = re.compile(r"^\d{6,9}$")
+PHONE_RE = re.compile(r"^(\+?254|0)?[17]\d{8}$")
+
+MIN_NAME_SIMILARITY = 0.3
+CANDIDATE_FACTOR = 5
+REINDEX_BATCH_SIZE = 2000
+
+TRIGRAM_INDEX_SQL = (
+    "CREATE INDEX IF NOT EXISTS customer_name_trgm_idx "
+    "ON {table} USING gin (name_normalized gin_trgm_ops)"
+)
+
+
+@dataclass
+class SearchHit:
+    customer: Customer
+    score: float
+    matched_on: str
+
+
+# =========================================================
+# NORMALISATION
+# =========================================================
+
+def normalize_phone(raw):
+    """Return 2547XXXXXXXX / 2541XXXXXXXX, or '' if ``raw`` isn't a Kenyan mobile."""
+    digits = re.sub(r"\D", "", raw or "")
+    if digits.startswith(KENYA_DIALING_CODE) and len(digits) == 12:
+        digits = digits[3:]
+    elif digits.startswith("0") and len(digits) == 10:
+        digits = digits[1:]
+    if len(digits) == 9 and digits[0] in "17":
+        return KENYA_DIALING_CODE + digits
+    return ""
+
+
+def normalize_name(raw):
+    text = unicodedata.normalize("NFKD", raw or "")
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return " ".join(re.sub(r"[^0-9a-z]+", " ", text.casefold()).split())
+
+
+def trigrams(name):
+    """pg_trgm-compatible trigrams: each word padded with two leading and one trailing space."""
+    grams = set()
+    for word in name.split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def similarity(left, right):
+    if not left or not right:
+        return 0.0
+    return len(left & right) / len(left | right)
+
+
+def uses_pg_trgm():
+    return connection.vendor == "postgresql"
+
+
+# =========================================================
+# INDEX MAINTENANCE
+# =========================================================
+
+@receiver(pre_save, sender=Customer)
+def normalise_search_keys(sender, instance, **kwargs):
+    instance.kra_pin = (instance.kra_pin or "").strip().upper()
+    instance.mobile_normalized = normalize_phone(instance.mobile_number)
+    instance._name_changed = instance.name_normalized != normalize_name(instance.full_name)
+    instance.name_normalized = normalize_name(instance.full_name)
+
+
+@receiver(post_save, sender=Customer)
+def refresh_name_grams(sender, instance, created, raw=False, **kwargs):
+    if raw or uses_pg_trgm():
+        return
+    if created or getattr(instance, "_name_changed", True):
+        index_names([instance])
+
+
+def index_names(customers):
+    """Rebuild CustomerNameGram rows for ``customers``."""
+    customers = list(customers)
+    with transaction.atomic():
+        CustomerNameGram.objects.filter(customer__in=customers).delete()
+        CustomerNameGram.objects.bulk_create(
+            [
+                CustomerNameGram(customer=customer, gram=gram)
+                for customer in customers
+                for gram in trigrams(customer.name_normalized)
+            ],
+            batch_size=REINDEX_BATCH_SIZE,
+        )
+
+
+def reindex_customers(batch_size=REINDEX_BATCH_SIZE):
+    """Backfill search keys (and grams, off PostgreSQL) for existing rows."""
+    last_id = 0
+    while True:
+        batch = list(Customer.objects.filter(pk__gt=last_id).order_by("pk")[:batch_size])
+        if not batch:
+            return
+        for customer in batch:
+            customer.kra_pin = customer.kra_pin.strip().upper()
+            customer.mobile_normalized = normalize_phone(customer.mobile_number)
+            customer.name_normalized = normalize_name(customer.full_name)
+        Customer.objects.bulk_update(
+            batch, ["kra_pin", "mobile_normalized", "name_normalized"], batch_size=batch_size
+        )
+        if not uses_pg_trgm():
+            index_names(batch)
+        last_id = batch[-1].pk
+
+
+@receiver(connection_created)
+def set_similarity_threshold(sender, connection, **kwargs):
+    if connection.vendor != "postgresql":
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT set_config('pg_trgm.similarity_threshold', %s, false)", [str(MIN_NAME_SIMILARITY)]
+        )
+
+
+@receiver(post_migrate)
+def create_trigram_index(sender, using="default", **kwargs):
+    if not uses_pg_trgm():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        cursor.execute(TRIGRAM_INDEX_SQL.format(table=Customer._meta.db_table))
+
+
+# =========================================================
+# SEARCH
+# =========================================================
+
+def _name_candidates_pg(name, queryset, limit):
+    from django.contrib.postgres.search import TrigramSimilarity
+
+    # Filtering on the computed similarity would score every row; ``%`` can
+    # use the GIN index.
+    rows = (
+        queryset
+        .filter(name_normalized__trigram_similar=name)
+        .annotate(similarity=TrigramSimilarity("name_normalized", name))
+        .order_by("-similarity")[:limit]
+    )
+    return [(customer, customer.similarity) for customer in rows]
+
+
+def _name_candidates_grams(name, queryset, limit):
+    query_grams = trigrams(name)
+    if not query_grams:
+        return []
+
+    # A name can only reach MIN_NAME_SIMILARITY if it shares at least that
+    # share of the query's grams, which prunes most of the table up front.
+    min_hits = max(1, int(len(query_grams) * MIN_NAME_SIMILARITY))
+    candidate_ids = (
+        CustomerNameGram.objects
+        .filter(gram__in=query_grams, customer__in=queryset)
+        .values("customer_id")
+        .annotate(hits=Count("id"))
+        .filter(hits__gte=min_hits)
+        .order_by("-hits")
+        .values_list("customer_id", flat=True)[:limit * CANDIDATE_FACTOR]
+    )
+
+    scored = []
+    for customer in queryset.filter(pk__in=list(candidate_ids)):
+        score = similarity(query_grams, trigrams(customer.name_normalized))
+        if score >= MIN_NAME_SIMILARITY:
+            scored.append((customer, score))
+    scored.sort(key=lambda pair: pair[1], reverse=True)
+    return scored[:limit]
+
+
+def search(query, branch=None, limit=20):
+    """
+    Ranked customers for a teller's free-text ``query``.
+
+    Exact identifier matches score 1.0. Name matches are scored by trigram
+    similarity, with a small boost for prefix matches and for customers of
+    the teller's own ``branch``.
+    """
+    text = (query or "").strip()
+    if not text:
+        return []
+
+    queryset = Customer.objects.select_related("branch")
+    compact = re.sub(r"[\s-]", "", text).upper()
+
+    if KRA_PIN_RE.match(compact):
+        return [SearchHit(c, 1.0, "kra_pin") for c in queryset.filter(kra_pin=compact)[:limit]]
+
+    if NATIONAL_ID_RE.match(compact):
+        hits = [SearchHit(c, 1.0, "national_id") for c in queryset.filter(national_id=compact)[:1]]
+        if hits:
+            return hits
+
+    if PHONE_RE.match(compact):
+        phone = normalize_phone(compact)
+        return [SearchHit(c, 1.0, "mobile") for c in queryset.filter(mobile_normalized=phone)[:limit]]
+
+    name = normalize_name(text)
+    if uses_pg_trgm():
+        candidates = _name_candidates_pg(name, queryset, limit * CANDIDATE_FACTOR)
+    else:
+        candidates = _name_candidates_grams(name, queryset, limit)
+
+    ranked = []
+    for customer, score in candidates:
+        if customer.name_normalized.startswith(name):
+            score += 0.1
+        if branch is not None and customer.branch_id == getattr(branch, "pk", branch):
+            score += 0.05
+        ranked.append((score, customer))
+
+    # Rank on the boosted score; only the reported score is capped at 1.0.
+    ranked.sort(key=lambda pair: pair[0], reverse=True)
+    return [SearchHit(customer, min(score, 1.0), "name") for score, customer in ranked[:limit]]
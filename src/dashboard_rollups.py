@@ -0,0 +1,226 @@
+"""
+Per-branch, per-day, per-service counters behind api/dashboard-counts/.
+
+Every tracked model bumps its ServiceDailyRollup bucket when a row is created
+and moves the row between status buckets when its status changes. The bumps
+run on transaction commit, so they never extend the posting transaction and
+a rolled-back posting is never counted.
+
+Signals can be missed (bulk_create, queryset.update(), raw SQL), so
+reconcile() rebuilds a date range straight from the source tables and is
+meant to run nightly over the last few days. It locks the range's buckets
+first, so on_commit bumps for those days wait for the rebuild instead of
+being overwritten by it.
+"""
+
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import Round, TruncDate
+from django.db.models.signals import post_init, post_save
+from django.utils import timezone
+
+from .metrics_engine import FX_TRANSFER_KES
+from .models import (
+    AccountModificationRequest,
+    BillPayment,
+    CardReplacement,
+    CashDeposit,
+    CashWithdrawal,
+    ChequeBookRequest,
+    DenominationExchange,
+    FundsTransfer,
+    FXBuy,
+    FXSell,
+    FXTransfer,
+    KYCUpdateRequest,
+    ServiceDailyRollup,
+    StandingOrder,
+    StatementRequest,
+)
+
+
+ZERO = Decimal("0.00")
+CENTS = Decimal("0.01")
+RECONCILE_DAYS = 3
+
+# model -> (service key, KES amount field or expression, or None)
+TRACKED_MODELS = {
+    CashDeposit: ("cash-deposit", "amount"),
+    CashWithdrawal: ("cash-withdrawal", "amount"),
+    FundsTransfer: ("funds-transfer", "amount"),
+    BillPayment: ("bill-payment", "amount"),
+    StandingOrder: ("standing-order", "amount"),
+    FXBuy: ("fx-buy", "kes_equivalent"),
+    FXSell: ("fx-sell", "kes_equivalent"),
+    # FXTransfer.amount is in the foreign currency; count it in KES as
+    # metrics_engine does.
+    FXTransfer: ("fx-transfer", FX_TRANSFER_KES),
+    DenominationExchange: ("denomination-exchange", "kes_equivalent"),
+    KYCUpdateRequest: ("kyc-update", None),
+    AccountModificationRequest: ("account-modification", None),
+    ChequeBookRequest: ("cheque-book", None),
+    StatementRequest: ("statement", None),
+    CardReplacement: ("card-replacement", None),
+}
+
+
+def _status(instance):
+    return getattr(instance, "status", "") or ""
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def _fx_transfer_kes(instance):
+    """Python side of FX_TRANSFER_KES: the quote's KES amount, else amount at the booked rate."""
+    if instance.quote_id:
+        return instance.quote.kes_amount
+    if instance.exchange_rate:
+        return (instance.amount * instance.exchange_rate).quantize(CENTS, rounding=ROUND_HALF_UP)
+    return ZERO
+
+
+def _amount(instance, amount_field):
+    if amount_field is None:
+        return ZERO
+    if not isinstance(amount_field, str):
+        return _fx_transfer_kes(instance)
+    return getattr(instance, amount_field) or ZERO
+
+
+def bump(branch_id, day, service, status, count, amount):
+    """Add ``count``/``amount`` to one bucket, creating it on first use."""
+    bucket = ServiceDailyRollup.objects.filter(
+        branch_id=branch_id, day=day, service=service, status=status
+    )
+    changes = {"count": F("count") + count, "amount": F("amount") + amount}
+    if bucket.update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            ServiceDailyRollup.objects.create(
+                branch_id=branch_id, day=day, service=service, status=status,
+                count=count, amount=amount,
+            )
+    except IntegrityError:
+        # Another worker created the bucket first.
+        bucket.update(**changes)
+
+
+# =========================================================
+# SIGNALS
+# =========================================================
+
+def remember_status(sender, instance, **kwargs):
+    instance._rollup_status = _status(instance) if instance.pk else None
+
+
+def count_change(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+
+    service, amount_field = TRACKED_MODELS[sender]
+    old_status = getattr(instance, "_rollup_status", None)
+    new_status = _status(instance)
+    if not created and old_status == new_status:
+        return
+
+    branch_id = instance.branch_id
+    day = timezone.localdate(instance.created_at)
+    amount = _amount(instance, amount_field)
+
+    def apply():
+        if not created and old_status is not None:
+            bump(branch_id, day, service, old_status, -1, -amount)
+        bump(branch_id, day, service, new_status, 1, amount)
+
+    transaction.on_commit(apply)
+    instance._rollup_status = new_status
+
+
+for _model in TRACKED_MODELS:
+    post_init.connect(remember_status, sender=_model, dispatch_uid=f"rollup-init-{_model.__name__}")
+    post_save.connect(count_change, sender=_model, dispatch_uid=f"rollup-save-{_model.__name__}")
+
+
+# =========================================================
+# RECONCILIATION
+# =========================================================
+
+def reconcile(date_from=None, date_to=None):
+    """Rebuild every bucket in [date_from, date_to] from the source tables."""
+    date_to = date_to or timezone.localdate()
+    date_from = date_from or date_to - timedelta(days=RECONCILE_DAYS - 1)
+
+    # Bounds on created_at itself, so the column's index (or partition
+    # pruning) applies; TruncDate only labels the rows.
+    start, end = _day_start(date_from), _day_start(date_to + timedelta(days=1))
+
+    with transaction.atomic():
+        rollups = ServiceDailyRollup.objects.filter(day__gte=date_from, day__lte=date_to)
+        list(rollups.select_for_update().values_list("pk", flat=True))
+
+        buckets = []
+        for model, (service, amount_field) in TRACKED_MODELS.items():
+            has_status = any(f.name == "status" for f in model._meta.fields)
+            group_by = ["branch_id", "day"] + (["status"] if has_status else [])
+            aggregates = {"total": Count("id")}
+            if isinstance(amount_field, str):
+                aggregates["amount"] = Sum(amount_field)
+            elif amount_field is not None:
+                # Rounded per row, as the signals count each row.
+                aggregates["amount"] = Sum(Round(amount_field, 2))
+
+            rows = (
+                model.objects
+                .filter(created_at__gte=start, created_at__lt=end)
+                .annotate(day=TruncDate("created_at"))
+                .values(*group_by)
+                .annotate(**aggregates)
+            )
+            for row in rows:
+                buckets.append(ServiceDailyRollup(
+                    branch_id=row["branch_id"],
+                    day=row["day"],
+                    service=service,
+                    status=row.get("status") or "",
+                    count=row["total"],
+                    amount=row.get("amount") or ZERO,
+                ))
+
+        rollups.delete()
+        ServiceDailyRollup.objects.bulk_create(buckets, batch_size=1000)
+    return len(buckets)
+
+
+# =========================================================
+# READS
+# =========================================================
+
+def dashboard_counts(branch=None, date_from=None, date_to=None):
+    """
+    {service: {"count", "amount", "by_status": {status: count}}} for the
+    range (default: today), read from the rollups only.
+    """
+    date_to = date_to or timezone.localdate()
+    date_from = date_from or date_to
+
+    buckets = ServiceDailyRollup.objects.filter(day__gte=date_from, day__lte=date_to)
+    if branch is not None:
+        buckets = buckets.filter(branch=branch)
+
+    rows = buckets.values("service", "status").annotate(total=Sum("count"), value=Sum("amount"))
+
+    counts = defaultdict(lambda: {"count": 0, "amount": ZERO, "by_status": {}})
+    for row in rows:
+        entry = counts[row["service"]]
+        entry["count"] += row["total"]
+        entry["amount"] += row["value"] or ZERO
+        if row["status"]:
+            entry["by_status"][row["status"]] = row["total"]
+    return dict(counts)
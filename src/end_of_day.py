@@ -0,0 +1,387 @@
+"""
+End-of-day batch: interest accrual, monthly add-on fees and dormancy.
+
+run(run_date) processes every ACTIVE and DORMANT CustomerAccount once per
+date:
+
+* interest accrues daily on balances at or above the account type's
+  minimum_balance, at interest_rate percent a year over DAYS_IN_YEAR.
+  It is computed in integer hundredths of a cent, rounded half up, and the
+  fractions of a cent are kept in CustomerAccount.accrued_interest. On the
+  last day of the month the whole cents are posted (debit
+  GL_INTEREST_EXPENSE, credit the account) and the remainder carries over;
+* on the last day of the month each account still ACTIVE is charged the
+  monthly_fee of its activated add-ons (debit the account, credit
+  GL_FEE_INCOME). A fee the balance cannot cover is not charged and is
+  counted in fees_unpaid;
+* an ACTIVE account with no customer activity for DORMANCY_DAYS becomes
+  DORMANT. Activity is the newest ledger entry not written by this batch,
+  or the opening date. last_activity_at is carried forward each run, so a
+  run only reads the entries written since the previous run.
+
+Every account a run touches gets an outbox UPDATED event with the columns
+it wrote.
+
+The accounts are split into BatchPartition id ranges of PARTITION_SIZE and
+the ranges are spread over a process pool. A worker walks its range in
+chunks of CHUNK_SIZE accounts. Each chunk is loaded as columns, computed
+with NumPy, and written back in one transaction: a bulk update of the
+accounts, a bulk insert of the ledger legs, and the partition's next_id
+checkpoint. A run that dies is restarted by calling run() again for the
+same date. Finished partitions are skipped, and the others resume at
+next_id, so no account is accrued or charged twice.
+
+run() also catches up: every date after the last COMPLETED BatchRun is
+run in order up to run_date, so a day the job did not run (or failed) still
+accrues its interest. It stops at the first date that fails.
+
+CustomerAccount.balance is only refreshed for accounts opened in the
+ledger. For the others the column is still their legacy opening balance,
+which ledger.account_balances() adds on top of the entries, so it is left
+untouched.
+
+Accounts opened after a run started are not in its partitions. They are
+picked up by the next date's run.
+
+Each run also calls partitions.ensure_partitions(), so the monthly
+transaction partitions are opened ahead of time by a job that already runs
+every day.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+import numpy as np
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F, Max, Min, Sum
+from django.utils import timezone
+
+from . import ledger, outbox, partitions, reference_cache
+from .models import BatchPartition, BatchRun, CustomerAccount, CustomerAccountAddOn, LedgerEntry
+
+
+WORKERS = 4
+PARTITION_SIZE = 100_000
+CHUNK_SIZE = 5000
+DAYS_IN_YEAR = 365
+DORMANCY_DAYS = getattr(settings, "DORMANCY_DAYS", 365)
+
+PROCESSED_STATUSES = ("ACTIVE", "DORMANT")
+# Columns written back per account; balance only once opened in the ledger.
+LEGACY_FIELDS = ["accrued_interest", "last_activity_at", "status"]
+OPENED_FIELDS = LEGACY_FIELDS + ["balance"]
+SOURCE_MODEL = "BatchRun"
+
+
+@dataclass
+class RunStats:
+    partitions: int = 0
+    failed: int = 0
+    accounts: int = 0
+    interest_accrued: Decimal = Decimal("0.0000")
+    interest_posted: Decimal = Decimal("0.00")
+    fees_charged: Decimal = Decimal("0.00")
+    fees_unpaid: int = 0
+    dormant: int = 0
+
+
+def _is_month_end(run_date):
+    return (run_date + timedelta(days=1)).day == 1
+
+
+def _end_of_day(run_date):
+    return timezone.make_aware(datetime.combine(run_date + timedelta(days=1), time.min))
+
+
+def _cents(amount):
+    return Decimal(int(amount)).scaleb(-2)
+
+
+def _fraction(units):
+    """An integer amount of hundredths of a cent as a Decimal to four places."""
+    return Decimal(int(units)).scaleb(-4)
+
+
+def _daily_interest(balance, rate):
+    """
+    One day's interest, in hundredths of a cent, on ``balance`` cents at
+    ``rate`` hundredths of a percent a year, rounded half up. Python ints
+    (object arrays) so the product cannot overflow int64.
+    """
+    numerator = balance.astype(object) * rate
+    denominator = 100 * DAYS_IN_YEAR
+    return ((2 * numerator + denominator) // (2 * denominator)).astype(np.int64)
+
+
+# =========================================================
+# PLANNING
+# =========================================================
+
+def _plan(run_date, partition_size):
+    """The BatchRun for ``run_date``, with its partitions created on first call."""
+    with transaction.atomic():
+        batch, created = BatchRun.objects.select_for_update().get_or_create(run_date=run_date)
+        if not created:
+            return batch
+
+        previous = (
+            BatchRun.objects
+            .filter(status="COMPLETED", run_date__lt=run_date)
+            .order_by("-run_date")
+            .values_list("run_date", flat=True)
+            .first()
+        )
+        # Re-read the previous day in full: entries written after that run
+        # started would otherwise never be seen.
+        batch.activity_since = _end_of_day(previous - timedelta(days=1)) if previous else None
+        batch.save(update_fields=["activity_since"])
+
+        bounds = (
+            CustomerAccount.objects
+            .filter(status__in=PROCESSED_STATUSES)
+            .aggregate(low=Min("id"), high=Max("id"))
+        )
+        if bounds["low"] is not None:
+            BatchPartition.objects.bulk_create([
+                BatchPartition(run=batch, first_id=first, last_id=min(first + partition_size, bounds["high"] + 1) - 1,
+                               next_id=first)
+                for first in range(bounds["low"], bounds["high"] + 1, partition_size)
+            ])
+    return batch
+
+
+# =========================================================
+# CHUNK PROCESSING
+# =========================================================
+
+def _last_activity(first_id, last_id, since, until):
+    entries = LedgerEntry.objects.filter(
+        account_id__gte=first_id, account_id__lte=last_id, created_at__lt=until,
+    ).exclude(source_model=SOURCE_MODEL)
+    if since is not None:
+        entries = entries.filter(created_at__gte=since)
+    return dict(entries.values("account_id").annotate(last=Max("created_at")).values_list("account_id", "last"))
+
+
+def _monthly_fees(first_id, last_id):
+    return dict(
+        CustomerAccountAddOn.objects
+        .filter(account_id__gte=first_id, account_id__lte=last_id, activated=True, addon__is_active=True)
+        .values("account_id")
+        .annotate(fee=Sum("addon__monthly_fee"))
+        .values_list("account_id", "fee")
+    )
+
+
+def _rates(type_ids):
+    """
+    Per-account (interest rate in hundredths of a percent, minimum balance
+    in cents) arrays from the reference cache.
+    """
+    account_types = {type_id: reference_cache.account_type(type_id) for type_id in set(type_ids)}
+    rate = np.array([int(account_types[type_id].interest_rate * 100) for type_id in type_ids], dtype=object)
+    minimum = np.array([int(account_types[type_id].minimum_balance * 100) for type_id in type_ids], dtype=np.int64)
+    return rate, minimum
+
+
+def _newest(*moments):
+    moments = [moment for moment in moments if moment is not None]
+    return max(moments) if moments else None
+
+
+def process_chunk(batch, partition_id, chunk_size=CHUNK_SIZE):
+    """
+    Process the next ``chunk_size`` accounts of the partition and advance its
+    checkpoint, all in one transaction. Returns False once the partition is
+    exhausted.
+    """
+    run_date = batch.run_date
+    until = _end_of_day(run_date)
+    month_end = _is_month_end(run_date)
+
+    with transaction.atomic():
+        # The checkpoint row is locked first, so a second run of the same
+        # date waits here and then starts after this chunk.
+        partition = BatchPartition.objects.select_for_update().get(pk=partition_id)
+        if partition.status == "DONE":
+            return False
+        rows = list(
+            CustomerAccount.objects
+            .select_for_update()
+            .filter(pk__gte=partition.next_id, pk__lte=partition.last_id, status__in=PROCESSED_STATUSES)
+            .order_by("pk")
+            .values_list("pk", "branch_id", "account_type_id", "status", "accrued_interest",
+                         "last_activity_at", "created_at", "ledger_opened_at")[:chunk_size]
+        )
+        if not rows:
+            BatchPartition.objects.filter(pk=partition.pk).update(
+                next_id=partition.last_id + 1, status="DONE", error="", finished_at=timezone.now(),
+            )
+            return False
+
+        ids, branch_ids, type_ids, statuses, accrued, last_seen, opened, ledger_opened = zip(*rows)
+        first_id, last_id = ids[0], ids[-1]
+
+        balances_by_id = ledger.account_balances(ids)
+        recent = _last_activity(first_id, last_id, batch.activity_since, until)
+        fees_by_id = _monthly_fees(first_id, last_id) if month_end else {}
+
+        balance = np.array([int(balances_by_id[pk] * 100) for pk in ids], dtype=np.int64)
+        accrued_units = np.array([int(value.scaleb(4)) for value in accrued], dtype=np.int64)
+        rate, minimum = _rates(type_ids)
+        active = np.array([status == "ACTIVE" for status in statuses])
+        seen = [_newest(previous, recent.get(pk)) for pk, previous in zip(ids, last_seen)]
+        last_activity = np.array([(moment or opened_at).timestamp() for moment, opened_at in zip(seen, opened)])
+        fee = np.array([int(fees_by_id.get(pk, 0) * 100) for pk in ids], dtype=np.int64)
+
+        # Interest.
+        earning = (balance > 0) & (balance >= minimum)
+        daily = np.where(earning, _daily_interest(balance, rate), 0)
+        accrued_units += daily
+        posted = accrued_units // 100 if month_end else np.zeros(len(ids), dtype=np.int64)
+        accrued_units -= posted * 100
+        balance += posted
+
+        # Dormancy.
+        cutoff = (until - timedelta(days=DORMANCY_DAYS)).timestamp()
+        dormant = active & (last_activity < cutoff)
+
+        # Fees: only accounts still ACTIVE, and only when the balance covers them.
+        owed = active & ~dormant & (fee > 0)
+        charged = np.where(owed & (balance >= fee), fee, 0)
+        balance -= charged
+
+        accounts, entries = [], []
+        for n, pk in enumerate(ids):
+            account = CustomerAccount(
+                pk=pk,
+                accrued_interest=_fraction(accrued_units[n]),
+                last_activity_at=seen[n],
+                status="DORMANT" if dormant[n] else statuses[n],
+            )
+            if ledger_opened[n] is not None:
+                account.balance = _cents(balance[n])
+            accounts.append(account)
+            if posted[n]:
+                amount = _cents(posted[n])
+                entries += ledger.build_entries(
+                    f"INT{run_date:%Y%m}-{pk}",
+                    [ledger.debit_gl(ledger.GL_INTEREST_EXPENSE, amount), ledger.credit_account(pk, amount)],
+                    branch_ids[n], SOURCE_MODEL, batch.pk, narration=f"Interest for {run_date:%B %Y}",
+                )
+            if charged[n]:
+                amount = _cents(charged[n])
+                entries += ledger.build_entries(
+                    f"FEE{run_date:%Y%m}-{pk}",
+                    [ledger.debit_account(pk, amount), ledger.credit_gl(ledger.GL_FEE_INCOME, amount)],
+                    branch_ids[n], SOURCE_MODEL, batch.pk, narration=f"Add-on fees for {run_date:%B %Y}",
+                )
+
+        opened_accounts = [account for account, moment in zip(accounts, ledger_opened) if moment is not None]
+        legacy_accounts = [account for account, moment in zip(accounts, ledger_opened) if moment is None]
+        CustomerAccount.objects.bulk_update(opened_accounts, OPENED_FIELDS, batch_size=1000)
+        CustomerAccount.objects.bulk_update(legacy_accounts, LEGACY_FIELDS, batch_size=1000)
+        LedgerEntry.objects.bulk_create(entries, batch_size=1000)
+        outbox.record(opened_accounts, outbox.UPDATED, fields=set(OPENED_FIELDS))
+        outbox.record(legacy_accounts, outbox.UPDATED, fields=set(LEGACY_FIELDS))
+
+        BatchPartition.objects.filter(pk=partition.pk).update(
+            next_id=last_id + 1,
+            accounts=F("accounts") + len(ids),
+            interest_accrued=F("interest_accrued") + _fraction(daily.sum()),
+            interest_posted=F("interest_posted") + _cents(posted.sum()),
+            fees_charged=F("fees_charged") + _cents(charged.sum()),
+            fees_unpaid=F("fees_unpaid") + int((owed & (charged == 0)).sum()),
+            dormant=F("dormant") + int(dormant.sum()),
+        )
+    return True
+
+
+def process_partition(partition_id, chunk_size=CHUNK_SIZE):
+    """Run one partition to the end from its checkpoint; returns its final status."""
+    batch = BatchRun.objects.get(partitions=partition_id)
+    try:
+        while process_chunk(batch, partition_id, chunk_size):
+            pass
+    except Exception as exc:
+        BatchPartition.objects.filter(pk=partition_id).update(status="FAILED", error=repr(exc))
+        return "FAILED"
+    return "DONE"
+
+
+# =========================================================
+# RUN
+# =========================================================
+
+def _stats(batch):
+    totals = batch.partitions.aggregate(
+        accounts=Sum("accounts"),
+        interest_accrued=Sum("interest_accrued"),
+        interest_posted=Sum("interest_posted"),
+        fees_charged=Sum("fees_charged"),
+        fees_unpaid=Sum("fees_unpaid"),
+        dormant=Sum("dormant"),
+    )
+    stats = RunStats(
+        partitions=batch.partitions.count(),
+        failed=batch.partitions.filter(status="FAILED").count(),
+    )
+    for name, value in totals.items():
+        if value is not None:
+            setattr(stats, name, value)
+    return stats
+
+
+def _dates_due(run_date):
+    """Every date after the last COMPLETED run, up to and including ``run_date``."""
+    previous = (
+        BatchRun.objects
+        .filter(status="COMPLETED", run_date__lte=run_date)
+        .order_by("-run_date")
+        .values_list("run_date", flat=True)
+        .first()
+    )
+    if previous == run_date:
+        return [run_date]
+    first = previous + timedelta(days=1) if previous else run_date
+    return [first + timedelta(days=n) for n in range((run_date - first).days + 1)]
+
+
+def run(run_date=None, workers=WORKERS, partition_size=PARTITION_SIZE, chunk_size=CHUNK_SIZE):
+    """
+    Run (or resume) the end-of-day batch for ``run_date`` across ``workers``
+    processes, first catching up on any earlier date not yet completed, and
+    return the RunStats of the last date run. Stops at the first date that
+    fails. Calling it again for a completed date does nothing.
+    """
+    run_date = run_date or timezone.localdate()
+    partitions.ensure_partitions()
+    for day in _dates_due(run_date):
+        stats = _run_date(day, workers, partition_size, chunk_size)
+        if stats.failed:
+            return stats
+    return stats
+
+
+def _run_date(run_date, workers, partition_size, chunk_size):
+    batch = _plan(run_date, partition_size)
+    if batch.status == "COMPLETED":
+        return _stats(batch)
+
+    pending = list(batch.partitions.exclude(status="DONE").order_by("first_id").values_list("pk", flat=True))
+    BatchPartition.objects.filter(pk__in=pending).update(status="PENDING", error="")
+
+    if workers <= 1 or len(pending) <= 1:
+        results = [process_partition(pk, chunk_size) for pk in pending]
+    else:
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers, initializer=connections.close_all) as pool:
+            results = list(pool.map(process_partition, pending, [chunk_size] * len(pending)))
+
+    batch.status = "FAILED" if "FAILED" in results else "COMPLETED"
+    batch.finished_at = timezone.now()
+    batch.save(update_fields=["status", "finished_at"])
+    return _stats(batch)
@@ -0,0 +1,346 @@
+"""
+FX rate store and quote engine.
+
+Rates are published as versioned ExchangeRate rows per Currency. Reads go
+through two cache tiers:
+
+1. a small in-process LRU of RateSnapshot objects with a short TTL,
+2. the shared Django cache (Redis in production), holding the current
+   snapshot of every currency for all workers.
+
+The database is only hit when both miss, so FxTicker polls and pricing don't
+query it.
+
+A quote locks a rate version for QUOTE_TTL seconds. The FXQuote row is what
+FXBuy / FXSell / FXTransfer / DenominationExchange reference. Open quotes
+are also held in the shared cache so get_quote() doesn't need the DB, and
+consume_quote() marks a quote USED exactly once.
+
+An FXBuy, FXSell or FXTransfer saved with a quote it did not have before
+consumes that quote in a pre_save receiver. The quote must be open and
+unexpired, for the same side, branch and foreign amount. The row's
+exchange_rate (and kes_equivalent) are then taken from the quote, whatever
+the caller set. The models carry no currency of their own; the quote's
+rate fixes it. Save inside a transaction, so that an insert that fails
+hands the quote back.
+
+convert_batch() prices many amounts at once with NumPy for batch paths,
+in integer minor units so its results match quote() to the cent.
+"""
+
+import threading
+import time
+import uuid
+from collections import OrderedDict, namedtuple
+from datetime import timedelta
+from decimal import ROUND_HALF_UP, Decimal
+
+import numpy as np
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Max
+from django.db.models.signals import pre_save
+from django.utils import timezone
+
+from .models import Currency, ExchangeRate, FXBuy, FXQuote, FXSell, FXTransfer
+
+
+LOCAL_TTL = 5
+LOCAL_MAX_ENTRIES = 256
+SHARED_TTL = 60 * 60
+QUOTE_TTL = 120
+
+BASE_CURRENCY = "KES"
+CUSTOMER_BUYS = "BUY"
+CUSTOMER_SELLS = "SELL"
+
+CENTS = Decimal("0.01")
+RATE_PLACES = Decimal("0.0001")
+
+RateSnapshot = namedtuple("RateSnapshot", ["code", "rate_id", "version", "buy", "sell", "mid", "effective_at"])
+Quote = namedtuple("Quote", ["quote_id", "code", "side", "rate", "fcy_amount", "kes_amount", "expires_at"])
+
+
+class RateUnavailable(Exception):
+    pass
+
+
+class QuoteExpired(Exception):
+    pass
+
+
+class QuoteMismatch(Exception):
+    pass
+
+
+def customer_rate(snapshot, side):
+    """Customers buy FCY at the bank's sell rate and sell at its buy rate."""
+    return snapshot.sell if side == CUSTOMER_BUYS else snapshot.buy
+
+
+# =========================================================
+# IN-PROCESS TIER
+# =========================================================
+
+class LocalRateCache:
+
+    def __init__(self, ttl=LOCAL_TTL, max_entries=LOCAL_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, code):
+        with self._lock:
+            entry = self._entries.get(code)
+            if entry is None:
+                return None
+            snapshot, loaded_at = entry
+            if time.monotonic() - loaded_at > self.ttl:
+                del self._entries[code]
+                return None
+            self._entries.move_to_end(code)
+            return snapshot
+
+    def put(self, snapshot):
+        with self._lock:
+            self._entries[snapshot.code] = (snapshot, time.monotonic())
+            self._entries.move_to_end(snapshot.code)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+local_rates = LocalRateCache()
+
+
+# =========================================================
+# RATE READS
+# =========================================================
+
+def _shared_key(code):
+    return f"fx:rate:{code}"
+
+
+def _snapshot(rate, code):
+    return RateSnapshot(
+        code, rate.pk, rate.version, rate.buy_rate, rate.sell_rate, rate.mid_rate, rate.effective_at
+    )
+
+
+def _load_from_db(code):
+    rate = (
+        ExchangeRate.objects
+        .filter(currency__code=code)
+        .order_by("-version")
+        .first()
+    )
+    if rate is None:
+        raise RateUnavailable(code)
+    return _snapshot(rate, code)
+
+
+def get_rate(code):
+    """Current RateSnapshot for ``code``: local tier, then shared, then DB."""
+    code = code.upper()
+    snapshot = local_rates.get(code)
+    if snapshot is not None:
+        return snapshot
+
+    snapshot = cache.get(_shared_key(code))
+    if snapshot is None:
+        snapshot = _load_from_db(code)
+        cache.set(_shared_key(code), tuple(snapshot), SHARED_TTL)
+    else:
+        snapshot = RateSnapshot(*snapshot)
+
+    local_rates.put(snapshot)
+    return snapshot
+
+
+def current_rates(codes=None):
+    """Snapshots for the ticker; ``codes`` defaults to every currency but KES."""
+    if codes is None:
+        codes = cache.get("fx:codes")
+        if codes is None:
+            codes = list(
+                Currency.objects.exclude(code=BASE_CURRENCY).order_by("code").values_list("code", flat=True)
+            )
+            cache.set("fx:codes", codes, SHARED_TTL)
+    return [get_rate(code) for code in codes]
+
+
+def publish_rates(rates, source="", effective_at=None):
+    """
+    Publish a new version for each ``{code: (buy, sell)}`` entry and push it
+    to the shared tier; other workers pick it up within LOCAL_TTL seconds.
+    """
+    effective_at = effective_at or timezone.now()
+    currencies = {c.code: c for c in Currency.objects.filter(code__in=list(rates))}
+
+    with transaction.atomic():
+        versions = dict(
+            ExchangeRate.objects
+            .filter(currency__in=currencies.values())
+            .values("currency__code")
+            .annotate(latest=Max("version"))
+            .values_list("currency__code", "latest")
+        )
+        created = ExchangeRate.objects.bulk_create([
+            ExchangeRate(
+                currency=currencies[code],
+                version=versions.get(code, 0) + 1,
+                buy_rate=Decimal(buy),
+                sell_rate=Decimal(sell),
+                mid_rate=((Decimal(buy) + Decimal(sell)) / 2).quantize(RATE_PLACES),
+                source=source,
+                effective_at=effective_at,
+            )
+            for code, (buy, sell) in rates.items()
+            if code in currencies
+        ])
+
+    snapshots = [_snapshot(rate, rate.currency.code) for rate in created]
+
+    def push():
+        cache.set_many({_shared_key(s.code): tuple(s) for s in snapshots}, SHARED_TTL)
+        for snapshot in snapshots:
+            local_rates.put(snapshot)
+
+    transaction.on_commit(push)
+    return snapshots
+
+
+# =========================================================
+# QUOTES
+# =========================================================
+
+def _quote_key(quote_id):
+    return f"fx:quote:{quote_id}"
+
+
+def quote(code, side, fcy_amount, branch, ttl=QUOTE_TTL):
+    """Lock the current rate for ``ttl`` seconds and return a Quote."""
+    snapshot = get_rate(code)
+    rate = customer_rate(snapshot, side)
+    fcy_amount = Decimal(fcy_amount).quantize(CENTS, rounding=ROUND_HALF_UP)
+    kes_amount = (fcy_amount * rate).quantize(CENTS, rounding=ROUND_HALF_UP)
+    expires_at = timezone.now() + timedelta(seconds=ttl)
+
+    row = FXQuote.objects.create(
+        quote_id=f"Q{uuid.uuid4().hex[:20].upper()}",
+        branch=branch,
+        rate_id=snapshot.rate_id,
+        side=side,
+        quoted_rate=rate,
+        fcy_amount=fcy_amount,
+        kes_amount=kes_amount,
+        expires_at=expires_at,
+    )
+    result = Quote(row.quote_id, snapshot.code, side, rate, fcy_amount, kes_amount, expires_at)
+    cache.set(_quote_key(row.quote_id), tuple(result), ttl)
+    return result
+
+
+def get_quote(quote_id):
+    """Open quote from the shared cache, or None once it has expired."""
+    cached = cache.get(_quote_key(quote_id))
+    return Quote(*cached) if cached else None
+
+
+def _use(quotes, quote_id):
+    used = quotes.filter(status="OPEN", expires_at__gt=timezone.now()).update(status="USED")
+    if not used:
+        raise QuoteExpired(quote_id)
+    transaction.on_commit(lambda: cache.delete(_quote_key(quote_id)))
+
+
+def consume_quote(quote_id):
+    """
+    Mark an open, unexpired quote USED and return its FXQuote row. Raises
+    QuoteExpired if it has expired or was already used.
+    """
+    _use(FXQuote.objects.filter(quote_id=quote_id), quote_id)
+    return FXQuote.objects.get(quote_id=quote_id)
+
+
+# model -> side its quote must be for
+QUOTED_MODELS = {
+    FXBuy: CUSTOMER_BUYS,
+    FXSell: CUSTOMER_SELLS,
+    FXTransfer: CUSTOMER_BUYS,
+}
+
+
+def _stored_quote_id(instance):
+    if instance._state.adding or instance.pk is None:
+        return None
+    return type(instance).objects.filter(pk=instance.pk).values_list("quote_id", flat=True).first()
+
+
+def apply_quote(sender, instance, raw=False, **kwargs):
+    """Consume a newly attached quote and price the row from it."""
+    if raw or instance.quote_id is None or instance.quote_id == _stored_quote_id(instance):
+        return
+
+    row = FXQuote.objects.get(pk=instance.quote_id)
+    if row.side != QUOTED_MODELS[sender]:
+        raise QuoteMismatch(f"{row.quote_id} is a {row.side} quote, not {QUOTED_MODELS[sender]}")
+    if row.branch_id != instance.branch_id:
+        raise QuoteMismatch(f"{row.quote_id} was issued to another branch")
+    if Decimal(instance.amount).quantize(CENTS, rounding=ROUND_HALF_UP) != row.fcy_amount:
+        raise QuoteMismatch(f"{row.quote_id} is for {row.fcy_amount}, not {instance.amount}")
+
+    _use(FXQuote.objects.filter(pk=row.pk), row.quote_id)
+    instance.quote = row
+    instance.exchange_rate = row.quoted_rate
+    if hasattr(instance, "kes_equivalent"):
+        instance.kes_equivalent = row.kes_amount
+
+
+for _model in QUOTED_MODELS:
+    pre_save.connect(apply_quote, sender=_model, dispatch_uid=f"fx-quote-{_model.__name__}")
+
+
+def expire_quotes():
+    """Flag quotes that lapsed without being used; for a periodic job."""
+    return FXQuote.objects.filter(status="OPEN", expires_at__lte=timezone.now()).update(status="EXPIRED")
+
+
+# =========================================================
+# BATCH PRICING
+# =========================================================
+
+RATE_UNITS = 10 ** 4  # RATE_PLACES
+CENT_UNITS = 100
+
+
+def convert_batch(codes, fcy_amounts, side=CUSTOMER_BUYS):
+    """
+    KES equivalents for parallel lists of currency codes and FCY amounts.
+
+    Each distinct currency is resolved once; the multiply runs over the whole
+    batch as one integer array operation on cents and 1/10000 rate units,
+    rounded half up exactly as quote() rounds. Returns (rates, kes_amounts)
+    as lists of Decimal.
+    """
+    unique_codes, inverse = np.unique(np.asarray(codes, dtype=str), return_inverse=True)
+    unique_rates = [customer_rate(get_rate(code), side).quantize(RATE_PLACES) for code in unique_codes]
+
+    cents = [int(Decimal(amount).quantize(CENTS, rounding=ROUND_HALF_UP) * CENT_UNITS) for amount in fcy_amounts]
+    rate_units = [int(rate * RATE_UNITS) for rate in unique_rates]
+    # int64 covers any realistic amount; past that, fall back to Python ints.
+    largest = max(map(abs, cents), default=0) * max(rate_units, default=0)
+    dtype = np.int64 if largest < 2 ** 62 else object
+
+    products = np.asarray(cents, dtype=dtype) * np.asarray(rate_units, dtype=dtype)[inverse]
+    magnitude = np.abs(products)
+    # ROUND_HALF_UP: halves go away from zero.
+    kes_cents = np.sign(products) * ((magnitude + RATE_UNITS // 2) // RATE_UNITS)
+
+    rates = [unique_rates[index] for index in inverse]
+    kes_amounts = [Decimal(int(value)).scaleb(-2) for value in kes_cents]
+    return rates, kes_amounts
@@ -0,0 +1,270 @@
+"""
+Idempotency keys for money-moving requests.
+
+A teller screen sends an Idempotency-Key with every deposit, withdrawal,
+transfer, bill payment, FX operation or denomination exchange. The first
+request with a key runs; any later request with the same key (within
+KEY_TTL) gets the first response back and runs nothing.
+
+How duplicates are kept out: the IdempotencyKey row is inserted in the
+same transaction as the posting, under a unique (scope, key) constraint.
+
+* A duplicate that arrives while the first request is still running waits
+  on that unique index. When the first request commits, the duplicate's
+  insert fails and it replays the committed response.
+* If the first request rolls back, its key goes with it, so the retry runs
+  for real.
+
+No one ever sees a half-finished key, and no posting is ever made twice.
+
+Replays are served from the shared cache when possible. Otherwise one
+unique-index lookup finds the stored response. The cache entry is written
+only once the key's transaction commits, so an outer transaction that rolls
+back leaves nothing behind to replay. A key reused with a
+different request body is refused with IdempotencyKeyReused. purge_expired()
+deletes keys past expires_at and runs as a periodic job.
+
+Two entry points:
+
+* create_once(model, key, **fields) creates a model row at most once per key
+  and returns it (replayed=True when it already existed);
+* @idempotent_view(scope) wraps a Django view that reads the
+  Idempotency-Key header and stores any response below 500.
+"""
+
+import hashlib
+import json
+from datetime import timedelta
+from functools import wraps
+
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+
+from .models import (
+    BillPayment,
+    CashDeposit,
+    CashWithdrawal,
+    DenominationExchange,
+    FundsTransfer,
+    FXBuy,
+    FXSell,
+    FXTransfer,
+    IdempotencyKey,
+)
+
+
+KEY_TTL = timedelta(hours=24)
+HEADER = "HTTP_IDEMPOTENCY_KEY"
+MAX_KEY_LENGTH = 100
+PURGE_BATCH_SIZE = 5000
+
+MONEY_MODELS = (
+    CashDeposit,
+    CashWithdrawal,
+    FundsTransfer,
+    BillPayment,
+    FXBuy,
+    FXSell,
+    FXTransfer,
+    DenominationExchange,
+)
+
+
+class IdempotencyError(Exception):
+    pass
+
+
+class IdempotencyKeyReused(IdempotencyError):
+    """The key was already used for a different request."""
+
+
+class Outcome:
+    """What the first request produced, ready to be replayed."""
+
+    __slots__ = ("status", "body", "source_model", "source_id")
+
+    def __init__(self, status=200, body=None, source_model="", source_id=None):
+        self.status = status
+        self.body = body
+        self.source_model = source_model
+        self.source_id = source_id
+
+
+def request_hash(payload):
+    if isinstance(payload, bytes):
+        data = payload
+    else:
+        data = json.dumps(payload, sort_keys=True, default=str).encode()
+    return hashlib.sha256(data).hexdigest()
+
+
+def _cache_key(scope, key):
+    return f"idempotency:{scope}:{hashlib.sha256(key.encode()).hexdigest()}"
+
+
+def _stored(scope, key, digest):
+    """The stored Outcome for (scope, key), or None if unused or expired."""
+    cached = cache.get(_cache_key(scope, key))
+    if cached is None:
+        row = (
+            IdempotencyKey.objects
+            .filter(scope=scope, key=key, expires_at__gt=timezone.now())
+            .values_list("request_hash", "response_status", "response_body", "source_model", "source_id")
+            .first()
+        )
+        if row is None:
+            return None
+        cached = row
+    stored_hash, status, body, source_model, source_id = cached
+    if stored_hash != digest:
+        raise IdempotencyKeyReused(f"{scope} key {key!r} was used for a different request")
+    return Outcome(status, body, source_model, source_id)
+
+
+def run_once(scope, key, payload, operation):
+    """
+    Run ``operation()`` once per (scope, key) and return (Outcome, replayed).
+    ``operation`` returns an Outcome and runs inside the same transaction as
+    the key insert.
+    """
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise IdempotencyError(f"idempotency key must be 1-{MAX_KEY_LENGTH} characters")
+    digest = request_hash(payload)
+
+    outcome = _stored(scope, key, digest)
+    if outcome is not None:
+        return outcome, True
+
+    now = timezone.now()
+    try:
+        with transaction.atomic():
+            # A key that expired but hasn't been purged yet is free again.
+            IdempotencyKey.objects.filter(scope=scope, key=key, expires_at__lte=now).delete()
+            record = IdempotencyKey.objects.create(
+                scope=scope, key=key, request_hash=digest, expires_at=now + KEY_TTL,
+            )
+            outcome = operation()
+            record.response_status = outcome.status
+            record.response_body = outcome.body
+            record.source_model = outcome.source_model
+            record.source_id = outcome.source_id
+            record.save(update_fields=["response_status", "response_body", "source_model", "source_id"])
+    except IntegrityError:
+        # A concurrent request with the same key committed first.
+        outcome = _stored(scope, key, digest)
+        if outcome is None:
+            raise
+        return outcome, True
+
+    stored = (digest, outcome.status, outcome.body, outcome.source_model, outcome.source_id)
+    transaction.on_commit(lambda: cache.set(_cache_key(scope, key), stored, int(KEY_TTL.total_seconds())))
+    return outcome, False
+
+
+def _forget(scope, key):
+    """Drop whatever is stored for (scope, key), so the next request runs."""
+    cache.delete(_cache_key(scope, key))
+    IdempotencyKey.objects.filter(scope=scope, key=key).delete()
+
+
+# =========================================================
+# MODELS
+# =========================================================
+
+def _payload(fields):
+    return {name: getattr(value, "pk", value) for name, value in fields.items()}
+
+
+def create_once(model, key, **fields):
+    """``model.objects.create(**fields)`` at most once per key; returns (instance, replayed)."""
+    if model not in MONEY_MODELS:
+        raise IdempotencyError(f"{model.__name__} is not a money-moving model")
+
+    def operation():
+        instance = model.objects.create(**fields)
+        return Outcome(201, None, model.__name__, instance.pk)
+
+    scope, payload = model.__name__, _payload(fields)
+    outcome, replayed = run_once(scope, key, payload, operation)
+    instance = model.objects.filter(pk=outcome.source_id).first()
+    if instance is None and replayed:
+        # The key outlived the row it points at, so nothing was posted.
+        _forget(scope, key)
+        outcome, replayed = run_once(scope, key, payload, operation)
+        instance = model.objects.get(pk=outcome.source_id)
+    return instance, replayed
+
+
+# =========================================================
+# VIEWS
+# =========================================================
+
+def idempotent_view(scope):
+    """
+    Make a view idempotent on the Idempotency-Key header. Requests without
+    the header run normally. Responses of 500 and above are not stored, so
+    the posting rolls back and the client may retry.
+    """
+    def decorate(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            key = request.META.get(HEADER)
+            if not key:
+                return view(request, *args, **kwargs)
+
+            def operation():
+                response = view(request, *args, **kwargs)
+                if response.status_code >= 500:
+                    raise _ServerError(response)
+                content_type = response.get("Content-Type", "")
+                body = (
+                    json.loads(response.content)
+                    if content_type.startswith("application/json")
+                    else {"content": response.content.decode(), "content_type": content_type}
+                )
+                return Outcome(response.status_code, body)
+
+            try:
+                outcome, replayed = run_once(scope, key, request.body, operation)
+            except IdempotencyKeyReused as exc:
+                return JsonResponse({"error": str(exc)}, status=422)
+            except _ServerError as exc:
+                return exc.response
+
+            if isinstance(outcome.body, dict) and "content_type" in outcome.body and "content" in outcome.body:
+                response = HttpResponse(
+                    outcome.body["content"], status=outcome.status, content_type=outcome.body["content_type"]
+                )
+            else:
+                response = JsonResponse(outcome.body, status=outcome.status, safe=False)
+            if replayed:
+                response["Idempotent-Replayed"] = "true"
+            return response
+        return wrapper
+    return decorate
+
+
+class _ServerError(Exception):
+    def __init__(self, response):
+        super().__init__(response.status_code)
+        self.response = response
+
+
+# =========================================================
+# EXPIRY
+# =========================================================
+
+def purge_expired():
+    """Delete expired keys in batches; returns how many went."""
+    purged = 0
+    while True:
+        batch = list(
+            IdempotencyKey.objects
+            .filter(expires_at__lte=timezone.now())
+            .values_list("pk", flat=True)[:PURGE_BATCH_SIZE]
+        )
+        if not batch:
+            return purged
+        purged += IdempotencyKey.objects.filter(pk__in=batch).delete()[0]
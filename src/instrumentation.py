@@ -0,0 +1,245 @@
+"""
+Query-count and latency instrumentation.
+
+instrument("operation", model=..., branch=...) is a context manager (and a
+decorator) that records, for one operation: the number of queries, the time
+spent in the database, and the remaining Python time. It counts queries with
+one execute wrapper per connection that adds to whatever measurements are
+open on the thread; with none open it costs one attribute lookup per query,
+so it is cheap enough to leave on in production.
+
+Model writes are measured automatically: pre_save opens an operation named
+"save" tagged with the model and branch, and post_save closes it. The
+figures cover the INSERT/UPDATE and every post_save receiver connected
+before this module is imported (ledger postings, rollups, ...), so import
+it last. A save that raises never reaches post_save; its measurement is
+never recorded. It is discarded when the instrument() it ran under exits,
+or else when the next request starts.
+
+Observations go into fixed-bucket histograms, rendered in Prometheus text
+format by metrics_view(). The view only answers requests from localhost.
+
+assert_max_queries(n) is the test helper: it fails when the wrapped block
+runs more than ``n`` queries and lists them.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import ContextDecorator, contextmanager
+
+from django.core.signals import request_started
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, pre_save
+from django.http import HttpResponse, HttpResponseForbidden
+
+
+QUERY_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+LOCAL_ADDRESSES = ("127.0.0.1", "::1")
+MAX_OPEN_MEASUREMENTS = 64
+
+
+# =========================================================
+# HISTOGRAMS
+# =========================================================
+
+class Histogram:
+
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self._series = defaultdict(lambda: [[0] * (len(buckets) + 1), 0.0, 0])
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series[labels]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {labels: (list(c), s, n) for labels, (c, s, n) in self._series.items()}
+        for labels, (counts, total, count) in sorted(series.items()):
+            label_text = ",".join(f'{key}="{value}"' for key, value in labels)
+            running = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                running += bucket_count
+                lines.append(f'{self.name}_bucket{{{label_text},le="{bound}"}} {running}')
+            lines.append(f'{self.name}_bucket{{{label_text},le="+Inf"}} {count}')
+            lines.append(f"{self.name}_sum{{{label_text}}} {total}")
+            lines.append(f"{self.name}_count{{{label_text}}} {count}")
+        return "\n".join(lines)
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+
+QUERIES = Histogram("bank_operation_queries", "Queries issued per operation.", QUERY_BUCKETS)
+DB_SECONDS = Histogram("bank_operation_db_seconds", "Database time per operation.", SECONDS_BUCKETS)
+PYTHON_SECONDS = Histogram("bank_operation_python_seconds", "Non-database time per operation.", SECONDS_BUCKETS)
+HISTOGRAMS = (QUERIES, DB_SECONDS, PYTHON_SECONDS)
+
+
+def render_prometheus():
+    return "\n".join(histogram.render() for histogram in HISTOGRAMS) + "\n"
+
+
+def metrics_view(request):
+    if request.META.get("REMOTE_ADDR") not in LOCAL_ADDRESSES:
+        return HttpResponseForbidden()
+    return HttpResponse(render_prometheus(), content_type="text/plain; version=0.0.4")
+
+
+# =========================================================
+# MEASURING
+# =========================================================
+
+class _Counter:
+    __slots__ = ("queries", "db_seconds", "statements")
+
+    def __init__(self, keep_statements=False):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.statements = [] if keep_statements else None
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_seconds += time.perf_counter() - started
+            self.queries += 1
+            if self.statements is not None:
+                self.statements.append(sql)
+
+
+_local = threading.local()
+
+
+def _open_measurements():
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def _count_query(execute, sql, params, many, context):
+    stack = getattr(_local, "stack", None)
+    if not stack:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        for measurement in stack:
+            measurement.queries += 1
+            measurement.db_seconds += elapsed
+
+
+def _install(sender, connection, **kwargs):
+    # One wrapper per connection for its whole life; when nothing is being
+    # measured it is a single attribute lookup per query.
+    if _count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_query)
+
+
+connection_created.connect(_install, dispatch_uid="instrumentation-install")
+
+
+class instrument(ContextDecorator):
+    """Measure one operation and record it under (operation, model, branch)."""
+
+    def __init__(self, operation, model="", branch="", key=None):
+        self.labels = (("operation", operation), ("model", model), ("branch", str(branch or "")))
+        self.key = key
+
+    def _recreate_cm(self):
+        # Used as a decorator, every call (including recursive ones) needs
+        # its own counters.
+        return type(self)(*(value for _, value in self.labels), key=self.key)
+
+    def __enter__(self):
+        _install(None, connection)
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.started = time.perf_counter()
+        _open_measurements().append(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        stack = _open_measurements()
+        for position in range(len(stack) - 1, -1, -1):
+            if stack[position] is self:
+                # Anything opened above it belongs to a save that raised.
+                del stack[position:]
+                break
+        self.record()
+        return False
+
+    def record(self):
+        elapsed = time.perf_counter() - self.started
+        QUERIES.observe(self.labels, self.queries)
+        DB_SECONDS.observe(self.labels, self.db_seconds)
+        PYTHON_SECONDS.observe(self.labels, max(0.0, elapsed - self.db_seconds))
+
+
+def _start_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    stack = _open_measurements()
+    if len(stack) >= MAX_OPEN_MEASUREMENTS:
+        # Saves that raised never reach post_save; forget the oldest.
+        del stack[0]
+    instrument("save", sender.__name__, getattr(instance, "branch_id", ""), key=id(instance)).__enter__()
+
+
+def _finish_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    stack = _open_measurements()
+    key = id(instance)
+    for position in range(len(stack) - 1, -1, -1):
+        if stack[position].key == key:
+            measurement = stack[position]
+            # Anything opened above it belongs to a save that raised.
+            del stack[position:]
+            measurement.record()
+            return
+
+
+def _reset(sender, **kwargs):
+    _open_measurements().clear()
+
+
+pre_save.connect(_start_save, dispatch_uid="instrumentation-pre-save")
+post_save.connect(_finish_save, dispatch_uid="instrumentation-post-save")
+request_started.connect(_reset, dispatch_uid="instrumentation-reset")
+
+
+# =========================================================
+# TEST HELPER
+# =========================================================
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+@contextmanager
+def assert_max_queries(budget, using=connection):
+    """Fail if the block issues more than ``budget`` queries."""
+    counter = _Counter(keep_statements=True)
+    with using.execute_wrapper(counter):
+        yield counter
+    if counter.queries > budget:
+        listing = "\n".join(f"  {n}. {sql}" for n, sql in enumerate(counter.statements, start=1))
+        raise QueryBudgetExceeded(f"{counter.queries} queries (budget {budget}):\n{listing}")
@@ -0,0 +1,193 @@
+"""
+Content-addressed storage for KYC documents, signatures and photos.
+
+An upload is streamed chunk by chunk into a temporary file next to the
+store while its SHA-256 is computed, and is then stored under its digest::
+
+    kyc/ab/cd/abcd...ef.pdf
+
+An ID copy that is uploaded again with every KYCUpdateRequest therefore
+maps to the blob that already exists: the temporary file is dropped and the
+field points at the existing name. No upload is ever held in memory whole.
+
+Because blobs are shared, deleting a field does not delete the blob;
+collect_garbage() removes blobs no row references any more. It spares blobs
+touched within GC_MIN_AGE, and a duplicate upload touches the blob it maps
+to, so a blob about to be referenced again is never collected under it.
+
+thumbnail() creates small JPEG previews on first request and reuses them
+afterwards, so teller screens never download originals.
+"""
+
+import functools
+import hashlib
+import os
+import tempfile
+import time
+from io import BytesIO
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+
+
+CHUNK_SIZE = 64 * 1024
+# Blobs younger than this may belong to a row that hasn't been saved yet.
+GC_MIN_AGE = 60 * 60
+THUMBNAIL_SIZES = {"small": (96, 96), "medium": (240, 240)}
+THUMBNAIL_CACHE_TIMEOUT = 24 * 60 * 60
+
+
+def _umask():
+    """
+    The process umask, without setting it: os.umask() can only be read by
+    changing it, and a file another thread created meanwhile would get mode
+    0666. Linux reports it in /proc; elsewhere a probe file shows it.
+    """
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("Umask:"):
+                    return int(line.split()[1], 8)
+    except OSError:
+        pass
+    with tempfile.TemporaryDirectory() as directory:
+        probe = os.path.join(directory, "probe")
+        os.close(os.open(probe, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o666))
+        return 0o666 & ~os.stat(probe).st_mode
+
+
+@functools.lru_cache(maxsize=None)
+def default_file_mode():
+    """
+    What a plain FileSystemStorage save would give a file. mkstemp creates
+    files 0600, so blobs are set to this instead.
+    """
+    return 0o666 & ~_umask()
+
+
+class ContentAddressedStorage(FileSystemStorage):
+
+    def get_available_name(self, name, max_length=None):
+        # Identical content maps to the same name, so never add suffixes.
+        return name
+
+    def _blob_name(self, name, digest):
+        directory, filename = os.path.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        return os.path.join(directory, digest[:2], digest[2:4], f"{digest}{extension}")
+
+    def _save(self, name, content):
+        digest = hashlib.sha256()
+        os.makedirs(self.location, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=self.location, prefix=".upload-")
+        try:
+            with os.fdopen(fd, "wb") as temp:
+                for chunk in content.chunks(CHUNK_SIZE):
+                    digest.update(chunk)
+                    temp.write(chunk)
+
+            blob_name = self._blob_name(name, digest.hexdigest())
+            blob_path = self.path(blob_name)
+            try:
+                # Already stored: touch it so collect_garbage() leaves it
+                # alone until the row pointing at it is saved.
+                os.utime(blob_path)
+            except FileNotFoundError:
+                os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                mode = self.file_permissions_mode
+                os.chmod(temp_path, default_file_mode() if mode is None else mode)
+                os.replace(temp_path, blob_path)
+            return blob_name.replace("\\", "/")
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def delete(self, name):
+        # Other rows may point at the same blob; see collect_garbage().
+        pass
+
+    def delete_blob(self, name):
+        super().delete(name)
+
+
+kyc_storage = ContentAddressedStorage(
+    location=getattr(settings, "KYC_STORAGE_ROOT", settings.MEDIA_ROOT),
+    base_url=getattr(settings, "KYC_STORAGE_URL", settings.MEDIA_URL),
+)
+
+
+# =========================================================
+# THUMBNAILS
+# =========================================================
+
+def _thumbnail_name(name, size):
+    stem = os.path.splitext(os.path.basename(name))[0]
+    width, height = THUMBNAIL_SIZES[size]
+    return f"thumbs/{width}x{height}/{stem}.jpg"
+
+
+def thumbnail(field_file, size="small"):
+    """URL of a cached JPEG preview of ``field_file``, created on first use."""
+    if not field_file:
+        return None
+    storage = field_file.storage
+    thumb_name = _thumbnail_name(field_file.name, size)
+    cache_key = f"kyc:thumb:{thumb_name}"
+
+    if cache.get(cache_key) or storage.exists(thumb_name):
+        cache.set(cache_key, True, THUMBNAIL_CACHE_TIMEOUT)
+        return storage.url(thumb_name)
+
+    from PIL import Image
+
+    with storage.open(field_file.name, "rb") as source:
+        image = Image.open(source)
+        image.draft("RGB", THUMBNAIL_SIZES[size])
+        image = image.convert("RGB")
+        image.thumbnail(THUMBNAIL_SIZES[size])
+        buffer = BytesIO()
+        image.save(buffer, "JPEG", quality=80, optimize=True)
+
+    # Thumbnails are named after the original's digest, so write them with
+    # the plain filesystem logic rather than hashing them again.
+    FileSystemStorage._save(storage, thumb_name, ContentFile(buffer.getvalue()))
+    cache.set(cache_key, True, THUMBNAIL_CACHE_TIMEOUT)
+    return storage.url(thumb_name)
+
+
+# =========================================================
+# GARBAGE COLLECTION
+# =========================================================
+
+def _referenced_names():
+    from .models import JointHolder, KYCDocument
+
+    names = set()
+    for model in (KYCDocument, JointHolder):
+        fields = [f.name for f in model._meta.fields if getattr(f, "storage", None) is kyc_storage]
+        for row in model.objects.values_list(*fields).iterator():
+            names.update(name for name in row if name)
+    return names
+
+
+def collect_garbage(prefixes=("kyc", "signatures", "photos")):
+    """Delete blobs (and their thumbnails) that no row references."""
+    referenced = _referenced_names()
+    removed = 0
+    for prefix in prefixes:
+        for root, _, files in os.walk(kyc_storage.path(prefix)):
+            for filename in files:
+                name = os.path.relpath(os.path.join(root, filename), kyc_storage.location).replace("\\", "/")
+                if name in referenced:
+                    continue
+                if time.time() - os.path.getmtime(os.path.join(root, filename)) < GC_MIN_AGE:
+                    continue
+                kyc_storage.delete_blob(name)
+                for size in THUMBNAIL_SIZES:
+                    thumb = _thumbnail_name(name, size)
+                    if kyc_storage.exists(thumb):
+                        kyc_storage.delete_blob(thumb)
+                removed += 1
+    return removed
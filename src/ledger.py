@@ -0,0 +1,522 @@
+"""
+Double-entry posting ledger.
+
+Every money-moving row (deposits, withdrawals, transfers, bill payments and
+the FX models) is turned into a balanced set of LedgerEntry legs. Posting is
+insert-only: nothing updates CustomerAccount.balance on the hot path.
+
+A customer balance is the latest AccountBalanceSnapshot plus the entries
+written after it, so reading a balance only touches the tail of the ledger.
+roll_snapshots() moves the snapshots forward and is meant to run from a
+periodic job (and after bulk loads).
+
+Accounts that existed before the ledger carry their balance only in
+CustomerAccount.balance. open_accounts() posts that figure as an opening
+entry (OPN<account id>) and stamps ledger_opened_at. It runs after every
+migrate and can be re-run at any time. Until an account is opened, balance
+reads add its legacy balance to the ledger figure, and roll_snapshots()
+never overwrites its balance column. New accounts are opened when they are
+created.
+
+The receivers below are connected when this module is imported;
+apps.SrcConfig.ready() imports it.
+"""
+
+from collections import namedtuple
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, Max, OuterRef, Subquery, Sum, When
+from django.db.models.signals import post_migrate, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import outbox
+from .models import (
+    AccountBalanceSnapshot,
+    BillPayment,
+    CashDeposit,
+    CashWithdrawal,
+    CustomerAccount,
+    FundsTransfer,
+    FXBuy,
+    FXSell,
+    FXTransfer,
+    LedgerEntry,
+)
+
+
+# =========================================================
+# INTERNAL GL ACCOUNTS (CONTRA SIDE OF CUSTOMER POSTINGS)
+# =========================================================
+
+GL_TELLER_CASH = "TELLER_CASH"
+GL_TRANSFERS_OUT = "TRANSFERS_OUT"
+GL_BILLER_SETTLEMENT = "BILLER_SETTLEMENT"
+GL_FX_POSITION = "FX_POSITION"
+GL_NOSTRO = "NOSTRO"
+GL_FEE_INCOME = "FEE_INCOME"
+GL_INTEREST_EXPENSE = "INTEREST_EXPENSE"
+GL_OPENING_BALANCE = "OPENING_BALANCE"
+
+DEBIT = "DEBIT"
+CREDIT = "CREDIT"
+
+ZERO = Decimal("0.00")
+CENTS = Decimal("0.01")
+
+# Roll a snapshot once an account has this many entries past its last one.
+SNAPSHOT_INTERVAL = 500
+
+
+class LedgerError(Exception):
+    pass
+
+
+class UnbalancedPosting(LedgerError):
+    pass
+
+
+Leg = namedtuple("Leg", ["direction", "amount", "account_id", "gl_code"])
+
+
+def debit_account(account_id, amount):
+    return Leg(DEBIT, amount, account_id, None)
+
+
+def credit_account(account_id, amount):
+    return Leg(CREDIT, amount, account_id, None)
+
+
+def debit_gl(gl_code, amount):
+    return Leg(DEBIT, amount, None, gl_code)
+
+
+def credit_gl(gl_code, amount):
+    return Leg(CREDIT, amount, None, gl_code)
+
+
+# =========================================================
+# POSTING
+# =========================================================
+
+def build_entries(reference, legs, branch_id, source_model, source_id, narration=None):
+    """Validate ``legs`` and return unsaved LedgerEntry rows for them."""
+    debits = sum((leg.amount for leg in legs if leg.direction == DEBIT), ZERO)
+    credits = sum((leg.amount for leg in legs if leg.direction == CREDIT), ZERO)
+
+    if debits != credits:
+        raise UnbalancedPosting(f"{reference}: debits {debits} != credits {credits}")
+
+    entries = []
+    for sequence, leg in enumerate(legs, start=1):
+        if leg.amount <= 0:
+            raise LedgerError(f"{reference}: leg {sequence} has non-positive amount")
+        if (leg.account_id is None) == (leg.gl_code is None):
+            raise LedgerError(f"{reference}: leg {sequence} needs an account or a GL code")
+
+        entries.append(LedgerEntry(
+            branch_id=branch_id,
+            account_id=leg.account_id,
+            gl_code=leg.gl_code,
+            posting_reference=reference,
+            sequence=sequence,
+            direction=leg.direction,
+            amount=leg.amount,
+            narration=narration,
+            source_model=source_model,
+            source_id=source_id,
+        ))
+    return entries
+
+
+def post(reference, legs, branch_id, source_model, source_id, narration=None):
+    """Insert a balanced posting. Re-posting the same reference is a no-op."""
+    entries = build_entries(reference, legs, branch_id, source_model, source_id, narration)
+
+    with transaction.atomic():
+        if LedgerEntry.objects.filter(posting_reference=reference).exists():
+            return []
+        return LedgerEntry.objects.bulk_create(entries)
+
+
+# =========================================================
+# MODEL -> LEGS
+# =========================================================
+
+def deposit_legs(deposit):
+    return [
+        debit_gl(GL_TELLER_CASH, deposit.amount),
+        credit_account(deposit.account_id, deposit.amount),
+    ]
+
+
+def withdrawal_legs(withdrawal):
+    return [
+        debit_account(withdrawal.account_id, withdrawal.amount),
+        credit_gl(GL_TELLER_CASH, withdrawal.amount),
+    ]
+
+
+def transfer_legs(transfer):
+    # Beneficiaries are free-text account numbers, so the credit side is
+    # only an internal account when the number resolves to one of ours.
+    beneficiary_id = (
+        CustomerAccount.objects
+        .filter(account_number=transfer.beneficiary_account)
+        .values_list("id", flat=True)
+        .first()
+    )
+    credit = (
+        credit_account(beneficiary_id, transfer.amount)
+        if beneficiary_id else credit_gl(GL_TRANSFERS_OUT, transfer.amount)
+    )
+    return [debit_account(transfer.source_account_id, transfer.amount), credit]
+
+
+def bill_payment_legs(payment):
+    return [
+        debit_account(payment.source_account_id, payment.amount),
+        credit_gl(GL_BILLER_SETTLEMENT, payment.amount),
+    ]
+
+
+def fx_buy_legs(fx):
+    return [
+        debit_account(fx.account_id, fx.kes_equivalent),
+        credit_gl(GL_FX_POSITION, fx.kes_equivalent),
+    ]
+
+
+def fx_sell_legs(fx):
+    return [
+        debit_gl(GL_FX_POSITION, fx.kes_equivalent),
+        credit_account(fx.account_id, fx.kes_equivalent),
+    ]
+
+
+def fx_transfer_kes(fx):
+    """KES cost of an FX transfer; ``amount`` is in the foreign currency."""
+    if fx.quote_id:
+        return fx.quote.kes_amount
+    if not fx.exchange_rate:
+        raise LedgerError(f"{fx.transaction_reference}: no quote or exchange rate to price the transfer")
+    return (fx.amount * fx.exchange_rate).quantize(CENTS, rounding=ROUND_HALF_UP)
+
+
+def fx_transfer_legs(fx):
+    kes_amount = fx_transfer_kes(fx)
+    legs = [
+        debit_account(fx.account_id, kes_amount + fx.charges),
+        credit_gl(GL_NOSTRO, kes_amount),
+    ]
+    if fx.charges:
+        legs.append(credit_gl(GL_FEE_INCOME, fx.charges))
+    return legs
+
+
+# model -> (legs builder, reference attribute, status that triggers posting)
+POSTING_RULES = {
+    CashDeposit: (deposit_legs, "reference", None),
+    CashWithdrawal: (withdrawal_legs, "reference", None),
+    FundsTransfer: (transfer_legs, "reference", None),
+    BillPayment: (bill_payment_legs, None, None),
+    FXBuy: (fx_buy_legs, "transaction_reference", "COMPLETED"),
+    FXSell: (fx_sell_legs, "transaction_reference", "COMPLETED"),
+    FXTransfer: (fx_transfer_legs, "transaction_reference", "COMPLETED"),
+}
+
+
+def posting_reference_for(instance):
+    _, attr, _ = POSTING_RULES[type(instance)]
+    if attr:
+        return getattr(instance, attr)
+    # BillPayment has no reference column of its own.
+    return f"BIL{instance.pk}"
+
+
+def post_instance(instance):
+    """Post the ledger legs for a saved money-moving model instance."""
+    build_legs, _, _ = POSTING_RULES[type(instance)]
+    return post(
+        posting_reference_for(instance),
+        build_legs(instance),
+        branch_id=instance.branch_id,
+        source_model=type(instance).__name__,
+        source_id=instance.pk,
+        narration=getattr(instance, "narration", None),
+    )
+
+
+@receiver(post_save, sender=CashDeposit)
+@receiver(post_save, sender=CashWithdrawal)
+@receiver(post_save, sender=FundsTransfer)
+@receiver(post_save, sender=BillPayment)
+@receiver(post_save, sender=FXBuy)
+@receiver(post_save, sender=FXSell)
+@receiver(post_save, sender=FXTransfer)
+def post_on_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+
+    _, _, trigger_status = POSTING_RULES[sender]
+    if trigger_status is None:
+        if created:
+            post_instance(instance)
+    elif instance.status == trigger_status:
+        # post() ignores a reference that is already in the ledger, so a
+        # COMPLETED row saved twice is only posted once.
+        post_instance(instance)
+
+
+# =========================================================
+# BALANCES
+# =========================================================
+
+def signed_amount():
+    """Credits increase a customer balance, debits reduce it."""
+    return Case(
+        When(direction=CREDIT, then=F("amount")),
+        default=-F("amount"),
+        output_field=DecimalField(max_digits=15, decimal_places=2),
+    )
+
+
+def latest_snapshot(account_id, as_of=None):
+    snapshots = AccountBalanceSnapshot.objects.filter(account_id=account_id)
+    if as_of is not None:
+        snapshots = snapshots.filter(as_of__lte=as_of)
+    return snapshots.order_by("-last_entry_id").first()
+
+
+def legacy_balances(account_ids):
+    """CustomerAccount.balance of the accounts in ``account_ids`` not yet opened in the ledger."""
+    return dict(
+        CustomerAccount.objects
+        .filter(pk__in=list(account_ids), ledger_opened_at__isnull=True)
+        .values_list("pk", "balance")
+    )
+
+
+def account_balance(account_id, as_of=None):
+    """
+    Balance of ``account_id`` now, or at ``as_of``.
+
+    Starts from the newest snapshot taken at or before ``as_of`` and only
+    sums the entries written after it.
+    """
+    snapshot = latest_snapshot(account_id, as_of)
+    base = snapshot.balance if snapshot else ZERO
+    after_id = snapshot.last_entry_id if snapshot else 0
+
+    tail = LedgerEntry.objects.filter(account_id=account_id, id__gt=after_id)
+    if as_of is not None:
+        tail = tail.filter(created_at__lte=as_of)
+
+    delta = tail.aggregate(total=Sum(signed_amount()))["total"]
+    legacy = legacy_balances([account_id]).get(account_id, ZERO)
+    return base + (delta or ZERO) + legacy
+
+
+def account_balances(account_ids):
+    """
+    Current balances for many accounts in at most five queries.
+
+    Used by batch paths that already hold locks on the accounts and would
+    otherwise call account_balance() once per account.
+    """
+    account_ids = list(account_ids)
+    cutoffs = dict(
+        AccountBalanceSnapshot.objects
+        .filter(account_id__in=account_ids)
+        .values("account_id")
+        .annotate(last_id=Max("last_entry_id"))
+        .values_list("account_id", "last_id")
+    )
+
+    balances = dict.fromkeys(account_ids, ZERO)
+    snapshots = AccountBalanceSnapshot.objects.filter(
+        account_id__in=list(cutoffs),
+        last_entry_id__in=set(cutoffs.values()),
+    )
+    for snapshot in snapshots:
+        if cutoffs[snapshot.account_id] == snapshot.last_entry_id:
+            balances[snapshot.account_id] = snapshot.balance
+
+    # Accounts without a snapshot need their whole history; the others only
+    # what follows the oldest of their snapshots, filtered per account below.
+    unsnapshotted = [account_id for account_id in account_ids if account_id not in cutoffs]
+    tails = [LedgerEntry.objects.filter(account_id__in=unsnapshotted)] if unsnapshotted else []
+    if cutoffs:
+        tails.append(LedgerEntry.objects.filter(account_id__in=list(cutoffs), id__gt=min(cutoffs.values())))
+    for tail in tails:
+        rows = tail.values_list("account_id", "id", "direction", "amount")
+        for account_id, entry_id, direction, amount in rows.iterator():
+            if entry_id <= cutoffs.get(account_id, 0):
+                continue
+            balances[account_id] += amount if direction == CREDIT else -amount
+
+    for account_id, legacy in legacy_balances(account_ids).items():
+        balances[account_id] += legacy
+
+    return balances
+
+
+def roll_snapshot(account_id):
+    """Write a new snapshot for one account if it has unsnapshotted entries."""
+    snapshot = latest_snapshot(account_id)
+    base = snapshot.balance if snapshot else ZERO
+    after_id = snapshot.last_entry_id if snapshot else 0
+
+    tail = (
+        LedgerEntry.objects
+        .filter(account_id=account_id, id__gt=after_id)
+        .aggregate(total=Sum(signed_amount()), last_id=Max("id"), last_at=Max("created_at"))
+    )
+    if tail["last_id"] is None:
+        return snapshot
+
+    return AccountBalanceSnapshot.objects.create(
+        account_id=account_id,
+        last_entry_id=tail["last_id"],
+        balance=base + (tail["total"] or ZERO),
+        as_of=tail["last_at"] or timezone.now(),
+    )
+
+
+def roll_snapshots(account_ids=None, min_entries=SNAPSHOT_INTERVAL, sync_balance=True):
+    """
+    Roll snapshots forward for accounts with at least ``min_entries`` new
+    entries. Also refreshes the denormalised CustomerAccount.balance column
+    (off the posting path), with an outbox event per account, unless
+    ``sync_balance`` is False. Accounts not yet opened in the ledger keep
+    their balance column untouched.
+    """
+    latest = (
+        AccountBalanceSnapshot.objects
+        .values("account_id")
+        .annotate(last_id=Max("last_entry_id"))
+    )
+    last_by_account = {row["account_id"]: row["last_id"] for row in latest}
+
+    entries = LedgerEntry.objects.filter(account__isnull=False)
+    if account_ids is not None:
+        entries = entries.filter(account_id__in=account_ids)
+
+    rolled = []
+    for account_id in entries.values_list("account_id", flat=True).distinct().order_by("account_id"):
+        pending = LedgerEntry.objects.filter(
+            account_id=account_id,
+            id__gt=last_by_account.get(account_id, 0),
+        )
+        if min_entries and pending[:min_entries].count() < min_entries:
+            continue
+        rolled.append(roll_snapshot(account_id))
+
+    if sync_balance and rolled:
+        opened = set(
+            CustomerAccount.objects
+            .filter(pk__in=[snapshot.account_id for snapshot in rolled], ledger_opened_at__isnull=False)
+            .values_list("pk", flat=True)
+        )
+        accounts = [
+            CustomerAccount(pk=snapshot.account_id, balance=snapshot.balance)
+            for snapshot in rolled if snapshot.account_id in opened
+        ]
+        with transaction.atomic():
+            CustomerAccount.objects.bulk_update(accounts, ["balance"], batch_size=1000)
+            outbox.record(accounts, outbox.UPDATED, fields={"balance"})
+
+    return rolled
+
+
+# =========================================================
+# OPENING BALANCES
+# =========================================================
+
+OPENING_BATCH_SIZE = 5000
+
+
+def opening_reference(account_id):
+    return f"OPN{account_id}"
+
+
+def opening_legs(account_id, balance):
+    """Legs that bring a pre-ledger ``balance`` into the ledger (none for zero)."""
+    if balance > 0:
+        return [debit_gl(GL_OPENING_BALANCE, balance), credit_account(account_id, balance)]
+    if balance < 0:
+        return [debit_account(account_id, -balance), credit_gl(GL_OPENING_BALANCE, -balance)]
+    return []
+
+
+def open_accounts(batch_size=OPENING_BATCH_SIZE):
+    """
+    Post the legacy balance of every account not yet opened in the ledger
+    and mark it opened. Each batch locks its accounts, so a balance cannot
+    change between being read and being posted. Returns how many accounts
+    were opened.
+    """
+    opened = 0
+    while True:
+        with transaction.atomic():
+            accounts = list(
+                CustomerAccount.objects
+                .select_for_update()
+                .filter(ledger_opened_at__isnull=True)
+                .order_by("pk")
+                .values_list("pk", "branch_id", "balance")[:batch_size]
+            )
+            if not accounts:
+                return opened
+
+            existing = set(
+                LedgerEntry.objects
+                .filter(posting_reference__in=[opening_reference(pk) for pk, _, _ in accounts])
+                .values_list("posting_reference", flat=True)
+            )
+            entries = []
+            for pk, branch_id, balance in accounts:
+                legs = opening_legs(pk, balance)
+                if legs and opening_reference(pk) not in existing:
+                    entries += build_entries(
+                        opening_reference(pk), legs, branch_id, "CustomerAccount", pk, narration="Opening balance",
+                    )
+            LedgerEntry.objects.bulk_create(entries, batch_size=1000)
+            # The legacy balance was built up before any ledger entry, so the
+            # opening entry is dated when the account was opened; statements
+            # and as-of balances then bring it forward for every period.
+            LedgerEntry.objects.filter(posting_reference__in={entry.posting_reference for entry in entries}).update(
+                created_at=Subquery(
+                    CustomerAccount.objects.filter(pk=OuterRef("source_id")).values("created_at")[:1]
+                )
+            )
+            CustomerAccount.objects.filter(pk__in=[pk for pk, _, _ in accounts]).update(
+                ledger_opened_at=timezone.now()
+            )
+            opened += len(accounts)
+
+
+@receiver(pre_save, sender=CustomerAccount)
+def open_new_account(sender, instance, raw=False, **kwargs):
+    if raw or instance.pk is not None or instance.ledger_opened_at is not None:
+        return
+    instance.ledger_opened_at = timezone.now()
+
+
+@receiver(post_save, sender=CustomerAccount)
+def post_opening_balance(sender, instance, created, raw=False, **kwargs):
+    # An account created with money on it (e.g. a migrated record) gets that
+    # money as its first ledger entry.
+    if raw or not created or not instance.balance:
+        return
+    post(
+        opening_reference(instance.pk), opening_legs(instance.pk, instance.balance),
+        instance.branch_id, "CustomerAccount", instance.pk, narration="Opening balance",
+    )
+
+
+@receiver(post_migrate)
+def backfill_opening_balances(sender, **kwargs):
+    if sender.label == CustomerAccount._meta.app_label:
+        open_accounts()
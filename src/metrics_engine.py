@@ -0,0 +1,385 @@
+"""
+Server-side series for the Analyser (src/components/admin/analyserMetrics.js).
+
+Rows from every service table in the range are loaded once into a columnar
+frame (one NumPy array per column) and each metric is computed with
+vectorised bucketing (np.bincount over bucket indices), so a 30-day,
+all-branch query costs one narrow values_list() per table plus array work.
+
+Results are cached per (metric, range, branch, service category, bucket).
+Versions are kept per (branch, category, day): a committed save bumps the
+version of the day its row falls in (and of today, where status-driven
+metrics such as sla-compliance land) for its branch and category and for
+the "all" scopes. A cache key carries a digest of the versions of the
+days it covers, so a write only invalidates series over that day. Ranges
+that end today are cached in two parts, the closed days and today, so
+today's traffic never recomputes the closed buckets. Bulk paths that skip
+post_save call invalidate_rows() themselves.
+
+Series use the frontend's shape: [{"date": "YYYY-MM-DD", "value": ...}].
+Metrics without a data source in the models raise UnsupportedMetric; other
+modules add metrics with @metric("id").
+"""
+
+import hashlib
+from datetime import datetime, time, timedelta
+
+import numpy as np
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import DecimalField, ExpressionWrapper, F
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_save
+from django.utils import timezone
+
+from .models import (
+    AccountModificationRequest,
+    BillPayment,
+    CardLimitUpdate,
+    CardPINAction,
+    CardReplacement,
+    CashDeposit,
+    CashWithdrawal,
+    ChequeBookRequest,
+    DenominationExchange,
+    FundsTransfer,
+    FXBuy,
+    FXSell,
+    FXTransfer,
+    KYCUpdateRequest,
+    StandingOrder,
+    StatementRequest,
+)
+
+
+CACHE_TIMEOUT = 15 * 60
+ALL = "all"
+
+SERVICE_CATEGORIES = (
+    "cash-operations",
+    "customer-account",
+    "payment-operations",
+    "fx-operations",
+    "card-services",
+)
+
+# FXTransfer.amount is in the foreign currency; value it in KES like the
+# other FX rows (the quote's KES amount, else amount at the booked rate).
+FX_TRANSFER_KES = Coalesce(
+    F("quote__kes_amount"),
+    ExpressionWrapper(F("amount") * F("exchange_rate"), output_field=DecimalField(max_digits=25, decimal_places=6)),
+    output_field=DecimalField(max_digits=25, decimal_places=6),
+)
+
+# model -> (category, timestamp field, amount field or expression, operator field)
+SOURCES = {
+    CashDeposit: ("cash-operations", "created_at", "amount", "created_by"),
+    CashWithdrawal: ("cash-operations", "created_at", "amount", "created_by"),
+    DenominationExchange: ("cash-operations", "created_at", "kes_equivalent", "teller"),
+    KYCUpdateRequest: ("customer-account", "created_at", None, "verified_by"),
+    AccountModificationRequest: ("customer-account", "created_at", None, "requested_by"),
+    ChequeBookRequest: ("customer-account", "created_at", None, "created_by"),
+    StatementRequest: ("customer-account", "created_at", None, "created_by"),
+    FundsTransfer: ("payment-operations", "created_at", "amount", "created_by"),
+    BillPayment: ("payment-operations", "created_at", "amount", "created_by"),
+    StandingOrder: ("payment-operations", "created_at", "amount", "created_by"),
+    FXBuy: ("fx-operations", "created_at", "kes_equivalent", "created_by"),
+    FXSell: ("fx-operations", "created_at", "kes_equivalent", "created_by"),
+    FXTransfer: ("fx-operations", "created_at", FX_TRANSFER_KES, "created_by"),
+    CardReplacement: ("card-services", "created_at", None, "created_by"),
+    CardPINAction: ("card-services", "performed_at", None, "created_by"),
+    CardLimitUpdate: ("card-services", "created_at", None, "approved_by"),
+}
+
+STATUS_NONE, STATUS_PENDING, STATUS_DONE, STATUS_REJECTED, STATUS_IN_PROGRESS = range(5)
+STATUS_CODES = {
+    "PENDING": STATUS_PENDING,
+    "APPROVED": STATUS_DONE,
+    "COMPLETED": STATUS_DONE,
+    "ACTIVE": STATUS_DONE,
+    "REJECTED": STATUS_REJECTED,
+    "VALIDATION": STATUS_IN_PROGRESS,
+    "RUNNING": STATUS_IN_PROGRESS,
+    "READY": STATUS_DONE,
+    "FAILED": STATUS_REJECTED,
+}
+
+BUCKETS = ("day", "hour", "hour-of-day")
+
+
+class UnsupportedMetric(Exception):
+    pass
+
+
+METRICS = {}
+
+
+def metric(metric_id):
+    def register(func):
+        METRICS[metric_id] = func
+        return func
+    return register
+
+
+# =========================================================
+# COLUMNAR FRAME
+# =========================================================
+
+class Frame:
+    """Column arrays for every row in [start, end) plus bucket indices."""
+
+    def __init__(self, start, end, bucket, columns, branch_id=None, category=ALL):
+        self.start = start
+        self.end = end
+        self.bucket = bucket
+        self.branch_id = branch_id
+        self.category = category
+        self.ts = columns["ts"]
+        self.branch = columns["branch"]
+        self.categories = columns["category"]
+        self.amount = columns["amount"]
+        self.status = columns["status"]
+        self.operator = columns["operator"]
+
+        seconds = self.ts - int(start.timestamp())
+        if bucket == "day":
+            self.index = seconds // 86400
+            self.size = max(1, (end - start).days)
+        elif bucket == "hour":
+            self.index = seconds // 3600
+            self.size = max(1, int((end - start).total_seconds() // 3600))
+        else:
+            local_hours = (self.ts + int(start.utcoffset().total_seconds())) // 3600
+            self.index = local_hours % 24
+            self.size = 24
+
+    def __len__(self):
+        return len(self.ts)
+
+    def counts(self, mask=None):
+        index = self.index if mask is None else self.index[mask]
+        return np.bincount(index, minlength=self.size)[:self.size]
+
+    def sums(self, values, mask=None):
+        index, weights = (self.index, values) if mask is None else (self.index[mask], values[mask])
+        return np.bincount(index, weights=weights, minlength=self.size)[:self.size]
+
+    def labels(self):
+        if self.bucket == "hour-of-day":
+            return [f"{hour:02d}:00" for hour in range(24)]
+        step = timedelta(days=1) if self.bucket == "day" else timedelta(hours=1)
+        fmt = "%Y-%m-%d" if self.bucket == "day" else "%Y-%m-%dT%H:00"
+        return [(self.start + step * i).strftime(fmt) for i in range(self.size)]
+
+
+def _load_columns(start, end, branch_id, category):
+    chunks = {name: [] for name in ("ts", "branch", "category", "amount", "status", "operator")}
+
+    for model, (model_category, ts_field, amount_field, operator_field) in SOURCES.items():
+        if category != ALL and model_category != category:
+            continue
+
+        has_status = any(f.name == "status" for f in model._meta.fields)
+        fields = [ts_field, "branch_id", f"{operator_field}_id"]
+        fields += [amount_field] if amount_field is not None else []
+        fields += ["status"] if has_status else []
+
+        rows = model.objects.filter(**{f"{ts_field}__gte": start, f"{ts_field}__lt": end})
+        if branch_id is not None:
+            rows = rows.filter(branch_id=branch_id)
+        rows = list(rows.values_list(*fields))
+        if not rows:
+            continue
+
+        columns = list(zip(*rows))
+        n = len(rows)
+        chunks["ts"].append(np.fromiter((int(ts.timestamp()) for ts in columns[0]), np.int64, n))
+        chunks["branch"].append(np.asarray(columns[1], dtype=np.int64))
+        chunks["operator"].append(np.fromiter((u or -1 for u in columns[2]), np.int64, n))
+        chunks["category"].append(np.full(n, SERVICE_CATEGORIES.index(model_category), np.int8))
+        chunks["amount"].append(
+            np.fromiter((float(a or 0) for a in columns[3]), np.float64, n)
+            if amount_field is not None else np.zeros(n, np.float64)
+        )
+        chunks["status"].append(
+            np.fromiter((STATUS_CODES.get(s, STATUS_NONE) for s in columns[-1]), np.int8, n)
+            if has_status else np.zeros(n, np.int8)
+        )
+
+    empty = {"ts": np.int64, "branch": np.int64, "operator": np.int64,
+             "category": np.int8, "amount": np.float64, "status": np.int8}
+    return {
+        name: np.concatenate(parts) if parts else np.empty(0, empty[name])
+        for name, parts in chunks.items()
+    }
+
+
+def load_frame(start, end, bucket="day", branch_id=None, category=ALL):
+    return Frame(start, end, bucket, _load_columns(start, end, branch_id, category), branch_id, category)
+
+
+# =========================================================
+# METRICS
+# =========================================================
+
+def _percent(numerator, denominator):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(denominator > 0, numerator * 100.0 / denominator, 0.0)
+
+
+@metric("txn-volume")
+def txn_volume(frame):
+    return frame.counts()
+
+
+@metric("peak-hours")
+def peak_hours(frame):
+    return frame.counts()
+
+
+@metric("txn-value")
+def txn_value(frame):
+    return frame.sums(frame.amount)
+
+
+@metric("approval-rate")
+def approval_rate(frame):
+    decided = np.isin(frame.status, (STATUS_DONE, STATUS_REJECTED))
+    return _percent(frame.counts(frame.status == STATUS_DONE), frame.counts(decided))
+
+
+@metric("completion-rate")
+def completion_rate(frame):
+    tracked = frame.status != STATUS_NONE
+    return _percent(frame.counts(frame.status == STATUS_DONE), frame.counts(tracked))
+
+
+@metric("error-rate")
+def error_rate(frame):
+    tracked = frame.status != STATUS_NONE
+    return _percent(frame.counts(frame.status == STATUS_REJECTED), frame.counts(tracked))
+
+
+@metric("pending-approvals")
+def pending_approvals(frame):
+    return frame.counts(frame.status == STATUS_PENDING)
+
+
+def _distinct_operators(frame):
+    known = frame.operator >= 0
+    pairs = np.unique(np.stack([frame.index[known], frame.operator[known]]), axis=1)
+    return np.bincount(pairs[0], minlength=frame.size)[:frame.size] if pairs.size else np.zeros(frame.size)
+
+
+@metric("active-users")
+def active_users(frame):
+    return _distinct_operators(frame)
+
+
+@metric("operator-throughput")
+def operator_throughput(frame):
+    """Transactions per operator-hour actually worked in each bucket."""
+    known = frame.operator >= 0
+    hours = frame.ts[known] // 3600
+    worked = np.unique(np.stack([frame.index[known], frame.operator[known], hours]), axis=1)
+    operator_hours = np.bincount(worked[0], minlength=frame.size)[:frame.size] if worked.size else np.zeros(frame.size)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(operator_hours > 0, frame.counts(known) / operator_hours, 0.0)
+
+
+# =========================================================
+# ENTRY POINT + CACHE
+# =========================================================
+
+def _version_key(branch_id, category, day):
+    return f"metrics:v:{branch_id or ALL}:{category}:{day}"
+
+
+def _versions_digest(branch_id, category, start, end):
+    first, last = timezone.localtime(start).date(), timezone.localtime(end - timedelta(microseconds=1)).date()
+    keys = [_version_key(branch_id, category, first + timedelta(days=n)) for n in range((last - first).days + 1)]
+    versions = cache.get_many(keys)
+    joined = ",".join(str(versions.get(key, 0)) for key in keys)
+    return hashlib.md5(joined.encode()).hexdigest()
+
+
+def _bump(keys):
+    for key in keys:
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, None)
+
+
+def invalidate_rows(model, rows):
+    """
+    Bump versions for ``rows`` of ``model`` once the transaction commits.
+    ``rows`` are instances or (branch_id, timestamp) pairs.
+    """
+    category, ts_field = SOURCES[model][:2]
+    today = timezone.localdate()
+    keys = set()
+    for row in rows:
+        branch_id, ts = row if isinstance(row, tuple) else (row.branch_id, getattr(row, ts_field))
+        days = {today, timezone.localdate(ts) if ts else today}
+        for day in days:
+            for scope in (branch_id, None):
+                keys.update(_version_key(scope, scoped, day) for scoped in (category, ALL))
+    # After commit, so a reader can never cache the old rows under the new version.
+    transaction.on_commit(lambda: _bump(keys))
+
+
+def invalidate(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    invalidate_rows(sender, [instance])
+
+
+for _model in SOURCES:
+    post_save.connect(invalidate, sender=_model, dispatch_uid=f"metrics-{_model.__name__}")
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min), timezone.get_current_timezone())
+
+
+def _range(days, end_date):
+    end_date = end_date or timezone.localdate()
+    end = _day_start(end_date + timedelta(days=1))
+    return end - timedelta(days=days), end
+
+
+def _series(metric_id, start, end, branch_id, category, bucket):
+    key = (
+        f"metrics:{metric_id}:{start.isoformat()}:{end.isoformat()}:{branch_id or ALL}:"
+        f"{category}:{bucket}:{_versions_digest(branch_id, category, start, end)}"
+    )
+    series = cache.get(key)
+    if series is None:
+        frame = load_frame(start, end, bucket, branch_id, category)
+        values = METRICS[metric_id](frame)
+        series = [
+            {"date": label, "value": round(float(value), 2)}
+            for label, value in zip(frame.labels(), values)
+        ]
+        cache.set(key, series, CACHE_TIMEOUT)
+    return series
+
+
+def time_series(metric_id, days=30, end_date=None, branch_id=None, category=ALL, bucket="day"):
+    """Series for ``metric_id`` over the ``days`` days ending ``end_date``."""
+    if metric_id not in METRICS:
+        raise UnsupportedMetric(metric_id)
+    if bucket not in BUCKETS:
+        raise ValueError(f"unknown bucket {bucket!r}")
+    if metric_id == "peak-hours":
+        bucket = "hour-of-day"
+
+    start, end = _range(days, end_date)
+    today = _day_start(timezone.localdate())
+    if bucket == "hour-of-day" or not start < today < end:
+        return _series(metric_id, start, end, branch_id, category, bucket)
+    return (
+        _series(metric_id, start, today, branch_id, category, bucket)
+        + _series(metric_id, today, end, branch_id, category, bucket)
+    )
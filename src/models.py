@@ -1,3 +1,10 @@
+from django.conf import settings
+from django.db import models
+
+from .kyc_storage import kyc_storage
+from .references import generate_card_number
+
+
 class Branch(models.Model):
     name = models.CharField(max_length=100)
     branch_code = models.CharField(max_length=10, unique=True)
@@ -17,6 +24,53 @@ class Currency(models.Model):
         return self.code
 
 
+class ExchangeRate(models.Model):
+    currency = models.ForeignKey(Currency, on_delete=models.CASCADE, related_name="rates")
+    version = models.PositiveIntegerField()
+
+    buy_rate = models.DecimalField(max_digits=10, decimal_places=4)
+    sell_rate = models.DecimalField(max_digits=10, decimal_places=4)
+    mid_rate = models.DecimalField(max_digits=10, decimal_places=4)
+
+    source = models.CharField(max_length=50, blank=True, default='')
+    effective_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('currency', 'version')
+
+    def __str__(self):
+        return f"{self.currency_id} v{self.version}: {self.buy_rate}/{self.sell_rate}"
+
+
+class FXQuote(models.Model):
+    SIDE = (
+        ('BUY', 'Customer Buys FCY'),
+        ('SELL', 'Customer Sells FCY'),
+    )
+
+    STATUS = (
+        ('OPEN', 'Open'),
+        ('USED', 'Used'),
+        ('EXPIRED', 'Expired'),
+    )
+
+    quote_id = models.CharField(max_length=40, unique=True)
+    branch = models.ForeignKey(Branch, on_delete=models.PROTECT)
+    rate = models.ForeignKey(ExchangeRate, on_delete=models.PROTECT, related_name="quotes")
+    side = models.CharField(max_length=10, choices=SIDE)
+
+    quoted_rate = models.DecimalField(max_digits=10, decimal_places=4)
+    fcy_amount = models.DecimalField(max_digits=15, decimal_places=2)
+    kes_amount = models.DecimalField(max_digits=15, decimal_places=2)
+
+    status = models.CharField(max_length=10, choices=STATUS, default='OPEN')
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.quote_id
+
+
 class AccountType(models.Model):
     code = models.CharField(max_length=50, unique=True)
     name = models.CharField(max_length=100)
@@ -105,7 +159,7 @@ class APIServiceType(models.Model):
         unique_together = ('service_group', 'code')
 
     def __str__(self):
-        return f"{self.service_group.name} - {self.name}"
+        return f"{self.code} - {self.name}"
 
 
 # =========================================================
@@ -145,6 +199,10 @@ class Customer(models.Model):
     mobile_number = models.CharField(max_length=15)
     email = models.EmailField(blank=True, null=True)
 
+    # Search keys maintained by customer_search.py on save.
+    mobile_normalized = models.CharField(max_length=15, blank=True, default='')
+    name_normalized = models.CharField(max_length=200, blank=True, default='')
+
     occupation = models.CharField(max_length=100)
     employer_name = models.CharField(max_length=200, blank=True, null=True)
     employer_address = models.TextField(blank=True, null=True)
@@ -162,22 +220,41 @@ class Customer(models.Model):
 
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['mobile_normalized'], name='customer_mobile_norm_idx'),
+            models.Index(fields=['kra_pin'], name='customer_kra_pin_idx'),
+            models.Index(fields=['name_normalized'], name='customer_name_norm_idx'),
+            models.Index(fields=['branch', 'name_normalized'], name='customer_branch_name_idx'),
+        ]
+
     def __str__(self):
         return self.full_name
 
 
+class CustomerNameGram(models.Model):
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name="name_grams")
+    gram = models.CharField(max_length=3)
+
+    class Meta:
+        unique_together = ('customer', 'gram')
+        indexes = [
+            models.Index(fields=['gram', 'customer'], name='name_gram_lookup_idx'),
+        ]
+
+
 class KYCDocument(models.Model):
     customer = models.OneToOneField(Customer, on_delete=models.CASCADE, related_name="kyc")
     branch = models.ForeignKey(Branch, on_delete=models.PROTECT)
 
-    national_id_copy = models.FileField(upload_to='kyc/', blank=True, null=True)
-    kra_pin_certificate = models.FileField(upload_to='kyc/', blank=True, null=True)
-    passport_photo = models.ImageField(upload_to='kyc/', blank=True, null=True)
+    national_id_copy = models.FileField(upload_to='kyc/', storage=kyc_storage, blank=True, null=True)
+    kra_pin_certificate = models.FileField(upload_to='kyc/', storage=kyc_storage, blank=True, null=True)
+    passport_photo = models.ImageField(upload_to='kyc/', storage=kyc_storage, blank=True, null=True)
 
-    passport_copy = models.FileField(upload_to='kyc/', blank=True, null=True)
-    alien_id = models.FileField(upload_to='kyc/', blank=True, null=True)
-    work_permit = models.FileField(upload_to='kyc/', blank=True, null=True)
-    visa_copy = models.FileField(upload_to='kyc/', blank=True, null=True)
+    passport_copy = models.FileField(upload_to='kyc/', storage=kyc_storage, blank=True, null=True)
+    alien_id = models.FileField(upload_to='kyc/', storage=kyc_storage, blank=True, null=True)
+    work_permit = models.FileField(upload_to='kyc/', storage=kyc_storage, blank=True, null=True)
+    visa_copy = models.FileField(upload_to='kyc/', storage=kyc_storage, blank=True, null=True)
 
     verified = models.BooleanField(default=False)
     verified_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
@@ -219,7 +296,7 @@ class CustomerAccount(models.Model):
     account_type = models.ForeignKey(AccountType, on_delete=models.PROTECT)
     currency = models.ForeignKey(Currency, on_delete=models.PROTECT)
 
-    account_number = models.CharField(max_length=20, unique=True, default=generate_account_number)
+    account_number = models.CharField(max_length=20, unique=True, blank=True)
     account_category = models.CharField(max_length=20, choices=ACCOUNT_CATEGORY)
     balance = models.DecimalField(max_digits=15, decimal_places=2, default=0)
 
@@ -230,6 +307,14 @@ class CustomerAccount(models.Model):
     status = models.CharField(max_length=20, choices=ACCOUNT_STATUS, default='PENDING')
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # Set once the account's balance lives in the ledger: at creation, or
+    # when ledger.open_accounts() posts its pre-ledger balance.
+    ledger_opened_at = models.DateTimeField(blank=True, null=True)
+
+    # Maintained by the end-of-day batch (end_of_day.py).
+    accrued_interest = models.DecimalField(max_digits=17, decimal_places=4, default=0)
+    last_activity_at = models.DateTimeField(blank=True, null=True)
+
     def __str__(self):
         return self.account_number
 
@@ -249,8 +334,8 @@ class JointHolder(models.Model):
     national_id = models.CharField(max_length=20)
     kra_pin = models.CharField(max_length=20)
     mobile = models.CharField(max_length=15)
-    signature = models.ImageField(upload_to='signatures/', blank=True, null=True)
-    passport_photo = models.ImageField(upload_to='photos/', blank=True, null=True)
+    signature = models.ImageField(upload_to='signatures/', storage=kyc_storage, blank=True, null=True)
+    passport_photo = models.ImageField(upload_to='photos/', storage=kyc_storage, blank=True, null=True)
 
 
 # =========================================================
@@ -275,6 +360,15 @@ class KYCUpdateRequest(models.Model):
     verified_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['branch', 'created_at', 'id'],
+                name='kyc_update_pending_idx',
+                condition=models.Q(status='PENDING'),
+            ),
+        ]
+
 
 class AccountModificationRequest(models.Model):
     MODIFICATION_TYPE = (
@@ -303,6 +397,15 @@ class AccountModificationRequest(models.Model):
 
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['branch', 'created_at', 'id'],
+                name='account_mod_pending_idx',
+                condition=models.Q(status='PENDING'),
+            ),
+        ]
+
 
 # =========================================================
 # CASH OPERATIONS
@@ -313,20 +416,30 @@ class CashDeposit(models.Model):
     account = models.ForeignKey(CustomerAccount, on_delete=models.CASCADE)
     amount = models.DecimalField(max_digits=15, decimal_places=2)
     narration = models.TextField()
-    reference = models.CharField(max_length=30, unique=True, default=generate_dep_reference)
+    reference = models.CharField(max_length=30, unique=True, blank=True)
     created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at'], name='cash_deposit_created_idx'),
+        ]
+
 
 class CashWithdrawal(models.Model):
     branch = models.ForeignKey(Branch, on_delete=models.PROTECT)
     account = models.ForeignKey(CustomerAccount, on_delete=models.CASCADE)
     amount = models.DecimalField(max_digits=15, decimal_places=2)
     narration = models.TextField()
-    reference = models.CharField(max_length=30, unique=True, default=generate_wdl_reference)
+    reference = models.CharField(max_length=30, unique=True, blank=True)
     created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at'], name='cash_withdrawal_created_idx'),
+        ]
+
 
 
 # =========================================================
@@ -359,7 +472,7 @@ class DenominationExchange(models.Model):
     transaction_reference = models.CharField(
         max_length=30,
         unique=True,
-        default=generate_fxc_reference
+        blank=True
     )
 
     direction = models.CharField(max_length=10, choices=DIRECTION)
@@ -369,6 +482,7 @@ class DenominationExchange(models.Model):
     fcy_amount = models.DecimalField(max_digits=15, decimal_places=2)
     exchange_rate = models.DecimalField(max_digits=10, decimal_places=4)
     kes_equivalent = models.DecimalField(max_digits=15, decimal_places=2)
+    quote = models.ForeignKey(FXQuote, on_delete=models.PROTECT, null=True, blank=True)
 
     source_account = models.ForeignKey(
         CustomerAccount,
@@ -400,6 +514,15 @@ class DenominationExchange(models.Model):
 
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['branch', 'created_at', 'id'],
+                name='denom_exchange_pending_idx',
+                condition=models.Q(status__in=['PENDING', 'VALIDATION']),
+            ),
+        ]
+
 
 # =========================================================
 # PAYMENT OPERATIONS
@@ -421,10 +544,15 @@ class FundsTransfer(models.Model):
     beneficiary_name = models.CharField(max_length=200)
     amount = models.DecimalField(max_digits=15, decimal_places=2)
     narration = models.TextField(blank=True, null=True)
-    reference = models.CharField(max_length=30, unique=True, default=generate_trf_reference)
+    reference = models.CharField(max_length=30, unique=True, blank=True)
     created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at'], name='funds_transfer_created_idx'),
+        ]
+
 
 class BillPayment(models.Model):
     branch = models.ForeignKey(Branch, on_delete=models.PROTECT)
@@ -437,6 +565,11 @@ class BillPayment(models.Model):
     created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at'], name='bill_payment_created_idx'),
+        ]
+
 
 class StandingOrder(models.Model):
     branch = models.ForeignKey(Branch, on_delete=models.PROTECT)
@@ -450,6 +583,45 @@ class StandingOrder(models.Model):
     created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # Maintained by standing_orders.py
+    is_active = models.BooleanField(default=True)
+    next_run_date = models.DateField(blank=True, null=True)
+    last_run_date = models.DateField(blank=True, null=True)
+    run_count = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['next_run_date', 'id'],
+                name='standing_order_due_idx',
+                condition=models.Q(is_active=True),
+            ),
+        ]
+
+
+class StandingOrderExecution(models.Model):
+    STATUS = (
+        ('POSTED', 'Posted'),
+        ('FAILED', 'Failed'),
+        ('SKIPPED', 'Skipped'),
+    )
+
+    standing_order = models.ForeignKey(StandingOrder, on_delete=models.CASCADE, related_name="executions")
+    run_date = models.DateField()
+    idempotency_key = models.CharField(max_length=60, unique=True)
+    status = models.CharField(max_length=20, choices=STATUS)
+    # FundsTransfer is partitioned by month on PostgreSQL (partitions.py),
+    # and a foreign key there would need the partition key as well, so the
+    # link is not a database constraint. Django still applies SET_NULL.
+    transfer = models.OneToOneField(
+        FundsTransfer, on_delete=models.SET_NULL, null=True, blank=True, db_constraint=False
+    )
+    error = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('standing_order', 'run_date')
+
 
 # =========================================================
 # CARD SERVICES
@@ -479,6 +651,22 @@ class CardReplacement(models.Model):
 
 
 
+class CardDailyUsage(models.Model):
+    CHANNEL = (
+        ('POS', 'POS'),
+        ('ATM', 'ATM'),
+    )
+
+    card = models.ForeignKey(Card, on_delete=models.CASCADE, related_name="daily_usage")
+    day = models.DateField()
+    channel = models.CharField(max_length=5, choices=CHANNEL)
+    spent = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('card', 'day', 'channel')
+
+
 # =========================================================
 # CARD PIN STORAGE (HASHED)
 # =========================================================
@@ -502,6 +690,11 @@ class CardPINAction(models.Model):
     created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True)
     performed_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['performed_at'], name='card_pin_action_at_idx'),
+        ]
+
 
 class CardLimitUpdate(models.Model):
     branch = models.ForeignKey(Branch, on_delete=models.PROTECT)
@@ -531,7 +724,7 @@ class FXBuy(models.Model):
     transaction_reference = models.CharField(
         max_length=30,
         unique=True,
-        default=generate_fxb_reference
+        blank=True
     )
 
     account = models.ForeignKey(
@@ -543,6 +736,7 @@ class FXBuy(models.Model):
     amount = models.DecimalField(max_digits=15, decimal_places=2)
     exchange_rate = models.DecimalField(max_digits=10, decimal_places=4)
     kes_equivalent = models.DecimalField(max_digits=15, decimal_places=2)
+    quote = models.ForeignKey(FXQuote, on_delete=models.PROTECT, null=True, blank=True)
 
     narration = models.TextField()
 
@@ -550,6 +744,15 @@ class FXBuy(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['branch', 'created_at', 'id'],
+                name='fx_buy_pending_idx',
+                condition=models.Q(status='PENDING'),
+            ),
+        ]
+
 # =========================================================
 # FX SELL
 # =========================================================
@@ -567,7 +770,7 @@ class FXSell(models.Model):
     transaction_reference = models.CharField(
         max_length=30,
         unique=True,
-        default=generate_fxs_reference
+        blank=True
     )
 
     account = models.ForeignKey(
@@ -579,6 +782,7 @@ class FXSell(models.Model):
     amount = models.DecimalField(max_digits=15, decimal_places=2)
     exchange_rate = models.DecimalField(max_digits=10, decimal_places=4)
     kes_equivalent = models.DecimalField(max_digits=15, decimal_places=2)
+    quote = models.ForeignKey(FXQuote, on_delete=models.PROTECT, null=True, blank=True)
 
     narration = models.TextField()
 
@@ -586,6 +790,15 @@ class FXSell(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['branch', 'created_at', 'id'],
+                name='fx_sell_pending_idx',
+                condition=models.Q(status='PENDING'),
+            ),
+        ]
+
 # =========================================================
 # FX TRANSFER (INTERNATIONAL WIRE)
 # =========================================================
@@ -604,7 +817,7 @@ class FXTransfer(models.Model):
     transaction_reference = models.CharField(
         max_length=30,
         unique=True,
-        default=generate_fxt_reference
+        blank=True
     )
 
     account = models.ForeignKey(
@@ -616,6 +829,7 @@ class FXTransfer(models.Model):
     amount = models.DecimalField(max_digits=15, decimal_places=2)
     exchange_rate = models.DecimalField(max_digits=10, decimal_places=4, null=True, blank=True)
     charges = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    quote = models.ForeignKey(FXQuote, on_delete=models.PROTECT, null=True, blank=True)
 
     beneficiary_name = models.CharField(max_length=200)
     beneficiary_account_number = models.CharField(max_length=50)
@@ -630,6 +844,15 @@ class FXTransfer(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['branch', 'created_at', 'id'],
+                name='fx_transfer_pending_idx',
+                condition=models.Q(status__in=['PENDING', 'VALIDATION']),
+            ),
+        ]
+
 
 # =========================================================
 # SERVICE REQUESTS
@@ -647,6 +870,13 @@ class ChequeBookRequest(models.Model):
 
 
 class StatementRequest(models.Model):
+    STATUS = (
+        ('PENDING', 'Pending'),
+        ('RUNNING', 'Running'),
+        ('READY', 'Ready'),
+        ('FAILED', 'Failed'),
+    )
+
     branch = models.ForeignKey(Branch, on_delete=models.PROTECT)
     account = models.ForeignKey(CustomerAccount, on_delete=models.CASCADE)
     statement_type = models.CharField(max_length=20)
@@ -656,4 +886,448 @@ class StatementRequest(models.Model):
     delivery_email = models.EmailField(blank=True, null=True)
     certified_statement = models.BooleanField(default=False)
     created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True)
-    created_at = models.DateTimeField(auto_now_add=True)
\ No newline at end of file
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    # Filled in by statements.py
+    status = models.CharField(max_length=20, choices=STATUS, default='PENDING')
+    output_file = models.FileField(upload_to='statements/', blank=True, null=True)
+    line_count = models.IntegerField(default=0)
+    error = models.TextField(blank=True, null=True)
+    completed_at = models.DateTimeField(blank=True, null=True)
+
+
+# =========================================================
+# LEDGER (DOUBLE-ENTRY POSTINGS)
+# =========================================================
+
+class LedgerEntry(models.Model):
+
+    DIRECTION = (
+        ('DEBIT', 'Debit'),
+        ('CREDIT', 'Credit'),
+    )
+
+    branch = models.ForeignKey(Branch, on_delete=models.PROTECT)
+
+    # Exactly one of account / gl_code is set: customer legs hit an account,
+    # the contra legs hit an internal GL (till cash, FX position, nostro...).
+    account = models.ForeignKey(
+        CustomerAccount,
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name="ledger_entries"
+    )
+    gl_code = models.CharField(max_length=30, blank=True, null=True)
+
+    posting_reference = models.CharField(max_length=30)
+    sequence = models.PositiveSmallIntegerField()
+    direction = models.CharField(max_length=10, choices=DIRECTION)
+    amount = models.DecimalField(max_digits=15, decimal_places=2)
+    narration = models.TextField(blank=True, null=True)
+
+    source_model = models.CharField(max_length=50)
+    source_id = models.BigIntegerField()
+
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['posting_reference', 'sequence'], name='uniq_ledger_leg'),
+        ]
+        indexes = [
+            models.Index(fields=['account', 'id'], name='ledger_account_id_idx'),
+            models.Index(fields=['account', 'created_at'], name='ledger_account_created_idx'),
+            models.Index(fields=['source_model', 'source_id'], name='ledger_source_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.posting_reference}/{self.sequence} {self.direction} {self.amount}"
+
+
+class AccountBalanceSnapshot(models.Model):
+    account = models.ForeignKey(CustomerAccount, on_delete=models.CASCADE, related_name="balance_snapshots")
+
+    # Balance after applying every entry with id <= last_entry_id.
+    last_entry_id = models.BigIntegerField()
+    balance = models.DecimalField(max_digits=15, decimal_places=2)
+    as_of = models.DateTimeField()
+
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['account', 'last_entry_id'], name='uniq_snapshot_account_entry'),
+        ]
+        indexes = [
+            models.Index(fields=['account', '-last_entry_id'], name='snapshot_account_latest_idx'),
+            models.Index(fields=['account', '-as_of'], name='snapshot_account_asof_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.account_id} @ {self.last_entry_id}: {self.balance}"
+
+
+
+# =========================================================
+# REFERENCE ALLOCATION (SEE references.py)
+# =========================================================
+
+class ReferenceBlock(models.Model):
+    series = models.CharField(max_length=10)
+    shard = models.CharField(max_length=20)
+    next_value = models.BigIntegerField(default=1)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('series', 'shard')
+
+    def __str__(self):
+        return f"{self.series}/{self.shard} -> {self.next_value}"
+
+
+# =========================================================
+# DASHBOARD ROLLUPS (SEE dashboard_rollups.py)
+# =========================================================
+
+class ServiceDailyRollup(models.Model):
+    branch = models.ForeignKey(Branch, on_delete=models.CASCADE, related_name="daily_rollups")
+    day = models.DateField()
+    service = models.CharField(max_length=50)
+    status = models.CharField(max_length=20, blank=True, default='')
+
+    count = models.IntegerField(default=0)
+    amount = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('branch', 'day', 'service', 'status')
+        indexes = [
+            models.Index(fields=['day', 'branch'], name='rollup_day_branch_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.branch_id} {self.day} {self.service}/{self.status}: {self.count}"
+
+
+# =========================================================
+# APPROVAL QUEUE (SEE approval_queue.py)
+# =========================================================
+
+class ApprovalItem(models.Model):
+    STATUS = (
+        ('PENDING', 'Pending'),
+        ('DONE', 'Done'),
+    )
+
+    branch = models.ForeignKey(Branch, on_delete=models.CASCADE, related_name="approval_items")
+    source_model = models.CharField(max_length=50)
+    source_id = models.BigIntegerField()
+    summary = models.CharField(max_length=200, blank=True, default='')
+
+    status = models.CharField(max_length=10, choices=STATUS, default='PENDING')
+    claimed_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
+    lease_expires_at = models.DateTimeField(blank=True, null=True)
+
+    created_at = models.DateTimeField()
+    closed_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        unique_together = ('source_model', 'source_id')
+        indexes = [
+            models.Index(
+                fields=['branch', 'created_at', 'id'],
+                name='approval_pending_idx',
+                condition=models.Q(status='PENDING'),
+            ),
+            models.Index(
+                fields=['created_at', 'id'],
+                name='approval_pending_all_idx',
+                condition=models.Q(status='PENDING'),
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.source_model}#{self.source_id} ({self.status})"
+
+
+# =========================================================
+# SLA TRACKING (SEE sla.py)
+# =========================================================
+
+class BranchHoliday(models.Model):
+    # branch NULL means a public holiday for every branch.
+    branch = models.ForeignKey(Branch, on_delete=models.CASCADE, null=True, blank=True, related_name="holidays")
+    date = models.DateField()
+    name = models.CharField(max_length=100)
+
+    class Meta:
+        unique_together = ('branch', 'date')
+
+    def __str__(self):
+        return f"{self.date} {self.name}"
+
+
+class SLARecord(models.Model):
+    branch = models.ForeignKey(Branch, on_delete=models.CASCADE, related_name="sla_records")
+    source_model = models.CharField(max_length=50)
+    source_id = models.BigIntegerField()
+    service = models.CharField(max_length=50)
+
+    started_at = models.DateTimeField()
+    due_at = models.DateTimeField()
+    completed_at = models.DateTimeField(blank=True, null=True)
+
+    breached = models.BooleanField(default=False)
+    breach_notified = models.BooleanField(default=False)
+
+    class Meta:
+        unique_together = ('source_model', 'source_id')
+        indexes = [
+            models.Index(
+                fields=['due_at'],
+                name='sla_open_due_idx',
+                condition=models.Q(completed_at__isnull=True),
+            ),
+            models.Index(fields=['branch', 'due_at'], name='sla_branch_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.source_model}#{self.source_id} due {self.due_at}"
+
+
+class SLADailyStat(models.Model):
+    branch = models.ForeignKey(Branch, on_delete=models.CASCADE, related_name="sla_stats")
+    day = models.DateField()
+    service = models.CharField(max_length=50)
+    met = models.IntegerField(default=0)
+    missed = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('branch', 'day', 'service')
+
+
+# =========================================================
+# TRANSACTION ARCHIVE (SEE partitions.py)
+# =========================================================
+
+class ArchivedPartition(models.Model):
+    table_name = models.CharField(max_length=100)
+    month = models.DateField()
+
+    path = models.CharField(max_length=500)
+    row_count = models.BigIntegerField()
+    sha256 = models.CharField(max_length=64)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('table_name', 'month')
+
+    def __str__(self):
+        return f"{self.table_name} {self.month:%Y-%m}"
+
+
+# =========================================================
+# AML / PEP SCREENING (SEE aml_screening.py)
+# =========================================================
+
+class WatchlistEntry(models.Model):
+    LIST_TYPE = (
+        ('SANCTIONS', 'Sanctions'),
+        ('PEP', 'Politically Exposed Person'),
+    )
+
+    list_name = models.CharField(max_length=50)
+    list_type = models.CharField(max_length=20, choices=LIST_TYPE)
+    external_id = models.CharField(max_length=100)
+
+    full_name = models.CharField(max_length=300)
+    name_normalized = models.CharField(max_length=300)
+    country = models.CharField(max_length=100, blank=True, default='')
+    date_of_birth = models.DateField(blank=True, null=True)
+
+    is_active = models.BooleanField(default=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('list_name', 'external_id')
+
+    def __str__(self):
+        return f"{self.list_name}:{self.external_id} {self.full_name}"
+
+
+class ScreeningHit(models.Model):
+    STATUS = (
+        ('OPEN', 'Open'),
+        ('CLEARED', 'Cleared'),
+        ('CONFIRMED', 'Confirmed'),
+    )
+
+    subject_model = models.CharField(max_length=50)
+    subject_id = models.BigIntegerField()
+    screened_name = models.CharField(max_length=300)
+
+    entry = models.ForeignKey(WatchlistEntry, on_delete=models.CASCADE, related_name="hits")
+    score = models.FloatField()
+    list_version = models.PositiveIntegerField()
+
+    status = models.CharField(max_length=20, choices=STATUS, default='OPEN')
+    reviewed_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
+    reviewed_at = models.DateTimeField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('subject_model', 'subject_id', 'entry')
+        indexes = [
+            models.Index(
+                fields=['created_at'],
+                name='screening_hit_open_idx',
+                condition=models.Q(status='OPEN'),
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.subject_model}#{self.subject_id} ~ {self.entry_id} ({self.score:.2f})"
+
+
+# =========================================================
+# IDEMPOTENCY KEYS (SEE idempotency.py)
+# =========================================================
+
+class IdempotencyKey(models.Model):
+    scope = models.CharField(max_length=50)
+    key = models.CharField(max_length=100)
+    request_hash = models.CharField(max_length=64)
+
+    response_status = models.PositiveSmallIntegerField(default=200)
+    response_body = models.JSONField(blank=True, null=True)
+    source_model = models.CharField(max_length=50, blank=True, default='')
+    source_id = models.BigIntegerField(blank=True, null=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['scope', 'key'], name='uniq_idempotency_scope_key'),
+        ]
+        indexes = [
+            models.Index(fields=['expires_at'], name='idempotency_expires_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.scope}:{self.key}"
+
+
+# =========================================================
+# END-OF-DAY BATCH (SEE end_of_day.py)
+# =========================================================
+
+class BatchRun(models.Model):
+    STATUS = (
+        ('RUNNING', 'Running'),
+        ('COMPLETED', 'Completed'),
+        ('FAILED', 'Failed'),
+    )
+
+    run_date = models.DateField(unique=True)
+    status = models.CharField(max_length=20, choices=STATUS, default='RUNNING')
+    activity_since = models.DateTimeField(blank=True, null=True)
+
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"End of day {self.run_date} ({self.status})"
+
+
+class BatchPartition(models.Model):
+    STATUS = (
+        ('PENDING', 'Pending'),
+        ('DONE', 'Done'),
+        ('FAILED', 'Failed'),
+    )
+
+    run = models.ForeignKey(BatchRun, on_delete=models.CASCADE, related_name="partitions")
+    first_id = models.BigIntegerField()
+    last_id = models.BigIntegerField()
+    # Checkpoint: every account below next_id has been processed and committed.
+    next_id = models.BigIntegerField()
+
+    status = models.CharField(max_length=20, choices=STATUS, default='PENDING')
+    accounts = models.PositiveIntegerField(default=0)
+    interest_accrued = models.DecimalField(max_digits=19, decimal_places=4, default=0)
+    interest_posted = models.DecimalField(max_digits=17, decimal_places=2, default=0)
+    fees_charged = models.DecimalField(max_digits=17, decimal_places=2, default=0)
+    fees_unpaid = models.PositiveIntegerField(default=0)
+    dormant = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True, default='')
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        unique_together = ('run', 'first_id')
+
+    def __str__(self):
+        return f"{self.run.run_date} [{self.first_id}, {self.last_id}] {self.status}"
+
+
+# =========================================================
+# TRANSACTIONAL OUTBOX (SEE outbox.py)
+# =========================================================
+
+class OutboxEvent(models.Model):
+    EVENT_TYPE = (
+        ('CREATED', 'Created'),
+        ('UPDATED', 'Updated'),
+        ('DELETED', 'Deleted'),
+    )
+
+    aggregate = models.CharField(max_length=50)
+    aggregate_id = models.BigIntegerField()
+    # Events for one account are delivered in order; it is the partition key.
+    account_id = models.BigIntegerField()
+    # Position among the account's events, handed out in commit order.
+    sequence = models.BigIntegerField(default=0)
+    event_type = models.CharField(max_length=10, choices=EVENT_TYPE)
+    payload = models.JSONField()
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    published_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['id'],
+                name='outbox_unpublished_idx',
+                condition=models.Q(published_at__isnull=True),
+            ),
+            models.Index(fields=['published_at'], name='outbox_published_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.aggregate}#{self.aggregate_id} {self.event_type}"
+
+
+class OutboxSequence(models.Model):
+    # Last sequence handed out for the account. Writers hold this row locked
+    # until they commit, so one account's events commit in sequence order.
+    account_id = models.BigIntegerField(primary_key=True)
+    last = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.account_id}: {self.last}"
+
+
+# =========================================================
+# CROSS-SELL RECOMMENDATIONS (SEE cross_sell.py)
+# =========================================================
+
+class CrossSellRecommendation(models.Model):
+    customer = models.OneToOneField(Customer, on_delete=models.CASCADE, related_name="cross_sell")
+    # Ranked [{"kind", "id", "code", "name", "score"}, ...], best first.
+    offers = models.JSONField(default=list)
+    computed_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.customer_id}: {len(self.offers)} offers"
@@ -0,0 +1,378 @@
+"""
+Transactional outbox: change events for CustomerAccount, Card,
+KYCUpdateRequest and the transaction models.
+
+Reporting, notifications and the Analyser used to poll these tables. Now
+every save or delete of a TRACKED model also inserts an OutboxEvent row from
+a post_save / post_delete receiver. That runs on the same connection, inside
+the caller's transaction, so the event commits or rolls back with the
+change. No committed change is missed, and no event is published for a
+change that rolled back.
+
+Bulk paths send no signals, so they call record() themselves (bulk_posting,
+the end-of-day account updates, ledger.roll_snapshots). queryset.update()
+and raw SQL still emit nothing.
+
+Ids are handed out at insert, not at commit, so a transaction can commit an
+event with a lower id after the relay has already sent a higher one. To
+keep one account's events in order, every event also takes the next
+``sequence`` of its account from an OutboxSequence row. That row stays
+locked until the writer commits, so a second writer for the same account
+waits, and takes both its sequence and its id after the first has
+committed. Per account, id order is therefore commit order.
+
+relay_batch() moves committed events to a broker. It locks the oldest
+unpublished events (a second relay waits rather than overtaking), appends
+them to the broker in id order, and marks them published. Each event goes
+to broker partition ``account_id % broker.partitions``, so all events of
+one account are delivered in order, numbered by "sequence". If the process
+dies between the append and the commit, the same events are sent again on
+the next batch. Delivery is therefore at least once, and consumers dedupe
+on the event "id".
+
+Two broker stand-ins share one interface:
+
+* MemoryBroker keeps partitions as lists and pushes each append to its
+  subscribers, for tests and single-process setups;
+* FileLog keeps one append-only JSON-lines file per partition under a
+  directory. Offsets are byte positions, kept in one JSON file per
+  consumer that is updated under an exclusive file lock.
+
+Both store committed offsets per (consumer, partition). consume() reads from
+each consumer's committed offset, hands the records to a handler and then
+commits, so a consumer that crashes reprocesses at most one batch.
+purge_published() deletes relayed events once RETENTION has passed.
+"""
+
+import fcntl
+import json
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import FileField
+from django.db.models.signals import post_delete, post_save
+from django.utils import timezone
+
+from .models import (
+    BillPayment,
+    Card,
+    CashDeposit,
+    CashWithdrawal,
+    CustomerAccount,
+    FundsTransfer,
+    FXBuy,
+    FXSell,
+    FXTransfer,
+    KYCUpdateRequest,
+    OutboxEvent,
+    OutboxSequence,
+)
+
+
+BATCH_SIZE = 1000
+PARTITIONS = 16
+POLL_INTERVAL = 0.5
+RETENTION = timedelta(days=7)
+PURGE_BATCH_SIZE = 10_000
+
+CREATED = "CREATED"
+UPDATED = "UPDATED"
+DELETED = "DELETED"
+
+# model -> attribute holding the account the event is ordered by
+TRACKED = {
+    CustomerAccount: "pk",
+    Card: "account_id",
+    KYCUpdateRequest: "account_id",
+    CashDeposit: "account_id",
+    CashWithdrawal: "account_id",
+    FundsTransfer: "source_account_id",
+    BillPayment: "source_account_id",
+    FXBuy: "account_id",
+    FXSell: "account_id",
+    FXTransfer: "account_id",
+}
+
+
+# =========================================================
+# WRITING EVENTS
+# =========================================================
+
+def _payload(instance, fields=None):
+    data = {}
+    for field in instance._meta.concrete_fields:
+        if fields is not None and not field.primary_key and not {field.name, field.attname} & fields:
+            continue
+        value = getattr(instance, field.attname)
+        if isinstance(field, FileField):
+            value = value.name or None
+        data[field.attname] = value
+    if isinstance(instance, Card) and data.get("card_number"):
+        data["card_number"] = "*" * 12 + data["card_number"][-4:]
+    # Decimals and datetimes become strings, as consumers will read them.
+    return json.loads(json.dumps(data, cls=DjangoJSONEncoder))
+
+
+def _event(instance, event_type, fields=None):
+    return OutboxEvent(
+        aggregate=type(instance).__name__,
+        aggregate_id=instance.pk,
+        account_id=getattr(instance, TRACKED[type(instance)]),
+        event_type=event_type,
+        payload=_payload(instance, fields),
+    )
+
+
+def _reserve(events):
+    """
+    Number ``events`` from their accounts' OutboxSequence rows. The rows
+    are locked in account order, and stay locked until the caller commits.
+    """
+    counts = Counter(event.account_id for event in events)
+    OutboxSequence.objects.bulk_create(
+        [OutboxSequence(account_id=account_id) for account_id in sorted(counts)],
+        batch_size=BATCH_SIZE, ignore_conflicts=True,
+    )
+    sequences = list(
+        OutboxSequence.objects
+        .select_for_update()
+        .filter(account_id__in=list(counts))
+        .order_by("account_id")
+    )
+    last = {}
+    for sequence in sequences:
+        last[sequence.account_id] = sequence.last
+        sequence.last += counts[sequence.account_id]
+    OutboxSequence.objects.bulk_update(sequences, ["last"], batch_size=BATCH_SIZE)
+
+    for event in events:
+        last[event.account_id] += 1
+        event.sequence = last[event.account_id]
+
+
+def _write(events):
+    # Atomic so the sequence locks are taken inside a transaction; nested
+    # in the caller's, they are held until that commits.
+    with transaction.atomic():
+        _reserve(events)
+        return OutboxEvent.objects.bulk_create(events, batch_size=BATCH_SIZE)
+
+
+def record(instances, event_type, fields=None):
+    """
+    Write events for rows saved without signals (bulk_create, bulk_update).
+    Call it inside the transaction that wrote them. ``fields`` limits the
+    payload to the columns that changed.
+    """
+    events = [_event(instance, event_type, fields) for instance in instances]
+    if not events:
+        return []
+    return _write(events)
+
+
+def _on_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    update_fields = kwargs.get("update_fields")
+    _write([_event(instance, CREATED if created else UPDATED, update_fields and set(update_fields))])
+
+
+def _on_delete(sender, instance, **kwargs):
+    _write([_event(instance, DELETED)])
+
+
+for _model in TRACKED:
+    post_save.connect(_on_save, sender=_model, dispatch_uid=f"outbox-save-{_model.__name__}")
+    post_delete.connect(_on_delete, sender=_model, dispatch_uid=f"outbox-delete-{_model.__name__}")
+
+
+# =========================================================
+# BROKER STAND-INS
+# =========================================================
+
+class MemoryBroker:
+
+    def __init__(self, partitions=PARTITIONS):
+        self.partitions = partitions
+        self._logs = [[] for _ in range(partitions)]
+        self._offsets = defaultdict(dict)
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, callback):
+        """Push: ``callback(partition, records)`` after every append."""
+        self._subscribers.append(callback)
+
+    def append(self, partition, records):
+        with self._lock:
+            self._logs[partition].extend(records)
+        for callback in list(self._subscribers):
+            callback(partition, records)
+
+    def read(self, partition, offset, limit):
+        """Up to ``limit`` records from ``offset``, and the offset after them."""
+        records = self._logs[partition][offset:offset + limit]
+        return records, offset + len(records)
+
+    def committed(self, consumer, partition):
+        return self._offsets[consumer].get(partition, 0)
+
+    def commit(self, consumer, partition, offset):
+        self._offsets[consumer][partition] = offset
+
+
+class FileLog:
+
+    def __init__(self, root, partitions=PARTITIONS):
+        self.root = root
+        self.partitions = partitions
+        self._lock = threading.Lock()
+        self._offsets_lock = threading.Lock()
+        os.makedirs(os.path.join(root, "offsets"), exist_ok=True)
+
+    def _path(self, partition):
+        return os.path.join(self.root, f"partition-{partition:03d}.log")
+
+    def _offsets_path(self, consumer):
+        return os.path.join(self.root, "offsets", f"{consumer}.json")
+
+    def append(self, partition, records):
+        data = b"".join(json.dumps(record, separators=(",", ":")).encode() + b"\n" for record in records)
+        with self._lock, open(self._path(partition), "ab") as handle:
+            handle.write(data)
+            handle.flush()
+            os.fsync(handle.fileno())
+
+    def read(self, partition, offset, limit):
+        records = []
+        try:
+            handle = open(self._path(partition), "rb")
+        except FileNotFoundError:
+            return records, offset
+        with handle:
+            handle.seek(offset)
+            while len(records) < limit:
+                line = handle.readline()
+                if not line.endswith(b"\n"):
+                    # Nothing more, or an append still being written.
+                    break
+                records.append(json.loads(line))
+                offset += len(line)
+        return records, offset
+
+    def _load_offsets(self, consumer):
+        try:
+            with open(self._offsets_path(consumer)) as handle:
+                return json.load(handle)
+        except FileNotFoundError:
+            return {}
+
+    def committed(self, consumer, partition):
+        return self._load_offsets(consumer).get(str(partition), 0)
+
+    def commit(self, consumer, partition, offset):
+        # Other threads and processes commit other partitions of the same
+        # consumer; without the locks their read-modify-writes drop each
+        # other's offsets.
+        path = self._offsets_path(consumer)
+        with self._offsets_lock, open(path + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            offsets = self._load_offsets(consumer)
+            offsets[str(partition)] = offset
+            with open(path + ".tmp", "w") as handle:
+                json.dump(offsets, handle)
+            os.replace(path + ".tmp", path)
+
+
+# =========================================================
+# RELAY
+# =========================================================
+
+def relay_batch(broker, batch_size=BATCH_SIZE):
+    """Publish up to ``batch_size`` committed events; returns how many went."""
+    with transaction.atomic():
+        events = list(
+            OutboxEvent.objects
+            .select_for_update()
+            .filter(published_at__isnull=True)
+            .order_by("id")
+            .values_list("id", "aggregate", "aggregate_id", "account_id", "sequence", "event_type", "payload",
+                         "created_at")
+            [:batch_size]
+        )
+        if not events:
+            return 0
+
+        by_partition = defaultdict(list)
+        for event_id, aggregate, aggregate_id, account_id, sequence, event_type, payload, created_at in events:
+            by_partition[account_id % broker.partitions].append({
+                "id": event_id,
+                "aggregate": aggregate,
+                "aggregate_id": aggregate_id,
+                "account_id": account_id,
+                "sequence": sequence,
+                "type": event_type,
+                "payload": payload,
+                "created_at": created_at.isoformat(),
+            })
+        for partition, records in by_partition.items():
+            broker.append(partition, records)
+
+        OutboxEvent.objects.filter(pk__in=[event[0] for event in events]).update(published_at=timezone.now())
+    return len(events)
+
+
+def relay(broker, batch_size=BATCH_SIZE, poll_interval=POLL_INTERVAL, stop=None):
+    """Relay until ``stop`` (a threading.Event) is set; returns the number of events sent."""
+    sent = 0
+    while stop is None or not stop.is_set():
+        count = relay_batch(broker, batch_size)
+        sent += count
+        if count < batch_size:
+            if stop is not None:
+                stop.wait(poll_interval)
+            else:
+                time.sleep(poll_interval)
+    return sent
+
+
+# =========================================================
+# CONSUMERS
+# =========================================================
+
+def consume(broker, consumer, handler, partitions=None, max_records=BATCH_SIZE):
+    """
+    One pass over ``partitions`` (default: all) for ``consumer``: hand each
+    partition's new records to ``handler(partition, records)``, then commit
+    the offset. Returns the number of records handled.
+    """
+    handled = 0
+    for partition in range(broker.partitions) if partitions is None else partitions:
+        offset = broker.committed(consumer, partition)
+        records, next_offset = broker.read(partition, offset, max_records)
+        if not records:
+            continue
+        handler(partition, records)
+        broker.commit(consumer, partition, next_offset)
+        handled += len(records)
+    return handled
+
+
+def purge_published(retention=RETENTION):
+    """Delete events relayed more than ``retention`` ago, in batches; returns how many went."""
+    cutoff = timezone.now() - retention
+    purged = 0
+    while True:
+        batch = list(
+            OutboxEvent.objects
+            .filter(published_at__lt=cutoff)
+            .values_list("pk", flat=True)[:PURGE_BATCH_SIZE]
+        )
+        if not batch:
+            return purged
+        purged += OutboxEvent.objects.filter(pk__in=batch).delete()[0]
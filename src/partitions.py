@@ -0,0 +1,494 @@
+"""
+Monthly partitioning and archiving for the high-volume transaction tables.
+
+On PostgreSQL, CashDeposit, CashWithdrawal, FundsTransfer, BillPayment and
+CardPINAction become tables range-partitioned by month on their timestamp.
+Each month's rows and indexes live in their own partition. The hot month's
+indexes, bloat and vacuum work therefore depend on that month's volume,
+not on the size of the history. A query that filters on the timestamp only
+touches the months it covers; the planner does the pruning.
+
+partition_tables() does the one-off conversion: it renames the table, creates
+the partitioned parent, copies the rows across and drops the old table. The
+primary key, indexes, sequence and constraints are recreated under their
+original names. It runs after migrate and skips tables that are already
+partitioned. Then ensure_partitions() keeps MONTHS_AHEAD months open in
+advance; it runs after migrate and from every end_of_day.run(), so the
+months never run out. A DEFAULT partition catches anything outside them.
+When a month is created for rows already sitting in DEFAULT, DEFAULT is
+detached, the rows are moved into the new month and DEFAULT is attached
+again.
+
+PostgreSQL requires the partition key in every unique constraint, so:
+
+- the primary key becomes (id, timestamp);
+- a unique column such as ``reference`` keeps its index, and uniqueness is
+  enforced through a side table holding one row per value
+  (``<table>_<column>_uniq``), kept by a trigger on the parent. A duplicate
+  fails the insert with an IntegrityError, as before. Values of archived
+  months stay in the side table, so they are never reused;
+- foreign keys cannot point *into* these tables. The only one,
+  StandingOrderExecution.transfer, is declared with db_constraint=False;
+  the SET_NULL on delete is still applied by Django.
+
+archive_month() moves one month to a zstd-compressed Parquet file under
+ARCHIVE_ROOT and records it as an ArchivedPartition. The partition is then
+detached and dropped, or on SQLite the month's rows are deleted. history()
+reads a date range across both tiers. It opens only the archive files for
+the months asked for, then reads the remainder from the database.
+
+SQLite has no partitioning. There, the tables keep their plain layout with
+an index on the timestamp, and the rest of this module works unchanged.
+That is the layout the tests run against.
+"""
+
+import hashlib
+import logging
+import os
+import re
+from datetime import date, datetime
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models.signals import post_migrate
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import (
+    ArchivedPartition,
+    BillPayment,
+    CardPINAction,
+    CashDeposit,
+    CashWithdrawal,
+    FundsTransfer,
+)
+
+
+logger = logging.getLogger(__name__)
+
+# model -> partition key
+PARTITIONED = {
+    CashDeposit: "created_at",
+    CashWithdrawal: "created_at",
+    FundsTransfer: "created_at",
+    BillPayment: "created_at",
+    CardPINAction: "performed_at",
+}
+
+MONTHS_AHEAD = 2
+HOT_MONTHS = getattr(settings, "TRANSACTION_HOT_MONTHS", 13)
+ARCHIVE_ROOT = getattr(settings, "TRANSACTION_ARCHIVE_ROOT", os.path.join(settings.MEDIA_ROOT, "archive"))
+ARCHIVE_BATCH_SIZE = 50_000
+
+# Applied to every partition: vacuum a month after ~1% of it has churned,
+# rather than the 20% default that lets a busy month bloat first.
+PARTITION_STORAGE = "autovacuum_vacuum_scale_factor = 0.01, autovacuum_analyze_scale_factor = 0.02"
+
+
+# =========================================================
+# MONTHS
+# =========================================================
+
+def month_start(value):
+    if isinstance(value, datetime):
+        value = timezone.localtime(value).date()
+    return value.replace(day=1)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def month_bounds(month):
+    """Aware datetimes [start, end) of ``month`` in the local time zone."""
+    start = timezone.make_aware(datetime.combine(month, datetime.min.time()))
+    end = timezone.make_aware(datetime.combine(add_months(month, 1), datetime.min.time()))
+    return start, end
+
+
+def _months(first, last):
+    month = month_start(first)
+    while month <= month_start(last):
+        yield month
+        month = add_months(month, 1)
+
+
+# =========================================================
+# POSTGRESQL LAYOUT
+# =========================================================
+
+def _partition_key(model):
+    return model._meta.get_field(PARTITIONED[model]).column
+
+
+def partition_name(model, month):
+    return f"{model._meta.db_table}_p{month:%Y%m}"
+
+
+def is_partitioned(model):
+    if connection.vendor != "postgresql":
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+            "WHERE c.oid = to_regclass(%s)",
+            [model._meta.db_table],
+        )
+        return cursor.fetchone() is not None
+
+
+def _unique_columns(model):
+    return [field.column for field in model._meta.concrete_fields if field.unique and not field.primary_key]
+
+
+def _keys_table(table, column):
+    return f"{table}_{column}_uniq"
+
+
+def _exists(cursor, name):
+    cursor.execute("SELECT to_regclass(%s)", [name])
+    return cursor.fetchone()[0] is not None
+
+
+def _create_partition(cursor, model, month):
+    """Create ``month``'s partition, moving in any of its rows held in DEFAULT."""
+    name = partition_name(model, month)
+    if _exists(cursor, name):
+        return
+    table = model._meta.db_table
+    default = f"{table}_default"
+    key = _partition_key(model)
+    start, end = month_bounds(month)
+    create = (
+        f'CREATE TABLE "{name}" PARTITION OF "{table}" '
+        f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}') "
+        f"WITH ({PARTITION_STORAGE})"
+    )
+    in_month = f'"{key}" >= %s AND "{key}" < %s'
+
+    stranded = False
+    if _exists(cursor, default):
+        cursor.execute(f'SELECT EXISTS (SELECT 1 FROM "{default}" WHERE {in_month})', [start, end])
+        stranded = cursor.fetchone()[0]
+    if not stranded:
+        cursor.execute(create)
+        return
+
+    # PostgreSQL refuses a partition whose rows DEFAULT already holds.
+    with transaction.atomic():
+        cursor.execute(f'ALTER TABLE "{table}" DETACH PARTITION "{default}"')
+        cursor.execute(create)
+        for column in _unique_columns(model):
+            # The re-insert below registers these values again.
+            cursor.execute(
+                f'DELETE FROM "{_keys_table(table, column)}" WHERE "{column}" IN '
+                f'(SELECT "{column}" FROM "{default}" WHERE {in_month})',
+                [start, end],
+            )
+        cursor.execute(
+            f'WITH moved AS (DELETE FROM "{default}" WHERE {in_month} RETURNING *) '
+            f'INSERT INTO "{table}" SELECT * FROM moved',
+            [start, end],
+        )
+        cursor.execute(f'ALTER TABLE "{table}" ATTACH PARTITION "{default}" DEFAULT')
+    logger.info("moved %s rows for %s out of %s", table, f"{month:%Y-%m}", default)
+
+
+def _enforce_unique(cursor, table, column):
+    """Keep ``column`` unique across all partitions through a side table."""
+    keys = _keys_table(table, column)
+    cursor.execute(f'CREATE TABLE IF NOT EXISTS "{keys}" ("{column}" text PRIMARY KEY)')
+    cursor.execute(f"""
+        CREATE OR REPLACE FUNCTION "{keys}_sync"() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') AND OLD."{column}" IS NOT NULL THEN
+                DELETE FROM "{keys}" WHERE "{column}" = OLD."{column}";
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') AND NEW."{column}" IS NOT NULL THEN
+                INSERT INTO "{keys}" ("{column}") VALUES (NEW."{column}");
+            END IF;
+            RETURN NULL;
+        END $$
+    """)
+    cursor.execute(
+        f'CREATE TRIGGER "{keys}_sync" AFTER INSERT OR DELETE OR UPDATE OF "{column}" ON "{table}" '
+        f'FOR EACH ROW EXECUTE FUNCTION "{keys}_sync"()'
+    )
+
+
+def _indexes(cursor, table, key):
+    """(definition, unique, includes the partition key) of every non-primary index on ``table``."""
+    cursor.execute(
+        "SELECT pg_get_indexdef(x.indexrelid), x.indisunique, "
+        "EXISTS (SELECT 1 FROM pg_attribute a WHERE a.attrelid = x.indrelid "
+        "AND a.attnum = ANY(x.indkey) AND a.attname = %s) "
+        "FROM pg_index x WHERE x.indrelid = %s::regclass AND NOT x.indisprimary",
+        [key, table],
+    )
+    return cursor.fetchall()
+
+
+def convert(model):
+    """Turn ``model``'s table into a monthly range-partitioned table, keeping its rows and names."""
+    table = model._meta.db_table
+    legacy = f"{table}_unpartitioned"
+    key = _partition_key(model)
+    pk = model._meta.pk.column
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'LOCK TABLE "{table}" IN ACCESS EXCLUSIVE MODE')
+
+        cursor.execute(
+            "SELECT conrelid::regclass::text, conname FROM pg_constraint "
+            "WHERE contype = 'f' AND confrelid = %s::regclass",
+            [table],
+        )
+        for referencing, name in cursor.fetchall():
+            logger.warning("dropping foreign key %s on %s: %s is being partitioned", name, referencing, table)
+            cursor.execute(f'ALTER TABLE {referencing} DROP CONSTRAINT "{name}"')
+
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE contype = 'f' AND conrelid = %s::regclass",
+            [table],
+        )
+        foreign_keys = cursor.fetchall()
+        cursor.execute("SELECT conname FROM pg_constraint WHERE contype = 'p' AND conrelid = %s::regclass", [table])
+        primary_key = cursor.fetchone()[0]
+        cursor.execute("SELECT pg_get_serial_sequence(%s, %s)", [table, pk])
+        original_sequence = cursor.fetchone()[0]
+        if original_sequence:
+            original_sequence = original_sequence.split(".")[-1].strip('"')
+        indexes = _indexes(cursor, table, key)
+
+        cursor.execute(f'SELECT min("{key}"), max("{pk}") FROM "{table}"')
+        oldest, max_id = cursor.fetchone()
+
+        cursor.execute(f'ALTER TABLE "{table}" RENAME TO "{legacy}"')
+        cursor.execute(
+            f'CREATE TABLE "{table}" (LIKE "{legacy}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+            f'PARTITION BY RANGE ("{key}")'
+        )
+
+        # The old id sequence belongs to the old table; give the new one its own.
+        sequence = f"{table}_{pk}_partitioned_seq"
+        cursor.execute(f'ALTER TABLE "{table}" ALTER COLUMN "{pk}" DROP DEFAULT')
+        cursor.execute(f'CREATE SEQUENCE "{sequence}" START WITH {(max_id or 0) + 1} OWNED BY "{table}"."{pk}"')
+        cursor.execute(f'ALTER TABLE "{table}" ALTER COLUMN "{pk}" SET DEFAULT nextval(\'"{sequence}"\')')
+
+        now = timezone.now()
+        for month in _months(oldest or now, add_months(month_start(now), MONTHS_AHEAD)):
+            _create_partition(cursor, model, month)
+        cursor.execute(f'CREATE TABLE "{table}_default" PARTITION OF "{table}" DEFAULT')
+        for column in _unique_columns(model):
+            _enforce_unique(cursor, table, column)
+
+        cursor.execute(f'INSERT INTO "{table}" SELECT * FROM "{legacy}"')
+        # Dropping the old table frees its index, constraint and sequence names.
+        cursor.execute(f'DROP TABLE "{legacy}"')
+
+        if original_sequence:
+            cursor.execute(f'ALTER SEQUENCE "{sequence}" RENAME TO "{original_sequence}"')
+        cursor.execute(f'ALTER TABLE "{table}" ADD CONSTRAINT "{primary_key}" PRIMARY KEY ("{pk}", "{key}")')
+        for name, definition in foreign_keys:
+            cursor.execute(f'ALTER TABLE "{table}" ADD CONSTRAINT "{name}" {definition}')
+        for definition, unique, has_key in indexes:
+            if unique and not has_key:
+                # Enforced by the side table instead.
+                definition = re.sub(r"^CREATE UNIQUE INDEX", "CREATE INDEX", definition)
+            cursor.execute(definition)
+        for field in model._meta.concrete_fields:
+            if field.is_relation:
+                cursor.execute(
+                    f'CREATE INDEX IF NOT EXISTS "{table}_{field.column}_{key}_idx" '
+                    f'ON "{table}" ("{field.column}", "{key}")'
+                )
+
+
+def ensure_partitions(months_ahead=MONTHS_AHEAD):
+    """
+    Create this month's partition and the next ``months_ahead`` for every
+    partitioned table. Safe to run any number of times; runs after migrate
+    and from end_of_day.run().
+    """
+    this_month = month_start(timezone.now())
+    with connection.cursor() as cursor:
+        for model in PARTITIONED:
+            if not is_partitioned(model):
+                continue
+            for month in _months(this_month, add_months(this_month, months_ahead)):
+                _create_partition(cursor, model, month)
+
+
+def partition_tables():
+    if connection.vendor != "postgresql":
+        return
+    for model in PARTITIONED:
+        if not is_partitioned(model):
+            convert(model)
+    ensure_partitions()
+
+
+@receiver(post_migrate)
+def prepare_partitions(sender, using="default", **kwargs):
+    if sender.label == ArchivedPartition._meta.app_label:
+        partition_tables()
+
+
+# =========================================================
+# ARCHIVE
+# =========================================================
+
+def _arrow_schema(model):
+    import pyarrow as pa
+
+    columns = []
+    for field in model._meta.concrete_fields:
+        kind = field.get_internal_type()
+        if kind == "DecimalField":
+            arrow_type = pa.decimal128(field.max_digits, field.decimal_places)
+        elif kind == "DateTimeField":
+            arrow_type = pa.timestamp("us", tz="UTC")
+        elif kind == "DateField":
+            arrow_type = pa.date32()
+        elif kind == "BooleanField":
+            arrow_type = pa.bool_()
+        elif field.is_relation or kind.endswith(("AutoField", "IntegerField")):
+            arrow_type = pa.int64()
+        else:
+            arrow_type = pa.string()
+        columns.append(pa.field(field.attname, arrow_type, nullable=field.null or field.is_relation))
+    return pa.schema(columns)
+
+
+def archive_path(model, month):
+    return os.path.join(ARCHIVE_ROOT, model._meta.db_table, f"{month:%Y-%m}.parquet")
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for block in iter(lambda: handle.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def archive_month(model, month):
+    """Write ``month`` of ``model`` to Parquet, then drop it from the database."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    month = month_start(month)
+    start, end = month_bounds(month)
+    key = PARTITIONED[model]
+    schema = _arrow_schema(model)
+    path = archive_path(model, month)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    rows = (
+        model.objects
+        .filter(**{f"{key}__gte": start, f"{key}__lt": end})
+        .order_by(key, "pk")
+        .values_list(*schema.names)
+        .iterator(chunk_size=ARCHIVE_BATCH_SIZE)
+    )
+    written = 0
+    partial = path + ".partial"
+    with pq.ParquetWriter(partial, schema, compression="zstd") as writer:
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == ARCHIVE_BATCH_SIZE:
+                writer.write_table(pa.Table.from_pylist([dict(zip(schema.names, r)) for r in batch], schema))
+                written += len(batch)
+                batch = []
+        if batch:
+            writer.write_table(pa.Table.from_pylist([dict(zip(schema.names, r)) for r in batch], schema))
+            written += len(batch)
+    os.replace(partial, path)
+
+    table = model._meta.db_table
+    with transaction.atomic():
+        archive = ArchivedPartition.objects.create(
+            table_name=table, month=month, path=path, row_count=written, sha256=_sha256(path),
+        )
+        with connection.cursor() as cursor:
+            name = partition_name(model, month)
+            if is_partitioned(model):
+                cursor.execute("SELECT to_regclass(%s)", [name])
+                partition_exists = cursor.fetchone()[0] is not None
+            else:
+                partition_exists = False
+            if partition_exists:
+                cursor.execute(f'ALTER TABLE "{table}" DETACH PARTITION "{name}"')
+                cursor.execute(f'DROP TABLE "{name}"')
+            else:
+                # SQLite, or rows that landed in the DEFAULT partition.
+                column = model._meta.get_field(key).column
+                cursor.execute(
+                    f'DELETE FROM "{table}" WHERE "{column}" >= %s AND "{column}" < %s', [start, end]
+                )
+    return archive
+
+
+def archive_old(hot_months=HOT_MONTHS):
+    """Archive every month older than the last ``hot_months`` months."""
+    cutoff = add_months(month_start(timezone.now()), -hot_months)
+    archived = []
+    for model, key in PARTITIONED.items():
+        oldest = model.objects.order_by(key).values_list(key, flat=True).first()
+        if oldest is None:
+            continue
+        done = set(
+            ArchivedPartition.objects.filter(table_name=model._meta.db_table).values_list("month", flat=True)
+        )
+        for month in _months(oldest, add_months(cutoff, -1)):
+            if month not in done:
+                archived.append(archive_month(model, month))
+    return archived
+
+
+# =========================================================
+# READING ACROSS TIERS
+# =========================================================
+
+def _read_archive(model, archive, start, end, filters):
+    import pyarrow.dataset as ds
+
+    key = PARTITIONED[model]
+    expression = (ds.field(key) >= start) & (ds.field(key) < end)
+    for name, value in filters.items():
+        expression &= ds.field(name) == value
+    table = ds.dataset(archive.path, format="parquet").to_table(filter=expression)
+    for row in table.sort_by([(key, "ascending"), ("id", "ascending")]).to_pylist():
+        row[key] = timezone.localtime(row[key])
+        yield row
+
+
+def history(model, start, end, **filters):
+    """
+    Rows of ``model`` with timestamp in [start, end), oldest first, as dicts
+    keyed by column attname. Archived months come from their Parquet files,
+    the rest from the database. ``filters`` are equality tests on attnames
+    (account_id=..., branch_id=...).
+    """
+    attnames = {field.attname for field in model._meta.concrete_fields}
+    unknown = set(filters) - attnames
+    if unknown:
+        raise ValueError(f"history() filters on columns only, not {sorted(unknown)}")
+
+    key = PARTITIONED[model]
+    archives = ArchivedPartition.objects.filter(
+        table_name=model._meta.db_table, month__gte=month_start(start), month__lte=month_start(end),
+    ).order_by("month")
+    for archive in archives:
+        yield from _read_archive(model, archive, start, end, filters)
+
+    yield from (
+        model.objects
+        .filter(**{f"{key}__gte": start, f"{key}__lt": end}, **filters)
+        .order_by(key, "pk")
+        .values(*attnames)
+        .iterator(chunk_size=ARCHIVE_BATCH_SIZE)
+    )
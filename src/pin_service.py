@@ -0,0 +1,250 @@
+"""
+PIN verification for CardPIN.
+
+PIN hashes are deliberately slow, so they run in a bounded process pool and
+never on the web worker's thread. At most MAX_IN_FLIGHT verifications may be
+queued or running; past that verify() raises PinServiceBusy straight away
+instead of letting requests pile up behind the pool. A slot is held until
+its hash has actually finished, so a verification that times out still
+counts against the limit while the pool works on it.
+
+Attempt counters live in the shared cache, so every web worker counts
+against the same number. A wrong PIN is one atomic cache.incr() instead of
+a row write; the count is seeded from CardPIN.failed_attempts the first time
+and written back to it in batches by each process's flusher (write-behind).
+The attempt that reaches MAX_FAILED_ATTEMPTS is the exception: it writes
+is_blocked through to CardPIN before its result is returned. If the cache
+loses a counter, counting resumes from the last flushed value, so at most
+FLUSH_INTERVAL seconds of failures are forgotten.
+
+A correct PIN only counts if the card is still unblocked once its hash has
+finished: the counter must be below the limit, and CardPIN must still match
+is_blocked=False. Wrong guesses racing a correct one therefore cannot get
+past MAX_FAILED_ATTEMPTS. Only set_pin() (or an administrator) ever clears
+is_blocked.
+
+Hashing uses Django's password hashers. When the configured work factor
+changes, a correct PIN is re-hashed inside the pool worker and the new hash
+is stored, unless the PIN was changed in the meantime.
+"""
+
+import atexit
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, identify_hasher, make_password
+from django.core.cache import cache
+from django.db import connections
+
+from .models import CardPIN
+
+
+MAX_FAILED_ATTEMPTS = 3
+WORKERS = getattr(settings, "PIN_WORKERS", 2)
+MAX_IN_FLIGHT = getattr(settings, "PIN_MAX_IN_FLIGHT", WORKERS * 8)
+ACQUIRE_TIMEOUT = 0.05
+VERIFY_TIMEOUT = 5
+FLUSH_INTERVAL = 2.0
+
+
+class PinServiceBusy(Exception):
+    pass
+
+
+@dataclass
+class VerifyResult:
+    ok: bool
+    blocked: bool
+    attempts_left: int
+
+
+# =========================================================
+# POOL WORKER
+# =========================================================
+
+def _check(pin, encoded):
+    """Runs in the pool: (matches, new hash if the hasher wants an upgrade)."""
+    if not check_password(pin, encoded):
+        return False, None
+    if identify_hasher(encoded).must_update(encoded):
+        return True, make_password(pin)
+    return True, None
+
+
+_inherited_connections = []
+
+
+def _init_worker():
+    # The worker is forked from a web process with open database sockets.
+    # Closing them here would end the parent's sessions, so keep the
+    # inherited objects alive and unused instead.
+    for conn in connections.all(initialized_only=True):
+        if conn.connection is not None:
+            _inherited_connections.append(conn.connection)
+            conn.connection = None
+
+
+# =========================================================
+# ATTEMPT COUNTERS
+# =========================================================
+
+_unflushed = set()
+_unflushed_lock = threading.Lock()
+
+
+def _attempts_key(card_id):
+    return f"pin:attempts:{card_id}"
+
+
+def failed_attempts(card_id, stored):
+    """Current failed attempts: the shared counter, else ``stored`` (CardPIN's)."""
+    attempts = cache.get(_attempts_key(card_id))
+    return stored if attempts is None else attempts
+
+
+def record_failure(card_id, stored):
+    """Count one wrong PIN; returns (failed_attempts, is_blocked) after it."""
+    key = _attempts_key(card_id)
+    cache.add(key, stored, None)
+    try:
+        attempts = cache.incr(key)
+    except ValueError:
+        # Evicted between the two calls.
+        cache.add(key, stored, None)
+        attempts = cache.incr(key)
+
+    if attempts >= MAX_FAILED_ATTEMPTS:
+        CardPIN.objects.filter(card_id=card_id).update(failed_attempts=attempts, is_blocked=True)
+        return attempts, True
+    with _unflushed_lock:
+        _unflushed.add(card_id)
+    return attempts, False
+
+
+def _record_success(card_id, stored, pin_hash, new_hash):
+    """Reset the counter unless the card was blocked meanwhile; False if it was."""
+    attempts = cache.get(_attempts_key(card_id))
+    if attempts is not None and attempts >= MAX_FAILED_ATTEMPTS:
+        return False
+    unblocked = CardPIN.objects.filter(card_id=card_id, is_blocked=False)
+    if stored or attempts:
+        if not unblocked.update(failed_attempts=0):
+            return False
+        cache.delete(_attempts_key(card_id))
+    elif not unblocked.exists():
+        return False
+    if new_hash:
+        CardPIN.objects.filter(card_id=card_id, pin_hash=pin_hash).update(pin_hash=new_hash)
+    return True
+
+
+def flush():
+    """Write the shared counters of cards failed in this process back to CardPIN."""
+    with _unflushed_lock:
+        card_ids = list(_unflushed)
+        _unflushed.clear()
+    if not card_ids:
+        return 0
+    written = 0
+    try:
+        counts = cache.get_many([_attempts_key(card_id) for card_id in card_ids])
+        for card_id in card_ids:
+            attempts = counts.get(_attempts_key(card_id))
+            if attempts is not None:
+                written += CardPIN.objects.filter(card_id=card_id, is_blocked=False).update(failed_attempts=attempts)
+    except Exception:
+        # Retried on the next flush.
+        with _unflushed_lock:
+            _unflushed.update(card_ids)
+        raise
+    return written
+
+
+# =========================================================
+# SERVICE
+# =========================================================
+
+class PinService:
+
+    def __init__(self, workers=WORKERS, max_in_flight=MAX_IN_FLIGHT, flush_interval=FLUSH_INTERVAL):
+        self._pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker)
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._stop = threading.Event()
+        self._flusher = threading.Thread(
+            target=self._flush_loop, args=(flush_interval,), name="pin-flusher", daemon=True,
+        )
+        self._flusher.start()
+
+    def _hash_check(self, pin, pin_hash):
+        if not self._slots.acquire(timeout=ACQUIRE_TIMEOUT):
+            raise PinServiceBusy("PIN verification queue is full")
+        try:
+            future = self._pool.submit(_check, pin, pin_hash)
+        except BaseException:
+            self._slots.release()
+            raise
+        # Released when the hash finishes, not when the caller stops waiting.
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=VERIFY_TIMEOUT)
+        except TimeoutError:
+            future.cancel()
+            raise
+
+    def verify(self, card_id, pin):
+        pin_hash, stored, is_blocked = (
+            CardPIN.objects
+            .values_list("pin_hash", "failed_attempts", "is_blocked")
+            .get(card_id=card_id)
+        )
+        if is_blocked or failed_attempts(card_id, stored) >= MAX_FAILED_ATTEMPTS:
+            return VerifyResult(False, True, 0)
+
+        ok, new_hash = self._hash_check(pin, pin_hash)
+        if ok:
+            if not _record_success(card_id, stored, pin_hash, new_hash):
+                return VerifyResult(False, True, 0)
+            return VerifyResult(True, False, MAX_FAILED_ATTEMPTS)
+
+        attempts, blocked = record_failure(card_id, stored)
+        return VerifyResult(False, blocked, max(0, MAX_FAILED_ATTEMPTS - attempts))
+
+    def set_pin(self, card_id, pin):
+        """Store a new PIN and clear the attempt counter and block."""
+        CardPIN.objects.update_or_create(
+            card_id=card_id,
+            defaults={"pin_hash": make_password(pin), "failed_attempts": 0, "is_blocked": False},
+        )
+        cache.delete(_attempts_key(card_id))
+
+    def _flush_loop(self, interval):
+        while not self._stop.wait(interval):
+            try:
+                flush()
+            except Exception:
+                # Keep the flusher alive; flush() kept the cards for next time.
+                pass
+            finally:
+                connections.close_all()
+
+    def shutdown(self):
+        self._stop.set()
+        flush()
+        self._pool.shutdown(wait=True)
+
+
+_service = None
+
+
+def get_service():
+    global _service
+    if _service is None:
+        _service = PinService()
+        atexit.register(_service.shutdown)
+    return _service
+
+
+def verify_pin(card_id, pin):
+    return get_service().verify(card_id, pin)
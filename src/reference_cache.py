@@ -0,0 +1,315 @@
+"""
+Process-local read-through cache for reference data: Branch, Currency,
+AccountType, AddOn and AccountTypeAddOn.
+
+All five tables are small and rarely change, so each process holds one
+immutable ReferenceData snapshot of all of them. It is built with one query
+per table, at warm() or on first use. Add-on bundles per account type are
+precomputed into it, with mandatory add-ons, recommended add-ons and the
+monthly fee of the mandatory set. Lookups such as branch(), currency() and
+bundle(), and account_opening_context() for the account-opening page,
+then read only memory.
+
+attach() fills forward foreign-key caches from the snapshot. After it,
+``deposit.branch`` or ``account.currency`` costs no query. The snapshot is
+shared by every request in the process, so attach() and the single-object
+lookups (branch(), currency(), ...) hand out copies: a caller that changes
+one cannot change what the next request reads. account_opening_context()
+and bundle() return the snapshot's own objects and are read-only.
+
+references.assign() takes branch codes from here, so posting a transaction
+or opening an account no longer queries Branch for its reference shard.
+
+Saving or deleting any of these models does two things on commit: it bumps a
+generation number in the shared cache, and it publishes the new number on
+the reference-data channel. Every subscribed process then drops its
+snapshot and rebuilds it on next use. The bus is Redis pub/sub when
+REFERENCE_CACHE_REDIS_URL is set, or LocalBus, an in-process stand-in for
+single-worker setups and tests. A process that missed a message still sees
+the new generation within VERSION_CHECK_SECONDS, at the cost of one cache
+read.
+"""
+
+import copy
+import threading
+import time
+from dataclasses import dataclass, field
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+
+from .models import AccountType, AccountTypeAddOn, AddOn, Branch, Currency
+
+
+CHANNEL = "reference-data"
+GENERATION_KEY = "reference:generation"
+VERSION_CHECK_SECONDS = 5
+
+MODELS = (Branch, Currency, AccountType, AddOn, AccountTypeAddOn)
+
+
+@dataclass(frozen=True)
+class AddOnBundle:
+    account_type_id: int
+    mandatory: tuple = ()
+    recommended: tuple = ()
+    monthly_fee: Decimal = Decimal("0.00")
+
+
+@dataclass
+class ReferenceData:
+    generation: int
+    branches: dict = field(default_factory=dict)
+    branches_by_code: dict = field(default_factory=dict)
+    currencies: dict = field(default_factory=dict)
+    currencies_by_code: dict = field(default_factory=dict)
+    account_types: dict = field(default_factory=dict)
+    account_types_by_code: dict = field(default_factory=dict)
+    addons: dict = field(default_factory=dict)
+    bundles: dict = field(default_factory=dict)
+
+
+def build(generation):
+    data = ReferenceData(generation)
+    for branch in Branch.objects.all():
+        data.branches[branch.pk] = branch
+        data.branches_by_code[branch.branch_code] = branch
+    for currency in Currency.objects.all():
+        data.currencies[currency.pk] = currency
+        data.currencies_by_code[currency.code] = currency
+    for account_type in AccountType.objects.all():
+        data.account_types[account_type.pk] = account_type
+        data.account_types_by_code[account_type.code] = account_type
+    data.addons = {addon.pk: addon for addon in AddOn.objects.all()}
+
+    mandatory, recommended = {}, {}
+    links = AccountTypeAddOn.objects.values_list("account_type_id", "addon_id", "is_mandatory", "is_recommended")
+    for account_type_id, addon_id, is_mandatory, is_recommended in links:
+        addon = data.addons.get(addon_id)
+        if addon is None or not addon.is_active:
+            continue
+        if is_mandatory:
+            mandatory.setdefault(account_type_id, []).append(addon)
+        elif is_recommended:
+            recommended.setdefault(account_type_id, []).append(addon)
+
+    for account_type_id in data.account_types:
+        required = tuple(sorted(mandatory.get(account_type_id, ()), key=lambda addon: addon.name))
+        data.bundles[account_type_id] = AddOnBundle(
+            account_type_id=account_type_id,
+            mandatory=required,
+            recommended=tuple(sorted(recommended.get(account_type_id, ()), key=lambda addon: addon.name)),
+            monthly_fee=sum((addon.monthly_fee for addon in required), Decimal("0.00")),
+        )
+    return data
+
+
+# =========================================================
+# PUB/SUB
+# =========================================================
+
+class LocalBus:
+    """In-process stand-in for a pub/sub broker."""
+
+    def __init__(self):
+        self._subscribers = []
+
+    def subscribe(self, callback):
+        self._subscribers.append(callback)
+
+    def publish(self, message):
+        for callback in list(self._subscribers):
+            callback(message)
+
+
+class RedisBus:
+
+    def __init__(self, client, channel=CHANNEL):
+        self.client = client
+        self.channel = channel
+        self._subscribers = []
+        self._listener = None
+
+    def subscribe(self, callback):
+        self._subscribers.append(callback)
+        if self._listener is None:
+            self._listener = threading.Thread(target=self._listen, name="reference-cache-bus", daemon=True)
+            self._listener.start()
+
+    def _listen(self):
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self.channel)
+        for message in pubsub.listen():
+            for callback in list(self._subscribers):
+                callback(int(message["data"]))
+
+    def publish(self, message):
+        self.client.publish(self.channel, message)
+
+
+def _default_bus():
+    url = getattr(settings, "REFERENCE_CACHE_REDIS_URL", None)
+    if url:
+        import redis
+
+        return RedisBus(redis.Redis.from_url(url))
+    return LocalBus()
+
+
+# =========================================================
+# CACHE
+# =========================================================
+
+class ReferenceCache:
+
+    def __init__(self, bus):
+        self.bus = bus
+        self._data = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        bus.subscribe(self._on_message)
+
+    def _on_message(self, generation):
+        data = self._data
+        if data is not None and data.generation != generation:
+            self._data = None
+
+    def current_generation(self):
+        return cache.get_or_set(GENERATION_KEY, 1, None)
+
+    def warm(self):
+        generation = self.current_generation()
+        data = build(generation)
+        with self._lock:
+            self._data = data
+            self._checked_at = time.monotonic()
+        return data
+
+    def get(self):
+        data = self._data
+        if data is not None and time.monotonic() - self._checked_at < VERSION_CHECK_SECONDS:
+            return data
+        if data is not None and data.generation == self.current_generation():
+            self._checked_at = time.monotonic()
+            return data
+        return self.warm()
+
+    def clear(self):
+        """Drop this process's snapshot; the next lookup rebuilds it."""
+        self._data = None
+
+    def invalidate(self):
+        try:
+            generation = cache.incr(GENERATION_KEY)
+        except ValueError:
+            generation = 2
+            cache.set(GENERATION_KEY, generation, None)
+        self._data = None
+        self.bus.publish(generation)
+
+
+reference_cache = ReferenceCache(_default_bus())
+
+
+def _on_change(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    transaction.on_commit(reference_cache.invalidate)
+
+
+for _model in MODELS:
+    post_save.connect(_on_change, sender=_model, dispatch_uid=f"reference-save-{_model.__name__}")
+    post_delete.connect(_on_change, sender=_model, dispatch_uid=f"reference-delete-{_model.__name__}")
+
+
+# =========================================================
+# LOOKUPS
+# =========================================================
+
+def warm():
+    """Load everything now, e.g. when a worker starts."""
+    return reference_cache.warm()
+
+
+def _copy(instance):
+    return None if instance is None else copy.copy(instance)
+
+
+def branch(branch_id):
+    return _copy(reference_cache.get().branches.get(branch_id))
+
+
+def branch_by_code(code):
+    return _copy(reference_cache.get().branches_by_code.get(code))
+
+
+def branch_code(branch_id):
+    """The branch's code, or None for a branch the snapshot does not have yet."""
+    found = reference_cache.get().branches.get(branch_id)
+    return None if found is None else found.branch_code
+
+
+def currency(currency_id):
+    return _copy(reference_cache.get().currencies.get(currency_id))
+
+
+def currency_by_code(code):
+    return _copy(reference_cache.get().currencies_by_code.get(code))
+
+
+def account_type(account_type_id):
+    return _copy(reference_cache.get().account_types.get(account_type_id))
+
+
+def account_type_by_code(code):
+    return _copy(reference_cache.get().account_types_by_code.get(code))
+
+
+def addon(addon_id):
+    return _copy(reference_cache.get().addons.get(addon_id))
+
+
+def bundle(account_type_id):
+    return reference_cache.get().bundles.get(account_type_id) or AddOnBundle(account_type_id)
+
+
+_RELATED = {Branch: "branches", Currency: "currencies", AccountType: "account_types", AddOn: "addons"}
+
+
+def attach(instances, *field_names):
+    """
+    Fill the forward foreign-key caches named in ``field_names`` (e.g.
+    "branch", "currency") from the snapshot, so accessing them runs no query.
+    Each instance gets its own copies; caches already filled are left alone.
+    """
+    data = reference_cache.get()
+    for instance in instances:
+        for name in field_names:
+            fk = instance._meta.get_field(name)
+            if fk.is_cached(instance):
+                continue
+            lookup = getattr(data, _RELATED[fk.related_model])
+            related = lookup.get(getattr(instance, fk.attname))
+            if related is not None:
+                fk.set_cached_value(instance, copy.copy(related))
+    return instances
+
+
+def account_opening_context(branch_id=None):
+    """Everything the account-opening form needs, from memory only."""
+    data = reference_cache.get()
+    account_types = sorted(
+        (account_type for account_type in data.account_types.values() if account_type.is_active),
+        key=lambda account_type: account_type.name,
+    )
+    return {
+        "branch": data.branches.get(branch_id),
+        "currencies": sorted(data.currencies.values(), key=lambda currency: currency.code),
+        "account_types": [
+            {"account_type": account_type, "bundle": data.bundles[account_type.pk]}
+            for account_type in account_types
+        ],
+    }
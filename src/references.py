@@ -0,0 +1,334 @@
+"""
+Reference and number allocation for unique model columns.
+
+Each (series, shard) pair owns a ReferenceBlock row. A worker process takes a
+block of BLOCK_SIZE values from that row in one short transaction and then
+hands them out from memory, so inserts never wait on a shared sequence and
+never collide on the unique columns. Shards are branch codes, so branches
+never contend with each other either.
+
+Blocks are per process: after a fork the child drops whatever the parent had
+reserved and takes its own.
+
+A block reserved inside the caller's transaction is only reserved once that
+transaction commits; if it rolls back, the ReferenceBlock row goes back to
+where it was and another process can take the same range. Until the commit
+such a block is therefore kept for the reserving thread alone, and it is
+dropped as soon as its on_commit callback is gone from the connection (the
+transaction or savepoint rolled back). On commit whatever is left of it
+becomes the process's shared block.
+
+Values are assigned in a pre_save receiver from the row's own branch, not
+as field defaults (a default has no instance to read the branch from).
+bulk_create sends no signals, so bulk paths call assign_all() first. The
+first block of a (series, shard) starts above the highest value already in
+the column, so numbers issued before the allocator existed are never
+handed out again.
+"""
+
+import functools
+import os
+import re
+import threading
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models.signals import pre_save
+
+
+BLOCK_SIZE = getattr(settings, "REFERENCE_BLOCK_SIZE", 1000)
+DEFAULT_SHARD = getattr(settings, "REFERENCE_DEFAULT_SHARD", "HQ")
+CARD_BIN = getattr(settings, "CARD_BIN", "522345")
+
+# series -> (prefix, sequence digits)
+REFERENCE_SERIES = {
+    "DEP": ("DEP", 10),
+    "WDL": ("WDL", 10),
+    "TRF": ("TRF", 10),
+    "FXB": ("FXB", 10),
+    "FXS": ("FXS", 10),
+    "FXT": ("FXT", 10),
+    "FXC": ("FXC", 10),
+}
+
+ACCOUNT_SEQUENCE_DIGITS = 8
+CARD_SEQUENCE_DIGITS = 15 - len(CARD_BIN)
+
+# series -> (model, column)
+SERIES_COLUMNS = {
+    "DEP": ("CashDeposit", "reference"),
+    "WDL": ("CashWithdrawal", "reference"),
+    "TRF": ("FundsTransfer", "reference"),
+    "FXB": ("FXBuy", "transaction_reference"),
+    "FXS": ("FXSell", "transaction_reference"),
+    "FXT": ("FXTransfer", "transaction_reference"),
+    "FXC": ("DenominationExchange", "transaction_reference"),
+    "ACC": ("CustomerAccount", "account_number"),
+    "CARD": ("Card", "card_number"),
+}
+
+
+class ReferenceExhausted(Exception):
+    pass
+
+
+# =========================================================
+# CHECK DIGITS
+# =========================================================
+
+def luhn_check_digit(digits):
+    """Check digit that makes ``digits`` + digit pass the Luhn test."""
+    total = 0
+    for index, char in enumerate(reversed(digits)):
+        value = int(char)
+        if index % 2 == 0:
+            value *= 2
+            if value > 9:
+                value -= 9
+        total += value
+    return str((10 - total % 10) % 10)
+
+
+def is_luhn_valid(number):
+    return number.isdigit() and luhn_check_digit(number[:-1]) == number[-1]
+
+
+def mod97_check_digits(value):
+    """ISO 7064 MOD 97-10 check digits; letters count as 10..35."""
+    numeric = "".join(str(int(char, 36)) for char in value.upper())
+    return f"{98 - (int(numeric) * 100) % 97:02d}"
+
+
+def is_mod97_valid(value):
+    return mod97_check_digits(value[:-2]) == value[-2:]
+
+
+def normalise_shard(shard):
+    shard = re.sub(r"[^A-Z0-9]", "", str(shard or DEFAULT_SHARD).upper())
+    return shard or DEFAULT_SHARD
+
+
+# =========================================================
+# BLOCK ALLOCATOR
+# =========================================================
+
+class ReferenceAllocator:
+
+    def __init__(self, block_size=BLOCK_SIZE):
+        self.block_size = block_size
+        self._blocks = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        # Blocks reserved in a transaction that has not committed yet.
+        self._local = threading.local()
+
+    def _reserve_block(self, series, shard):
+        from .models import ReferenceBlock
+
+        with transaction.atomic():
+            block = ReferenceBlock.objects.select_for_update().filter(series=series, shard=shard).first()
+            if block is None:
+                block, _ = (
+                    ReferenceBlock.objects
+                    .select_for_update()
+                    .get_or_create(series=series, shard=shard, defaults={
+                        "next_value": highest_issued(series, shard) + 1,
+                    })
+                )
+            start = block.next_value
+            block.next_value = start + self.block_size
+            block.save(update_fields=["next_value", "updated_at"])
+
+        return [start, start + self.block_size]
+
+    def _uncommitted(self):
+        """This thread's uncommitted blocks, without those whose transaction rolled back."""
+        pending = getattr(self._local, "blocks", None)
+        if pending is None or getattr(self._local, "pid", None) != os.getpid():
+            pending = self._local.blocks = {}
+            self._local.pid = os.getpid()
+        waiting = {func for _, func, _ in connection.run_on_commit}
+        for key, (block, callback) in list(pending.items()):
+            if callback not in waiting:
+                del pending[key]
+        return pending
+
+    def _committed(self, key, block):
+        self._local.blocks.pop(key, None)
+        with self._lock:
+            current = self._blocks.get(key)
+            if block[0] < block[1] and (current is None or current[0] >= current[1]):
+                self._blocks[key] = block
+
+    def next_value(self, series, shard):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._blocks.clear()
+                self._pid = os.getpid()
+
+            key = (series, shard)
+            block = self._blocks.get(key)
+            if block is None or block[0] >= block[1]:
+                pending = self._uncommitted()
+                block = pending.get(key, (None, None))[0]
+                if block is None or block[0] >= block[1]:
+                    block = self._reserve_block(series, shard)
+                    if connection.in_atomic_block:
+                        callback = functools.partial(self._committed, key, block)
+                        pending[key] = (block, callback)
+                        transaction.on_commit(callback)
+                    else:
+                        self._blocks[key] = block
+
+            value = block[0]
+            block[0] += 1
+            return value
+
+
+allocator = ReferenceAllocator()
+
+
+def _layout(series, shard):
+    """(head, sequence digits, check digits) of the values a series issues."""
+    if series == "ACC":
+        return shard, ACCOUNT_SEQUENCE_DIGITS, 2
+    if series == "CARD":
+        return CARD_BIN, CARD_SEQUENCE_DIGITS, 1
+    prefix, digits = REFERENCE_SERIES[series]
+    return f"{prefix}{shard}", digits, 0
+
+
+def highest_issued(series, shard):
+    """Highest sequence number already stored for (series, shard), or 0."""
+    from . import models
+
+    model_name, column = SERIES_COLUMNS[series]
+    head, digits, check = _layout(series, shard)
+    # Fixed-width digits: the highest string is the highest number.
+    pattern = rf"^{re.escape(head)}[0-9]{{{digits + check}}}$"
+    latest = (
+        getattr(models, model_name).objects
+        .filter(**{f"{column}__regex": pattern})
+        .order_by(f"-{column}")
+        .values_list(column, flat=True)
+        .first()
+    )
+    return int(latest[len(head):len(head) + digits]) if latest else 0
+
+
+def _sequence(series, shard, digits):
+    value = allocator.next_value(series, shard)
+    if value >= 10 ** digits:
+        raise ReferenceExhausted(f"{series}/{shard} has used all {digits}-digit values")
+    return f"{value:0{digits}d}"
+
+
+# =========================================================
+# GENERATORS
+# =========================================================
+
+def generate_reference(series, branch_code=None):
+    prefix, digits = REFERENCE_SERIES[series]
+    shard = normalise_shard(branch_code)
+    return f"{prefix}{shard}{_sequence(series, shard, digits)}"
+
+
+def generate_dep_reference(branch_code=None):
+    return generate_reference("DEP", branch_code)
+
+
+def generate_wdl_reference(branch_code=None):
+    return generate_reference("WDL", branch_code)
+
+
+def generate_trf_reference(branch_code=None):
+    return generate_reference("TRF", branch_code)
+
+
+def generate_fxb_reference(branch_code=None):
+    return generate_reference("FXB", branch_code)
+
+
+def generate_fxs_reference(branch_code=None):
+    return generate_reference("FXS", branch_code)
+
+
+def generate_fxt_reference(branch_code=None):
+    return generate_reference("FXT", branch_code)
+
+
+def generate_fxc_reference(branch_code=None):
+    return generate_reference("FXC", branch_code)
+
+
+def generate_account_number(branch_code=None):
+    """Branch code, sequence and two MOD 97-10 check digits (max 20 chars)."""
+    shard = normalise_shard(branch_code)
+    body = f"{shard}{_sequence('ACC', shard, ACCOUNT_SEQUENCE_DIGITS)}"
+    return f"{body}{mod97_check_digits(body)}"
+
+
+def generate_card_number():
+    """16-digit, Luhn-valid PAN under the bank's BIN."""
+    body = f"{CARD_BIN}{_sequence('CARD', 'ALL', CARD_SEQUENCE_DIGITS)}"
+    return f"{body}{luhn_check_digit(body)}"
+
+
+# =========================================================
+# ASSIGNMENT
+# =========================================================
+
+# model -> (column, generator taking a branch code)
+GENERATORS = {
+    "CashDeposit": ("reference", generate_dep_reference),
+    "CashWithdrawal": ("reference", generate_wdl_reference),
+    "FundsTransfer": ("reference", generate_trf_reference),
+    "FXBuy": ("transaction_reference", generate_fxb_reference),
+    "FXSell": ("transaction_reference", generate_fxs_reference),
+    "FXTransfer": ("transaction_reference", generate_fxt_reference),
+    "DenominationExchange": ("transaction_reference", generate_fxc_reference),
+    "CustomerAccount": ("account_number", generate_account_number),
+}
+
+
+def assign(instance, branch_code=None):
+    """Fill the instance's empty reference column from its branch's shard."""
+    spec = GENERATORS.get(type(instance).__name__)
+    if spec is None:
+        return
+    column, generate = spec
+    if not getattr(instance, column):
+        if branch_code is None:
+            branch_code = _branch_codes({instance.branch_id})[instance.branch_id]
+        setattr(instance, column, generate(branch_code))
+
+
+def _branch_codes(branch_ids):
+    """Branch codes from the reference cache; only branches it lacks are queried."""
+    from . import reference_cache
+    from .models import Branch
+
+    codes = {branch_id: reference_cache.branch_code(branch_id) for branch_id in branch_ids}
+    missing = [branch_id for branch_id, code in codes.items() if code is None]
+    if missing:
+        codes.update(Branch.objects.filter(pk__in=missing).values_list("pk", "branch_code"))
+    return codes
+
+
+def assign_all(instances):
+    """assign() for rows about to be bulk created, with at most one branch lookup."""
+    instances = list(instances)
+    if not instances or type(instances[0]).__name__ not in GENERATORS:
+        return instances
+    codes = _branch_codes({instance.branch_id for instance in instances})
+    for instance in instances:
+        assign(instance, codes[instance.branch_id])
+    return instances
+
+
+def assign_on_save(sender, instance, raw=False, **kwargs):
+    if not raw and sender.__name__ in GENERATORS:
+        assign(instance)
+
+
+pre_save.connect(assign_on_save, dispatch_uid="references-assign")
@@ -0,0 +1,200 @@
+"""
+Per-branch service catalog cache (APIServiceGroup -> APIServiceType).
+
+The teller UI loads the catalog (view_api_service_groups1 and
+view_api_service_types_by_group/<key>) on almost every screen. Each branch's
+catalog is built once, with two queries, into a precomputed tree plus flat
+dictionaries for fee and SLA lookups. The tree is kept in process memory.
+A branch's catalog holds its own service types, under their groups even when
+a group belongs to another branch, and its own groups.
+
+Every branch has a version number in the shared cache. Saving or deleting
+an APIServiceGroup / APIServiceType bumps only the version of the branches
+whose catalog shows it, and drops this process's copy. Other workers compare
+their copy's version with the shared one at most every VERSION_CHECK_SECONDS,
+so fee and SLA lookups in between are plain dictionary reads. Responses
+carry an ETag made from branch and version, so unchanged catalogs are
+answered with 304 Not Modified.
+"""
+
+import threading
+import time
+from dataclasses import dataclass, field
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+from django.http import HttpResponseNotModified, JsonResponse
+
+from .models import APIServiceGroup, APIServiceType
+
+
+VERSION_CHECK_SECONDS = 5
+
+@dataclass
+class Catalog:
+    branch_id: int
+    version: int
+    groups: list = field(default_factory=list)
+    services_by_group: dict = field(default_factory=dict)
+    fees: dict = field(default_factory=dict)
+    sla_days: dict = field(default_factory=dict)
+    requires_approval: dict = field(default_factory=dict)
+    sla_days_by_code: dict = field(default_factory=dict)
+    checked_at: float = 0.0
+
+    @property
+    def etag(self):
+        return f'"catalog-{self.branch_id}-{self.version}"'
+
+
+_catalogs = {}
+_lock = threading.Lock()
+
+
+def _version_key(branch_id):
+    return f"catalog:version:{branch_id}"
+
+
+def current_version(branch_id):
+    # Seeded from the clock, so a version lost with a cache restart never
+    # comes back and matches a catalog a worker still holds.
+    return cache.get_or_set(_version_key(branch_id), time.time_ns, None)
+
+
+def build(branch_id, version):
+    groups = list(
+        APIServiceGroup.objects
+        .filter(
+            Q(branch_id=branch_id) | Q(service_types__branch_id=branch_id, service_types__is_active=True),
+            is_active=True,
+        )
+        .distinct()
+        .order_by("name")
+        .values("id", "code", "name", "description")
+    )
+    services = (
+        APIServiceType.objects
+        .filter(branch_id=branch_id, is_active=True, service_group__is_active=True)
+        .order_by("name")
+        .values(
+            "id", "code", "name", "description", "service_fee",
+            "sla_days", "requires_approval", "service_group_id",
+        )
+    )
+
+    catalog = Catalog(branch_id, version, checked_at=time.monotonic())
+    code_by_group_id = {group["id"]: group["code"] for group in groups}
+    for group in groups:
+        catalog.services_by_group[group["code"]] = []
+        catalog.groups.append({
+            "key": group["code"],
+            "label": group["name"],
+            "description": group["description"] or "",
+        })
+
+    for service in services:
+        group_code = code_by_group_id.get(service["service_group_id"])
+        if group_code is None:
+            continue
+        key = (group_code, service["code"])
+        catalog.fees[key] = service["service_fee"]
+        catalog.sla_days[key] = service["sla_days"]
+        catalog.sla_days_by_code.setdefault(service["code"], service["sla_days"])
+        catalog.requires_approval[key] = service["requires_approval"]
+        catalog.services_by_group[group_code].append({
+            "id": service["id"],
+            "code": service["code"],
+            "name": service["name"],
+            "description": service["description"] or "",
+            "service_fee": str(service["service_fee"]),
+            "sla_days": service["sla_days"],
+            "requires_approval": service["requires_approval"],
+        })
+    return catalog
+
+
+def get_catalog(branch_id):
+    """The branch's catalog, rebuilt only when its version has moved on."""
+    catalog = _catalogs.get(branch_id)
+    if catalog is not None and time.monotonic() - catalog.checked_at < VERSION_CHECK_SECONDS:
+        return catalog
+    version = current_version(branch_id)
+    if catalog is not None and catalog.version == version:
+        catalog.checked_at = time.monotonic()
+        return catalog
+    catalog = build(branch_id, version)
+    with _lock:
+        _catalogs[branch_id] = catalog
+    return catalog
+
+
+def clear():
+    """Drop every catalog this process holds; the next lookup rebuilds it."""
+    with _lock:
+        _catalogs.clear()
+
+
+def service_fee(branch_id, group_code, service_code):
+    return get_catalog(branch_id).fees.get((group_code, service_code))
+
+
+def service_sla_days(branch_id, group_code, service_code):
+    return get_catalog(branch_id).sla_days.get((group_code, service_code))
+
+
+# =========================================================
+# INVALIDATION
+# =========================================================
+
+def invalidate(branch_id):
+    key = _version_key(branch_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), None)
+    with _lock:
+        _catalogs.pop(branch_id, None)
+
+
+def _on_change(sender, instance, **kwargs):
+    if kwargs.get("raw"):
+        return
+    branch_ids = {instance.branch_id}
+    if sender is APIServiceGroup:
+        # Branches with types under this group show it in their catalog
+        # too, whichever branch owns it (see build()).
+        branch_ids.update(instance.service_types.values_list("branch_id", flat=True).distinct())
+
+    for branch_id in branch_ids - {None}:
+        transaction.on_commit(lambda branch_id=branch_id: invalidate(branch_id))
+
+
+for _model in (APIServiceGroup, APIServiceType):
+    post_save.connect(_on_change, sender=_model, dispatch_uid=f"catalog-save-{_model.__name__}")
+    post_delete.connect(_on_change, sender=_model, dispatch_uid=f"catalog-delete-{_model.__name__}")
+
+
+# =========================================================
+# HTTP
+# =========================================================
+
+def _respond(request, catalog, payload):
+    if request.headers.get("If-None-Match") == catalog.etag:
+        response = HttpResponseNotModified()
+    else:
+        response = JsonResponse(payload, safe=False)
+    response["ETag"] = catalog.etag
+    response["Cache-Control"] = "private, no-cache"
+    return response
+
+
+def groups_response(request, branch_id):
+    catalog = get_catalog(branch_id)
+    return _respond(request, catalog, catalog.groups)
+
+
+def services_response(request, branch_id, group_code):
+    catalog = get_catalog(branch_id)
+    return _respond(request, catalog, catalog.services_by_group.get(group_code, []))
@@ -0,0 +1,296 @@
+"""
+SLA tracking for service requests, driven by APIServiceType.sla_days.
+
+When a tracked request is created it gets an SLARecord with a due_at time.
+due_at is sla_days business days after creation on the branch's calendar:
+weekends (per BUSINESS_WEEKDAYS), public holidays and branch-specific
+BranchHoliday rows don't count. Open records are indexed on due_at, so both
+"what breaches in the next hour" (due_soon) and "what has breached"
+(scan_breaches) are range scans over open rows only.
+
+Requests that were already open when tracking started get their records
+from backfill_records(), which also runs after every migrate.
+
+When a request leaves its open statuses, its record is closed and the day's
+SLADailyStat counter for met or missed is bumped. Compliance percentages
+(including the Analyser's sla-compliance metric) are read from those
+counters, never by rescanning history.
+"""
+
+import threading
+import time as clock
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q, Sum
+from django.db.models.signals import post_migrate, post_save
+from django.dispatch import Signal, receiver
+from django.utils import timezone
+
+from . import metrics_engine, service_catalog
+from .dashboard_rollups import TRACKED_MODELS
+from .models import (
+    AccountModificationRequest,
+    BranchHoliday,
+    DenominationExchange,
+    FXBuy,
+    FXSell,
+    FXTransfer,
+    KYCUpdateRequest,
+    SLADailyStat,
+    SLARecord,
+    StatementRequest,
+)
+
+
+DEFAULT_SLA_DAYS = 1
+BACKFILL_BATCH_SIZE = 1000
+BUSINESS_WEEKDAYS = set(getattr(settings, "SLA_BUSINESS_WEEKDAYS", (0, 1, 2, 3, 4)))
+HOLIDAY_CACHE_SECONDS = 10 * 60
+BREACH_BATCH_SIZE = 500
+
+# model -> statuses during which the SLA clock is running
+OPEN_STATUSES = {
+    KYCUpdateRequest: ("PENDING",),
+    AccountModificationRequest: ("PENDING",),
+    StatementRequest: ("PENDING", "RUNNING"),
+    FXBuy: ("PENDING",),
+    FXSell: ("PENDING",),
+    FXTransfer: ("PENDING", "VALIDATION"),
+    DenominationExchange: ("PENDING", "VALIDATION"),
+}
+
+# TRACKED_MODELS service key -> APIServiceType.code holding its sla_days
+SERVICE_CODES = getattr(settings, "SLA_SERVICE_CODES", {
+    "kyc-update": "KYC_UPDATE",
+    "account-modification": "ACCOUNT_MODIFICATION",
+    "statement": "STATEMENT_REQUEST",
+    "fx-buy": "FX_BUY",
+    "fx-sell": "FX_SELL",
+    "fx-transfer": "FX_TRANSFER",
+    "denomination-exchange": "DENOMINATION_EXCHANGE",
+})
+
+# Sent once per record when it passes due_at while still open.
+sla_breached = Signal()
+
+
+# =========================================================
+# BUSINESS CALENDAR
+# =========================================================
+
+_holidays = {}
+_holidays_lock = threading.Lock()
+
+
+def holidays(branch_id):
+    """Public plus branch holidays, cached in-process for a few minutes."""
+    cached = _holidays.get(branch_id)
+    if cached and clock.monotonic() - cached[0] < HOLIDAY_CACHE_SECONDS:
+        return cached[1]
+    dates = frozenset(
+        BranchHoliday.objects
+        .filter(Q(branch__isnull=True) | Q(branch_id=branch_id))
+        .values_list("date", flat=True)
+    )
+    with _holidays_lock:
+        _holidays[branch_id] = (clock.monotonic(), dates)
+    return dates
+
+
+def is_business_day(branch_id, day):
+    return day.weekday() in BUSINESS_WEEKDAYS and day not in holidays(branch_id)
+
+
+def add_business_days(branch_id, start, days):
+    """``start`` moved forward by ``days`` business days, same time of day."""
+    due = start
+    remaining = days
+    while remaining > 0:
+        due += timedelta(days=1)
+        if is_business_day(branch_id, timezone.localtime(due).date()):
+            remaining -= 1
+    return due
+
+
+def sla_days_for(branch_id, service):
+    code = SERVICE_CODES.get(service, service)
+    return service_catalog.get_catalog(branch_id).sla_days_by_code.get(code, DEFAULT_SLA_DAYS)
+
+
+def _record(sender, instance, service):
+    return SLARecord(
+        branch_id=instance.branch_id,
+        source_model=sender.__name__,
+        source_id=instance.pk,
+        service=service,
+        started_at=instance.created_at,
+        due_at=add_business_days(instance.branch_id, instance.created_at, sla_days_for(instance.branch_id, service)),
+    )
+
+
+# =========================================================
+# STAMPING AND CLOSING
+# =========================================================
+
+def _bump_stat(branch_id, day, service, met):
+    column = "met" if met else "missed"
+    stats = SLADailyStat.objects.filter(branch_id=branch_id, day=day, service=service)
+    if stats.update(**{column: F(column) + 1}):
+        return
+    try:
+        with transaction.atomic():
+            SLADailyStat.objects.create(branch_id=branch_id, day=day, service=service, **{column: 1})
+    except IntegrityError:
+        stats.update(**{column: F(column) + 1})
+
+
+def track(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    service = TRACKED_MODELS[sender][0]
+    source = dict(source_model=sender.__name__, source_id=instance.pk)
+
+    if created:
+        record = _record(sender, instance, service)
+        SLARecord.objects.get_or_create(
+            defaults=dict(
+                branch_id=record.branch_id,
+                service=service,
+                started_at=record.started_at,
+                due_at=record.due_at,
+            ),
+            **source,
+        )
+
+    if instance.status in OPEN_STATUSES[sender]:
+        return
+
+    record = SLARecord.objects.filter(completed_at__isnull=True, **source).first()
+    if record is None:
+        return
+    now = timezone.now()
+    met = now <= record.due_at
+    closed = SLARecord.objects.filter(pk=record.pk, completed_at__isnull=True).update(
+        completed_at=now, breached=not met
+    )
+    if closed:
+        day = timezone.localdate(now)
+        transaction.on_commit(lambda: _bump_stat(record.branch_id, day, service, met))
+
+
+for _model in OPEN_STATUSES:
+    post_save.connect(track, sender=_model, dispatch_uid=f"sla-{_model.__name__}")
+
+
+def backfill_records(batch_size=BACKFILL_BATCH_SIZE):
+    """Create records for open requests written before tracking started; returns how many."""
+    created = 0
+    for model, statuses in OPEN_STATUSES.items():
+        service = TRACKED_MODELS[model][0]
+        tracked = SLARecord.objects.filter(source_model=model.__name__).values_list("source_id", flat=True)
+        last_id = 0
+        while True:
+            rows = list(
+                model.objects
+                .filter(status__in=statuses, pk__gt=last_id)
+                .exclude(pk__in=tracked)
+                .order_by("pk")[:batch_size]
+            )
+            if not rows:
+                break
+            records = [_record(model, row, service) for row in rows]
+            SLARecord.objects.bulk_create(records, ignore_conflicts=True)
+            created += len(records)
+            last_id = rows[-1].pk
+    return created
+
+
+@receiver(post_migrate)
+def backfill_on_migrate(sender, **kwargs):
+    if sender.label == SLARecord._meta.app_label:
+        backfill_records()
+
+
+# =========================================================
+# BREACH DETECTION
+# =========================================================
+
+def _open(branch=None):
+    records = SLARecord.objects.filter(completed_at__isnull=True)
+    return records if branch is None else records.filter(branch=branch)
+
+
+def due_soon(within=timedelta(hours=1), branch=None):
+    """Open records that breach within ``within`` from now."""
+    now = timezone.now()
+    return _open(branch).filter(due_at__gt=now, due_at__lte=now + within).order_by("due_at")
+
+
+def scan_breaches(now=None):
+    """Flag open records past due and send sla_breached once for each."""
+    now = now or timezone.now()
+    flagged = 0
+    while True:
+        with transaction.atomic():
+            batch = list(
+                _open()
+                .filter(due_at__lte=now, breach_notified=False)
+                .select_for_update(skip_locked=True)
+                .order_by("due_at")[:BREACH_BATCH_SIZE]
+            )
+            if not batch:
+                return flagged
+            SLARecord.objects.filter(pk__in=[r.pk for r in batch]).update(breached=True, breach_notified=True)
+        for record in batch:
+            sla_breached.send(sender=SLARecord, record=record)
+        flagged += len(batch)
+
+
+# =========================================================
+# COMPLIANCE
+# =========================================================
+
+def compliance(branch=None, date_from=None, date_to=None, service=None):
+    """Percentage of closed requests that met their SLA, or None if none closed."""
+    stats = SLADailyStat.objects.all()
+    if branch is not None:
+        stats = stats.filter(branch=branch)
+    if date_from:
+        stats = stats.filter(day__gte=date_from)
+    if date_to:
+        stats = stats.filter(day__lte=date_to)
+    if service:
+        stats = stats.filter(service=service)
+    totals = stats.aggregate(met=Sum("met"), missed=Sum("missed"))
+    closed = (totals["met"] or 0) + (totals["missed"] or 0)
+    return round(totals["met"] * 100.0 / closed, 2) if closed else None
+
+
+_CATEGORY_SERVICES = {}
+for _model in OPEN_STATUSES:
+    _CATEGORY_SERVICES.setdefault(metrics_engine.SOURCES[_model][0], []).append(TRACKED_MODELS[_model][0])
+
+
+@metrics_engine.metric("sla-compliance")
+def sla_compliance_series(frame):
+    if frame.bucket != "day":
+        raise metrics_engine.UnsupportedMetric("sla-compliance is only kept per day")
+
+    start_day = timezone.localtime(frame.start).date()
+    stats = SLADailyStat.objects.filter(day__gte=start_day, day__lt=start_day + timedelta(days=frame.size))
+    if frame.branch_id is not None:
+        stats = stats.filter(branch_id=frame.branch_id)
+    if frame.category != metrics_engine.ALL:
+        stats = stats.filter(service__in=_CATEGORY_SERVICES.get(frame.category, []))
+
+    rows = list(stats.values("day").annotate(met=Sum("met"), missed=Sum("missed")).values_list("day", "met", "missed"))
+    met = np.zeros(frame.size)
+    closed = np.zeros(frame.size)
+    for day, day_met, day_missed in rows:
+        met[(day - start_day).days] += day_met
+        closed[(day - start_day).days] += day_met + day_missed
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(closed > 0, met * 100.0 / closed, 0.0)
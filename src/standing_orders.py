@@ -0,0 +1,319 @@
+"""
+Standing order scheduler.
+
+Each active StandingOrder carries its next_run_date, so finding due orders is
+a range scan on standing_order_due_idx. Workers claim due orders in batches
+with SELECT ... FOR UPDATE SKIP LOCKED, so any number of processes can run
+side by side without handing the same order to two of them.
+
+Every run date gets a StandingOrderExecution row whose idempotency key
+(order id + run date) is unique. The execution row, the FundsTransfer (and
+the ledger postings it triggers) and the advanced next_run_date all commit
+in one transaction. A worker that crashes mid-batch therefore leaves nothing
+behind, and re-running a date can never debit twice.
+
+Each order in a batch runs in its own savepoint. If one raises, its work
+is rolled back and its due dates are recorded as FAILED executions carrying
+the error; the rest of the batch still commits.
+
+With catch_up=True (the default) an order that missed several dates, for
+example after an outage, is executed once for every missed date. With
+catch_up=False the missed dates are recorded as SKIPPED and only the latest
+one is paid.
+
+Orders saved before the scheduler existed have no next_run_date.
+backfill_schedules() (run after migrate) schedules them from their next
+occurrence on or after today, since their earlier dates were paid by the
+old process.
+"""
+
+import calendar
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import timedelta
+
+from django.db import connections, transaction
+from django.db.models.signals import post_migrate, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import ledger
+from .models import CustomerAccount, FundsTransfer, StandingOrder, StandingOrderExecution
+
+
+BATCH_SIZE = 500
+WORKERS = 4
+BACKFILL_BATCH_SIZE = 1000
+
+FREQUENCY_DAYS = {
+    "WEEKLY": 7,
+    "BIWEEKLY": 14,
+}
+FREQUENCY_MONTHS = {
+    "MONTHLY": 1,
+    "QUARTERLY": 3,
+    "ANNUALLY": 12,
+}
+
+
+class UnknownFrequency(Exception):
+    pass
+
+
+@dataclass
+class RunStats:
+    orders: int = 0
+    posted: int = 0
+    failed: int = 0
+    skipped: int = 0
+
+    def add(self, other):
+        self.orders += other.orders
+        self.posted += other.posted
+        self.failed += other.failed
+        self.skipped += other.skipped
+
+
+# =========================================================
+# SCHEDULE
+# =========================================================
+
+def _frequency_key(frequency):
+    return (frequency or "").replace("-", "").replace("_", "").replace(" ", "").upper()
+
+
+def _add_months(day, months):
+    month_index = day.month - 1 + months
+    year, month = day.year + month_index // 12, month_index % 12 + 1
+    return day.replace(year=year, month=month, day=min(day.day, calendar.monthrange(year, month)[1]))
+
+
+def occurrence(order, n):
+    """Date of the ``n``-th run (0-based), always counted from start_date."""
+    key = _frequency_key(order.frequency)
+    if key in FREQUENCY_DAYS:
+        return order.start_date + timedelta(days=FREQUENCY_DAYS[key] * n)
+    if key in FREQUENCY_MONTHS:
+        # Counting from start_date keeps a 31st-of-month order on the last
+        # day of short months without drifting to the 28th afterwards.
+        return _add_months(order.start_date, FREQUENCY_MONTHS[key] * n)
+    raise UnknownFrequency(order.frequency)
+
+
+def next_run_after(order, run_count):
+    """next_run_date once ``run_count`` runs have happened, or None if finished."""
+    day = occurrence(order, run_count)
+    if order.end_date and day > order.end_date:
+        return None
+    return day
+
+
+@receiver(pre_save, sender=StandingOrder)
+def schedule_new_order(sender, instance, raw=False, **kwargs):
+    if raw or instance.pk or instance.next_run_date:
+        return
+    instance.next_run_date = next_run_after(instance, 0)
+    instance.is_active = instance.next_run_date is not None
+
+
+def _first_run_from(order, day):
+    """(run_count, next_run_date) for the first occurrence on or after ``day``."""
+    run_count = 0
+    next_date = next_run_after(order, 0)
+    while next_date is not None and next_date < day:
+        run_count += 1
+        next_date = next_run_after(order, run_count)
+    return run_count, next_date
+
+
+def backfill_schedules(today=None, batch_size=BACKFILL_BATCH_SIZE):
+    """Schedule active orders that have no next_run_date; returns how many were updated."""
+    today = today or timezone.localdate()
+    updated = 0
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            orders = list(
+                StandingOrder.objects
+                .select_for_update(skip_locked=True)
+                .filter(is_active=True, next_run_date__isnull=True, pk__gt=last_id)
+                .order_by("pk")[:batch_size]
+            )
+            if not orders:
+                return updated
+            for order in orders:
+                after = order.last_run_date + timedelta(days=1) if order.last_run_date else today
+                try:
+                    order.run_count, order.next_run_date = _first_run_from(order, max(after, today))
+                except UnknownFrequency:
+                    order.next_run_date = None
+                order.is_active = order.next_run_date is not None
+            StandingOrder.objects.bulk_update(orders, ["run_count", "next_run_date", "is_active"])
+            updated += len(orders)
+            last_id = orders[-1].pk
+
+
+@receiver(post_migrate)
+def backfill_on_migrate(sender, **kwargs):
+    if sender.label == StandingOrder._meta.app_label:
+        backfill_schedules()
+
+
+# =========================================================
+# EXECUTION
+# =========================================================
+
+def idempotency_key(order, run_date):
+    return f"SO{order.pk}-{run_date.isoformat()}"
+
+
+def _pay(order, run_date, balances):
+    if balances[order.source_account_id] < order.amount:
+        return StandingOrderExecution(
+            standing_order=order, run_date=run_date, status="FAILED",
+            idempotency_key=idempotency_key(order, run_date), error="insufficient funds",
+        )
+
+    transfer = FundsTransfer.objects.create(
+        branch_id=order.branch_id,
+        source_account_id=order.source_account_id,
+        beneficiary_account=order.beneficiary_account,
+        beneficiary_name=order.beneficiary_name,
+        amount=order.amount,
+        narration=f"Standing order {order.pk} ({run_date.isoformat()})",
+        created_by_id=order.created_by_id,
+    )
+    balances[order.source_account_id] -= order.amount
+    return StandingOrderExecution(
+        standing_order=order, run_date=run_date, status="POSTED",
+        idempotency_key=idempotency_key(order, run_date), transfer=transfer,
+    )
+
+
+def _advance(order, run_date):
+    """Move ``order`` past the dates due by ``run_date``; returns (due, not yet executed)."""
+    due = []
+    while order.next_run_date and order.next_run_date <= run_date:
+        due.append(order.next_run_date)
+        order.run_count += 1
+        order.next_run_date = next_run_after(order, order.run_count)
+
+    done = set(
+        StandingOrderExecution.objects
+        .filter(standing_order=order, run_date__in=due)
+        .values_list("run_date", flat=True)
+    )
+    return due, [day for day in due if day not in done]
+
+
+def _finish(order, due):
+    order.last_run_date = due[-1] if due else order.last_run_date
+    order.is_active = order.next_run_date is not None
+    order.save(update_fields=["run_count", "next_run_date", "last_run_date", "is_active"])
+
+
+def _execute(order, run_date, catch_up, balances, stats):
+    due, pending = _advance(order, run_date)
+
+    executions = []
+    for day in pending:
+        if not catch_up and day != due[-1]:
+            executions.append(StandingOrderExecution(
+                standing_order=order, run_date=day, status="SKIPPED",
+                idempotency_key=idempotency_key(order, day),
+            ))
+            stats.skipped += 1
+            continue
+
+        execution = _pay(order, day, balances)
+        executions.append(execution)
+        if execution.status == "POSTED":
+            stats.posted += 1
+        else:
+            stats.failed += 1
+
+    StandingOrderExecution.objects.bulk_create(executions)
+    _finish(order, due)
+
+
+def _fail(order, run_date, error, stats):
+    """Record every pending date of ``order`` as FAILED with ``error`` and move it on."""
+    try:
+        due, pending = _advance(order, run_date)
+    except UnknownFrequency:
+        # It can no longer be scheduled: fail the date it was due and stop it.
+        due = pending = [order.next_run_date]
+        order.next_run_date = None
+
+    StandingOrderExecution.objects.bulk_create([
+        StandingOrderExecution(
+            standing_order=order, run_date=day, status="FAILED",
+            idempotency_key=idempotency_key(order, day), error=error,
+        )
+        for day in pending
+    ], ignore_conflicts=True)
+    stats.failed += len(pending)
+    _finish(order, due)
+
+
+def run_batch(run_date, batch_size=BATCH_SIZE, catch_up=True):
+    """Claim and execute up to ``batch_size`` due orders; returns RunStats."""
+    stats = RunStats()
+    with transaction.atomic():
+        orders = list(
+            StandingOrder.objects
+            .select_for_update(skip_locked=True)
+            .filter(is_active=True, next_run_date__lte=run_date)
+            .order_by("next_run_date", "id")[:batch_size]
+        )
+        if not orders:
+            return stats
+
+        # Lock the debited accounts in key order so overlapping workers
+        # queue behind each other instead of deadlocking.
+        account_ids = sorted({order.source_account_id for order in orders})
+        list(
+            CustomerAccount.objects.select_for_update()
+            .filter(pk__in=account_ids).order_by("pk").values_list("pk", flat=True)
+        )
+        balances = ledger.account_balances(account_ids)
+
+        for order in orders:
+            saved = (order.run_count, order.next_run_date, order.last_run_date, order.is_active)
+            balance = balances[order.source_account_id]
+            order_stats = RunStats()
+            try:
+                with transaction.atomic():
+                    _execute(order, run_date, catch_up, balances, order_stats)
+            except Exception as exc:
+                order.run_count, order.next_run_date, order.last_run_date, order.is_active = saved
+                balances[order.source_account_id] = balance
+                order_stats = RunStats()
+                _fail(order, run_date, str(exc) or type(exc).__name__, order_stats)
+            stats.add(order_stats)
+        stats.orders = len(orders)
+    return stats
+
+
+def _work(run_date, batch_size, catch_up):
+    stats = RunStats()
+    while True:
+        batch = run_batch(run_date, batch_size, catch_up)
+        if not batch.orders:
+            return stats
+        stats.add(batch)
+
+
+def run(run_date=None, workers=WORKERS, batch_size=BATCH_SIZE, catch_up=True):
+    """Execute every order due on or before ``run_date`` across ``workers`` processes."""
+    run_date = run_date or timezone.localdate()
+    if workers <= 1:
+        return _work(run_date, batch_size, catch_up)
+
+    connections.close_all()
+    total = RunStats()
+    with ProcessPoolExecutor(max_workers=workers, initializer=connections.close_all) as pool:
+        futures = [pool.submit(_work, run_date, batch_size, catch_up) for _ in range(workers)]
+        for future in futures:
+            total.add(future.result())
+    return total
@@ -0,0 +1,298 @@
+"""
+Statement generation for StatementRequest.
+
+Every deposit, withdrawal, transfer, bill payment and FX leg for an account
+already lands in the ledger (see ledger.py), so a statement is one indexed
+range read over LedgerEntry(account, created_at) in date order. The read
+goes through .iterator(), which uses a server-side cursor on PostgreSQL, and
+each line is written straight to the output file as it arrives. Memory stays
+flat whatever the size of the statement.
+
+CSV and Excel (openpyxl write-only mode) are fully streaming. PDF output is
+streamed too: each page is compressed and written as soon as it is full,
+and only the object offsets (a few bytes a page) stay in memory until the
+page tree and cross-reference table close the file.
+
+The balance brought forward counts the legacy balance of an account not
+yet opened in the ledger (see ledger.open_accounts), so statements agree
+with account_balance() before and after the backfill.
+
+submit() queues generation on a process pool once the request's transaction
+commits, so the web worker only creates the row.
+"""
+
+import csv
+import os
+import tempfile
+import zlib
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db import connections, transaction
+from django.utils import timezone
+
+from . import ledger
+from .models import LedgerEntry, StatementRequest
+
+
+CURSOR_CHUNK_SIZE = 5000
+WORKERS = getattr(settings, "STATEMENT_WORKERS", 2)
+
+COLUMNS = ("Date", "Reference", "Narration", "Debit", "Credit", "Balance")
+
+
+# =========================================================
+# LINES
+# =========================================================
+
+def _day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def statement_lines(account_id, date_from=None, date_to=None):
+    """
+    Yield (created_at, reference, narration, debit, credit, balance) in date
+    order, starting from the balance brought forward at ``date_from``.
+    """
+    entries = LedgerEntry.objects.filter(account_id=account_id)
+    opening = ledger.legacy_balances([account_id]).get(account_id, ledger.ZERO)
+    if date_from:
+        start = _day_start(date_from)
+        opening = ledger.account_balance(account_id, as_of=start - timedelta(microseconds=1))
+        entries = entries.filter(created_at__gte=start)
+    if date_to:
+        entries = entries.filter(created_at__lt=_day_start(date_to + timedelta(days=1)))
+
+    rows = (
+        entries
+        .order_by("created_at", "id")
+        .values_list("created_at", "posting_reference", "narration", "direction", "amount")
+        .iterator(chunk_size=CURSOR_CHUNK_SIZE)
+    )
+
+    yield None, "", "Balance brought forward", None, None, opening
+
+    balance = opening
+    for created_at, reference, narration, direction, amount in rows:
+        if direction == ledger.CREDIT:
+            balance += amount
+            yield created_at, reference, narration or "", None, amount, balance
+        else:
+            balance -= amount
+            yield created_at, reference, narration or "", amount, None, balance
+
+
+# =========================================================
+# WRITERS
+# =========================================================
+
+def _cells(line):
+    created_at, reference, narration, debit, credit, balance = line
+    date = timezone.localtime(created_at).strftime("%Y-%m-%d %H:%M") if created_at else ""
+    return [date, reference, narration, debit or "", credit or "", balance]
+
+
+class CsvStatementWriter:
+    extension = "csv"
+
+    def __init__(self, path, title):
+        self.handle = open(path, "w", newline="", encoding="utf-8")
+        self.writer = csv.writer(self.handle)
+        self.writer.writerow([title])
+        self.writer.writerow(COLUMNS)
+
+    def write(self, line):
+        self.writer.writerow(_cells(line))
+
+    def close(self):
+        self.handle.close()
+
+
+class ExcelStatementWriter:
+    extension = "xlsx"
+
+    def __init__(self, path, title):
+        from openpyxl import Workbook
+
+        self.path = path
+        self.workbook = Workbook(write_only=True)
+        self.sheet = self.workbook.create_sheet("Statement")
+        self.sheet.append([title])
+        self.sheet.append(list(COLUMNS))
+
+    def write(self, line):
+        cells = _cells(line)
+        self.sheet.append(cells[:3] + [float(c) if c != "" else None for c in cells[3:]])
+
+    def close(self):
+        self.workbook.save(self.path)
+
+
+class PdfStatementWriter:
+    """
+    A PDF written front to back. Objects 1-4 are the catalog, the page tree
+    (written last, when the page count is known) and the two standard
+    Helvetica fonts; each page then adds its content stream and its page
+    object.
+    """
+    extension = "pdf"
+
+    TOP, BOTTOM, LINE_HEIGHT = 800, 50, 12
+    X = (30, 120, 215, 385, 450, 515)
+    MEDIA_BOX = b"[0 0 595.2756 841.8898]"
+    FIRST_PAGE_OBJECT = 5
+
+    def __init__(self, path, title):
+        self.handle = open(path, "wb")
+        self.offsets = array("q", [0] * (self.FIRST_PAGE_OBJECT - 1))
+        self.title = title
+        self.page = 0
+        self.content = []
+
+        self.handle.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        self._object(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+        self._object(3, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+        self._object(4, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>")
+        self._new_page()
+
+    def _object(self, number, body):
+        if number > len(self.offsets):
+            self.offsets.append(0)
+        self.offsets[number - 1] = self.handle.tell()
+        self.handle.write(b"%d 0 obj\n" % number + body + b"\nendobj\n")
+
+    def _text(self, x, y, font, size, text):
+        data = str(text).replace("\r", " ").replace("\n", " ").encode("cp1252", "replace")
+        data = data.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)")
+        self.content.append(b"BT /%s %d Tf %d %d Td (%s) Tj ET\n" % (font, size, x, y, data))
+
+    def _end_page(self):
+        stream = zlib.compress(b"".join(self.content))
+        self.content = []
+        contents = len(self.offsets) + 1
+        self._object(
+            contents,
+            b"<< /Length %d /Filter /FlateDecode >>\nstream\n" % len(stream) + stream + b"\nendstream",
+        )
+        self._object(contents + 1, (
+            b"<< /Type /Page /Parent 2 0 R /MediaBox " + self.MEDIA_BOX
+            + b" /Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> /Contents %d 0 R >>" % contents
+        ))
+
+    def _new_page(self):
+        if self.page:
+            self._end_page()
+        self.page += 1
+        self._text(self.X[0], self.TOP + 20, b"F2", 10, f"{self.title}  (page {self.page})")
+        self.y = self.TOP
+        self._draw(COLUMNS, b"F2")
+
+    def _draw(self, cells, font=b"F1"):
+        for x, cell in zip(self.X, cells):
+            self._text(x, self.y, font, 8, str(cell)[:40])
+        self.y -= self.LINE_HEIGHT
+
+    def write(self, line):
+        if self.y < self.BOTTOM:
+            self._new_page()
+        self._draw(_cells(line))
+
+    def close(self):
+        self._end_page()
+        write = self.handle.write
+
+        self.offsets[1] = self.handle.tell()
+        write(b"2 0 obj\n<< /Type /Pages /Count %d /Kids [" % self.page)
+        for page in range(self.page):
+            write(b" %d 0 R" % (self.FIRST_PAGE_OBJECT + 1 + 2 * page))
+        write(b" ] >>\nendobj\n")
+
+        xref = self.handle.tell()
+        write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(self.offsets) + 1))
+        for offset in self.offsets:
+            write(b"%010d 00000 n \n" % offset)
+        write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(self.offsets) + 1, xref))
+        self.handle.close()
+
+
+WRITERS = {
+    "CSV": CsvStatementWriter,
+    "EXCEL": ExcelStatementWriter,
+    "XLSX": ExcelStatementWriter,
+    "PDF": PdfStatementWriter,
+}
+
+
+# =========================================================
+# GENERATION
+# =========================================================
+
+def generate_statement(request_id):
+    """Build the file for one StatementRequest; runs inside a pool worker."""
+    request = StatementRequest.objects.select_related("account").get(pk=request_id)
+    # Status changes are saved through the model, so SLA tracking and the
+    # dashboard rollups see them.
+    request.status = "RUNNING"
+    request.error = None
+    request.save(update_fields=["status", "error"])
+
+    writer_class = WRITERS.get((request.output_format or "").upper(), PdfStatementWriter)
+    title = f"Statement - {request.account.account_number}"
+    if request.certified_statement:
+        title += " (Certified)"
+
+    fd, path = tempfile.mkstemp(suffix=f".{writer_class.extension}")
+    os.close(fd)
+    try:
+        writer = writer_class(path, title)
+        count = 0
+        for line in statement_lines(request.account_id, request.date_from, request.date_to):
+            writer.write(line)
+            count += 1
+        writer.close()
+
+        name = f"{request.account.account_number}-{request.pk}.{writer_class.extension}"
+        with open(path, "rb") as handle:
+            request.output_file.save(name, File(handle), save=False)
+        request.status = "READY"
+        request.line_count = count
+        request.completed_at = timezone.now()
+        request.save(update_fields=["output_file", "status", "line_count", "completed_at"])
+    except Exception as exc:
+        request.status = "FAILED"
+        request.error = str(exc)
+        request.save(update_fields=["status", "error"])
+        raise
+    finally:
+        os.remove(path)
+
+
+_inherited_connections = []
+
+
+def _drop_inherited_connections():
+    # A forked worker shares the parent's database sockets. Closing them
+    # here would end the parent's sessions, so the worker keeps the
+    # inherited objects alive, unused and never closed, and opens its own.
+    for conn in connections.all(initialized_only=True):
+        if conn.connection is not None:
+            _inherited_connections.append(conn.connection)
+            conn.connection = None
+
+
+_pool = None
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=WORKERS, initializer=_drop_inherited_connections)
+    return _pool
+
+
+def submit(request):
+    """Queue ``request`` for generation once the current transaction commits."""
+    transaction.on_commit(lambda: get_pool().submit(generate_statement, request.pk))
@@ -0,0 +1,555 @@
+"""
+Seeded synthetic data for load testing.
+
+generate(scale, seed) fills an empty database with branches, customers,
+accounts, cards and a transaction history. Branches are spread over the 47
+counties in proportion to population. Each row is built from a seeded NumPy
+generator, so the same scale and seed always give the same data, whatever
+the size.
+
+The history mixes cash, transfers, bill payments and completed FX buys,
+sells and outward transfers, priced from seeded ExchangeRate rows.
+
+Everything goes in with bulk_create, chunk by chunk, so 10M transactions
+stay within bounded memory. bulk_create sends no signals, so the factory
+does itself what the receivers would have done:
+
+- it writes each transaction's ledger legs,
+- it fills the customer search keys,
+- at the end it rolls balance snapshots, rebuilds the dashboard rollups and
+  backfills the approval queue.
+
+Balances are tracked in cents while the history is built. A debit that
+would overdraw its account becomes a deposit instead.
+
+Account and card numbers and transaction references come from the normal
+allocators (references.py), so they depend on the database and not on the
+seed. Every timestamp does follow the seed: created_at values are backdated
+across the ``days`` before today. auto_now_add stamps rows with the insert
+time, so _bulk_create() writes the backdated values back with an UPDATE.
+"""
+
+from dataclasses import dataclass
+from datetime import timedelta
+from decimal import ROUND_HALF_UP, Decimal
+
+import numpy as np
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.utils import timezone
+
+from . import approval_queue, customer_search, dashboard_rollups, ledger, metrics_engine, references
+from .models import (
+    AccountType,
+    AccountTypeAddOn,
+    AddOn,
+    BillPayment,
+    Branch,
+    Card,
+    CashDeposit,
+    CashWithdrawal,
+    Currency,
+    Customer,
+    CustomerAccount,
+    CustomerAccountAddOn,
+    ExchangeRate,
+    FundsTransfer,
+    FXBuy,
+    FXSell,
+    FXTransfer,
+    KYCUpdateRequest,
+    LedgerEntry,
+)
+
+
+CHUNK_SIZE = 10_000
+BACKDATE_BATCH_SIZE = 1000
+CENTS = Decimal("0.01")
+
+# 2019 census population, thousands.
+COUNTIES = {
+    "Nairobi": 4397, "Kiambu": 2418, "Nakuru": 2162, "Kakamega": 1868, "Bungoma": 1671,
+    "Meru": 1545, "Kilifi": 1453, "Machakos": 1422, "Kisii": 1266, "Mombasa": 1208,
+    "Uasin Gishu": 1163, "Narok": 1157, "Kisumu": 1155, "Kitui": 1136, "Homa Bay": 1131,
+    "Kajiado": 1117, "Migori": 1116, "Murang'a": 1056, "Siaya": 993, "Trans Nzoia": 990,
+    "Makueni": 987, "Turkana": 926, "Kericho": 901, "Busia": 893, "Nandi": 885,
+    "Bomet": 875, "Mandera": 867, "Kwale": 866, "Garissa": 841, "Wajir": 781,
+    "Nyeri": 759, "Baringo": 666, "Nyandarua": 638, "West Pokot": 621, "Kirinyaga": 610,
+    "Embu": 608, "Nyamira": 605, "Vihiga": 590, "Laikipia": 518, "Marsabit": 459,
+    "Elgeyo-Marakwet": 454, "Tharaka-Nithi": 393, "Taita-Taveta": 340, "Tana River": 315,
+    "Samburu": 310, "Isiolo": 268, "Lamu": 143,
+}
+
+FIRST_NAMES = (
+    "Wanjiru", "Achieng", "Njeri", "Akinyi", "Wambui", "Chebet", "Atieno", "Nyambura",
+    "Jepkemoi", "Mwende", "Kerubo", "Nafula", "Zawadi", "Amina", "Faith", "Grace",
+    "Kamau", "Otieno", "Mwangi", "Ochieng", "Kiprono", "Mutua", "Wafula", "Omondi",
+    "Kipchoge", "Njoroge", "Barasa", "Hassan", "Brian", "Kevin", "Dennis", "Peter",
+)
+SURNAMES = (
+    "Kamau", "Otieno", "Mwangi", "Ochieng", "Kariuki", "Wanjala", "Kiptoo", "Mutiso",
+    "Onyango", "Njoroge", "Kimani", "Odhiambo", "Cheruiyot", "Musyoka", "Wekesa", "Maina",
+    "Owino", "Rotich", "Nyaga", "Gitau", "Abdi", "Mohamed", "Langat", "Ndungu",
+)
+BRANCH_SUFFIXES = ("Town", "Central", "Market", "Junction", "Plaza", "Road")
+OCCUPATIONS = ("Teacher", "Farmer", "Trader", "Nurse", "Driver", "Civil Servant", "Engineer", "Student")
+INCOME_RANGES = ("Below 20,000", "20,000 - 50,000", "50,000 - 100,000", "100,000 - 500,000", "Above 500,000")
+ACCOUNT_TYPES = (
+    ("SAVINGS", "Savings Account", Decimal("4.00"), Decimal("1000.00")),
+    ("CURRENT", "Current Account", Decimal("0.00"), Decimal("0.00")),
+)
+BILLERS = (("KPLC Prepaid", "888880"), ("Nairobi Water", "444400"), ("DSTV", "444900"), ("NHIF", "200222"))
+# code, name, mid rate in KES; the bank buys 1% under and sells 1% over mid
+FX_CURRENCIES = (
+    ("USD", "US Dollar", Decimal("129.3500")),
+    ("EUR", "Euro", Decimal("140.8200")),
+    ("GBP", "Pound Sterling", Decimal("164.1000")),
+)
+FX_SPREAD = Decimal("0.01")
+FX_TRANSFER_CHARGES = Decimal("1500.00")
+FX_BENEFICIARIES = (
+    ("Global Supplies LLC", "Citibank N.A.", "CITIUS33", "United States"),
+    ("Shenzhen Trading Co", "Bank of China", "BKCHCNBJ", "China"),
+    ("Dubai Motors FZE", "Emirates NBD", "EBILAEAD", "United Arab Emirates"),
+)
+
+# transaction mix, must sum to 1
+DEPOSIT, WITHDRAWAL, TRANSFER, BILL, FX_BUY, FX_SELL, FX_TRANSFER = range(7)
+MIX = (0.34, 0.29, 0.19, 0.14, 0.02, 0.015, 0.005)
+INTERNAL_TRANSFER_SHARE = 0.7
+CARD_SHARE = 0.6
+PENDING_KYC_SHARE = 0.005
+
+
+@dataclass(frozen=True)
+class Scale:
+    branches: int
+    customers: int
+    transactions: int
+    accounts_per_customer: float = 1.3
+    days: int = 365
+
+
+SCALES = {
+    "tiny": Scale(branches=3, customers=200, transactions=5_000, days=60),
+    "small": Scale(branches=10, customers=5_000, transactions=100_000),
+    "medium": Scale(branches=50, customers=100_000, transactions=1_000_000),
+    "large": Scale(branches=200, customers=1_000_000, transactions=10_000_000),
+    # About 5M accounts with a thin history, for the end-of-day batch benchmark.
+    "accounts-5m": Scale(branches=200, customers=3_850_000, transactions=5_000_000),
+}
+
+
+@dataclass
+class Generated:
+    branches: int = 0
+    customers: int = 0
+    accounts: int = 0
+    cards: int = 0
+    transactions: int = 0
+    ledger_entries: int = 0
+
+
+class _AccountIndex:
+    """The few account columns the transaction builder needs, without model instances."""
+
+    def __init__(self):
+        self.ids = []
+        self.branch_ids = []
+        self.numbers = []
+        self.holders = []
+
+    def __len__(self):
+        return len(self.ids)
+
+    def extend(self, accounts):
+        for account in accounts:
+            self.ids.append(account.pk)
+            self.branch_ids.append(account.branch_id)
+            self.numbers.append(account.account_number)
+            self.holders.append(account.customer.full_name)
+
+
+def _chunks(count, size=CHUNK_SIZE):
+    for start in range(0, count, size):
+        yield start, min(start + size, count)
+
+
+def _bulk_create(model, rows, **kwargs):
+    """bulk_create, then put back the timestamps auto_now_add overwrote."""
+    fields = [field.attname for field in model._meta.concrete_fields if getattr(field, "auto_now_add", False)]
+    stamps = [[getattr(row, name) for name in fields] for row in rows]
+    created = model.objects.bulk_create(rows, **kwargs)
+    if fields:
+        for row, values in zip(created, stamps):
+            for name, value in zip(fields, values):
+                setattr(row, name, value)
+        model.objects.bulk_update(created, fields, batch_size=BACKDATE_BATCH_SIZE)
+    return created
+
+
+def _reference_data():
+    kes, _ = Currency.objects.get_or_create(code="KES", defaults={"name": "Kenya Shilling"})
+    account_types = [
+        AccountType.objects.get_or_create(code=code, defaults={
+            "name": name, "description": name, "interest_rate": rate, "minimum_balance": minimum,
+        })[0]
+        for code, name, rate, minimum in ACCOUNT_TYPES
+    ]
+    sms, _ = AddOn.objects.get_or_create(code="SMS_ALERTS", defaults={
+        "name": "SMS Alerts", "description": "SMS Alerts", "monthly_fee": Decimal("30.00"),
+    })
+    for account_type in account_types:
+        if account_type.code == "CURRENT":
+            AccountTypeAddOn.objects.get_or_create(
+                account_type=account_type, addon=sms, defaults={"is_mandatory": True},
+            )
+    return kes, account_types, sms
+
+
+def _exchange_rates(start):
+    """One rate row per FX currency, effective from the start of the history."""
+    rates = []
+    for code, name, mid in FX_CURRENCIES:
+        currency, _ = Currency.objects.get_or_create(code=code, defaults={"name": name})
+        rate = ExchangeRate.objects.filter(currency=currency).order_by("-version").first()
+        if rate is None:
+            rate = ExchangeRate.objects.create(
+                currency=currency, version=1, mid_rate=mid,
+                buy_rate=(mid * (1 - FX_SPREAD)).quantize(Decimal("0.0001")),
+                sell_rate=(mid * (1 + FX_SPREAD)).quantize(Decimal("0.0001")),
+                source="synthetic", effective_at=start,
+            )
+        rate.currency = currency
+        rates.append(rate)
+    return rates
+
+
+# =========================================================
+# BRANCHES, CUSTOMERS, ACCOUNTS, CARDS
+# =========================================================
+
+def _branches(rng, scale):
+    counties = list(COUNTIES)
+    weights = np.array([COUNTIES[name] for name in counties], dtype=np.float64)
+    picked = rng.choice(len(counties), size=scale.branches, p=weights / weights.sum())
+
+    branches = [
+        Branch(
+            name=f"{counties[county]} {BRANCH_SUFFIXES[n % len(BRANCH_SUFFIXES)]}",
+            branch_code=f"S{n + 1:04d}",
+            county=counties[county],
+        )
+        for n, county in enumerate(picked)
+    ]
+    Branch.objects.bulk_create(branches)
+
+    User = get_user_model()
+    tellers = [
+        User.objects.get_or_create(**{User.USERNAME_FIELD: f"teller-{branch.branch_code.lower()}"})[0]
+        for branch in branches
+    ]
+    return branches, tellers
+
+
+def _customers(rng, branches, start, end, created):
+    count = end - start
+    branch_index = rng.integers(0, len(branches), count)
+    first = rng.integers(0, len(FIRST_NAMES), count)
+    last = rng.integers(0, len(SURNAMES), count)
+    mobiles = rng.integers(10_000_000, 99_999_999, count)
+    birth_days = rng.integers(18 * 365, 75 * 365, count)
+    today = timezone.localdate()
+
+    customers = []
+    for n in range(count):
+        branch = branches[branch_index[n]]
+        name = f"{FIRST_NAMES[first[n]]} {SURNAMES[last[n]]}"
+        mobile = f"07{mobiles[n]:08d}"
+        customers.append(Customer(
+            branch=branch,
+            full_name=name,
+            national_id=str(20_000_000 + start + n),
+            kra_pin=f"A{start + n:09d}K",
+            date_of_birth=today - timedelta(days=int(birth_days[n])),
+            gender=("MALE", "FEMALE")[n % 2],
+            marital_status=("SINGLE", "MARRIED")[int(birth_days[n]) % 2],
+            mobile_number=mobile,
+            mobile_normalized=customer_search.normalize_phone(mobile),
+            name_normalized=customer_search.normalize_name(name),
+            occupation=OCCUPATIONS[n % len(OCCUPATIONS)],
+            monthly_income_range=INCOME_RANGES[int(mobiles[n]) % len(INCOME_RANGES)],
+            county=branch.county,
+            sub_county=branch.county,
+            ward=branch.county,
+            postal_address="P.O. Box 100",
+            physical_address=branch.name,
+            created_at=created[n],
+        ))
+    _bulk_create(Customer, customers)
+    if not customer_search.uses_pg_trgm():
+        customer_search.index_names(customers)
+    return customers
+
+
+def _accounts(rng, scale, customers, kes, account_types, sms, created):
+    per_customer = rng.poisson(scale.accounts_per_customer - 1, len(customers)) + 1
+    accounts = [
+        CustomerAccount(
+            branch_id=customer.branch_id,
+            customer=customer,
+            account_type=account_types[k % len(account_types)],
+            currency=kes,
+            account_category="INDIVIDUAL",
+            mode_of_operation="SINGLY",
+            source_of_funds="Employment",
+            expected_monthly_transaction_volume=Decimal("50000.00"),
+            status="ACTIVE",
+            created_at=created[n],
+            ledger_opened_at=created[n],
+        )
+        for n, customer in enumerate(customers)
+        for k in range(int(per_customer[n]))
+    ]
+    _bulk_create(CustomerAccount, references.assign_all(accounts))
+    _bulk_create(CustomerAccountAddOn, [
+        CustomerAccountAddOn(account=account, addon=sms, activated_date=account.created_at)
+        for account in accounts if account.account_type.code == "CURRENT"
+    ])
+    return accounts
+
+
+def _cards(rng, accounts):
+    holders = rng.random(len(accounts)) < CARD_SHARE
+    cards = [
+        Card(
+            branch_id=account.branch_id,
+            account=account,
+            card_type="DEBIT",
+            card_tier="CLASSIC",
+            name_on_card=account.customer.full_name.upper()[:26],
+            daily_pos_limit=Decimal("100000.00"),
+            daily_atm_limit=Decimal("40000.00"),
+            status="ACTIVE",
+            created_at=account.created_at,
+        )
+        for account, has_card in zip(accounts, holders) if has_card
+    ]
+    _bulk_create(Card, cards)
+    return len(cards)
+
+
+def _pending_kyc(rng, accounts):
+    picked = rng.random(len(accounts)) < PENDING_KYC_SHARE
+    requests = [
+        KYCUpdateRequest(
+            branch_id=account.branch_id,
+            account=account,
+            update_type="MOBILE_NUMBER",
+            old_value=account.customer.mobile_number,
+            new_value="0700000000",
+            reason="Customer changed number",
+            created_at=account.created_at,
+        )
+        for account, pending in zip(accounts, picked) if pending
+    ]
+    _bulk_create(KYCUpdateRequest, requests)
+
+
+# =========================================================
+# TRANSACTIONS
+# =========================================================
+
+def _timestamps(rng, count, start, first_day, last_day):
+    """Sorted timestamps in [first_day, last_day), weighted towards banking hours."""
+    day = rng.integers(first_day, max(first_day + 1, last_day), count)
+    hour = np.clip(rng.normal(12.5, 2.5, count), 8, 17)
+    seconds = day * 86400 + (hour * 3600).astype(np.int64)
+    seconds.sort()
+    return [start + timedelta(seconds=int(s)) for s in seconds]
+
+
+def _fx_amount(kes_amount, rate):
+    """Whole foreign-currency units worth about ``kes_amount`` shillings, at least 10."""
+    return Decimal(max(10, int(kes_amount / rate.mid_rate)))
+
+
+def _kes(fcy_amount, rate):
+    return (fcy_amount * rate).quantize(CENTS, rounding=ROUND_HALF_UP)
+
+
+def _cents(amount):
+    return int(amount * 100)
+
+
+def _transactions(rng, scale, accounts, activity, tellers_by_branch, rates, balances, start, first, last):
+    count = last - first
+    kinds = rng.choice(len(MIX), size=count, p=MIX)
+    owners = rng.choice(len(accounts), size=count, p=activity)
+    counterparts = rng.integers(0, len(accounts), count)
+    internal = rng.random(count) < INTERNAL_TRANSFER_SHARE
+    billers = rng.integers(0, len(BILLERS), count)
+    currencies = rng.integers(0, len(rates), count)
+    # Whole shillings in 50s, median around KES 3,000.
+    amounts = np.maximum(50, (rng.lognormal(8.0, 1.1, count) // 50) * 50).astype(np.int64)
+    # Chunks walk through the history in order, so balances only ever see
+    # postings in date order.
+    stamps = _timestamps(
+        rng, count, start,
+        scale.days * first // scale.transactions, scale.days * last // scale.transactions,
+    )
+
+    rows = {kind: [] for kind in range(len(MIX))}
+    legs = {kind: [] for kind in range(len(MIX))}
+    for n in range(count):
+        owner = int(owners[n])
+        account_id, branch_id = accounts.ids[owner], accounts.branch_ids[owner]
+        amount = int(amounts[n])
+        kind = int(kinds[n])
+        rate = rates[int(currencies[n])]
+        fcy_amount = _fx_amount(amount, rate)
+        if kind == FX_BUY:
+            debit = _kes(fcy_amount, rate.sell_rate)
+        elif kind == FX_TRANSFER:
+            debit = _kes(fcy_amount, rate.sell_rate) + FX_TRANSFER_CHARGES
+        elif kind in (WITHDRAWAL, TRANSFER, BILL):
+            debit = Decimal(amount)
+        else:
+            debit = None
+        if debit is not None and balances[owner] < _cents(debit):
+            kind = DEPOSIT
+        common = dict(branch_id=branch_id, created_by=tellers_by_branch[branch_id], created_at=stamps[n])
+        money = dict(common, amount=Decimal(amount))
+
+        if kind == DEPOSIT:
+            balances[owner] += amount * 100
+            rows[kind].append(CashDeposit(account_id=account_id, narration="Cash deposit", **money))
+            legs[kind].append([ledger.debit_gl(ledger.GL_TELLER_CASH, money["amount"]),
+                               ledger.credit_account(account_id, money["amount"])])
+        elif kind == WITHDRAWAL:
+            balances[owner] -= amount * 100
+            rows[kind].append(CashWithdrawal(account_id=account_id, narration="Cash withdrawal", **money))
+            legs[kind].append([ledger.debit_account(account_id, money["amount"]),
+                               ledger.credit_gl(ledger.GL_TELLER_CASH, money["amount"])])
+        elif kind == TRANSFER:
+            balances[owner] -= amount * 100
+            target = int(counterparts[n])
+            if internal[n] and target != owner:
+                balances[target] += amount * 100
+                credit = ledger.credit_account(accounts.ids[target], money["amount"])
+                number, name = accounts.numbers[target], accounts.holders[target]
+            else:
+                credit = ledger.credit_gl(ledger.GL_TRANSFERS_OUT, money["amount"])
+                number, name = f"01{int(amounts[n] * 7919) % 10**10:010d}", "External Beneficiary"
+            rows[kind].append(FundsTransfer(
+                source_account_id=account_id, beneficiary_account=number, beneficiary_name=name,
+                narration="Funds transfer", **money,
+            ))
+            legs[kind].append([ledger.debit_account(account_id, money["amount"]), credit])
+        elif kind == BILL:
+            balances[owner] -= amount * 100
+            biller_name, paybill = BILLERS[billers[n]]
+            rows[kind].append(BillPayment(
+                source_account_id=account_id, biller_name=biller_name, paybill_number=paybill,
+                reference_number=accounts.numbers[owner], **money,
+            ))
+            legs[kind].append([ledger.debit_account(account_id, money["amount"]),
+                               ledger.credit_gl(ledger.GL_BILLER_SETTLEMENT, money["amount"])])
+        elif kind in (FX_BUY, FX_SELL):
+            if kind == FX_BUY:
+                model, quoted, build_legs, sign, verb = FXBuy, rate.sell_rate, ledger.fx_buy_legs, -1, "purchase"
+            else:
+                model, quoted, build_legs, sign, verb = FXSell, rate.buy_rate, ledger.fx_sell_legs, 1, "sale"
+            fx = model(
+                account_id=account_id, amount=fcy_amount, exchange_rate=quoted,
+                kes_equivalent=_kes(fcy_amount, quoted), narration=f"{rate.currency.code} {verb}",
+                status="COMPLETED", **common,
+            )
+            balances[owner] += sign * _cents(fx.kes_equivalent)
+            rows[kind].append(fx)
+            legs[kind].append(build_legs(fx))
+        else:
+            beneficiary, bank, swift, country = FX_BENEFICIARIES[int(counterparts[n]) % len(FX_BENEFICIARIES)]
+            fx = FXTransfer(
+                account_id=account_id, amount=fcy_amount, exchange_rate=rate.sell_rate,
+                charges=FX_TRANSFER_CHARGES, beneficiary_name=beneficiary,
+                beneficiary_account_number=f"{int(amounts[n] * 104729) % 10**12:012d}",
+                beneficiary_bank=bank, swift_code=swift, beneficiary_country=country,
+                narration=f"{rate.currency.code} transfer", status="COMPLETED", **common,
+            )
+            balances[owner] -= _cents(debit)
+            rows[kind].append(fx)
+            legs[kind].append(ledger.fx_transfer_legs(fx))
+
+    entries = []
+    for kind, model in ((DEPOSIT, CashDeposit), (WITHDRAWAL, CashWithdrawal),
+                        (TRANSFER, FundsTransfer), (BILL, BillPayment),
+                        (FX_BUY, FXBuy), (FX_SELL, FXSell), (FX_TRANSFER, FXTransfer)):
+        created = _bulk_create(model, references.assign_all(rows[kind]), batch_size=CHUNK_SIZE)
+        metrics_engine.invalidate_rows(model, created)
+        for row, row_legs in zip(created, legs[kind]):
+            for entry in ledger.build_entries(
+                ledger.posting_reference_for(row), row_legs, row.branch_id,
+                model.__name__, row.pk, getattr(row, "narration", None),
+            ):
+                entry.created_at = row.created_at
+                entries.append(entry)
+    _bulk_create(LedgerEntry, entries, batch_size=CHUNK_SIZE)
+    return len(entries)
+
+
+# =========================================================
+# ENTRY POINT
+# =========================================================
+
+def generate(scale="small", seed=42):
+    """Fill the database at ``scale`` (a SCALES key or a Scale) from ``seed``."""
+    if isinstance(scale, str):
+        scale = SCALES[scale]
+    if not connection.features.can_return_rows_from_bulk_insert:
+        raise RuntimeError("the factory needs a database that returns primary keys from bulk inserts")
+
+    rng = np.random.default_rng(seed)
+    start = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=scale.days)
+    result = Generated()
+
+    with transaction.atomic():
+        kes, account_types, sms = _reference_data()
+        rates = _exchange_rates(start - timedelta(days=scale.days))
+        branches, tellers = _branches(rng, scale)
+        tellers_by_branch = {branch.pk: teller for branch, teller in zip(branches, tellers)}
+    result.branches = len(branches)
+
+    accounts = _AccountIndex()
+    for first, last in _chunks(scale.customers):
+        # Customers open their accounts before the history starts.
+        opened = _timestamps(rng, last - first, start - timedelta(days=scale.days), 0, scale.days)
+        with transaction.atomic():
+            customers = _customers(rng, branches, first, last, opened)
+            chunk = _accounts(rng, scale, customers, kes, account_types, sms, opened)
+            result.cards += _cards(rng, chunk)
+            _pending_kyc(rng, chunk)
+        accounts.extend(chunk)
+        result.customers += len(customers)
+    result.accounts = len(accounts)
+
+    # A few accounts do most of the business.
+    activity = rng.pareto(1.5, len(accounts)) + 1
+    activity /= activity.sum()
+    balances = np.zeros(len(accounts), dtype=np.int64)
+    for first, last in _chunks(scale.transactions):
+        with transaction.atomic():
+            result.ledger_entries += _transactions(
+                rng, scale, accounts, activity, tellers_by_branch, rates, balances, start, first, last
+            )
+        result.transactions += last - first
+
+    for first, last in _chunks(len(accounts)):
+        CustomerAccount.objects.bulk_update(
+            [CustomerAccount(pk=accounts.ids[n], balance=Decimal(int(balances[n])) / 100) for n in range(first, last)],
+            ["balance"], batch_size=CHUNK_SIZE,
+        )
+    ledger.roll_snapshots(sync_balance=False)
+    dashboard_rollups.reconcile(start.date(), timezone.localdate())
+    approval_queue.backfill()
+    return result
@@ -0,0 +1,55 @@
+"""
+Django settings for the test suite: an SQLite test database with the ``src``
+app installed. The PostgreSQL-only paths (partition DDL, pg_trgm, LISTEN)
+have their own tests that are skipped on SQLite.
+"""
+
+import os
+import sys
+import tempfile
+
+import django
+import pytest
+from django.conf import settings
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+def pytest_configure():
+    media_root = tempfile.mkdtemp(prefix="bank-tests-")
+    settings.configure(
+        DEBUG=False,
+        SECRET_KEY="tests",
+        USE_TZ=True,
+        TIME_ZONE="Africa/Nairobi",
+        DATABASES={"default": {"ENGINE": "django.db.backends.sqlite3", "NAME": ":memory:"}},
+        INSTALLED_APPS=["django.contrib.auth", "django.contrib.contenttypes", "src.apps.SrcConfig"],
+        CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+        DEFAULT_AUTO_FIELD="django.db.models.BigAutoField",
+        PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"],
+        MEDIA_ROOT=media_root,
+        KYC_STORAGE_ROOT=os.path.join(media_root, "kyc"),
+        TRANSACTION_ARCHIVE_ROOT=os.path.join(media_root, "archive"),
+    )
+    django.setup()
+
+    from django.test.utils import setup_test_environment
+    from django.db import connection
+
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0)
+
+
+@pytest.fixture(autouse=True)
+def fresh_reference_cache():
+    # Test transactions roll back without running on_commit, so nothing
+    # invalidates the snapshot between tests, and row ids get reused.
+    from src import service_catalog
+    from src.reference_cache import reference_cache
+
+    reference_cache.clear()
+    service_catalog.clear()
+    yield
@@ -0,0 +1,68 @@
+"""Small builders for the rows most tests need."""
+
+import itertools
+from datetime import date
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+
+from src.models import AccountType, Branch, Currency, Customer, CustomerAccount
+
+
+_sequence = itertools.count(1)
+
+
+def branch(code=None):
+    n = next(_sequence)
+    return Branch.objects.create(name=f"Branch {n}", branch_code=code or f"T{n:04d}", county="Nairobi")
+
+
+def user(name=None):
+    User = get_user_model()
+    return User.objects.create(**{User.USERNAME_FIELD: name or f"user-{next(_sequence)}"})
+
+
+def customer(branch, full_name="Wanjiru Kamau", **fields):
+    n = next(_sequence)
+    values = dict(
+        branch=branch,
+        full_name=full_name,
+        national_id=f"{n:08d}",
+        kra_pin=f"A{n:09d}Z",
+        date_of_birth=date(1990, 1, 1),
+        gender="FEMALE",
+        marital_status="SINGLE",
+        mobile_number=f"07{n:08d}",
+        occupation="Teacher",
+        monthly_income_range="20,000 - 50,000",
+        county="Nairobi",
+        sub_county="Westlands",
+        ward="Parklands",
+        postal_address="P.O. Box 100",
+        physical_address="Nairobi",
+    )
+    values.update(fields)
+    return Customer.objects.create(**values)
+
+
+def account_type(code="SAVINGS", **fields):
+    values = {"name": code.title(), "description": code.title()}
+    values.update(fields)
+    return AccountType.objects.get_or_create(code=code, defaults=values)[0]
+
+
+def account(branch, owner=None, balance=Decimal("0.00"), status="ACTIVE", kind=None, **fields):
+    kes, _ = Currency.objects.get_or_create(code="KES", defaults={"name": "Kenya Shilling"})
+    return CustomerAccount.objects.create(
+        branch=branch,
+        customer=owner or customer(branch),
+        account_type=kind or account_type(),
+        currency=kes,
+        account_category="INDIVIDUAL",
+        balance=balance,
+        mode_of_operation="SINGLY",
+        source_of_funds="Employment",
+        expected_monthly_transaction_volume=Decimal("50000.00"),
+        status=status,
+        **fields,
+    )
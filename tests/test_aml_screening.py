@@ -0,0 +1,44 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase
+
+from src import aml_screening
+from src.models import WatchlistEntry
+
+from . import factories
+
+
+class ScreeningTests(TestCase):
+
+    def setUp(self):
+        WatchlistEntry.objects.create(
+            list_name="UN", list_type="SANCTIONS", external_id="1",
+            full_name="Baraka Odhiambo Otieno", name_normalized="baraka odhiambo otieno",
+        )
+        aml_screening._index = None
+        self.addCleanup(setattr, aml_screening, "_index", None)
+        self.addCleanup(cache.delete, aml_screening.VERSION_KEY)
+        self.branch = factories.branch()
+
+    def test_name_change_never_lowers_the_status(self):
+        customer = factories.customer(self.branch, full_name="Baraka Odhiambo Otieno")
+        self.assertEqual(customer.aml_screening_status, aml_screening.HIT)
+
+        customer.full_name = "Wanjiru Kamau"
+        customer.save()
+
+        customer.refresh_from_db()
+        self.assertEqual(customer.aml_screening_status, aml_screening.HIT)
+        self.assertEqual(customer.risk_rating, "HIGH")
+
+    def test_new_list_version_is_built_off_the_save_path(self):
+        index = aml_screening.get_index()
+        cache.set(aml_screening.VERSION_KEY, index.version + 1, None)
+
+        with mock.patch.object(aml_screening, "warm_index") as warm:
+            self.assertIs(aml_screening.get_index(), index)
+            factories.customer(self.branch, full_name="Achieng Wafula")
+
+        warm.assert_called()
+        self.assertEqual(aml_screening.get_index(wait=True).version, index.version + 1)
@@ -0,0 +1,89 @@
+from datetime import timedelta
+from decimal import Decimal
+
+from django.test import TestCase
+from django.utils import timezone
+
+from src import approval_queue
+from src.models import ApprovalItem, FXTransfer
+
+from . import factories
+
+
+class QueueTests(TestCase):
+
+    def setUp(self):
+        self.branch = factories.branch()
+        self.approvers = [factories.user(), factories.user()]
+        now = timezone.now()
+        # Pairs share a created_at, so paging has to break ties on id.
+        self.items = [
+            ApprovalItem.objects.create(
+                branch=self.branch, source_model="Test", source_id=n, created_at=now + timedelta(seconds=n // 2),
+            )
+            for n in range(7)
+        ]
+
+    def test_claims_never_overlap(self):
+        first = approval_queue.claim(self.approvers[0], self.branch, count=3)
+        second = approval_queue.claim(self.approvers[1], self.branch, count=10)
+
+        self.assertEqual([item.pk for item in first], [item.pk for item in self.items[:3]])
+        self.assertEqual([item.pk for item in second], [item.pk for item in self.items[3:]])
+        self.assertEqual(approval_queue.claim(self.approvers[0], self.branch), [])
+
+    def test_a_lapsed_lease_returns_the_item_to_the_queue(self):
+        [item] = approval_queue.claim(self.approvers[0], self.branch, lease_seconds=60)
+        ApprovalItem.objects.filter(pk=item.pk).update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+
+        [again] = approval_queue.claim(self.approvers[1], self.branch)
+
+        self.assertEqual(again.pk, item.pk)
+        self.assertFalse(approval_queue.renew(item, self.approvers[0]))
+        self.assertTrue(approval_queue.renew(again, self.approvers[1]))
+
+    def test_keyset_pages_cover_every_item_once(self):
+        seen, cursor = [], None
+        while True:
+            page, cursor = approval_queue.list_pending(self.branch, after=cursor, limit=2)
+            seen += [item.pk for item in page]
+            if cursor is None:
+                break
+
+        self.assertEqual(seen, [item.pk for item in self.items])
+
+
+class SyncTests(TestCase):
+
+    def setUp(self):
+        self.branch = factories.branch()
+        self.account = factories.account(self.branch)
+
+    def _transfer(self):
+        return FXTransfer.objects.create(
+            branch=self.branch, account=self.account, amount=Decimal("10.00"), exchange_rate=Decimal("129.4550"),
+            beneficiary_name="Acme Ltd", beneficiary_account_number="001", beneficiary_bank="Bank",
+            swift_code="BANKUS33", beneficiary_country="US", narration="invoice",
+        )
+
+    def test_items_follow_the_source_status(self):
+        announced = []
+        approval_queue.subscribe(announced.append)
+        self.addCleanup(approval_queue._subscribers.remove, announced.append)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            transfer = self._transfer()
+        item = ApprovalItem.objects.get(source_model="FXTransfer", source_id=transfer.pk)
+        self.assertEqual(item.status, "PENDING")
+        self.assertEqual(announced, [{"id": item.pk, "branch": self.branch.pk, "source": "FXTransfer"}])
+
+        transfer.status = "VALIDATION"
+        transfer.save()
+        item.refresh_from_db()
+        self.assertEqual(item.status, "PENDING")
+
+        transfer.status = "REJECTED"
+        transfer.save()
+        item.refresh_from_db()
+        self.assertEqual(item.status, "DONE")
+        self.assertIsNotNone(item.closed_at)
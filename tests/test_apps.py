@@ -0,0 +1,14 @@
+import sys
+
+from django.apps import apps
+from django.test import SimpleTestCase
+
+from src.apps import RECEIVER_MODULES, SrcConfig
+
+
+class AppConfigTests(SimpleTestCase):
+
+    def test_ready_imports_every_receiver_module(self):
+        self.assertIsInstance(apps.get_app_config("src"), SrcConfig)
+        for module in RECEIVER_MODULES:
+            self.assertIn(f"src.{module}", sys.modules)
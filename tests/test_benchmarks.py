@@ -0,0 +1,33 @@
+from django.test import SimpleTestCase
+
+from src import benchmarks
+
+
+class CompareTests(SimpleTestCase):
+
+    def test_skips_metrics_a_result_does_not_report(self):
+        before = {"results": {
+            "lookup.balance": {"p95_ms": 2.0, "queries_per_op": 1.0},
+            "pins.verify-64-clients": {"p95_ms": 10.0},
+            "posting.bulk-10k": {"seconds": 4.0, "queries": 30},
+            "statement.rss-pdf-all-days": {"lines": 9000, "peak_rss_kib": 80000, "growth_kib": 0},
+        }}
+        after = {"results": {
+            "lookup.balance": {"p95_ms": 3.0, "queries_per_op": 1.0},
+            "pins.verify-64-clients": {"p95_ms": 10.5},
+            "posting.bulk-10k": {"seconds": 9.0, "queries": 30},
+            "statement.rss-pdf-all-days": {"lines": 9000, "peak_rss_kib": 96000, "growth_kib": 500},
+            "statement.rss-csv-all-days": {"lines": 9000, "peak_rss_kib": 90000, "growth_kib": 0},
+        }}
+
+        regressions = benchmarks.compare(before, after)
+
+        self.assertEqual(
+            [(r["benchmark"], r["metric"]) for r in regressions],
+            [
+                ("lookup.balance", "p95_ms"),
+                ("posting.bulk-10k", "seconds"),
+                ("statement.rss-pdf-all-days", "peak_rss_kib"),
+            ],
+        )
+        self.assertEqual(regressions[1]["change"], 1.25)
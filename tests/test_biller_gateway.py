@@ -0,0 +1,164 @@
+import asyncio
+import time
+from decimal import Decimal
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase
+
+from src import biller_gateway
+from src.biller_gateway import Bill, BillCache, BillerGateway, CircuitBreaker
+from src.biller_stub import StubBiller
+from src.models import BillPayment
+
+from . import factories
+
+
+class CircuitBreakerTests(SimpleTestCase):
+
+    def test_lost_half_open_trial_is_replaced_after_the_reset_interval(self):
+        breaker = CircuitBreaker(failures=2, reset_seconds=30)
+        with mock.patch.object(biller_gateway.time, "monotonic", return_value=100.0):
+            breaker.record_failure()
+            breaker.record_failure()
+            self.assertFalse(breaker.allow())
+
+        with mock.patch.object(biller_gateway.time, "monotonic", return_value=131.0):
+            self.assertTrue(breaker.allow())
+            # The trial is in flight; nobody else gets through.
+            self.assertFalse(breaker.allow())
+
+        with mock.patch.object(biller_gateway.time, "monotonic", return_value=162.0):
+            self.assertTrue(breaker.allow())
+            breaker.record_success()
+            self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+
+class BillCacheTests(SimpleTestCase):
+
+    def _bill(self, reference, fetched_at):
+        return Bill("888880", reference, "Customer", Decimal("100.00"), fetched_at)
+
+    def test_expired_bills_are_swept_and_size_is_bounded(self):
+        cache = BillCache(ttl=60, max_entries=2)
+        with mock.patch.object(biller_gateway.time, "monotonic", return_value=1000.0):
+            cache.put(("888880", "1"), self._bill("1", 900.0))
+            cache.put(("888880", "2"), self._bill("2", 990.0))
+            self.assertEqual(len(cache), 1)
+
+            cache.put(("888880", "3"), self._bill("3", 995.0))
+            cache.put(("888880", "4"), self._bill("4", 999.0))
+
+            self.assertEqual(len(cache), 2)
+            self.assertIsNone(cache.get(("888880", "2")))
+            self.assertIsNotNone(cache.get(("888880", "4")))
+
+    async def test_a_bill_evicted_mid_fetch_is_not_cached(self):
+        cache = BillCache()
+        key = ("888880", "1")
+        release = asyncio.Event()
+
+        async def fetch():
+            await release.wait()
+            return self._bill("1", time.monotonic())
+
+        pending = asyncio.ensure_future(cache.get_or_fetch(key, fetch))
+        await asyncio.sleep(0)
+        cache.evict(key)
+        release.set()
+
+        self.assertEqual((await pending).reference_number, "1")
+        self.assertIsNone(cache.get(key))
+
+
+class GatewayTests(SimpleTestCase):
+    """Against biller_stub.py on a local port."""
+
+    async def _gateway(self, **stub_options):
+        stub = StubBiller(latency=0.0, **stub_options)
+        base_url = await stub.start()
+        gateway = BillerGateway(base_url)
+
+        async def stop():
+            await gateway.close()
+            await stub.stop()
+
+        return stub, gateway, stop
+
+    async def test_validate_checks_the_bill_or_asks_the_biller(self):
+        stub, gateway, stop = await self._gateway()
+        try:
+            due = Decimal(stub.bill("888880", "12345")["amount_due"])
+
+            self.assertTrue((await gateway.validate("888880", "12345", due)).ok)
+            too_much = await gateway.validate("888880", "12345", due + 1)
+            self.assertFalse(too_much.ok)
+            self.assertEqual(too_much.bill.amount_due, due)
+            self.assertFalse((await gateway.validate("888880", "12340", "10.00")).ok)
+            self.assertTrue((await gateway.validate("888880", "12345", "10.00", False)).ok)
+            self.assertFalse((await gateway.validate("888880", "12340", "10.00", False)).ok)
+        finally:
+            await stop()
+
+    async def test_concurrent_fetches_of_one_bill_share_a_request(self):
+        stub, gateway, stop = await self._gateway()
+        stub.latency = 0.05
+        try:
+            results = await asyncio.gather(*(gateway.validate("888880", "777", "1.00") for _ in range(20)))
+
+            self.assertTrue(all(result.ok for result in results))
+            self.assertEqual(stub.requests, 1)
+            await gateway.validate("888880", "777", "1.00")
+            self.assertEqual(stub.requests, 1)
+        finally:
+            await stop()
+
+    async def test_5xx_opens_the_breaker(self):
+        stub, gateway, stop = await self._gateway(failure_rate=1.0)
+        try:
+            for n in range(biller_gateway.BREAKER_FAILURES):
+                with self.assertRaises(biller_gateway.BillerUnavailable):
+                    await gateway.validate("888880", f"{n}1", "1.00")
+            self.assertEqual(gateway.breaker("888880").state, CircuitBreaker.OPEN)
+
+            with self.assertRaises(biller_gateway.BillerUnavailable):
+                await gateway.validate("888880", "99", "1.00")
+            self.assertEqual(stub.requests, biller_gateway.BREAKER_FAILURES)
+            # Other billers are not affected.
+            self.assertEqual(gateway.breaker("222111").state, CircuitBreaker.CLOSED)
+        finally:
+            await stop()
+
+    async def test_4xx_rejects_the_payment_without_tripping_the_breaker(self):
+        stub, gateway, stop = await self._gateway()
+        try:
+            for _ in range(biller_gateway.BREAKER_FAILURES + 1):
+                with self.assertRaises(biller_gateway.PaymentRejected):
+                    await gateway.validate("888880", "12345", "1000000.00", False)
+                self.assertFalse((await gateway.validate("888880", "12340", "1.00", False)).ok)
+
+            self.assertEqual(gateway.breaker("888880").state, CircuitBreaker.CLOSED)
+            self.assertEqual(stub.requests, 2 * (biller_gateway.BREAKER_FAILURES + 1))
+        finally:
+            await stop()
+
+
+class PaidBillTests(TestCase):
+
+    def test_a_committed_payment_evicts_its_bill(self):
+        key = ("888880", "12345")
+
+        async def cache_bill(gateway):
+            gateway.cache.put(key, Bill(*key, "Customer", Decimal("100.00"), time.monotonic()))
+
+        async def cached(gateway):
+            return gateway.cache.get(key)
+
+        biller_gateway.run(cache_bill)
+        branch = factories.branch()
+        with self.captureOnCommitCallbacks(execute=True):
+            BillPayment.objects.create(
+                branch=branch, source_account=factories.account(branch), biller_name="Water",
+                paybill_number=key[0], reference_number=key[1], amount=Decimal("100.00"),
+            )
+
+        self.assertIsNone(biller_gateway.run(cached))
@@ -0,0 +1,65 @@
+from decimal import Decimal
+
+from django.test import TestCase
+
+from src import bulk_posting, ledger
+from src.models import CashWithdrawal, CustomerAccount, FundsTransfer
+
+from . import factories
+
+
+class FundsCheckTests(TestCase):
+
+    def setUp(self):
+        self.branch = factories.branch("NRB02")
+        self.user = factories.user()
+        self.account = factories.account(self.branch, balance=Decimal("1000.00"))
+
+    def _row(self, kind, amount, **extra):
+        return dict(type=kind, account_number=self.account.account_number, amount=amount, narration="upload", **extra)
+
+    def test_debits_beyond_the_balance_are_rejected(self):
+        result = bulk_posting.post_batch([
+            self._row(bulk_posting.WITHDRAWAL, "600.00"),
+            self._row(bulk_posting.WITHDRAWAL, "600.00"),
+            self._row(bulk_posting.DEPOSIT, "300.00"),
+            self._row(bulk_posting.WITHDRAWAL, "600.00"),
+        ], self.branch, self.user)
+
+        self.assertEqual(result.posted, 3)
+        self.assertEqual([(f.row, f.error) for f in result.failures], [(1, "insufficient funds")])
+        self.assertEqual(ledger.account_balance(self.account.pk), Decimal("100.00"))
+        self.assertTrue(all(w.reference.startswith("WDLNRB02") for w in CashWithdrawal.objects.all()))
+
+    def test_legacy_balance_counts_and_is_not_overwritten(self):
+        CustomerAccount.objects.filter(pk=self.account.pk).update(balance=Decimal("5000.00"), ledger_opened_at=None)
+        ledger.LedgerEntry.objects.filter(posting_reference=ledger.opening_reference(self.account.pk)).delete()
+
+        result = bulk_posting.post_batch([self._row(bulk_posting.WITHDRAWAL, "4000.00")], self.branch, self.user)
+
+        self.assertEqual(result.posted, 1)
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, Decimal("5000.00"))
+        self.assertEqual(ledger.account_balance(self.account.pk), Decimal("1000.00"))
+
+    def test_accounts_changed_after_validation_fail_per_row(self):
+        beneficiary = factories.account(self.branch)
+        closed = factories.account(self.branch, balance=Decimal("100.00"))
+        result = bulk_posting.BatchResult(total=3)
+        rows = bulk_posting._parse([
+            self._row(bulk_posting.TRANSFER, "10.00", beneficiary_account=beneficiary.account_number,
+                      beneficiary_name="Gone"),
+            dict(type=bulk_posting.DEPOSIT, account_number=closed.account_number, amount="5.00"),
+            self._row(bulk_posting.DEPOSIT, "5.00"),
+        ], result)
+        beneficiary.delete()
+        CustomerAccount.objects.filter(pk=closed.pk).update(status="CLOSED")
+
+        posted = bulk_posting._post_chunk(rows, self.branch, self.user, result)
+
+        self.assertEqual(posted, 1)
+        self.assertEqual([(f.row, f.error) for f in result.failures], [
+            (0, "beneficiary account no longer exists"),
+            (1, "account is CLOSED"),
+        ])
+        self.assertFalse(FundsTransfer.objects.exists())
@@ -0,0 +1,58 @@
+from decimal import Decimal
+
+from django.test import TestCase
+
+from src import card_limits
+from src.models import Card
+
+from . import factories
+
+
+class LimitEngineTests(TestCase):
+
+    def setUp(self):
+        branch = factories.branch()
+        self.card = Card.objects.create(
+            branch=branch, account=factories.account(branch), card_type="DEBIT", card_tier="CLASSIC",
+            name_on_card="W KAMAU", daily_pos_limit=Decimal("1000.00"), daily_atm_limit=Decimal("500.00"),
+            status="ACTIVE",
+        )
+        # Two authorization workers sharing one cache.
+        self.workers = [card_limits.LimitEngine(card_limits.MemoryCounters()) for _ in range(2)]
+
+    def _authorize(self, worker, amount):
+        return self.workers[worker].authorize(self.card.pk, card_limits.POS, amount)
+
+    def test_a_status_change_reaches_every_worker(self):
+        self.assertTrue(self._authorize(0, "100.00").approved)
+        self.assertTrue(self._authorize(1, "100.00").approved)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.card.status = "BLOCKED"
+            self.card.save()
+
+        for worker in (0, 1):
+            self.assertEqual(self._authorize(worker, "1.00").reason, "card inactive")
+
+    def test_only_active_cards_are_authorized(self):
+        Card.objects.filter(pk=self.card.pk).update(status="PENDING")
+        card_limits.invalidate(self.card.pk)
+        self.assertFalse(self._authorize(0, "1.00").approved)
+
+    def test_zero_and_negative_amounts_are_refused(self):
+        for amount in ("0.00", "-500.00", "0.001"):
+            decision = self._authorize(0, amount)
+            self.assertEqual((decision.approved, decision.reason), (False, "invalid amount"))
+        with self.assertRaises(ValueError):
+            self.workers[0].reverse(self.card.pk, card_limits.POS, "-500.00")
+
+        # Nothing above moved the day's spend.
+        self.assertTrue(self._authorize(0, "1000.00").approved)
+        self.assertFalse(self._authorize(0, "0.01").approved)
+
+    def test_a_new_limit_applies_without_a_restart(self):
+        self.assertFalse(self._authorize(0, "1500.00").approved)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.card.daily_pos_limit = Decimal("2000.00")
+            self.card.save()
+        self.assertTrue(self._authorize(0, "1500.00").approved)
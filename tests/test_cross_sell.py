@@ -0,0 +1,55 @@
+from decimal import Decimal
+
+from django.test import TestCase
+
+from src import cross_sell
+from src.models import AccountTypeAddOn, AddOn, Card
+
+from . import factories
+
+
+class EligibilityTests(TestCase):
+
+    def setUp(self):
+        self.branch = factories.branch()
+        self.savings = factories.account_type("SAVINGS")
+        self.current = factories.account_type("CURRENT")
+        self.addon = AddOn.objects.create(code="SMS", name="SMS alerts", description="SMS alerts")
+        AccountTypeAddOn.objects.create(account_type=self.savings, addon=self.addon)
+
+    def _chunk(self, customer):
+        space = cross_sell.feature_space()
+        rows = [(customer.pk, customer.occupation, customer.monthly_income_range, customer.created_at,
+                 customer.aml_screening_status)]
+        return space, cross_sell.build_chunk(space, rows)
+
+    def _eligible(self, customer):
+        space, chunk = self._chunk(customer)
+        return {(kind, offer.code) for (kind, offer), ok in zip(space.offers, chunk.eligible[0]) if ok}
+
+    def test_customer_without_an_account_is_offered_account_types(self):
+        customer = factories.customer(self.branch)
+
+        self.assertEqual(
+            self._eligible(customer),
+            {(cross_sell.ACCOUNT_TYPE, "SAVINGS"), (cross_sell.ACCOUNT_TYPE, "CURRENT")},
+        )
+
+    def test_linked_addons_need_a_held_account_type(self):
+        account = factories.account(self.branch, kind=self.savings)
+
+        self.assertEqual(
+            self._eligible(account.customer),
+            {(cross_sell.ACCOUNT_TYPE, "CURRENT"), (cross_sell.ADDON, "SMS")},
+        )
+
+    def test_infinite_cards_have_their_own_tier(self):
+        account = factories.account(self.branch, kind=self.savings)
+        Card.objects.create(
+            branch=self.branch, account=account, card_type="DEBIT", card_tier="Infinite", name_on_card="W KAMAU",
+            daily_pos_limit=Decimal("100000.00"), daily_atm_limit=Decimal("40000.00"),
+        )
+
+        space, chunk = self._chunk(account.customer)
+        tiers = chunk.features[0, space.tier_start:space.volume_start]
+        self.assertEqual(tiers.tolist(), [0.0, 0.0, 0.0, 1.0, 0.0])
@@ -0,0 +1,72 @@
+from django.test import TestCase
+
+from src import customer_search
+from src.models import CustomerNameGram
+
+from . import factories
+
+
+class NormalisationTests(TestCase):
+
+    def test_phone_formats_normalise_to_one_key(self):
+        for raw in ("0712 345 678", "+254712345678", "254-712-345-678", "712345678"):
+            self.assertEqual(customer_search.normalize_phone(raw), "254712345678")
+        self.assertEqual(customer_search.normalize_phone("0512345678x"), "")
+        self.assertEqual(customer_search.normalize_phone("12345"), "")
+
+    def test_names_lose_accents_case_and_punctuation(self):
+        self.assertEqual(customer_search.normalize_name("  Njoroge-Kamau, Zoë "), "njoroge kamau zoe")
+
+    def test_save_stores_the_search_keys(self):
+        customer = factories.customer(factories.branch(), kra_pin=" a123456789b ", mobile_number="+254 722 000 111")
+        customer.refresh_from_db()
+        self.assertEqual(customer.kra_pin, "A123456789B")
+        self.assertEqual(customer.mobile_normalized, "254722000111")
+        self.assertEqual(customer.name_normalized, "wanjiru kamau")
+
+
+class SearchTests(TestCase):
+
+    def setUp(self):
+        self.branch = factories.branch()
+        self.wanjiru = factories.customer(
+            self.branch, full_name="Wanjiru Kamau", national_id="12345678",
+            kra_pin="A123456789B", mobile_number="0712345678",
+        )
+        self.otieno = factories.customer(
+            self.branch, full_name="Otieno Odhiambo", national_id="87654321",
+            kra_pin="P987654321C", mobile_number="0733000111",
+        )
+
+    def _found(self, query, **kwargs):
+        return [(hit.customer.pk, hit.matched_on) for hit in customer_search.search(query, **kwargs)]
+
+    def test_identifiers_match_exactly(self):
+        self.assertEqual(self._found("a123456789b"), [(self.wanjiru.pk, "kra_pin")])
+        self.assertEqual(self._found("87654321"), [(self.otieno.pk, "national_id")])
+        self.assertEqual(self._found("+254 712 345 678"), [(self.wanjiru.pk, "mobile")])
+        self.assertEqual(self._found("733-000-111"), [(self.otieno.pk, "mobile")])
+
+    def test_fuzzy_name_fallback_uses_the_gram_table(self):
+        self.assertTrue(CustomerNameGram.objects.filter(customer=self.wanjiru).exists())
+
+        hits = customer_search.search("wanjiro kamau")
+
+        self.assertEqual([hit.customer.pk for hit in hits], [self.wanjiru.pk])
+        self.assertEqual(hits[0].matched_on, "name")
+        self.assertGreaterEqual(hits[0].score, customer_search.MIN_NAME_SIMILARITY)
+
+    def test_renamed_customer_is_found_by_the_new_name(self):
+        self.otieno.full_name = "Achieng Otieno"
+        self.otieno.save()
+
+        self.assertEqual([pk for pk, _ in self._found("achieng")], [self.otieno.pk])
+        self.assertEqual(self._found("odhiambo"), [])
+
+    def test_own_branch_ranks_first_on_a_tie(self):
+        other = factories.branch()
+        twin = factories.customer(other, full_name="Wanjiru Kamau")
+
+        hits = customer_search.search("Wanjiru Kamau", branch=other)
+
+        self.assertEqual([hit.customer.pk for hit in hits], [twin.pk, self.wanjiru.pk])
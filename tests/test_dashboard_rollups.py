@@ -0,0 +1,76 @@
+from decimal import Decimal
+
+from django.test import TestCase
+from django.utils import timezone
+
+from src import dashboard_rollups
+from src.models import CashDeposit, FXTransfer, ServiceDailyRollup
+
+from . import factories
+
+
+class RollupTests(TestCase):
+
+    def setUp(self):
+        self.branch = factories.branch()
+        self.account = factories.account(self.branch)
+
+    def _deposit(self, amount):
+        return CashDeposit.objects.create(
+            branch=self.branch, account=self.account, amount=Decimal(amount), narration="in",
+        )
+
+    def _transfer(self, amount, rate, status="PENDING"):
+        return FXTransfer.objects.create(
+            branch=self.branch, account=self.account, amount=Decimal(amount), exchange_rate=Decimal(rate),
+            beneficiary_name="Acme Ltd", beneficiary_account_number="001", beneficiary_bank="Bank",
+            swift_code="BANKUS33", beneficiary_country="US", narration="invoice", status=status,
+        )
+
+    def test_saves_are_counted_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self._deposit("100.00")
+            self._deposit("50.50")
+
+        counts = dashboard_rollups.dashboard_counts(self.branch)
+        self.assertEqual(counts["cash-deposit"]["count"], 2)
+        self.assertEqual(counts["cash-deposit"]["amount"], Decimal("150.50"))
+
+    def test_fx_transfers_are_valued_in_kes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self._transfer("100.00", "129.4550")
+
+        entry = dashboard_rollups.dashboard_counts(self.branch)["fx-transfer"]
+        self.assertEqual(entry["amount"], Decimal("12945.50"))
+        self.assertEqual(entry["by_status"], {"PENDING": 1})
+
+    def test_status_changes_move_the_row_between_buckets(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            transfer = self._transfer("10.00", "100.0000")
+        with self.captureOnCommitCallbacks(execute=True):
+            transfer.status = "REJECTED"
+            transfer.save()
+
+        entry = dashboard_rollups.dashboard_counts(self.branch)["fx-transfer"]
+        self.assertEqual(entry["count"], 1)
+        self.assertEqual(entry["by_status"], {"PENDING": 0, "REJECTED": 1})
+
+    def test_reconcile_rebuilds_from_the_source_tables(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self._deposit("100.00")
+            self._transfer("100.00", "129.4550")
+        # A missed signal and a stray bucket, both fixed by the rebuild.
+        CashDeposit.objects.bulk_create([
+            CashDeposit(branch=self.branch, account=self.account, amount=Decimal("25.00"),
+                        narration="bulk", reference="DEPBULK0000000001"),
+        ])
+        dashboard_rollups.bump(self.branch.pk, timezone.localdate(), "cheque-book", "PENDING", 3, Decimal("0"))
+
+        dashboard_rollups.reconcile()
+
+        counts = dashboard_rollups.dashboard_counts(self.branch)
+        self.assertEqual(counts["cash-deposit"]["count"], 2)
+        self.assertEqual(counts["cash-deposit"]["amount"], Decimal("125.00"))
+        self.assertEqual(counts["fx-transfer"]["amount"], Decimal("12945.50"))
+        self.assertNotIn("cheque-book", counts)
+        self.assertFalse(ServiceDailyRollup.objects.filter(service="cheque-book").exists())
@@ -0,0 +1,91 @@
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import mock
+
+import numpy as np
+from django.test import TestCase
+
+from src import end_of_day, ledger
+from src.models import BatchRun, CustomerAccount, LedgerEntry
+
+from . import factories
+
+
+RUN_DATE = date(2026, 3, 10)
+MONTH_END = date(2026, 3, 31)
+
+
+class EndOfDayTests(TestCase):
+
+    def setUp(self):
+        self.branch = factories.branch()
+        # 10% a year on 36,500.00 is exactly 10.00 a day.
+        self.kind = factories.account_type("EOD_SAVINGS", interest_rate=Decimal("10.00"))
+        self.accounts = [
+            factories.account(self.branch, balance=Decimal("36500.00"), kind=self.kind) for _ in range(3)
+        ]
+
+    def _accrued(self):
+        return list(
+            CustomerAccount.objects
+            .filter(pk__in=[account.pk for account in self.accounts])
+            .order_by("pk")
+            .values_list("accrued_interest", flat=True)
+        )
+
+    def test_restart_resumes_without_accruing_twice(self):
+        real = ledger.account_balances
+        calls = []
+
+        def fail_second_chunk(account_ids):
+            calls.append(account_ids)
+            if len(calls) == 2:
+                raise RuntimeError("worker died")
+            return real(account_ids)
+
+        with mock.patch.object(ledger, "account_balances", side_effect=fail_second_chunk):
+            stats = end_of_day.run(RUN_DATE, workers=1, chunk_size=1)
+
+        self.assertEqual(stats.failed, 1)
+        self.assertEqual(BatchRun.objects.get(run_date=RUN_DATE).status, "FAILED")
+        self.assertEqual(self._accrued(), [Decimal("10.0000"), Decimal("0.0000"), Decimal("0.0000")])
+
+        stats = end_of_day.run(RUN_DATE, workers=1, chunk_size=1)
+
+        self.assertEqual(stats.failed, 0)
+        self.assertEqual(stats.accounts, 3)
+        self.assertEqual(stats.interest_accrued, Decimal("30.0000"))
+        self.assertEqual(BatchRun.objects.get(run_date=RUN_DATE).status, "COMPLETED")
+        self.assertEqual(self._accrued(), [Decimal("10.0000")] * 3)
+
+    def test_missed_dates_are_caught_up(self):
+        BatchRun.objects.create(run_date=RUN_DATE, status="COMPLETED")
+
+        end_of_day.run(RUN_DATE + timedelta(days=3), workers=1)
+
+        self.assertEqual(
+            list(BatchRun.objects.filter(status="COMPLETED").order_by("run_date").values_list("run_date", flat=True)),
+            [RUN_DATE + timedelta(days=n) for n in range(4)],
+        )
+        self.assertEqual(self._accrued(), [Decimal("30.0000")] * 3)
+
+    def test_interest_rounds_half_up_in_whole_hundredths_of_a_cent(self):
+        CustomerAccount.objects.filter(pk=self.accounts[0].pk).update(accrued_interest=Decimal("0.0049"))
+
+        end_of_day.run(RUN_DATE, workers=1)
+
+        self.assertEqual(self._accrued()[0], Decimal("10.0049"))
+        self.assertEqual(end_of_day._daily_interest(np.array([1]), np.array([18250], dtype=object))[0], 1)
+
+    def test_month_end_leaves_legacy_balances_alone(self):
+        opened, legacy = self.accounts[0], self.accounts[1]
+        # From before the ledger: no opening entry, money only in the column.
+        LedgerEntry.objects.filter(account_id=legacy.pk).delete()
+        CustomerAccount.objects.filter(pk=legacy.pk).update(ledger_opened_at=None)
+
+        end_of_day.run(MONTH_END, workers=1)
+
+        self.assertEqual(CustomerAccount.objects.get(pk=opened.pk).balance, Decimal("36510.00"))
+        self.assertEqual(CustomerAccount.objects.get(pk=legacy.pk).balance, Decimal("36500.00"))
+        self.assertEqual(ledger.account_balance(legacy.pk), Decimal("36510.00"))
+        self.assertEqual(self._accrued()[:2], [Decimal("0.0000")] * 2)
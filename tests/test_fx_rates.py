@@ -0,0 +1,98 @@
+import random
+from decimal import ROUND_HALF_UP, Decimal
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase
+
+from src import fx_rates
+from src.models import Currency, FXBuy, FXQuote
+
+from . import factories
+
+
+RATES = {"USD": Decimal("129.4550"), "EUR": Decimal("140.1235"), "ZAR": Decimal("0.5000")}
+
+
+@mock.patch.object(fx_rates, "get_rate", lambda code: code)
+@mock.patch.object(fx_rates, "customer_rate", lambda snapshot, side: RATES[snapshot])
+class ConvertBatchTests(SimpleTestCase):
+
+    def test_matches_quote_rounding_to_the_cent(self):
+        rng = random.Random(7)
+        codes = [rng.choice(list(RATES)) for _ in range(5000)]
+        amounts = [Decimal(rng.randrange(1, 10 ** 9)).scaleb(-2) for _ in codes]
+        amounts[:2] = [Decimal("0.10"), Decimal("100.00")]
+
+        rates, kes = fx_rates.convert_batch(codes, amounts)
+
+        expected = [
+            (amount * RATES[code]).quantize(fx_rates.CENTS, rounding=ROUND_HALF_UP)
+            for code, amount in zip(codes, amounts)
+        ]
+        self.assertEqual(kes, expected)
+        self.assertEqual(rates[0], RATES[codes[0]])
+
+    def test_halves_round_up(self):
+        # 1.05 x 0.5 = 0.525 -> 0.53; float64 rounding gave 0.52.
+        self.assertEqual(fx_rates.convert_batch(["ZAR"], ["1.05"])[1], [Decimal("0.53")])
+
+    def test_amounts_beyond_int64(self):
+        self.assertEqual(
+            fx_rates.convert_batch(["USD"], [Decimal("10") ** 15])[1],
+            [Decimal("129455000000000000.00")],
+        )
+
+
+class QuotedSaveTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        fx_rates.local_rates.clear()
+        Currency.objects.get_or_create(code="USD", defaults={"name": "US Dollar"})
+        fx_rates.publish_rates({"USD": ("128.0000", "130.0000")})
+        self.branch = factories.branch()
+        self.account = factories.account(self.branch)
+
+    def _quote(self, side=fx_rates.CUSTOMER_BUYS, amount="100.00", **kwargs):
+        return FXQuote.objects.get(quote_id=fx_rates.quote("USD", side, amount, self.branch, **kwargs).quote_id)
+
+    def _buy(self, quote, model=FXBuy, amount="100.00"):
+        return model.objects.create(
+            branch=self.branch, account=self.account, amount=Decimal(amount), exchange_rate=Decimal("1.0000"),
+            kes_equivalent=Decimal("1.00"), quote=quote, narration="USD purchase",
+        )
+
+    def test_save_consumes_the_quote_and_takes_its_prices(self):
+        quote = self._quote()
+
+        buy = self._buy(quote)
+
+        buy.refresh_from_db()
+        self.assertEqual((buy.exchange_rate, buy.kes_equivalent), (Decimal("130.0000"), Decimal("13000.00")))
+        quote.refresh_from_db()
+        self.assertEqual(quote.status, "USED")
+
+    def test_used_and_expired_quotes_are_refused(self):
+        quote = self._quote()
+        self._buy(quote)
+        with self.assertRaises(fx_rates.QuoteExpired):
+            self._buy(quote)
+        with self.assertRaises(fx_rates.QuoteExpired):
+            self._buy(self._quote(ttl=-1))
+
+    def test_quote_must_match_side_and_amount(self):
+        with self.assertRaises(fx_rates.QuoteMismatch):
+            self._buy(self._quote(side=fx_rates.CUSTOMER_SELLS))
+        with self.assertRaises(fx_rates.QuoteMismatch):
+            self._buy(self._quote(), amount="99.99")
+        self.assertFalse(FXQuote.objects.filter(status="USED").exists())
+
+    def test_resaving_does_not_consume_again(self):
+        buy = self._buy(self._quote())
+        buy.status = "COMPLETED"
+        buy.save()
+        self.assertEqual(buy.status, "COMPLETED")
+
+    def test_quote_rounds_the_foreign_amount_half_up(self):
+        self.assertEqual(self._quote(amount="10.125").fcy_amount, Decimal("10.13"))
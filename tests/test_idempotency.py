@@ -0,0 +1,97 @@
+import json
+from decimal import Decimal
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import transaction
+from django.http import JsonResponse
+from django.test import RequestFactory, TestCase
+
+from src import idempotency, ledger
+from src.models import CashDeposit, IdempotencyKey
+
+from . import factories
+
+
+class ReplayTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.branch = factories.branch()
+        self.account = factories.account(self.branch)
+        self.fields = dict(branch=self.branch, account=self.account, amount=Decimal("500.00"), narration="cash")
+
+    def test_replay_returns_the_first_deposit_without_posting_again(self):
+        first, replayed = idempotency.create_once(CashDeposit, "till-7-0001", **self.fields)
+        self.assertFalse(replayed)
+
+        cache.clear()  # served from the key table as well as the cache
+        for _ in range(2):
+            again, replayed = idempotency.create_once(CashDeposit, "till-7-0001", **self.fields)
+            self.assertTrue(replayed)
+            self.assertEqual(again.pk, first.pk)
+
+        self.assertEqual(CashDeposit.objects.count(), 1)
+        self.assertEqual(ledger.account_balance(self.account.pk), Decimal("500.00"))
+
+    def test_key_reused_for_another_request_is_refused(self):
+        idempotency.create_once(CashDeposit, "till-7-0002", **self.fields)
+
+        with self.assertRaises(idempotency.IdempotencyKeyReused):
+            idempotency.create_once(CashDeposit, "till-7-0002", **dict(self.fields, amount=Decimal("600.00")))
+
+    def test_duplicate_that_lost_the_race_replays_the_winner(self):
+        first, _ = idempotency.create_once(CashDeposit, "till-7-0003", **self.fields)
+        digest = idempotency.request_hash(idempotency._payload(self.fields))
+        winner = idempotency._stored("CashDeposit", "till-7-0003", digest)
+
+        # The duplicate looked before the first request committed, then hit
+        # the unique key on insert.
+        with mock.patch.object(idempotency, "_stored", side_effect=[None, winner]):
+            again, replayed = idempotency.create_once(CashDeposit, "till-7-0003", **self.fields)
+
+        self.assertTrue(replayed)
+        self.assertEqual(again.pk, first.pk)
+        self.assertEqual(IdempotencyKey.objects.count(), 1)
+        self.assertEqual(CashDeposit.objects.count(), 1)
+
+    def test_outer_rollback_leaves_nothing_to_replay(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            idempotency.create_once(CashDeposit, "till-7-0005", **self.fields)
+            raise RuntimeError("teller screen crashed")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            deposit, replayed = idempotency.create_once(CashDeposit, "till-7-0005", **self.fields)
+
+        self.assertFalse(replayed)
+        self.assertEqual(list(CashDeposit.objects.values_list("pk", flat=True)), [deposit.pk])
+        self.assertEqual(ledger.account_balance(self.account.pk), Decimal("500.00"))
+
+    def test_key_pointing_at_a_missing_row_runs_again(self):
+        digest = idempotency.request_hash(idempotency._payload(self.fields))
+        cache.set(idempotency._cache_key("CashDeposit", "till-7-0006"), (digest, 201, None, "CashDeposit", 999999))
+
+        deposit, replayed = idempotency.create_once(CashDeposit, "till-7-0006", **self.fields)
+
+        self.assertFalse(replayed)
+        self.assertEqual(IdempotencyKey.objects.get(key="till-7-0006").source_id, deposit.pk)
+
+    def test_view_replays_the_stored_response(self):
+        calls = []
+
+        @idempotency.idempotent_view("deposit")
+        def view(request):
+            calls.append(request)
+            return JsonResponse({"reference": "DEP1"}, status=201)
+
+        def post():
+            return view(RequestFactory().post(
+                "/deposit", data=json.dumps({"amount": "500.00"}), content_type="application/json",
+                HTTP_IDEMPOTENCY_KEY="till-7-0004",
+            ))
+
+        first, second = post(), post()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual((second.status_code, second.content), (first.status_code, first.content))
+        self.assertEqual(second["Idempotent-Replayed"], "true")
@@ -0,0 +1,121 @@
+from decimal import Decimal
+
+from django.test import TestCase
+
+from src import instrumentation
+from src.models import Card, CardReplacement, CashDeposit, Currency, DenominationExchange
+
+from . import factories
+
+
+# Queries per save, including the on_commit work it schedules. Raise one
+# only together with the change that needs it.
+SAVE_BUDGETS = {
+    CashDeposit: 24,
+    CardReplacement: 5,
+    DenominationExchange: 25,
+}
+
+
+class InstrumentationTests(TestCase):
+
+    def setUp(self):
+        for histogram in instrumentation.HISTOGRAMS:
+            histogram.reset()
+        # Saves that raised in earlier tests left measurements open.
+        instrumentation._open_measurements().clear()
+        self.branch = factories.branch()
+        self.account = factories.account(self.branch)
+
+    def _deposit(self):
+        return CashDeposit.objects.create(
+            branch=self.branch, account=self.account, amount=Decimal("100.00"), narration="in",
+        )
+
+    def _series(self, histogram, operation):
+        return {
+            dict(labels)["model"]: values
+            for labels, values in histogram._series.items() if dict(labels)["operation"] == operation
+        }
+
+    def test_saves_are_measured_per_model(self):
+        self._deposit()
+
+        queries, total, count = self._series(instrumentation.QUERIES, "save")["CashDeposit"]
+        self.assertEqual(count, 1)
+        self.assertGreater(total, 0)
+        self.assertEqual(sum(queries), 1)
+        self.assertEqual(instrumentation._open_measurements(), [])
+
+    def test_prometheus_text_lists_cumulative_buckets(self):
+        with instrumentation.instrument("posting", model="CashDeposit", branch=7):
+            self._deposit()
+
+        text = instrumentation.render_prometheus()
+
+        self.assertIn("# TYPE bank_operation_queries histogram", text)
+        labels = 'operation="posting",model="CashDeposit",branch="7"'
+        self.assertIn(f'bank_operation_queries_bucket{{{labels},le="+Inf"}} 1', text)
+        self.assertIn(f"bank_operation_queries_count{{{labels}}} 1", text)
+        buckets = [
+            int(line.rsplit(" ", 1)[1]) for line in text.splitlines()
+            if line.startswith(f"bank_operation_queries_bucket{{{labels}")
+        ]
+        self.assertEqual(buckets, sorted(buckets))
+        self.assertTrue(text.endswith("\n"))
+
+    def test_an_operation_drops_what_a_failed_save_left_open(self):
+        with instrumentation.instrument("posting"):
+            # pre_save opened a measurement; the save then raised.
+            instrumentation._start_save(CashDeposit, CashDeposit(branch=self.branch))
+            self.assertEqual(len(instrumentation._open_measurements()), 2)
+
+        self.assertEqual(instrumentation._open_measurements(), [])
+        self.assertNotIn("CashDeposit", self._series(instrumentation.QUERIES, "save"))
+
+    def test_budget_overrun_lists_the_queries(self):
+        with self.assertRaises(instrumentation.QueryBudgetExceeded) as raised:
+            with instrumentation.assert_max_queries(1):
+                list(Currency.objects.all())
+                list(Card.objects.all())
+
+        message = str(raised.exception)
+        self.assertTrue(message.startswith("2 queries (budget 1):"))
+        self.assertIn("  2. SELECT", message)
+
+
+class SaveBudgetTests(TestCase):
+
+    def setUp(self):
+        self.branch = factories.branch()
+        self.account = factories.account(self.branch)
+        self.user = factories.user()
+
+    def _within_budget(self, model, create):
+        with instrumentation.assert_max_queries(SAVE_BUDGETS[model]):
+            with self.captureOnCommitCallbacks(execute=True):
+                create()
+
+    def test_cash_deposit(self):
+        self._within_budget(CashDeposit, lambda: CashDeposit.objects.create(
+            branch=self.branch, account=self.account, amount=Decimal("100.00"), narration="in",
+            created_by=self.user,
+        ))
+
+    def test_card_replacement(self):
+        card = Card.objects.create(
+            branch=self.branch, account=self.account, card_type="DEBIT", card_tier="CLASSIC",
+            name_on_card="WANJIRU KAMAU", daily_pos_limit=Decimal("50000"), daily_atm_limit=Decimal("20000"),
+        )
+        self._within_budget(CardReplacement, lambda: CardReplacement.objects.create(
+            branch=self.branch, card=card, reason="LOST", delivery_method="PICKUP", pickup_branch=self.branch,
+            created_by=self.user,
+        ))
+
+    def test_denomination_exchange(self):
+        usd, _ = Currency.objects.get_or_create(code="USD", defaults={"name": "US Dollar"})
+        self._within_budget(DenominationExchange, lambda: DenominationExchange.objects.create(
+            branch=self.branch, teller=self.user, direction="BUY", currency=usd, fcy_amount=Decimal("100.00"),
+            exchange_rate=Decimal("129.4550"), kes_equivalent=Decimal("12945.50"), source_account=self.account,
+            settlement_method="CASH_COLLECTION",
+        ))
@@ -0,0 +1,40 @@
+import builtins
+import os
+import time
+from unittest import mock
+
+from django.core.files.base import ContentFile
+from django.test import SimpleTestCase
+
+from src import kyc_storage as module
+from src.kyc_storage import default_file_mode, kyc_storage
+
+
+class ContentAddressedStorageTests(SimpleTestCase):
+
+    def test_new_blob_gets_default_permissions(self):
+        name = kyc_storage.save("kyc/id-front.pdf", ContentFile(b"front"))
+
+        mode = os.stat(kyc_storage.path(name)).st_mode & 0o777
+        self.assertEqual(mode, default_file_mode())
+
+    def test_duplicate_upload_refreshes_blob_mtime(self):
+        name = kyc_storage.save("kyc/id-back.pdf", ContentFile(b"back"))
+        path = kyc_storage.path(name)
+        stale = time.time() - 2 * 60 * 60
+        os.utime(path, (stale, stale))
+
+        again = kyc_storage.save("kyc/other.pdf", ContentFile(b"back"))
+
+        self.assertEqual(again, name)
+        self.assertGreater(os.path.getmtime(path), stale + 60)
+
+    def test_umask_is_read_without_changing_it(self):
+        expected = os.umask(0o022)
+        os.umask(expected)
+
+        with mock.patch.object(os, "umask", side_effect=AssertionError("umask changed")):
+            self.assertEqual(module._umask(), expected)
+            # Without /proc, a probe file shows the same mask.
+            with mock.patch.object(builtins, "open", side_effect=OSError):
+                self.assertEqual(module._umask(), expected & 0o666)
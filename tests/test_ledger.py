@@ -0,0 +1,99 @@
+from decimal import Decimal
+from types import SimpleNamespace
+
+from django.test import TestCase
+
+from src import ledger
+from src.models import CashDeposit, CashWithdrawal, CustomerAccount, LedgerEntry
+
+from . import factories
+
+
+class PostingTests(TestCase):
+
+    def setUp(self):
+        self.branch = factories.branch()
+        self.account = factories.account(self.branch)
+
+    def test_deposit_and_withdrawal_post_balanced_legs(self):
+        CashDeposit.objects.create(branch=self.branch, account=self.account, amount=Decimal("500.00"), narration="in")
+        CashWithdrawal.objects.create(branch=self.branch, account=self.account, amount=Decimal("120.00"), narration="out")
+
+        for reference in LedgerEntry.objects.values_list("posting_reference", flat=True).distinct():
+            legs = LedgerEntry.objects.filter(posting_reference=reference)
+            debits = sum(leg.amount for leg in legs if leg.direction == ledger.DEBIT)
+            credits = sum(leg.amount for leg in legs if leg.direction == ledger.CREDIT)
+            self.assertEqual(debits, credits)
+        self.assertEqual(ledger.account_balance(self.account.pk), Decimal("380.00"))
+
+    def test_unbalanced_posting_is_refused(self):
+        legs = [ledger.debit_gl(ledger.GL_TELLER_CASH, Decimal("10.00")), ledger.credit_account(self.account.pk, Decimal("9.00"))]
+        with self.assertRaises(ledger.UnbalancedPosting):
+            ledger.post("BAD1", legs, self.branch.pk, "Test", 1)
+        self.assertFalse(LedgerEntry.objects.filter(posting_reference="BAD1").exists())
+
+    def test_reposting_a_reference_is_a_no_op(self):
+        legs = [ledger.debit_gl(ledger.GL_TELLER_CASH, Decimal("10.00")), ledger.credit_account(self.account.pk, Decimal("10.00"))]
+        ledger.post("DUP1", legs, self.branch.pk, "Test", 1)
+        self.assertEqual(ledger.post("DUP1", legs, self.branch.pk, "Test", 1), [])
+        self.assertEqual(ledger.account_balance(self.account.pk), Decimal("10.00"))
+
+    def test_bulk_balances_mix_snapshotted_and_unsnapshotted_accounts(self):
+        other = factories.account(self.branch)
+        CashDeposit.objects.create(branch=self.branch, account=other, amount=Decimal("30.00"), narration="in")
+        CashDeposit.objects.create(branch=self.branch, account=self.account, amount=Decimal("50.00"), narration="in")
+        ledger.roll_snapshots(account_ids=[self.account.pk], min_entries=1)
+        CashDeposit.objects.create(branch=self.branch, account=self.account, amount=Decimal("5.00"), narration="in")
+
+        balances = ledger.account_balances([self.account.pk, other.pk])
+
+        self.assertEqual(balances, {self.account.pk: Decimal("55.00"), other.pk: Decimal("30.00")})
+
+    def test_fx_transfer_debits_the_kes_equivalent(self):
+        fx = SimpleNamespace(
+            account_id=self.account.pk, amount=Decimal("100.00"), exchange_rate=Decimal("129.4550"),
+            charges=Decimal("500.00"), quote_id=None, transaction_reference="FXT1",
+        )
+        legs = ledger.fx_transfer_legs(fx)
+        self.assertEqual(legs[0], ledger.debit_account(self.account.pk, Decimal("13445.50")))
+        self.assertEqual(legs[1], ledger.credit_gl(ledger.GL_NOSTRO, Decimal("12945.50")))
+
+
+class OpeningBalanceTests(TestCase):
+
+    def setUp(self):
+        self.branch = factories.branch()
+        self.account = factories.account(self.branch)
+        # An account from before the ledger: money only in the balance column.
+        CustomerAccount.objects.filter(pk=self.account.pk).update(
+            balance=Decimal("2500.00"), ledger_opened_at=None,
+        )
+
+    def test_legacy_balance_counts_before_opening(self):
+        CashDeposit.objects.create(branch=self.branch, account=self.account, amount=Decimal("100.00"), narration="in")
+        self.assertEqual(ledger.account_balance(self.account.pk), Decimal("2600.00"))
+        self.assertEqual(ledger.account_balances([self.account.pk])[self.account.pk], Decimal("2600.00"))
+
+    def test_snapshot_sync_leaves_unopened_balance_alone(self):
+        CashDeposit.objects.create(branch=self.branch, account=self.account, amount=Decimal("100.00"), narration="in")
+        ledger.roll_snapshots(min_entries=1)
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, Decimal("2500.00"))
+
+    def test_open_accounts_posts_the_legacy_balance_once(self):
+        CashDeposit.objects.create(branch=self.branch, account=self.account, amount=Decimal("100.00"), narration="in")
+        self.assertEqual(ledger.open_accounts(), 1)
+        self.assertEqual(ledger.open_accounts(), 0)
+
+        opening = LedgerEntry.objects.filter(posting_reference=ledger.opening_reference(self.account.pk))
+        self.assertEqual(opening.count(), 2)
+        self.assertEqual(ledger.account_balance(self.account.pk), Decimal("2600.00"))
+
+        ledger.roll_snapshots(min_entries=1)
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, Decimal("2600.00"))
+
+    def test_account_created_with_a_balance_is_opened_with_it(self):
+        account = factories.account(self.branch, balance=Decimal("750.00"))
+        self.assertIsNotNone(account.ledger_opened_at)
+        self.assertEqual(ledger.account_balance(account.pk), Decimal("750.00"))
@@ -0,0 +1,63 @@
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.test import TestCase
+
+from src import metrics_engine
+from src.models import CashDeposit, FXTransfer
+
+from . import factories
+
+
+class SeriesTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.branch = factories.branch()
+        self.account = factories.account(self.branch)
+        with self.captureOnCommitCallbacks(execute=True):
+            self._deposit("100.00")
+            self._deposit("50.50")
+            FXTransfer.objects.create(
+                branch=self.branch, account=self.account, amount=Decimal("10.00"), exchange_rate=Decimal("129.4550"),
+                beneficiary_name="Acme Ltd", beneficiary_account_number="001", beneficiary_bank="Bank",
+                swift_code="BANKUS33", beneficiary_country="US", narration="invoice", status="REJECTED",
+            )
+
+    def _deposit(self, amount, **fields):
+        return CashDeposit.objects.create(
+            branch=self.branch, account=self.account, amount=Decimal(amount), narration="in", **fields,
+        )
+
+    def _series(self, metric_id):
+        return metrics_engine.time_series(metric_id, days=3, branch_id=self.branch.pk)
+
+    def test_series_match_hand_computed_values(self):
+        volume = self._series("txn-volume")
+        value = self._series("txn-value")
+
+        self.assertEqual([point["value"] for point in volume], [0.0, 0.0, 3.0])
+        # 100.00 + 50.50 + 10 USD at 129.4550 = 1294.55 KES.
+        self.assertEqual(value[-1]["value"], 1445.05)
+        # One FX transfer decided, and rejected.
+        self.assertEqual(self._series("error-rate")[-1]["value"], 100.0)
+        self.assertEqual(len(volume), 3)
+
+    def test_invalidate_rows_refreshes_cached_series(self):
+        self.assertEqual(self._series("txn-volume")[-1]["value"], 3.0)
+
+        # bulk_create sends no post_save, so the cached series is stale...
+        rows = CashDeposit.objects.bulk_create([
+            CashDeposit(branch=self.branch, account=self.account, amount=Decimal("1.00"),
+                        narration="bulk", reference="DEPBULK0000000001"),
+        ])
+        self.assertEqual(self._series("txn-volume")[-1]["value"], 3.0)
+
+        # ...until the bulk path reports its rows.
+        with self.captureOnCommitCallbacks(execute=True):
+            metrics_engine.invalidate_rows(CashDeposit, rows)
+        self.assertEqual(self._series("txn-volume")[-1]["value"], 4.0)
+
+    def test_unknown_metric_is_refused(self):
+        with self.assertRaises(metrics_engine.UnsupportedMetric):
+            metrics_engine.time_series("no-such-metric")
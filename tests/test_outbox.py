@@ -0,0 +1,95 @@
+import json
+import os
+import tempfile
+import threading
+from datetime import date
+from decimal import Decimal
+
+from django.test import TestCase
+
+from src import end_of_day, ledger, outbox
+from src.models import CashDeposit, CustomerAccount, OutboxEvent, OutboxSequence
+
+from . import factories
+
+
+class SequenceTests(TestCase):
+
+    def setUp(self):
+        self.branch = factories.branch()
+        self.account = factories.account(self.branch)
+
+    def _events(self):
+        return OutboxEvent.objects.filter(account_id=self.account.pk).order_by("id")
+
+    def test_each_account_numbers_its_events_without_gaps(self):
+        other = factories.account(self.branch)
+        for amount in ("10.00", "20.00"):
+            CashDeposit.objects.create(branch=self.branch, account=self.account, amount=Decimal(amount), narration="in")
+        CashDeposit.objects.create(branch=self.branch, account=other, amount=Decimal("5.00"), narration="in")
+
+        sequences = list(self._events().values_list("sequence", flat=True))
+        self.assertEqual(sequences, list(range(1, len(sequences) + 1)))
+        self.assertEqual(OutboxSequence.objects.get(account_id=self.account.pk).last, len(sequences))
+
+    def test_relayed_records_carry_the_sequence(self):
+        broker = outbox.MemoryBroker(partitions=4)
+        outbox.relay_batch(broker)
+
+        records = broker.read(self.account.pk % 4, 0, 100)[0]
+        mine = [record["sequence"] for record in records if record["account_id"] == self.account.pk]
+        self.assertEqual(mine, sorted(mine))
+        self.assertTrue(mine)
+
+
+class BulkUpdateEventTests(TestCase):
+
+    def setUp(self):
+        self.branch = factories.branch()
+        kind = factories.account_type("OUTBOX_SAVINGS", interest_rate=Decimal("10.00"))
+        self.account = factories.account(self.branch, balance=Decimal("36500.00"), kind=kind)
+
+    def _updates(self):
+        return list(
+            OutboxEvent.objects
+            .filter(aggregate="CustomerAccount", aggregate_id=self.account.pk, event_type=outbox.UPDATED)
+            .order_by("id")
+            .values_list("payload", flat=True)
+        )
+
+    def test_end_of_day_emits_account_updates(self):
+        before = len(self._updates())
+        end_of_day.run(date(2026, 3, 31), workers=1)
+
+        payload = self._updates()[before]
+        self.assertEqual(payload["accrued_interest"], "0.0000")
+        self.assertEqual(payload["balance"], "36510.00")
+
+    def test_roll_snapshots_emits_balance_updates(self):
+        CashDeposit.objects.create(branch=self.branch, account=self.account, amount=Decimal("100.00"), narration="in")
+        before = len(self._updates())
+
+        ledger.roll_snapshots(account_ids=[self.account.pk], min_entries=1)
+
+        self.assertEqual(self._updates()[before:], [{"id": self.account.pk, "balance": "36600.00"}])
+        self.assertEqual(CustomerAccount.objects.get(pk=self.account.pk).balance, Decimal("36600.00"))
+
+
+class FileLogTests(TestCase):
+
+    def test_concurrent_commits_keep_every_partition(self):
+        with tempfile.TemporaryDirectory() as root:
+            logs = [outbox.FileLog(root, partitions=8) for _ in range(2)]
+            threads = [
+                threading.Thread(target=logs[partition % 2].commit, args=("reports", partition, partition * 10))
+                for partition in range(8)
+                for _ in range(20)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            with open(os.path.join(root, "offsets", "reports.json")) as handle:
+                offsets = json.load(handle)
+        self.assertEqual(offsets, {str(partition): partition * 10 for partition in range(8)})
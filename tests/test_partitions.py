@@ -0,0 +1,122 @@
+import importlib.util
+import os
+import unittest
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase
+from django.utils import timezone
+
+from src import end_of_day, partitions
+from src.models import ArchivedPartition, CashDeposit
+
+from . import factories
+
+
+class MonthTests(TestCase):
+
+    def test_months_and_partition_names(self):
+        self.assertEqual(partitions.add_months(date(2025, 11, 1), 3), date(2026, 2, 1))
+        self.assertEqual(partitions.partition_name(CashDeposit, date(2026, 2, 1)), "src_cashdeposit_p202602")
+
+        start, end = partitions.month_bounds(date(2026, 2, 1))
+        self.assertEqual(timezone.localtime(start).date(), date(2026, 2, 1))
+        self.assertEqual(timezone.localtime(end).date(), date(2026, 3, 1))
+
+    def test_end_of_day_keeps_partitions_open(self):
+        with mock.patch.object(partitions, "ensure_partitions") as ensure:
+            end_of_day.run(workers=1)
+
+        ensure.assert_called_once_with()
+
+
+@unittest.skipUnless(importlib.util.find_spec("pyarrow"), "archiving needs pyarrow")
+class ArchiveTests(TestCase):
+
+    def setUp(self):
+        self.branch = factories.branch()
+        self.account = factories.account(self.branch)
+        self.other = factories.account(self.branch)
+        self.month = partitions.add_months(partitions.month_start(timezone.now()), -14)
+
+    def _deposit(self, account, amount, month):
+        deposit = CashDeposit.objects.create(branch=self.branch, account=account, amount=Decimal(amount), narration="in")
+        created_at = partitions.month_bounds(month)[0] + timedelta(days=2)
+        CashDeposit.objects.filter(pk=deposit.pk).update(created_at=created_at)
+        return deposit.pk
+
+    def test_archived_month_leaves_the_table_and_reads_back(self):
+        archived = [self._deposit(self.account, "100.00", self.month), self._deposit(self.other, "5.00", self.month)]
+        live = self._deposit(self.account, "7.50", partitions.add_months(self.month, 1))
+
+        archive = partitions.archive_month(CashDeposit, self.month)
+
+        self.assertEqual(archive.row_count, 2)
+        self.assertTrue(os.path.exists(archive.path))
+        self.assertEqual(ArchivedPartition.objects.get().month, self.month)
+        self.assertFalse(CashDeposit.objects.filter(pk__in=archived).exists())
+        self.assertTrue(CashDeposit.objects.filter(pk=live).exists())
+
+        start = partitions.month_bounds(self.month)[0]
+        end = partitions.month_bounds(partitions.add_months(self.month, 1))[1]
+        rows = list(partitions.history(CashDeposit, start, end, account_id=self.account.pk))
+
+        self.assertEqual([row["id"] for row in rows], [archived[0], live])
+        self.assertEqual([row["amount"] for row in rows], [Decimal("100.00"), Decimal("7.50")])
+        self.assertEqual(timezone.localtime(rows[0]["created_at"]).date(), self.month.replace(day=3))
+
+
+@unittest.skipUnless(connection.vendor == "postgresql", "partitioning needs PostgreSQL")
+class PartitionCreationTests(TestCase):
+
+    def setUp(self):
+        self.branch = factories.branch()
+        self.account = factories.account(self.branch)
+
+    def _deposit(self, **fields):
+        return CashDeposit.objects.create(
+            branch=self.branch, account=self.account, amount=Decimal("100.00"), narration="test", **fields
+        )
+
+    def _exists(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT to_regclass(%s)", [name])
+            return cursor.fetchone()[0] is not None
+
+    def _count(self, table):
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT count(*) FROM "{table}"')
+            return cursor.fetchone()[0]
+
+    def test_months_ahead_are_created(self):
+        partitions.ensure_partitions()
+
+        this_month = partitions.month_start(timezone.now())
+        for ahead in range(partitions.MONTHS_AHEAD + 1):
+            month = partitions.add_months(this_month, ahead)
+            self.assertTrue(self._exists(partitions.partition_name(CashDeposit, month)))
+
+    def test_rows_in_default_move_into_their_new_month(self):
+        month = partitions.add_months(partitions.month_start(timezone.now()), 6)
+        deposit = self._deposit()
+        CashDeposit.objects.filter(pk=deposit.pk).update(created_at=partitions.month_bounds(month)[0])
+        self.assertEqual(self._count("src_cashdeposit_default"), 1)
+
+        partitions.ensure_partitions(months_ahead=6)
+
+        self.assertEqual(self._count("src_cashdeposit_default"), 0)
+        self.assertEqual(self._count(partitions.partition_name(CashDeposit, month)), 1)
+
+    def test_original_index_names_are_kept(self):
+        self.assertTrue(self._exists("cash_deposit_created_idx"))
+
+    def test_reference_stays_unique_across_months(self):
+        first = self._deposit()
+        CashDeposit.objects.filter(pk=first.pk).update(
+            created_at=partitions.month_bounds(partitions.add_months(partitions.month_start(timezone.now()), -1))[0]
+        )
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            self._deposit(reference=first.reference)
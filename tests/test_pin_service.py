@@ -0,0 +1,102 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase
+
+from src import pin_service
+from src.models import Card, CardPIN
+
+from . import factories
+
+
+class PinServiceTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        branch = factories.branch()
+        self.card = Card.objects.create(
+            branch=branch, account=factories.account(branch), card_type="DEBIT", card_tier="CLASSIC",
+            name_on_card="W KAMAU", daily_pos_limit=Decimal("1000.00"), daily_atm_limit=Decimal("500.00"),
+            status="ACTIVE",
+        )
+        # Two web workers; hashing on threads keeps the test in one process.
+        self.workers = []
+        for _ in range(2):
+            service = pin_service.PinService(workers=1, max_in_flight=1, flush_interval=3600)
+            service._pool.shutdown()
+            service._pool = ThreadPoolExecutor(max_workers=1)
+            self.addCleanup(service.shutdown)
+            self.workers.append(service)
+        self.workers[0].set_pin(self.card.pk, "1234")
+
+    def _verify(self, worker, pin):
+        return self.workers[worker].verify(self.card.pk, pin)
+
+    def test_lockout_counts_failures_from_every_worker(self):
+        self.assertEqual(self._verify(0, "0000").attempts_left, 2)
+        self.assertEqual(self._verify(1, "0000").attempts_left, 1)
+        result = self._verify(0, "0000")
+        self.assertTrue(result.blocked)
+
+        self.assertEqual(self._verify(1, "1234"), pin_service.VerifyResult(False, True, 0))
+        self.assertEqual(CardPIN.objects.values_list("failed_attempts", "is_blocked").get(), (3, True))
+
+    def test_a_correct_pin_resets_the_shared_counter(self):
+        self._verify(0, "0000")
+        self._verify(1, "0000")
+        self.assertTrue(self._verify(1, "1234").ok)
+        self.assertEqual(self._verify(0, "0000").attempts_left, 2)
+
+    def test_set_pin_unblocks(self):
+        for _ in range(3):
+            self._verify(0, "0000")
+        self.workers[1].set_pin(self.card.pk, "4321")
+        self.assertTrue(self._verify(0, "4321").ok)
+
+    def test_a_timed_out_hash_keeps_its_slot_until_it_finishes(self):
+        finished = threading.Event()
+
+        def slow_check(pin, encoded):
+            time.sleep(0.3)
+            finished.set()
+            return True, None
+
+        with mock.patch.object(pin_service, "_check", slow_check), \
+                mock.patch.object(pin_service, "VERIFY_TIMEOUT", 0.05):
+            with self.assertRaises(TimeoutError):
+                self._verify(0, "1234")
+            with self.assertRaises(pin_service.PinServiceBusy):
+                self._verify(0, "1234")
+            finished.wait(1)
+        time.sleep(0.05)
+        self.assertTrue(self._verify(0, "1234").ok)
+
+    def test_wrong_pins_are_counted_in_the_cache_and_flushed_in_batches(self):
+        self._verify(0, "0000")
+        self._verify(1, "0000")
+        self.assertEqual(CardPIN.objects.values_list("failed_attempts", flat=True).get(), 0)
+
+        self.assertEqual(pin_service.flush(), 1)
+        self.assertEqual(CardPIN.objects.values_list("failed_attempts", flat=True).get(), 2)
+
+        # A worker that only knows the flushed value still sees the shared count.
+        cache.delete(pin_service._attempts_key(self.card.pk))
+        self.assertTrue(self._verify(0, "0000").blocked)
+
+    def test_a_correct_pin_loses_to_a_block_set_while_it_hashed(self):
+        real = self.workers[0]._hash_check
+
+        def hash_while_others_guess(pin, pin_hash):
+            for _ in range(pin_service.MAX_FAILED_ATTEMPTS):
+                self._verify(1, "0000")
+            return real(pin, pin_hash)
+
+        with mock.patch.object(self.workers[0], "_hash_check", hash_while_others_guess):
+            result = self._verify(0, "1234")
+
+        self.assertEqual(result, pin_service.VerifyResult(False, True, 0))
+        self.assertEqual(CardPIN.objects.values_list("failed_attempts", "is_blocked").get(), (3, True))
@@ -0,0 +1,36 @@
+from decimal import Decimal
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from src import reference_cache, references
+from src.models import Branch, CashDeposit
+
+from . import factories
+
+
+class ReferenceCacheTests(TestCase):
+
+    def setUp(self):
+        self.branch = factories.branch("NRB07")
+        self.account = factories.account(self.branch)
+        reference_cache.warm()
+
+    def test_attach_hands_out_copies(self):
+        first, second = CashDeposit(branch_id=self.branch.pk), CashDeposit(branch_id=self.branch.pk)
+        reference_cache.attach([first, second], "branch")
+
+        with self.assertNumQueries(0):
+            first.branch.name = "Changed"
+            self.assertEqual(second.branch.name, self.branch.name)
+        self.assertEqual(reference_cache.branch(self.branch.pk).name, self.branch.name)
+
+    def test_references_take_branch_codes_from_the_cache(self):
+        deposit = CashDeposit(branch_id=self.branch.pk, account=self.account, amount=Decimal("10.00"))
+
+        with CaptureQueriesContext(connection) as queries:
+            references.assign(deposit)
+
+        self.assertTrue(deposit.reference.startswith("DEPNRB07"))
+        self.assertFalse([q for q in queries if Branch._meta.db_table in q["sql"]])
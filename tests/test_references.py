@@ -0,0 +1,79 @@
+from decimal import Decimal
+
+from django.db import transaction
+from django.test import TestCase
+
+from src import references
+from src.models import CashDeposit, CustomerAccount
+
+from . import factories
+
+
+class AssignmentTests(TestCase):
+
+    def setUp(self):
+        self.branch = factories.branch("NRB01")
+        self.account = factories.account(self.branch)
+
+    def test_references_use_the_rows_branch(self):
+        deposit = CashDeposit.objects.create(branch=self.branch, account=self.account, amount=Decimal("10.00"), narration="in")
+        self.assertTrue(deposit.reference.startswith("DEPNRB01"))
+        self.assertTrue(self.account.account_number.startswith("NRB01"))
+        self.assertTrue(references.is_mod97_valid(self.account.account_number))
+
+    def test_unsaved_rows_draw_nothing(self):
+        self.assertEqual(CustomerAccount(pk=self.account.pk).account_number, "")
+
+    def test_assign_all_fills_rows_for_bulk_create(self):
+        other = factories.branch("MSA01")
+        rows = references.assign_all([
+            CashDeposit(branch=self.branch, account=self.account, amount=Decimal("1.00"), narration="a"),
+            CashDeposit(branch_id=other.pk, account=self.account, amount=Decimal("1.00"), narration="b"),
+        ])
+        self.assertTrue(rows[0].reference.startswith("DEPNRB01"))
+        self.assertTrue(rows[1].reference.startswith("DEPMSA01"))
+
+
+class SeedingTests(TestCase):
+
+    def test_first_block_starts_above_existing_values(self):
+        branch = factories.branch("KSM01")
+        account = factories.account(branch)
+        CashDeposit.objects.create(
+            branch=branch, account=account, amount=Decimal("10.00"), narration="legacy",
+            reference="DEPKSM010000000500",
+        )
+        # A longer shard that shares the prefix must not count.
+        CashDeposit.objects.create(
+            branch=branch, account=account, amount=Decimal("10.00"), narration="legacy",
+            reference="DEPKSM01X0000009000",
+        )
+        self.assertEqual(references.highest_issued("DEP", "KSM01"), 500)
+        self.assertEqual(references.ReferenceAllocator().next_value("DEP", "KSM01"), 501)
+
+    def test_account_numbers_skip_check_digits(self):
+        branch = factories.branch("ELD01")
+        factories.account(branch, account_number="ELD010000004217")
+        self.assertEqual(references.highest_issued("ACC", "ELD01"), 42)
+
+
+class RollbackTests(TestCase):
+
+    def test_block_reserved_in_a_rolled_back_transaction_is_dropped(self):
+        first = references.ReferenceAllocator(block_size=10)
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            self.assertEqual(first.next_value("DEP", "RBK01"), 1)
+            raise RuntimeError("teller cancelled")
+
+        # The counter went back with the rollback, so [1, 11) is free again...
+        self.assertEqual(references.ReferenceAllocator(block_size=10).next_value("DEP", "RBK01"), 1)
+        # ...and the first allocator no longer hands it out from memory.
+        self.assertEqual(first.next_value("DEP", "RBK01"), 11)
+
+    def test_committed_block_is_shared(self):
+        allocator = references.ReferenceAllocator(block_size=10)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(allocator.next_value("DEP", "RBK02"), 1)
+
+        self.assertEqual(allocator._blocks[("DEP", "RBK02")], [2, 11])
+        self.assertEqual(allocator.next_value("DEP", "RBK02"), 2)
@@ -0,0 +1,94 @@
+import json
+from decimal import Decimal
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import RequestFactory, TestCase
+
+from src import service_catalog
+from src.models import APIServiceGroup, APIServiceType
+
+from . import factories
+
+
+class CatalogTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.branch = factories.branch()
+        self.other = factories.branch()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.group = APIServiceGroup.objects.create(branch=self.branch, code="ACCOUNTS", name="Accounts")
+            self.statement = self._service(self.branch, self.group, "STATEMENT", "150.00")
+
+    def _service(self, branch, group, code, fee):
+        return APIServiceType.objects.create(
+            service_group=group, branch=branch, code=code, name=code.title(), service_fee=Decimal(fee), sla_days=2,
+        )
+
+    def test_lookups_between_version_checks_stay_in_process(self):
+        service_catalog.get_catalog(self.branch.pk)
+
+        with mock.patch.object(service_catalog, "current_version") as version, self.assertNumQueries(0):
+            fee = service_catalog.service_fee(self.branch.pk, "ACCOUNTS", "STATEMENT")
+            days = service_catalog.service_sla_days(self.branch.pk, "ACCOUNTS", "STATEMENT")
+
+        self.assertEqual((fee, days), (Decimal("150.00"), 2))
+        version.assert_not_called()
+
+    def test_another_workers_change_is_seen_at_the_next_version_check(self):
+        catalog = service_catalog.get_catalog(self.branch.pk)
+        # Another worker saved a type: the shared version moved, this
+        # process's copy did not hear about it.
+        APIServiceType.objects.filter(pk=self.statement.pk).update(service_fee=Decimal("200.00"))
+        cache.incr(service_catalog._version_key(self.branch.pk))
+
+        self.assertIs(service_catalog.get_catalog(self.branch.pk), catalog)
+        catalog.checked_at -= service_catalog.VERSION_CHECK_SECONDS
+        self.assertEqual(service_catalog.service_fee(self.branch.pk, "ACCOUNTS", "STATEMENT"), Decimal("200.00"))
+
+    def test_saves_rebuild_only_the_affected_branch(self):
+        mine = service_catalog.get_catalog(self.branch.pk)
+        theirs = service_catalog.get_catalog(self.other.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.statement.service_fee = Decimal("175.00")
+            self.statement.save()
+
+        self.assertIsNot(service_catalog.get_catalog(self.branch.pk), mine)
+        self.assertIs(service_catalog.get_catalog(self.other.pk), theirs)
+        self.assertEqual(service_catalog.service_fee(self.branch.pk, "ACCOUNTS", "STATEMENT"), Decimal("175.00"))
+
+    def test_types_under_another_branchs_group_are_listed(self):
+        service_catalog.get_catalog(self.other.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            self._service(self.other, self.group, "CHEQUE", "500.00")
+
+        catalog = service_catalog.get_catalog(self.other.pk)
+
+        self.assertEqual([group["key"] for group in catalog.groups], ["ACCOUNTS"])
+        self.assertEqual([service["code"] for service in catalog.services_by_group["ACCOUNTS"]], ["CHEQUE"])
+        self.assertEqual(service_catalog.service_fee(self.other.pk, "ACCOUNTS", "CHEQUE"), Decimal("500.00"))
+
+        # Renaming the owner's group reaches the other branch's catalog too.
+        with self.captureOnCommitCallbacks(execute=True):
+            self.group.name = "Accounts & Cards"
+            self.group.save()
+        self.assertEqual(service_catalog.get_catalog(self.other.pk).groups[0]["label"], "Accounts & Cards")
+
+    def test_unchanged_catalog_answers_not_modified(self):
+        factory = RequestFactory()
+        first = service_catalog.groups_response(factory.get("/"), self.branch.pk)
+        etag = first["ETag"]
+
+        again = service_catalog.groups_response(factory.get("/", HTTP_IF_NONE_MATCH=etag), self.branch.pk)
+        self.assertEqual(again.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self._service(self.branch, self.group, "CHEQUE", "500.00")
+        changed = service_catalog.services_response(
+            factory.get("/", HTTP_IF_NONE_MATCH=etag), self.branch.pk, "ACCOUNTS",
+        )
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed["ETag"], etag)
+        self.assertEqual(len(json.loads(changed.content)), 2)
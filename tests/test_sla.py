@@ -0,0 +1,122 @@
+from datetime import date, datetime, timedelta
+from unittest import mock
+
+from django.test import TestCase
+from django.utils import timezone
+
+from src import sla, statements
+from src.models import (
+    APIServiceGroup,
+    APIServiceType,
+    BranchHoliday,
+    KYCUpdateRequest,
+    SLADailyStat,
+    SLARecord,
+    StatementRequest,
+)
+
+from . import factories
+
+
+class SlaTests(TestCase):
+
+    def setUp(self):
+        self.branch = factories.branch()
+        self.account = factories.account(self.branch)
+        # Branch ids are reused between tests, so cached holidays are not.
+        sla._holidays.clear()
+
+    def _request(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return KYCUpdateRequest.objects.create(
+                branch=self.branch, account=self.account, update_type="PHONE",
+                old_value="0700000000", new_value="0711111111", reason="New line",
+            )
+
+    def test_sla_days_come_from_the_mapped_service_type(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            group = APIServiceGroup.objects.create(branch=self.branch, code="ACCOUNTS", name="Accounts")
+            APIServiceType.objects.create(
+                service_group=group, branch=self.branch, code="KYC_UPDATE", name="KYC update", sla_days=5,
+            )
+
+        self.assertEqual(sla.sla_days_for(self.branch.pk, "kyc-update"), 5)
+
+    def test_backfill_creates_records_for_open_requests_only(self):
+        pending = self._request()
+        approved = self._request()
+        KYCUpdateRequest.objects.filter(pk=approved.pk).update(status="APPROVED")
+        SLARecord.objects.all().delete()
+
+        self.assertEqual(sla.backfill_records(), 1)
+        record = SLARecord.objects.get()
+        self.assertEqual((record.source_model, record.source_id), ("KYCUpdateRequest", pending.pk))
+        self.assertEqual(record.service, "kyc-update")
+        self.assertGreater(record.due_at, pending.created_at)
+        self.assertEqual(sla.backfill_records(), 0)
+
+    def _decide(self, request, status="APPROVED"):
+        with self.captureOnCommitCallbacks(execute=True):
+            request.status = status
+            request.save()
+
+    def test_closing_counts_met_and_missed(self):
+        on_time = self._request()
+        late = self._request()
+        SLARecord.objects.filter(source_id=late.pk).update(due_at=timezone.now() - timedelta(minutes=1))
+
+        self._decide(on_time)
+        self._decide(late, "REJECTED")
+
+        stat = SLADailyStat.objects.get(branch=self.branch, service="kyc-update")
+        self.assertEqual((stat.met, stat.missed), (1, 1))
+        self.assertEqual(SLARecord.objects.get(source_id=late.pk).breached, True)
+        self.assertEqual(sla.compliance(branch=self.branch), 50.0)
+
+    def test_a_failed_statement_closes_its_record(self):
+        request = StatementRequest.objects.create(
+            branch=self.branch, account=self.account, statement_type="FULL", output_format="CSV",
+        )
+
+        with self.captureOnCommitCallbacks(execute=True), \
+                mock.patch.object(statements, "statement_lines", side_effect=RuntimeError("disk full")), \
+                self.assertRaises(RuntimeError):
+            statements.generate_statement(request.pk)
+
+        record = SLARecord.objects.get(source_model="StatementRequest", source_id=request.pk)
+        self.assertIsNotNone(record.completed_at)
+        self.assertEqual(SLADailyStat.objects.get(service="statement").met, 1)
+
+    def test_scan_flags_each_breach_once(self):
+        request = self._request()
+        SLARecord.objects.filter(source_id=request.pk).update(due_at=timezone.now() - timedelta(minutes=1))
+        breached = []
+
+        def listener(sender, record, **kwargs):
+            breached.append(record.source_id)
+
+        sla.sla_breached.connect(listener)
+        self.addCleanup(sla.sla_breached.disconnect, listener)
+
+        self.assertEqual(sla.scan_breaches(), 1)
+        self.assertEqual(sla.scan_breaches(), 0)
+        self.assertEqual(breached, [request.pk])
+        self.assertTrue(SLARecord.objects.get(source_id=request.pk).breached)
+
+    def test_due_soon_lists_open_records_inside_the_window(self):
+        soon, later, closed = self._request(), self._request(), self._request()
+        now = timezone.now()
+        SLARecord.objects.filter(source_id__in=[soon.pk, closed.pk]).update(due_at=now + timedelta(minutes=30))
+        SLARecord.objects.filter(source_id=later.pk).update(due_at=now + timedelta(hours=3))
+        self._decide(closed)
+
+        self.assertEqual([record.source_id for record in sla.due_soon(branch=self.branch)], [soon.pk])
+
+    def test_due_dates_skip_weekends_and_branch_holidays(self):
+        friday = timezone.make_aware(datetime(2026, 10, 16, 15, 0))
+        BranchHoliday.objects.create(branch=self.branch, date=date(2026, 10, 19), name="Mashujaa Day (observed)")
+
+        due = sla.add_business_days(self.branch.pk, friday, 1)
+
+        self.assertEqual(due, timezone.make_aware(datetime(2026, 10, 20, 15, 0)))
+        self.assertEqual(sla.add_business_days(factories.branch().pk, friday, 1).date(), date(2026, 10, 19))
@@ -0,0 +1,63 @@
+from datetime import date
+from decimal import Decimal
+from unittest import mock
+
+from django.db import DatabaseError
+from django.test import TestCase
+
+from src import ledger, standing_orders
+from src.models import FundsTransfer, StandingOrder, StandingOrderExecution
+
+from . import factories
+
+
+class StandingOrderTests(TestCase):
+
+    def setUp(self):
+        self.branch = factories.branch()
+        self.account = factories.account(self.branch, balance=Decimal("10000.00"))
+
+    def _order(self, **fields):
+        values = dict(
+            branch=self.branch, source_account=self.account, beneficiary_account="0100000001",
+            beneficiary_name="Landlord", amount=Decimal("1000.00"), frequency="MONTHLY",
+            start_date=date(2026, 1, 31),
+        )
+        values.update(fields)
+        return StandingOrder.objects.create(**values)
+
+    def test_backfill_schedules_legacy_orders_from_today(self):
+        order = self._order()
+        StandingOrder.objects.filter(pk=order.pk).update(next_run_date=None, is_active=True)
+        finished = self._order(end_date=date(2026, 3, 31))
+        StandingOrder.objects.filter(pk=finished.pk).update(next_run_date=None, is_active=True)
+
+        self.assertEqual(standing_orders.backfill_schedules(today=date(2026, 4, 10)), 2)
+
+        order.refresh_from_db()
+        finished.refresh_from_db()
+        self.assertEqual((order.next_run_date, order.run_count, order.is_active), (date(2026, 4, 30), 3, True))
+        self.assertEqual((finished.next_run_date, finished.is_active), (None, False))
+
+    def test_a_failing_order_is_recorded_and_the_batch_goes_on(self):
+        failing = self._order(beneficiary_name="Broken")
+        working = self._order()
+        create = FundsTransfer.objects.create
+
+        def create_transfer(**fields):
+            if fields["narration"].startswith(f"Standing order {failing.pk} "):
+                create(**fields)
+                raise DatabaseError("beneficiary bank offline")
+            return create(**fields)
+
+        with mock.patch.object(FundsTransfer.objects, "create", side_effect=create_transfer):
+            stats = standing_orders.run(date(2026, 1, 31), workers=1)
+
+        self.assertEqual((stats.orders, stats.posted, stats.failed), (2, 1, 1))
+        failed = StandingOrderExecution.objects.get(standing_order=failing)
+        self.assertEqual((failed.status, failed.error), ("FAILED", "beneficiary bank offline"))
+        self.assertEqual(StandingOrderExecution.objects.get(standing_order=working).status, "POSTED")
+        self.assertEqual(FundsTransfer.objects.count(), 1)
+        self.assertEqual(ledger.account_balance(self.account.pk), Decimal("9000.00"))
+        failing.refresh_from_db()
+        self.assertEqual(failing.next_run_date, date(2026, 2, 28))
@@ -0,0 +1,62 @@
+from datetime import timedelta
+from decimal import Decimal
+
+from django.test import TestCase
+from django.utils import timezone
+
+from src import ledger, statements
+from src.models import CashDeposit, CustomerAccount
+
+from . import factories
+
+
+class OpeningBalanceTests(TestCase):
+
+    def setUp(self):
+        self.branch = factories.branch()
+        self.account = factories.account(self.branch)
+        CustomerAccount.objects.filter(pk=self.account.pk).update(
+            balance=Decimal("2500.00"), ledger_opened_at=None,
+            created_at=timezone.now() - timedelta(days=400),
+        )
+        CashDeposit.objects.create(branch=self.branch, account=self.account, amount=Decimal("100.00"), narration="in")
+
+    def _closing(self, date_from=None):
+        return list(statements.statement_lines(self.account.pk, date_from))[-1][-1]
+
+    def test_statement_brings_the_legacy_balance_forward(self):
+        self.assertEqual(self._closing(), Decimal("2600.00"))
+        self.assertEqual(self._closing(timezone.localdate() - timedelta(days=30)), Decimal("2600.00"))
+
+    def test_statements_agree_after_the_backfill(self):
+        ledger.open_accounts()
+        week_ago = timezone.localdate() - timedelta(days=7)
+        lines = list(statements.statement_lines(self.account.pk, week_ago))
+        self.assertEqual(lines[0][-1], Decimal("2500.00"))
+        self.assertEqual(lines[-1][-1], Decimal("2600.00"))
+        self.assertEqual(self._closing(), Decimal("2600.00"))
+
+
+class PdfWriterTests(TestCase):
+
+    def test_pages_stream_to_a_valid_file(self):
+        import os
+        import tempfile
+
+        fd, path = tempfile.mkstemp(suffix=".pdf")
+        os.close(fd)
+        try:
+            writer = statements.PdfStatementWriter(path, "Statement - (test) \\\\ café")
+            now = timezone.now()
+            for n in range(200):
+                writer.write((now, f"REF{n}", "Narration (with brackets)", Decimal("1.00"), None, Decimal(n)))
+            writer.close()
+            with open(path, "rb") as handle:
+                data = handle.read()
+        finally:
+            os.remove(path)
+
+        self.assertTrue(data.startswith(b"%PDF-1.4"))
+        self.assertIn(b"/Count 4 ", data)
+        startxref = int(data.rsplit(b"startxref\n", 1)[1].split(b"\n")[0])
+        self.assertTrue(data[startxref:].startswith(b"xref\n0 13\n"))